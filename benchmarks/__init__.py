@@ -0,0 +1,8 @@
+"""
+Benchmarks of wpbackup2
+
+Measures the throughput and peak memory of backups, restores, database
+loads and archive verification against a synthetic WordPress site, with a
+stand-in for mysqldump and mysql so no database server is needed. See the
+Benchmarks section of the README.
+"""
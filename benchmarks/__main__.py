@@ -0,0 +1,183 @@
+"""
+Command line of the benchmarks
+
+    python -m benchmarks generate SITE_PATH [--files N ...]
+    python -m benchmarks run --output results.json [--files N ...]
+    python -m benchmarks compare base.json new.json [--threshold 10]
+"""
+
+# pylint: disable=line-too-long
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import fake_mysql
+from benchmarks.results import best_result
+from benchmarks.results import compare_results
+from benchmarks.results import format_comparison
+from benchmarks.results import load_results
+from benchmarks.results import new_results
+from benchmarks.results import write_results
+from benchmarks.site_generator import generate_site
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#########################################################################
+def add_site_arguments(parser):
+    """ Arguments of the synthetic site """
+
+    parser.add_argument('--files', type=int, default=2000, help='Number of files in the site (default: 2000)')
+    parser.add_argument('--median-size', type=int, default=8 * 1024, help='Median file size in bytes (default: 8192)')
+    parser.add_argument('--max-size', type=int, default=16 * 1024 * 1024, help='Largest file size in bytes (default: 16 MiB)')
+    parser.add_argument('--media-share', type=float, default=0.3, help='Share of incompressible media files, 0 to 1 (default: 0.3)')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the generator (default: 1)')
+
+#########################################################################
+def site_config(args):
+    """ The arguments of generate_site from the command line """
+    return {'files': args.files, 'median_size': args.median_size, 'max_size': args.max_size, 'media_share': args.media_share, 'seed': args.seed}
+
+#########################################################################
+def generate(args):
+    """ Write a synthetic site """
+
+    files, total = generate_site(args.path, **site_config(args))
+    print("Generated {} files, {:.1f} MiB in {}".format(files, total / 1024 / 1024, args.path))
+
+#########################################################################
+def run_case(args):
+    """ Run a single case (in a child process of ``run``), printing its result as JSON """
+
+    from benchmarks.cases import run_case as run # pylint: disable=import-outside-toplevel
+
+    print(json.dumps(run(json.loads(args.case), args.work_dir, args.site_path)))
+
+#########################################################################
+def selected_cases(names):
+    """
+    The cases named in ``names`` (all of them when None), along with the
+    backup cases whose archive a selected restore or verify case reads
+    """
+
+    from benchmarks.cases import available_cases # pylint: disable=import-outside-toplevel
+
+    cases = available_cases()
+    if names is None:
+        return cases
+
+    selected = set(names)
+    for case in cases:
+        if case['name'] in names and 'archive' in case:
+            selected.add(case['archive'])
+
+    return [case for case in cases if case['name'] in selected]
+
+#########################################################################
+def run(args):
+    """ Generate a site and run the cases against it """
+
+    cases = selected_cases(args.cases)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='wpbench_')
+    site_path = os.path.join(work_dir, 'site')
+
+    config = dict(site_config(args), dump_bytes=args.dump_bytes, rate=args.rate, repeat=args.repeat)
+    results = new_results(config)
+
+    try:
+        files, total = generate_site(site_path, **site_config(args))
+        print("Generated {} files, {:.1f} MiB; dump {:.1f} MiB".format(files, total / 1024 / 1024, args.dump_bytes / 1024 / 1024))
+
+        fake_mysql.install(os.path.join(work_dir, 'bin'))
+        os.makedirs(os.path.join(work_dir, 'tmp'))
+        os.makedirs(os.path.join(work_dir, 'archives'))
+
+        env = dict(os.environ,
+                   PATH=os.path.join(work_dir, 'bin') + os.pathsep + os.environ.get('PATH', ''),
+                   PYTHONPATH=os.pathsep.join(path for path in [REPOSITORY_PATH, os.environ.get('PYTHONPATH')] if path),
+                   WPBENCH_DUMP_BYTES=str(args.dump_bytes),
+                   WPBENCH_RATE=str(args.rate))
+
+        for case in cases:
+            runs = []
+            for _ in range(args.repeat):
+                child = subprocess.run([sys.executable, '-m', 'benchmarks', 'case', json.dumps(case), work_dir, site_path] + (['--verbose'] if args.verbose else []),
+                                       env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.PIPE, check=False)
+                if child.returncode != 0:
+                    sys.stderr.write(child.stderr.decode('utf-8', 'replace') if child.stderr else '')
+                    raise RuntimeError("Case {} failed with exit code {}".format(case['name'], child.returncode))
+                runs.append(json.loads(child.stdout.decode('utf-8').splitlines()[-1]))
+
+            result = best_result(runs)
+            results['results'].append(result)
+            print("{:<20} {:>8.2f}s {:>9.1f} MB/s  peak RSS {:>7.1f} MiB".format(result['name'], result['seconds'], result['throughput_mb_s'] or 0, (result['peak_rss_bytes'] or 0) / 1024 / 1024))
+    finally:
+        if args.work_dir is None and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    write_results(results, args.output)
+    print("Results written to {}".format(args.output))
+
+#########################################################################
+def compare(args):
+    """ Compare two results files, failing on a regression """
+
+    base = load_results(args.base)
+    new = load_results(args.new)
+    rows = compare_results(base, new, args.threshold / 100)
+
+    print(format_comparison(base, new, rows))
+
+    return 1 if any(row[5] for row in rows) else 0
+
+#########################################################################
+def main():
+    """ Entry point """
+
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Benchmarks of wpbackup2')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    parser_generate = subparsers.add_parser('generate', help='Write a synthetic WordPress site')
+    parser_generate.add_argument('path', help='Directory to create the site in')
+    add_site_arguments(parser_generate)
+    parser_generate.set_defaults(function=generate)
+
+    parser_run = subparsers.add_parser('run', help='Run the benchmarks against a synthetic site')
+    parser_run.add_argument('--output', required=True, help='JSON file to write the results to')
+    parser_run.add_argument('--dump-bytes', type=int, default=64 * 1024 * 1024, help='Size of the database dump (default: 64 MiB)')
+    parser_run.add_argument('--rate', type=int, default=0, help='Bytes per second mysqldump and mysql move, 0 = unlimited (default: 0)')
+    parser_run.add_argument('--repeat', type=int, default=1, help='Run every case this many times and keep the fastest (default: 1)')
+    parser_run.add_argument('--cases', nargs='+', help='Only run these cases')
+    parser_run.add_argument('--work-dir', help='Directory for the site and archives (default: a temporary directory)')
+    parser_run.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    parser_run.add_argument('--verbose', action='store_true', help='Show the log of every case')
+    add_site_arguments(parser_run)
+    parser_run.set_defaults(function=run)
+
+    parser_case = subparsers.add_parser('case')
+    parser_case.add_argument('case')
+    parser_case.add_argument('work_dir')
+    parser_case.add_argument('site_path')
+    parser_case.add_argument('--verbose', action='store_true')
+    parser_case.set_defaults(function=run_case)
+
+    parser_compare = subparsers.add_parser('compare', help='Compare two results files')
+    parser_compare.add_argument('base', help='Results of the reference run')
+    parser_compare.add_argument('new', help='Results of the run to check')
+    parser_compare.add_argument('--threshold', type=float, default=10, help='Percentage a value may get worse by before it is a regression (default: 10)')
+    parser_compare.set_defaults(function=compare)
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if getattr(args, 'verbose', False) else logging.WARNING, stream=sys.stderr)
+
+    return args.function(args) or 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+"""
+cases
+
+The benchmark cases. Each case runs in a child process of its own
+(``python -m benchmarks case``), so the peak resident set size it reports
+is its own and not that of the cases run before it.
+
+A case is a dict: ``name``, ``operation`` ('backup', 'restore', 'load' or
+'verify') and the arguments of the operation. Cases read what earlier cases
+produced (restore and verify read the archive of a backup case), so they
+run in the order of ``CASES``.
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import shutil
+import subprocess
+import time
+
+from wpbackup2 import WpBackup
+from wpbackup2 import WpCompression
+from wpbackup2 import WpRestoreMode
+from wpbackup2 import WpSite
+from wpbackup2.classes.wp_compression import archive_extension
+from wpbackup2.classes.wp_database_loader import WpDatabaseLoader
+from wpbackup2.classes.wp_database_loader import file_source
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import XXHASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import hash_available
+from wpbackup2.classes.wp_metrics import WpMetrics
+
+try:
+    import zstandard # pylint: disable=unused-import
+except ImportError:
+    zstandard = None
+
+CASES = [
+    {'name': 'backup-gzip-1', 'operation': 'backup', 'compression': 'GZIP', 'compression_workers': 1},
+    {'name': 'backup-gzip-n', 'operation': 'backup', 'compression': 'GZIP', 'compression_workers': 0},
+    {'name': 'backup-zstd-n', 'operation': 'backup', 'compression': 'ZSTD', 'compression_workers': 0},
+    {'name': 'backup-tables', 'operation': 'backup', 'compression': 'GZIP', 'compression_workers': 0, 'dump_workers': 4},
+    {'name': 'backup-unhashed', 'operation': 'backup', 'compression': 'GZIP', 'compression_workers': 0, 'hash_files': False},
+    {'name': 'backup-xxh3', 'operation': 'backup', 'compression': 'GZIP', 'compression_workers': 0, 'hash_algorithm': XXHASH_ALGORITHM},
+    {'name': 'restore-files', 'operation': 'restore', 'archive': 'backup-gzip-n'},
+    {'name': 'load-database', 'operation': 'load'},
+    {'name': 'verify', 'operation': 'verify', 'archive': 'backup-gzip-n'}
+]
+
+#########################################################################
+def available_cases():
+    """ The cases that can run with the codecs and hash algorithms installed """
+    return [case for case in CASES if (case.get('compression') != 'ZSTD' or zstandard is not None) and hash_available(case.get('hash_algorithm', HASH_ALGORITHM))]
+
+#########################################################################
+def archive_path(work_dir, case_name, compression='GZIP'):
+    """ Archive written by the backup case ``case_name`` """
+    return os.path.join(work_dir, 'archives', case_name + archive_extension(WpCompression[compression]))
+
+#########################################################################
+def _backup(case, work_dir, site_path):
+    filename = archive_path(work_dir, case['name'], case['compression'])
+    if os.path.exists(filename):
+        os.remove(filename)
+
+    metrics = WpBackup(temp_path=os.path.join(work_dir, 'tmp'), compression_workers=case.get('compression_workers', 1)).backup(
+        WpSite.from_wp_path(site_path), filename,
+        compression=WpCompression[case['compression']],
+        hash_files=case.get('hash_files', True),
+        hash_algorithm=case.get('hash_algorithm', HASH_ALGORITHM),
+        dump_workers=case.get('dump_workers', 1),
+        default_excludes=False)
+
+    return metrics
+
+#########################################################################
+def _restore(case, work_dir, site_path):
+    target = os.path.join(work_dir, 'restored')
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+    wp_site = WpSite.from_wp_path(site_path)
+    wp_site.site_path = target
+
+    return WpBackup(temp_path=os.path.join(work_dir, 'tmp')).restore(wp_site, archive_path(work_dir, case['archive']), restore_mode=WpRestoreMode.FILES)
+
+#########################################################################
+def _load(case, work_dir, site_path): # pylint: disable=unused-argument
+    dump_filename = os.path.join(work_dir, 'database.sql')
+
+    if not os.path.exists(dump_filename):
+        with open(dump_filename, 'wb') as output:
+            subprocess.run(['mysqldump', 'wordpress'], stdout=output, check=True)
+
+    metrics = WpMetrics('load', dump_filename)
+
+    loader = WpDatabaseLoader(['--host', '127.0.0.1'], 'wordpress', '127.0.0.1', metrics=metrics)
+    loader.load_dump('database.sql', file_source(dump_filename))
+
+    metrics.finish()
+
+    return metrics
+
+#########################################################################
+def _verify(case, work_dir, site_path): # pylint: disable=unused-argument
+    """
+    Verify the archive of a backup case (see WpBackup.verify): read it back
+    once, comparing the hash of every file with the manifest
+    """
+
+    filename = archive_path(work_dir, case['archive'])
+    result = WpBackup(temp_path=os.path.join(work_dir, 'tmp')).verify(filename)
+
+    if not result.succeeded:
+        raise ValueError(str(result))
+
+    if result.hashed_files == 0:
+        raise ValueError("{} holds no content hashes to verify".format(filename))
+
+    return result.metrics
+
+OPERATIONS = {'backup': _backup, 'restore': _restore, 'load': _load, 'verify': _verify}
+
+#########################################################################
+def run_case(case, work_dir, site_path):
+    """
+    Run ``case`` in this process, returning its result (see results.py)
+    """
+
+    started = time.monotonic()
+    metrics = OPERATIONS[case['operation']](case, work_dir, site_path)
+    seconds = time.monotonic() - started
+
+    # What the operation moved: the site and dump read by a backup, the dump
+    # fed to mysql by a load, the uncompressed archive read by a restore or
+    # a verify
+    phases = metrics.phases
+    if case['operation'] == 'backup':
+        processed = phases.get('read', {}).get('bytes_in', 0) + phases.get('mysqldump', {}).get('bytes_in', 0)
+    elif case['operation'] == 'load':
+        processed = phases.get('mysql', {}).get('bytes_out', 0)
+    else:
+        processed = phases.get('decompress', {}).get('bytes_out', 0)
+
+    return {
+        'name': case['name'],
+        'operation': case['operation'],
+        'case': case,
+        'seconds': round(seconds, 6),
+        'bytes': processed,
+        'throughput_mb_s': round(processed / seconds / 1000000, 3) if seconds > 0 else None,
+        'archive_bytes': metrics.archive_bytes,
+        'compression_ratio': metrics.compression_ratio,
+        'peak_rss_bytes': metrics.peak_rss,
+        'phases': metrics.to_dict()['phases']
+    }
@@ -0,0 +1,195 @@
+"""
+fake_mysql
+
+Stand-in for mysqldump and mysql, so backups and restores can be benchmarked
+without a database server. ``install`` writes ``mysqldump`` and ``mysql``
+wrappers into a directory to put first on the PATH.
+
+mysqldump writes a synthetic dump of WPBENCH_DUMP_BYTES bytes spread over
+the tables in WPBENCH_TABLES (the schema with --no-data, one table with
+--no-create-info and a table name). mysql reads and discards its input,
+answers the table listing and holds the lock session of a per-table dump.
+Both are throttled to WPBENCH_RATE bytes per second (0 = as fast as
+possible), which stands in for the speed of the database server.
+
+The content of the dump only depends on its size and tables, so every run
+dumps the same bytes.
+"""
+
+# pylint: disable=line-too-long
+
+import os
+import random
+import stat
+import sys
+import time
+
+DEFAULT_DUMP_BYTES = 64 * 1024 * 1024
+DEFAULT_TABLES = ['wp_commentmeta', 'wp_comments', 'wp_links', 'wp_options', 'wp_postmeta', 'wp_posts',
+                  'wp_term_relationships', 'wp_term_taxonomy', 'wp_termmeta', 'wp_terms', 'wp_usermeta', 'wp_users']
+
+# Share of the dump held by the posts and their meta data, as on most sites
+LARGE_TABLES = {'wp_posts': 0.45, 'wp_postmeta': 0.3}
+
+WRITE_SIZE = 64 * 1024
+ROWS_PER_INSERT = 100
+STATEMENT_POOL = 64
+LOCK_MARKER_PREFIX = "SELECT '"
+
+#########################################################################
+def install(directory):
+    """
+    Write ``mysqldump`` and ``mysql`` wrappers running this script with
+    the current interpreter to ``directory``
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    for program in ('mysqldump', 'mysql'):
+        filename = os.path.join(directory, program)
+        with open(filename, 'w') as output:
+            output.write('#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(sys.executable, os.path.abspath(__file__), program))
+        os.chmod(filename, os.stat(filename).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+#########################################################################
+def _tables():
+    return [table for table in os.environ.get('WPBENCH_TABLES', ','.join(DEFAULT_TABLES)).split(',') if len(table) > 0]
+
+#########################################################################
+def _table_bytes(table, tables):
+    total = int(os.environ.get('WPBENCH_DUMP_BYTES', DEFAULT_DUMP_BYTES))
+    rest = 1.0 - sum(share for name, share in LARGE_TABLES.items() if name in tables)
+    others = len([name for name in tables if name not in LARGE_TABLES])
+
+    share = LARGE_TABLES.get(table, rest / others if others > 0 else 0.0)
+
+    return int(total * share)
+
+class _Throttle:
+    """ Keeps the bytes moved per second under WPBENCH_RATE """
+
+    #########################################################################
+    def __init__(self):
+        self.__rate = int(os.environ.get('WPBENCH_RATE', '0'))
+        self.__started = time.monotonic()
+        self.__bytes = 0
+
+    #########################################################################
+    def __call__(self, size):
+        if self.__rate <= 0:
+            return
+
+        self.__bytes += size
+        ahead = self.__bytes / self.__rate - (time.monotonic() - self.__started)
+        if ahead > 0:
+            time.sleep(ahead)
+
+#########################################################################
+def _schema(tables):
+    for table in tables:
+        yield ("DROP TABLE IF EXISTS `{0}`;\n"
+               "CREATE TABLE `{0}` (\n"
+               "  `id` bigint unsigned NOT NULL AUTO_INCREMENT,\n"
+               "  `parent_id` bigint unsigned NOT NULL DEFAULT '0',\n"
+               "  `name` varchar(255) NOT NULL DEFAULT '',\n"
+               "  `value` longtext,\n"
+               "  PRIMARY KEY (`id`),\n"
+               "  KEY `parent_id` (`parent_id`),\n"
+               "  KEY `name` (`name`(191))\n"
+               ") ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;\n").format(table).encode('utf-8')
+
+#########################################################################
+def _data(table, size):
+    """
+    INSERT statements picked from a pool of STATEMENT_POOL distinct ones,
+    which keeps the dump cheap to generate and as compressible as a real one
+    """
+
+    rng = random.Random(table)
+    words = ['wordpress', 'post', 'meta', 'option', 'value', 'draft', 'publish', 'attachment', 'revision', 'nav_menu_item', 'a:1:{s:4:"data";}']
+    pool = []
+
+    for statement in range(STATEMENT_POOL):
+        values = ["({},{},'{}','{}')".format(row, rng.randint(0, row), rng.choice(words), ' '.join(rng.choices(words, k=rng.randint(4, 40))))
+                  for row in range(statement * ROWS_PER_INSERT + 1, (statement + 1) * ROWS_PER_INSERT + 1)]
+        pool.append('INSERT INTO `{}` VALUES {};\n'.format(table, ','.join(values)).encode('utf-8'))
+
+    written = 0
+
+    while written < size:
+        statement = rng.choice(pool)
+        written += len(statement)
+        yield statement
+
+#########################################################################
+def _write(chunks):
+    throttle = _Throttle()
+    output = sys.stdout.buffer
+    buffer = bytearray()
+
+    for chunk in chunks:
+        buffer += chunk
+        if len(buffer) >= WRITE_SIZE:
+            output.write(buffer)
+            throttle(len(buffer))
+            buffer = bytearray()
+
+    output.write(buffer)
+    output.write(b'-- Dump completed\n')
+    output.flush()
+
+#########################################################################
+def mysqldump(args):
+    """ Write a synthetic dump to stdout """
+
+    tables = _tables()
+
+    if '--no-data' in args:
+        if '--triggers' in args and '--no-create-info' in args:
+            _write([b'-- No triggers\n'])
+        else:
+            _write(_schema(tables))
+        return 0
+
+    if '--no-create-info' in args:
+        table = args[-1]
+        _write(_data(table, _table_bytes(table, tables)))
+        return 0
+
+    def whole():
+        yield from _schema(tables)
+        for table in tables:
+            yield from _data(table, _table_bytes(table, tables))
+
+    _write(whole())
+
+    return 0
+
+#########################################################################
+def mysql(args):
+    """ Consume SQL from stdin (or answer the queries the backup sends) """
+
+    if '--execute' in args:
+        statement = args[args.index('--execute') + 1]
+        if statement.startswith('SHOW FULL TABLES'):
+            for table in _tables():
+                print(table + '\tBASE TABLE')
+        return 0
+
+    if '--unbuffered' in args:
+        # The session holding the table locks of a per-table dump
+        for line in sys.stdin:
+            if LOCK_MARKER_PREFIX in line:
+                print(line.split(LOCK_MARKER_PREFIX)[1].split("'")[0], flush=True)
+        return 0
+
+    throttle = _Throttle()
+
+    while True:
+        data = sys.stdin.buffer.read(WRITE_SIZE)
+        if not data:
+            return 0
+        throttle(len(data))
+
+if __name__ == '__main__':
+    sys.exit({'mysqldump': mysqldump, 'mysql': mysql}[sys.argv[1]](sys.argv[2:]))
@@ -0,0 +1,142 @@
+"""
+results
+
+The JSON results of a benchmark run and the comparison of two runs.
+
+A results file records where it was measured (Python, platform, CPU count,
+package version), the configuration of the synthetic site and one result
+per case:
+
+    {
+      "version": 1,
+      "created": "2024-05-01T12:00:00",
+      "environment": {"python": "3.11.4", "platform": "Linux-...", "cpu_count": 8, "wpbackup2": "0.2.21"},
+      "config": {"files": 2000, "median_size": 8192, "media_share": 0.3, "seed": 1, ...},
+      "results": [
+        {"name": "backup-gzip-1", "operation": "backup", "seconds": 4.2, "bytes": 123456789,
+         "throughput_mb_s": 29.4, "peak_rss_bytes": 52428800, "phases": {...}, ...},
+        ...
+      ]
+    }
+
+When a case is repeated, the fastest run is kept, as it is the one least
+disturbed by the rest of the machine.
+"""
+
+# pylint: disable=line-too-long
+
+import datetime
+import json
+import os
+import platform
+
+RESULTS_VERSION = 1
+
+# (key, True when higher is better) of the values compared between runs
+COMPARED = [('throughput_mb_s', True), ('peak_rss_bytes', False)]
+
+#########################################################################
+def _package_version():
+    try:
+        from importlib import metadata # pylint: disable=import-outside-toplevel
+        return metadata.version('wpbackup2')
+    except Exception: # pylint: disable=broad-except
+        return None
+
+#########################################################################
+def new_results(config):
+    """ Empty results of a run with ``config`` """
+
+    return {
+        'version': RESULTS_VERSION,
+        'created': datetime.datetime.now().isoformat(timespec='seconds'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'wpbackup2': _package_version()
+        },
+        'config': config,
+        'results': []
+    }
+
+#########################################################################
+def best_result(runs):
+    """ The fastest of several runs of a case """
+    return min(runs, key=lambda result: result['seconds'])
+
+#########################################################################
+def write_results(results, filename):
+    """ Write ``results`` to ``filename`` """
+
+    with open(filename, 'w') as output:
+        json.dump(results, output, indent=2)
+        output.write('\n')
+
+#########################################################################
+def load_results(filename):
+    """
+    Read a results file
+
+    Raises:
+        ValueError: the file is not in a format this version reads.
+    """
+
+    with open(filename, 'r') as source:
+        results = json.load(source)
+
+    if results.get('version') != RESULTS_VERSION:
+        raise ValueError("{}: unsupported results version {}".format(filename, results.get('version')))
+
+    return results
+
+#########################################################################
+def compare_results(base, new, threshold=0.1):
+    """
+    Compare the cases two runs have in common, returning one row per case
+    and value: (name, key, base value, new value, relative change,
+    regressed). A value regressed when it is worse than in ``base`` by more
+    than ``threshold`` (0.1 = 10%).
+    """
+
+    base_results = {result['name']: result for result in base['results']}
+    rows = []
+
+    for result in new['results']:
+        previous = base_results.get(result['name'])
+        if previous is None:
+            continue
+
+        for key, higher_is_better in COMPARED:
+            before = previous.get(key)
+            after = result.get(key)
+            if not before or after is None:
+                continue
+
+            change = (after - before) / before
+            regressed = -change > threshold if higher_is_better else change > threshold
+            rows.append((result['name'], key, before, after, change, regressed))
+
+    return rows
+
+#########################################################################
+def format_comparison(base, new, rows):
+    """ The comparison of two runs as a table """
+
+    lines = []
+
+    if base['config'] != new['config'] or base['environment'] != new['environment']:
+        lines.append('Warning: the runs differ in configuration or environment, the numbers may not be comparable.')
+
+    lines.append('{:<20} {:<16} {:>14} {:>14} {:>9}'.format('case', 'value', 'base', 'new', 'change'))
+
+    for name, key, before, after, change, regressed in rows:
+        lines.append('{:<20} {:<16} {:>14} {:>14} {:>+8.1f}%{}'.format(name, key, _format_value(key, before), _format_value(key, after), change * 100, '  REGRESSION' if regressed else ''))
+
+    return '\n'.join(lines)
+
+#########################################################################
+def _format_value(key, value):
+    if key.endswith('_bytes'):
+        return '{:.1f} MiB'.format(value / 1024 / 1024)
+    return '{:.2f}'.format(value)
@@ -0,0 +1,134 @@
+"""
+site_generator
+
+Generates synthetic WordPress trees for the benchmarks. The layout follows
+a real installation (wp-admin, wp-includes, plugins, themes and uploads
+sorted by year and month) and the content is generated from a seed, so the
+same arguments always produce the same tree.
+
+File sizes follow a log-normal distribution around ``median_size``. A share
+of the files (``media_share``) are uploads filled with random bytes, which
+stand in for already-compressed media (JPEG, PNG, MP4...); every other file
+is PHP, CSS or JavaScript-like text that compresses about as well as the
+real thing.
+"""
+
+# pylint: disable=line-too-long
+
+import math
+import os
+import random
+
+WP_CONFIG_TEMPLATE = """<?php
+// Synthetic site generated by the wpbackup2 benchmarks
+
+// ** MySQL settings ** //
+define( 'DB_NAME', '{db_name}' );
+define( 'DB_USER', 'wordpress' );
+define( 'DB_PASSWORD', 'wordpress' );
+define( 'DB_HOST', '{db_host}' );
+define( 'DB_CHARSET', 'utf8' );
+define( 'DB_COLLATE', '' );
+
+$table_prefix = 'wp_';
+
+if ( ! defined( 'ABSPATH' ) ) {{
+    define( 'ABSPATH', __DIR__ . '/' );
+}}
+
+require_once ABSPATH . 'wp-settings.php';
+"""
+
+CODE_DIRECTORIES = ['wp-admin', 'wp-admin/includes', 'wp-includes', 'wp-includes/js', 'wp-includes/css']
+CODE_EXTENSIONS = ['.php', '.php', '.php', '.js', '.css']
+MEDIA_EXTENSIONS = ['.jpg', '.png', '.webp', '.mp4', '.pdf']
+
+WORDS = ('function return array string value post meta option query filter action hook '
+         'register enqueue script style admin user site table prefix cache transient '
+         'sanitize escape render widget block theme plugin upload media attachment').split()
+
+# Distinct lines the text files are assembled from
+TEXT_LINES = 4096
+
+# Content directories files are spread over
+PLUGINS = 12
+THEMES = 3
+UPLOAD_YEARS = range(2019, 2025)
+
+#########################################################################
+def _text_lines(rng):
+    """
+    Source-code-like lines the text files are assembled from
+    """
+
+    return [("{}${} = {}( '{}', {} );\n".format('    ' * rng.randint(0, 3), rng.choice(WORDS), '_'.join(rng.sample(WORDS, 2)), rng.choice(WORDS), rng.randint(0, 9999))).encode('ascii')
+            for _ in range(TEXT_LINES)]
+
+#########################################################################
+def _text(rng, lines, size):
+    """
+    ``size`` bytes of text picked from ``lines``
+    """
+
+    average = sum(len(line) for line in lines[:64]) // 64
+
+    return b''.join(rng.choices(lines, k=size // average + 1))[:size].ljust(size, b'\n')
+
+#########################################################################
+def _size(rng, median_size, max_size):
+    return max(1, min(max_size, int(rng.lognormvariate(math.log(median_size), 1.2))))
+
+#########################################################################
+def generate_site(path, files=2000, median_size=8 * 1024, max_size=16 * 1024 * 1024, media_share=0.3, seed=1, db_name='wordpress', db_host='127.0.0.1'):
+    """
+    Write a synthetic WordPress site to ``path``, returning (files, bytes)
+    written.
+
+    Args:
+        path (str):             directory to create the site in (must not exist)
+        files (int):            number of files besides wp-config.php
+        median_size (int):      median file size in bytes
+        max_size (int):         largest file size in bytes
+        media_share (float):    share (0 to 1) of the files that are
+                                incompressible media uploads
+        seed (int):             seed of the generator
+        db_name (str):          DB_NAME written to wp-config.php
+        db_host (str):          DB_HOST written to wp-config.php
+    """
+
+    rng = random.Random(seed)
+    lines = _text_lines(rng)
+
+    os.makedirs(path)
+
+    with open(os.path.join(path, 'wp-config.php'), 'w') as output:
+        output.write(WP_CONFIG_TEMPLATE.format(db_name=db_name, db_host=db_host))
+
+    directories = list(CODE_DIRECTORIES)
+    directories += ['wp-content/plugins/plugin-{:02d}/includes'.format(plugin) for plugin in range(PLUGINS)]
+    directories += ['wp-content/themes/theme-{}/assets'.format(theme) for theme in range(THEMES)]
+    upload_directories = ['wp-content/uploads/{}/{:02d}'.format(year, month) for year in UPLOAD_YEARS for month in range(1, 13)]
+
+    total = 0
+
+    for number in range(files):
+        media = rng.random() < media_share
+        size = _size(rng, median_size * (8 if media else 1), max_size)
+
+        if media:
+            directory = rng.choice(upload_directories)
+            name = 'image-{:06d}{}'.format(number, rng.choice(MEDIA_EXTENSIONS))
+            content = rng.getrandbits(size * 8).to_bytes(size, 'little')
+        else:
+            directory = rng.choice(directories)
+            name = 'file-{:06d}{}'.format(number, rng.choice(CODE_EXTENSIONS))
+            content = _text(rng, lines, size)
+
+        os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+        with open(os.path.join(path, directory, name), 'wb') as output:
+            output.write(content)
+
+        total += size
+
+    return files, total
@@ -35,6 +35,15 @@ setup(
             'autopep8',
             'coverage',
             'pylint'
+        ],
+        'zstd': [
+            'zstandard>=0.15'
+        ],
+        'lz4': [
+            'lz4>=3.0'
+        ],
+        'xxhash': [
+            'xxhash>=3.0'
         ]
     },
     install_requires=[
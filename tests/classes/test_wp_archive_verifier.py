@@ -0,0 +1,93 @@
+""" Tests for the wp_archive_verifier module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+
+from wpbackup2.classes.wp_archive_verifier import WpArchiveVerifier
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import MANIFEST_ARCNAME
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.classes.wp_manifest import new_hasher
+
+class WpArchiveVerifierTestCase(unittest.TestCase):
+    """ Tests for the WpArchiveVerifier class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def _write_archive(self, name, files, dump, recorded=None):
+        """
+        Write an archive holding ``files`` (path -> content) and the
+        database dump ``dump``, with a manifest hashing ``recorded`` (by
+        default the same files)
+        """
+
+        site_path = os.path.join(self._temp_dir.name, name)
+        os.makedirs(site_path)
+
+        manifest = WpManifest(hash_algorithm=HASH_ALGORITHM)
+        manifest.add('', os.lstat(site_path))
+
+        for path, content in (recorded if recorded is not None else files).items():
+            with open(os.path.join(site_path, path), 'wb') as output:
+                output.write(content)
+
+            hasher = new_hasher()
+            hasher.update(content)
+            manifest.add(path, os.lstat(os.path.join(site_path, path)), hasher.hexdigest())
+
+        archive_filename = os.path.join(self._temp_dir.name, name + '.tar.gz')
+
+        with tarfile.open(archive_filename, 'w:gz') as archive:
+            archive.add(site_path, 'wp-root', recursive=False)
+
+            for arcname, content in [('wp-root/' + path, content) for path, content in files.items()] + [('database.sql', dump), (MANIFEST_ARCNAME, manifest.to_json())]:
+                member = tarfile.TarInfo(arcname)
+                member.size = len(content)
+                archive.addfile(member, io.BytesIO(content))
+
+        return archive_filename
+
+    #########################################################################
+    def test_verify(self):
+        """ A complete archive verifies, a modified file or a truncated dump does not """
+
+        files = {'index.php': b'<?php', 'wp-config.php': b'<?php define();'}
+        dump = b'INSERT INTO t VALUES (1);\n-- Dump completed on 2024-01-01 12:00:00\n'
+
+        result = WpArchiveVerifier().verify(self._write_archive('complete', files, dump))
+
+        self.assertTrue(result.succeeded, result.errors)
+        self.assertEqual((result.files, result.hashed_files, result.database_dumps), (2, 2, ['database.sql']))
+        self.assertGreater(result.metrics.phases['decompress']['bytes_out'], 0)
+
+        result = WpArchiveVerifier().verify(self._write_archive('modified', files, dump, recorded={'index.php': b'<?PHP', 'wp-config.php': b'<?php define();'}))
+
+        self.assertFalse(result.succeeded)
+        self.assertEqual(result.errors, ["the content of 'index.php' does not match the hash of the manifest"])
+
+        result = WpArchiveVerifier().verify(self._write_archive('truncated', files, b'INSERT INTO t VALUES (1);\n'))
+
+        self.assertFalse(result.succeeded)
+        self.assertEqual(result.database_dumps, [])
+
+        # Cut off in the middle of the compressed stream
+        filename = self._write_archive('cut', files, dump)
+        with open(filename, 'rb') as source:
+            content = source.read()
+        with open(filename, 'wb') as output:
+            output.write(content[:len(content) // 2])
+
+        self.assertFalse(WpArchiveVerifier().verify(filename).succeeded)
+
+if __name__ == '__main__':
+    unittest.main()
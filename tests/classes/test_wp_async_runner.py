@@ -0,0 +1,122 @@
+""" Tests for the WpAsyncRunner class. """
+
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+import unittest
+
+from wpbackup2.classes.wp_async_runner import WpAsyncRunner
+from wpbackup2.classes.wp_async_runner import run_concurrently
+from wpbackup2.classes.wp_async_runner import start_process
+from wpbackup2.classes.wp_async_runner import stop_process
+
+class WpAsyncRunnerTestCase(unittest.TestCase):
+    """ Tests for the WpAsyncRunner class. """
+
+    #########################################################################
+    def test_drive(self):
+        """ Steps run on the executor, requests on the loop, and the result is returned """
+
+        loop_thread = []
+        step_threads = set()
+
+        def steps():
+            total = 0
+            for value in range(3):
+                step_threads.add(threading.get_ident())
+                yield
+                total += yield value
+            return total
+
+        async def double(value):
+            loop_thread.append(threading.get_ident())
+            await asyncio.sleep(0)
+            return value * 2
+
+        async def main():
+            return threading.get_ident(), await WpAsyncRunner().drive(steps(), double)
+
+        loop_ident, result = asyncio.run(main())
+
+        self.assertEqual(result, 6)
+        self.assertEqual(set(loop_thread), {loop_ident})
+        self.assertNotIn(loop_ident, step_threads)
+
+    #########################################################################
+    def test_drive_closes_steps(self):
+        """ A failed request closes the generator before the error is raised """
+
+        closed = []
+
+        def steps():
+            try:
+                yield 'request'
+            finally:
+                closed.append(True)
+
+        async def fail(_):
+            raise ValueError('failed')
+
+        with self.assertRaises(ValueError):
+            asyncio.run(WpAsyncRunner().drive(steps(), fail))
+
+        self.assertEqual(closed, [True])
+
+    #########################################################################
+    def test_call_cancelled(self):
+        """ A cancelled call waits for the running step """
+
+        finished = []
+
+        def step():
+            time.sleep(0.2)
+            finished.append(True)
+
+        async def main():
+            task = asyncio.ensure_future(WpAsyncRunner().call(step))
+            await asyncio.sleep(0.05)
+            task.cancel()
+
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+            return list(finished)
+
+        self.assertEqual(asyncio.run(main()), [True])
+
+    #########################################################################
+    def test_processes(self):
+        """ Children run on the loop, and the first failure cancels the others """
+
+        async def upper(data):
+            process = await start_process([sys.executable, '-c', 'import sys; sys.stdout.write(sys.stdin.read().upper())'],
+                                          stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+            output, _ = await process.communicate(data)
+            return output
+
+        async def sleep():
+            process = await start_process([sys.executable, '-c', 'import time; time.sleep(60)'])
+            try:
+                await process.wait()
+            finally:
+                await stop_process(process)
+            return process.returncode
+
+        async def fail():
+            await asyncio.sleep(0.1)
+            raise ValueError('failed')
+
+        async def main():
+            self.assertEqual(await run_concurrently([upper(b'hello'), upper(b'world')], 1), [b'HELLO', b'WORLD'])
+
+            with self.assertRaises(ValueError):
+                await run_concurrently([sleep(), fail()], 2)
+
+        started = time.monotonic()
+        asyncio.run(main())
+        self.assertLess(time.monotonic() - started, 30)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+""" Tests for the WpBackupResult class. """
+
+import unittest
+
+from wpbackup2 import WpBackupResult
+
+class WpBackupResultTestCase(unittest.TestCase):
+    """ Tests for the WpBackupResult class. """
+
+    def test_succeeded(self):
+        """ A result without an error succeeded """
+
+        result = WpBackupResult('/var/www/site', '/backups/site.tar.gz', duration=1.23456, archive_bytes=42)
+
+        self.assertTrue(result.succeeded)
+        self.assertEqual(result.to_dict(), {
+            'site_path': '/var/www/site',
+            'archive': '/backups/site.tar.gz',
+            'succeeded': True,
+            'duration': 1.235,
+            'bytes': 42,
+            'error': None,
+            'metrics': None
+        })
+
+    def test_failed(self):
+        """ A result with an error failed and reports it """
+
+        result = WpBackupResult('/var/www/site', '/backups/site.tar.gz', error=ValueError('boom'))
+
+        self.assertFalse(result.succeeded)
+        self.assertEqual(result.to_dict()['error'], 'ValueError: boom')
+        self.assertIn('FAILED', str(result))
+
+if __name__ == '__main__':
+    unittest.main()
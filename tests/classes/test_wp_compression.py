@@ -0,0 +1,190 @@
+""" Tests for the wp_compression module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import gzip
+import io
+import os
+import tarfile
+import tempfile
+
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import WpParallelCompressor
+from wpbackup2.classes.wp_compression import WpStoringReader
+from wpbackup2.classes.wp_compression import detect_compression
+from wpbackup2.classes.wp_compression import is_incompressible
+from wpbackup2.classes.wp_compression import open_archive_reader
+from wpbackup2.classes.wp_compression import stream_members
+
+class WpParallelCompressorTestCase(unittest.TestCase):
+    """ Tests for the WpParallelCompressor class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_output_is_standard_gzip(self):
+        """ Test the concatenated members decompress to the original data """
+
+        filename = os.path.join(self._temp_dir.name, 'data.gz')
+        data = os.urandom(100000) + b'wordpress ' * 50000
+
+        compressor = WpParallelCompressor(filename, workers=4, block_size=65536)
+        compressor.write(data[:1000])
+        compressor.write(data[1000:])
+        self.assertEqual(compressor.tell(), len(data))
+        compressor.close()
+
+        with gzip.open(filename, 'rb') as stream:
+            self.assertEqual(stream.read(), data)
+
+    #########################################################################
+    def test_tarfile_round_trip(self):
+        """ Test a tar written through the compressor can be read with 'r:gz' """
+
+        filename = os.path.join(self._temp_dir.name, 'archive.tar.gz')
+        payload = b'<?php echo "hello"; ?>\n' * 10000
+
+        compressor = WpParallelCompressor(filename, workers=2, block_size=4096)
+        with tarfile.open(fileobj=compressor, mode='w') as stream:
+            tarinfo = tarfile.TarInfo('wp-root/index.php')
+            tarinfo.size = len(payload)
+            stream.addfile(tarinfo, io.BytesIO(payload))
+        compressor.close()
+
+        with tarfile.open(filename, 'r:gz') as stream:
+            self.assertEqual(stream.extractfile('wp-root/index.php').read(), payload)
+
+    #########################################################################
+    def test_codec_round_trip(self):
+        """ Test the codecs from the standard library are detected and read back """
+
+        payload = b'define( \'DB_NAME\', \'wordpress\' );\n' * 5000
+
+        for compression in [WpCompression.GZIP, WpCompression.XZ, WpCompression.NONE]:
+            filename = os.path.join(self._temp_dir.name, 'archive-' + compression.value)
+
+            compressor = WpParallelCompressor(filename, workers=2, block_size=8192, compression=compression)
+            compressor.write(payload)
+            compressor.close()
+
+            self.assertEqual(detect_compression(filename), compression)
+
+            with open_archive_reader(filename) as stream:
+                self.assertEqual(stream.read(), payload)
+
+    #########################################################################
+    def test_reader_over_pipe(self):
+        """ Test an archive is read sequentially from a file object that cannot seek, which is left open """
+
+        filename = os.path.join(self._temp_dir.name, 'piped.tar.gz')
+        payload = b'<?php phpinfo();\n' * 1000
+
+        compressor = WpParallelCompressor(filename, workers=2, block_size=4096)
+        with tarfile.open(fileobj=compressor, mode='w') as stream:
+            tarinfo = tarfile.TarInfo('wp-root/info.php')
+            tarinfo.size = len(payload)
+            stream.addfile(tarinfo, io.BytesIO(payload))
+        compressor.close()
+
+        read_fd, write_fd = os.pipe()
+        with open(filename, 'rb') as source, open(write_fd, 'wb') as pipe:
+            pipe.write(source.read())
+
+        with open(read_fd, 'rb') as pipe:
+            with open_archive_reader(pipe) as fileobj, tarfile.open(fileobj=fileobj, mode='r|') as stream:
+                member = stream.next()
+                self.assertEqual(stream.extractfile(member).read(), payload)
+
+            self.assertFalse(pipe.closed)
+
+    #########################################################################
+    def test_reader_over_short_reads(self):
+        """ Test the codec is detected when the magic bytes arrive over several reads """
+
+        class Trickle:
+            """ A pipe handing out one byte per read """
+
+            def __init__(self, data):
+                self.__stream = io.BytesIO(data)
+
+            def read(self, size=-1): # pylint: disable=unused-argument
+                return self.__stream.read(1)
+
+        payload = b'define( \'DB_NAME\', \'wordpress\' );\n' * 100
+
+        for compression in [WpCompression.GZIP, WpCompression.XZ, WpCompression.NONE]:
+            filename = os.path.join(self._temp_dir.name, 'trickle-' + compression.value)
+
+            compressor = WpParallelCompressor(filename, compression=compression)
+            compressor.write(payload)
+            compressor.close()
+
+            with open(filename, 'rb') as source:
+                data = source.read()
+
+            with open_archive_reader(Trickle(data)) as stream:
+                self.assertEqual(stream.read(), payload)
+
+    #########################################################################
+    def test_stored_media(self):
+        """ Test media is stored in frames of its own while the tar headers and text are compressed """
+
+        filename = os.path.join(self._temp_dir.name, 'media.tar.gz')
+        image = os.urandom(200000)
+        text = b'<?php wp_enqueue_script( "theme" );\n' * 5000
+
+        self.assertTrue(is_incompressible('wp-content/uploads/2024/01/photo.JPG', len(image)))
+        self.assertTrue(is_incompressible('wp-content/uploads/backup.bin', len(image), io.BytesIO(image)))
+        self.assertFalse(is_incompressible('wp-content/debug.bin', len(text), io.BytesIO(text)))
+        self.assertFalse(is_incompressible('wp-content/uploads/icon.png', 1000))
+
+        compressor = WpParallelCompressor(filename, workers=2, block_size=65536, record_frames=True)
+        with tarfile.open(fileobj=compressor, mode='w') as stream:
+            for name, payload in [('wp-root/a.php', text), ('wp-root/photo.jpg', image), ('wp-root/b.php', text)]:
+                tarinfo = tarfile.TarInfo(name)
+                tarinfo.size = len(payload)
+                fileobj = io.BytesIO(payload)
+                if name.endswith('.jpg'):
+                    fileobj = WpStoringReader(fileobj, compressor)
+                stream.addfile(tarinfo, fileobj)
+                if name.endswith('.jpg'):
+                    fileobj.close()
+        compressor.close()
+
+        # The image data (and its padding) is in stored frames, the headers are not
+        stored = [frame for frame in compressor.frames if frame[1] >= frame[3]]
+        self.assertGreaterEqual(sum(frame[3] for frame in stored), len(image))
+        self.assertLess(sum(frame[3] for frame in stored), len(image) + tarfile.BLOCKSIZE)
+
+        with tarfile.open(filename, 'r:gz') as stream:
+            self.assertEqual(stream.extractfile('wp-root/photo.jpg').read(), image)
+            self.assertEqual(stream.extractfile('wp-root/b.php').read(), text)
+
+    #########################################################################
+    def test_stream_members(self):
+        """ Test members read sequentially are yielded in order and not kept by tarfile """
+
+        filename = os.path.join(self._temp_dir.name, 'members.tar.gz')
+
+        with tarfile.open(filename, 'w:gz') as stream:
+            for index in range(50):
+                tarinfo = tarfile.TarInfo('wp-root/{}.php'.format(index))
+                tarinfo.size = 5
+                stream.addfile(tarinfo, io.BytesIO(b'<?php'))
+
+        names = []
+        with open_archive_reader(filename) as fileobj, tarfile.open(fileobj=fileobj, mode='r|') as stream:
+            for member in stream_members(stream):
+                self.assertEqual(stream.extractfile(member).read(), b'<?php')
+                self.assertEqual(stream.members, [])
+                names.append(member.name)
+
+        self.assertEqual(names, ['wp-root/{}.php'.format(index) for index in range(50)])
+
+if __name__ == '__main__':
+    unittest.main()
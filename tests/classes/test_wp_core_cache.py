@@ -0,0 +1,118 @@
+""" Tests for the wp_core_cache module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import os
+import tempfile
+
+from wpbackup2.classes.wp_core_cache import CHECKSUMS_FILENAME
+from wpbackup2.classes.wp_core_cache import WpCoreCache
+from wpbackup2.classes.wp_core_cache import detect_version
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.exceptions import WpCoreReleaseCorruptError
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as output:
+        output.write(content)
+
+class WpCoreCacheTestCase(unittest.TestCase):
+    """ Tests for the WpCoreCache class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_release(self):
+        """ Site files are matched against the release of the version the site runs """
+
+        cache_path = os.path.join(self._temp_dir.name, 'cache')
+        site_path = os.path.join(self._temp_dir.name, 'site')
+
+        for root in [os.path.join(cache_path, '6.4.2', 'wordpress'), site_path]:
+            _write(os.path.join(root, 'wp-includes', 'version.php'), "<?php\n$wp_version = '6.4.2';\n")
+            _write(os.path.join(root, 'wp-admin', 'index.php'), '<?php // admin')
+            _write(os.path.join(root, 'index.php'), '<?php // front')
+
+        _write(os.path.join(site_path, 'index.php'), '<?php // FRONT')
+
+        self.assertEqual(detect_version(site_path), '6.4.2')
+        self.assertIsNone(detect_version(cache_path))
+
+        cache = WpCoreCache(cache_path)
+        release = cache.release_for_site(site_path)
+
+        self.assertEqual(release.version, '6.4.2')
+        self.assertEqual(sorted(release.checksums), ['index.php', 'wp-admin/index.php', 'wp-includes/version.php'])
+        self.assertTrue(os.path.isfile(os.path.join(cache_path, '6.4.2', 'wordpress', CHECKSUMS_FILENAME)))
+
+        admin = os.path.join(site_path, 'wp-admin', 'index.php')
+        self.assertEqual(release.matching_hash('wp-admin/index.php', admin, os.path.getsize(admin)), release.checksums['wp-admin/index.php'][1])
+
+        # Same size, other content
+        front = os.path.join(site_path, 'index.php')
+        self.assertIsNone(release.matching_hash('index.php', front, os.path.getsize(front)))
+
+        self.assertIsNone(release.matching_hash('wp-admin/other.php', admin, os.path.getsize(admin)))
+        self.assertIsNone(cache.release('5.0'))
+
+        # The checksums are read back from the cache
+        self.assertEqual(WpCoreCache(cache_path).release('6.4.2').checksums, release.checksums)
+
+    #########################################################################
+    def test_release_changed(self):
+        """ A changed release gets new checksums, and a damaged one fails restores """
+
+        cache_path = os.path.join(self._temp_dir.name, 'changed')
+        release_path = os.path.join(cache_path, '6.5')
+
+        _write(os.path.join(release_path, 'wp-includes', 'version.php'), "<?php\n$wp_version = '6.5';\n")
+        _write(os.path.join(release_path, 'index.php'), '<?php // front')
+
+        release = WpCoreCache(cache_path).release('6.5')
+        size, file_hash = release.checksums['index.php']
+
+        target = os.path.join(self._temp_dir.name, 'materialized.php')
+        release.materialize('index.php', target, size, file_hash)
+
+        with open(target, 'r') as source:
+            self.assertEqual(source.read(), '<?php // front')
+
+        # Damaged after its checksums were written: a restore refuses it
+        checksums_time = os.stat(os.path.join(release_path, CHECKSUMS_FILENAME)).st_mtime_ns
+        _write(os.path.join(release_path, 'index.php'), '<?php // FRONT')
+
+        with self.assertRaises(WpCoreReleaseCorruptError):
+            release.materialize('index.php', target, size, file_hash)
+        self.assertFalse(os.path.exists(target))
+
+        # Even with the mtime of the original, the checksums are computed again
+        os.utime(os.path.join(release_path, 'index.php'), ns=(checksums_time - 10**9, checksums_time - 10**9))
+        self.assertNotEqual(WpCoreCache(cache_path).release('6.5').checksums['index.php'][1], file_hash)
+
+        for version in ['../changed/6.5', '6.5/../6.5', '..', '']:
+            self.assertIsNone(WpCoreCache(cache_path).release(version or None))
+
+    #########################################################################
+    def test_manifest_core_files(self):
+        """ Referenced core files survive a manifest round trip """
+
+        filename = os.path.join(self._temp_dir.name, 'core.php')
+        _write(filename, '<?php')
+
+        manifest = WpManifest()
+        manifest.core_version = '6.4.2'
+        manifest.add_core('wp-admin/index.php', os.lstat(filename), 'abc')
+
+        loaded = WpManifest.from_json(manifest.to_json())
+
+        self.assertEqual(loaded.core_version, '6.4.2')
+        self.assertEqual(loaded.core_files, manifest.core_files)
+        self.assertEqual(loaded.entries['wp-admin/index.php'][4], 'abc')
+
+if __name__ == '__main__':
+    unittest.main()
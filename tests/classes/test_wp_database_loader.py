@@ -0,0 +1,71 @@
+""" Tests for the wp_database_loader module. """
+
+# pylint: disable=line-too-long
+
+import os
+import tempfile
+import unittest
+
+from wpbackup2.classes.wp_database_loader import FILE_READ_SIZE
+from wpbackup2.classes.wp_database_loader import defer_secondary_keys
+from wpbackup2.classes.wp_database_loader import file_source
+
+SCHEMA = """DROP TABLE IF EXISTS `wp_posts`;
+/*!40101 SET character_set_client = utf8 */;
+CREATE TABLE `wp_posts` (
+  `ID` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  `post_name` varchar(200) NOT NULL DEFAULT '',
+  `post_content` longtext NOT NULL,
+  PRIMARY KEY (`ID`),
+  UNIQUE KEY `post_name_unique` (`post_name`),
+  KEY `post_name` (`post_name`(191)),
+  FULLTEXT KEY `post_content` (`post_content`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+CREATE TABLE `wp_links` (
+  `link_id` bigint(20) unsigned NOT NULL AUTO_INCREMENT,
+  PRIMARY KEY (`link_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+class WpDatabaseLoaderTestCase(unittest.TestCase):
+    """ Tests for the WpDatabaseLoader class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_defer_secondary_keys(self):
+        """ Test plain and FULLTEXT keys are moved out of CREATE TABLE, primary and unique keys stay """
+
+        schema, deferred = defer_secondary_keys(SCHEMA)
+
+        self.assertIn("  UNIQUE KEY `post_name_unique` (`post_name`)\n) ENGINE=InnoDB", schema)
+        self.assertNotIn("KEY `post_name` (`post_name`(191))", schema)
+        self.assertNotIn("FULLTEXT", schema)
+        self.assertIn("  PRIMARY KEY (`link_id`)\n) ENGINE=InnoDB", schema)
+
+        self.assertEqual(deferred, {'wp_posts': ["ALTER TABLE `wp_posts` ADD KEY `post_name` (`post_name`(191));",
+                                                 "ALTER TABLE `wp_posts` ADD FULLTEXT KEY `post_content` (`post_content`);"]})
+
+    #########################################################################
+    def test_file_source(self):
+        """ Test a file source yields the file in chunks and can be read again """
+
+        filename = os.path.join(self._temp_dir.name, 'dump.sql')
+        content = b'INSERT INTO `wp_posts` VALUES (1);\n' * (FILE_READ_SIZE // 16)
+
+        with open(filename, 'wb') as stream:
+            stream.write(content)
+
+        source = file_source(filename)
+
+        chunks = list(source())
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b''.join(chunks), content)
+        self.assertEqual(b''.join(source()), content)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+""" Tests for the wp_file_writer module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+
+from wpbackup2.classes.wp_file_writer import WpFileWriterPool
+from wpbackup2.classes.wp_metrics import WpMetrics
+
+class WpFileWriterPoolTestCase(unittest.TestCase):
+    """ Tests for the WpFileWriterPool class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_write(self):
+        """ Files are written with their content, mode and mtime, large ones inline """
+
+        contents = {'index.php': b'<?php', 'wp-content/uploads/a.bin': os.urandom(4096), 'wp-content/empty.txt': b''}
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w') as archive:
+            for name, data in contents.items():
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                member.mode = 0o640
+                member.mtime = 1500000000
+                archive.addfile(member, io.BytesIO(data))
+
+        root = os.path.join(self._temp_dir.name, 'site')
+        os.makedirs(root)
+
+        # A symlink in the way is replaced, not written through
+        os.symlink(os.path.join(self._temp_dir.name, 'outside'), os.path.join(root, 'index.php'))
+
+        metrics = WpMetrics('restore')
+
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode='r') as archive:
+            with WpFileWriterPool(root, 4, metrics, large_file_size=1024, max_buffered_bytes=8192) as writer:
+                for member in archive:
+                    writer.add(archive, member, member.name)
+
+                with self.assertRaises(ValueError):
+                    writer.add(archive, member, '../outside')
+
+        self.assertFalse(os.path.exists(os.path.join(self._temp_dir.name, 'outside')))
+
+        for name, data in contents.items():
+            path = os.path.join(root, name)
+            with open(path, 'rb') as source:
+                self.assertEqual(source.read(), data)
+            self.assertEqual(os.stat(path).st_mode & 0o777, 0o640)
+            self.assertEqual(os.stat(path).st_mtime, 1500000000)
+
+        self.assertEqual(metrics.phases['extract']['files'], 3)
+
+if __name__ == '__main__':
+    unittest.main()
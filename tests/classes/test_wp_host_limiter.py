@@ -0,0 +1,81 @@
+""" Tests for the wp_host_limiter module. """
+
+# pylint: disable=line-too-long
+
+import asyncio
+import unittest
+import threading
+import time
+
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
+
+class WpDbHostLimiterTestCase(unittest.TestCase):
+    """ Tests for the WpDbHostLimiter class. """
+
+    #########################################################################
+    def test_parse_and_lookup(self):
+        """ Test HOST=N parsing and lookup with and without a port """
+
+        limiter = WpDbHostLimiter(WpDbHostLimiter.parse(['db.example.com=4', 'other:3307=2']))
+
+        self.assertEqual(limiter.limit('db.example.com'), 4)
+        self.assertEqual(limiter.limit('db.example.com:3306'), 4)
+        self.assertEqual(limiter.limit('other:3307'), 2)
+        self.assertIsNone(limiter.limit('localhost'))
+        self.assertEqual(limiter.workers('db.example.com', 8), 4)
+        self.assertEqual(limiter.workers('localhost', 8), 8)
+
+        with self.assertRaises(ValueError):
+            WpDbHostLimiter.parse(['db.example.com'])
+
+    #########################################################################
+    def test_acquire_limits_concurrency(self):
+        """ Test no more than the limit of slots are held at once """
+
+        limiter = WpDbHostLimiter({'db': 2})
+        lock = threading.Lock()
+        active = [0, 0]
+
+        def worker():
+            with limiter.acquire('db'):
+                with lock:
+                    active[0] += 1
+                    active[1] = max(active[1], active[0])
+                time.sleep(0.02)
+                with lock:
+                    active[0] -= 1
+
+        threads = [threading.Thread(target=worker) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(active[1], 2)
+
+    #########################################################################
+    def test_acquire_async_shares_slots(self):
+        """ Test coroutines wait for the slots held by threads without blocking the loop """
+
+        limiter = WpDbHostLimiter({'db': 1})
+        order = []
+
+        async def coroutine():
+            async with limiter.acquire_async('db'):
+                order.append('coroutine')
+
+        async def main():
+            with limiter.acquire('db'):
+                task = asyncio.ensure_future(coroutine())
+                # The loop keeps running while the coroutine waits
+                await asyncio.sleep(0.2)
+                order.append('thread')
+
+            await task
+
+        asyncio.run(main())
+
+        self.assertEqual(order, ['thread', 'coroutine'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+""" Tests for the wp_ignore_rules module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import os
+import tempfile
+
+from wpbackup2.classes.wp_ignore_rules import IGNORE_FILENAME
+from wpbackup2.classes.wp_ignore_rules import WpIgnoreRules
+
+class WpIgnoreRulesTestCase(unittest.TestCase):
+    """ Tests for the WpIgnoreRules class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_gitignore_syntax(self):
+        """ Test anchoring, directory only rules, ** and negation """
+
+        rules = WpIgnoreRules(['# comment',
+                               '',
+                               'node_modules/',
+                               '/wp-content/cache/',
+                               '*.log.[0-9]',
+                               'wp-content/**/backups',
+                               '!wp-content/uploads/keep.log.1'])
+
+        self.assertTrue(rules.is_ignored('node_modules', is_dir=True))
+        self.assertTrue(rules.is_ignored('wp-content/themes/twentytwenty/node_modules', is_dir=True))
+        self.assertFalse(rules.is_ignored('node_modules', is_dir=False))
+        self.assertTrue(rules.is_ignored('wp-content/cache', is_dir=True))
+        self.assertFalse(rules.is_ignored('wp-content/plugins/foo/wp-content/cache', is_dir=True))
+        self.assertTrue(rules.is_ignored('wp-content/debug.log.1'))
+        self.assertFalse(rules.is_ignored('wp-content/debug.log'))
+        self.assertTrue(rules.is_ignored('wp-content/backups', is_dir=True))
+        self.assertTrue(rules.is_ignored('wp-content/plugins/foo/backups'))
+        self.assertFalse(rules.is_ignored('wp-content/uploads/keep.log.1'))
+        self.assertFalse(rules.is_ignored('wp-config.php'))
+
+    #########################################################################
+    def test_for_site(self):
+        """ Test the defaults, .wpbackupignore and command line rules are combined in order """
+
+        with open(os.path.join(self._temp_dir.name, IGNORE_FILENAME), 'w') as stream:
+            stream.write('.git/\n*.zip\n')
+
+        rules = WpIgnoreRules.for_site(self._temp_dir.name, excludes=['*.tmp'], includes=['wp-content/cache'])
+
+        self.assertTrue(rules.is_ignored('.git', is_dir=True))
+        self.assertTrue(rules.is_ignored('wp-content/uploads/archive.zip'))
+        self.assertTrue(rules.is_ignored('upload.tmp'))
+        self.assertTrue(rules.is_ignored('wp-content/upgrade', is_dir=True))
+        self.assertFalse(rules.is_ignored('wp-content/cache', is_dir=True))
+
+        rules = WpIgnoreRules.for_site(self._temp_dir.name, default_excludes=False)
+
+        self.assertFalse(rules.is_ignored('wp-content/upgrade', is_dir=True))
+
+if __name__ == '__main__':
+    unittest.main()
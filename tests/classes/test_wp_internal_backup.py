@@ -8,13 +8,46 @@ import shutil
 import json
 import os
 import logging
+import subprocess
+import sys
+import tarfile
 import tempfile
 
+from unittest import mock
+
 from wpbackup2 import WpSite
+from wpbackup2.classes.wp_ignore_rules import WpIgnoreRules
+from wpbackup2.classes.wp_internal_backup import DB_DUMP_SEGMENT_SIZE
+from wpbackup2.classes.wp_internal_backup import WpBackupMode
 from wpbackup2.classes.wp_internal_backup import WpInternalBackup
+from wpbackup2.exceptions import WpDatabaseBackupFailed
 
 LOG = logging.getLogger(__name__)
 
+# A line of dump and how many of them make a dump of two full segments
+# and a bit of a third
+DUMP_LINE = b"INSERT INTO `wp_posts` VALUES (1,'post');\n"
+DUMP_LINES = (2 * DB_DUMP_SEGMENT_SIZE) // len(DUMP_LINE) + 10
+
+def _mysqldump(returncode, lines):
+    """
+    Patch subprocess.Popen so that mysqldump is a python child writing
+    ``lines`` lines of dump and exiting with ``returncode``
+    """
+
+    script = ('import sys\n'
+              'sys.stdout.buffer.write({!r} * {})\n'
+              'sys.stdout.flush()\n'
+              'sys.stderr.write("mysqldump: Got error: 2002")\n'
+              'sys.exit({})').format(DUMP_LINE, lines, returncode)
+
+    popen = subprocess.Popen
+
+    def mysqldump(args, **kwargs): # pylint: disable=unused-argument
+        return popen([sys.executable, '-c', script], **kwargs) # pylint: disable=consider-using-with
+
+    return mock.patch('subprocess.Popen', side_effect=mysqldump)
+
 class WpInternalBackupTestCase(unittest.TestCase):
     """ Tests for the WpSite class. """
     _wp_site = None
@@ -64,5 +97,65 @@ class WpInternalBackupTestCase(unittest.TestCase):
         #instance.backup(site, "test_backup.tar.gz")
         self._cleanup_test_data()
 
+    #########################################################################
+    def test_segmented_dump(self):
+        """ A dump larger than a segment is split into numbered segments that join back into it """
+
+        self._setup_test_data()
+
+        archive_filename = os.path.join(self._temp_dir.name, 'segmented.tar.gz')
+
+        with _mysqldump(0, DUMP_LINES):
+            WpInternalBackup(self._wp_site, self._temp_dir.name, self._what_if).backup(archive_filename, WpBackupMode.DATABASE)
+
+        with tarfile.open(archive_filename) as archive:
+            names = [name for name in archive.getnames() if name.startswith('database.sql')]
+            self.assertEqual(names, ['database.sql.000000', 'database.sql.000001', 'database.sql.000002'])
+            self.assertEqual([archive.getmember(name).size for name in names[:2]], [DB_DUMP_SEGMENT_SIZE] * 2)
+
+            dump = b''.join(archive.extractfile(name).read() for name in names)
+
+        self.assertEqual(dump, DUMP_LINE * DUMP_LINES)
+
+    #########################################################################
+    def test_failed_dump(self):
+        """ A failing mysqldump fails the backup and removes the partial archive """
+
+        self._setup_test_data()
+
+        archive_filename = os.path.join(self._temp_dir.name, 'failed.tar.gz')
+
+        with _mysqldump(2, 1000), self.assertRaises(WpDatabaseBackupFailed):
+            WpInternalBackup(self._wp_site, self._temp_dir.name, self._what_if).backup(archive_filename, WpBackupMode.DATABASE)
+
+        self.assertFalse(os.path.exists(archive_filename))
+
+    #########################################################################
+    def test_default_excludes(self):
+        """ The built-in excludes leave the cache, upgrade and backup plugin directories out unless switched off """
+
+        site_path = os.path.join(self._temp_dir.name, 'excludes')
+        for directory in ('wp-content/cache/page', 'wp-content/upgrade', 'wp-content/updraft', 'wp-content/uploads'):
+            os.makedirs(os.path.join(site_path, directory))
+            with open(os.path.join(site_path, directory, 'file.txt'), 'w') as output:
+                output.write(directory)
+        shutil.copy2(os.path.join(os.getcwd(), 'tests/data/wp-config.php'), site_path)
+
+        wp_site = WpSite.from_wp_path(site_path)
+        dropped = ['wp-root/wp-content/cache', 'wp-root/wp-content/cache/page', 'wp-root/wp-content/cache/page/file.txt',
+                   'wp-root/wp-content/updraft', 'wp-root/wp-content/updraft/file.txt',
+                   'wp-root/wp-content/upgrade', 'wp-root/wp-content/upgrade/file.txt']
+
+        names = {}
+        for default_excludes in (True, False):
+            archive_filename = os.path.join(self._temp_dir.name, 'excludes-{}.tar.gz'.format(default_excludes))
+            WpInternalBackup(wp_site, self._temp_dir.name, self._what_if).backup(archive_filename, WpBackupMode.FILES, ignore_rules=WpIgnoreRules.for_site(site_path, default_excludes=default_excludes))
+
+            with tarfile.open(archive_filename) as archive:
+                names[default_excludes] = set(archive.getnames())
+
+        self.assertEqual(sorted(names[False] - names[True]), dropped)
+        self.assertIn('wp-root/wp-content/uploads/file.txt', names[True])
+
 if __name__ == '__main__':
     unittest.main()
@@ -3,17 +3,26 @@
 # pylint: disable=line-too-long
 
 import unittest
+import errno
 import shutil
+import io
 import json
 import os
 import logging
+import tarfile
 import tempfile
 
+from unittest import mock
+
 from wpconfigr import WpConfigFile
 
 from wpbackup2 import WpSite
+from wpbackup2.classes.wp_internal_backup import WpBackupMode
+from wpbackup2.classes.wp_internal_backup import WpInternalBackup
 from wpbackup2.classes.wp_internal_restore import WpInternalRestore
-#from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_manifest import MANIFEST_ARCNAME
+from wpbackup2.classes.wp_manifest import WpManifest
 
 LOG = logging.getLogger(__name__)
 
@@ -91,5 +100,165 @@ class WpInternalBackupTestCase(unittest.TestCase):
 
         self._cleanup_test_data()
 
+    #########################################################################
+    def test_sync_restore(self):
+        """ Only the files that differ are written, the others are removed """
+
+        site_path = os.path.join(self._temp_dir.name, 'sync')
+        os.makedirs(site_path)
+
+        manifest = WpManifest()
+        archive_filename = os.path.join(self._temp_dir.name, 'sync.tar.gz')
+
+        with tarfile.open(archive_filename, 'w:gz') as archive:
+            for name, data in [('same.txt', b'archived'), ('changed.txt', b'archived')]:
+                member = tarfile.TarInfo('wp-root/' + name)
+                member.size = len(data)
+                member.mode = 0o644
+                member.mtime = 1500000000
+                archive.addfile(member, io.BytesIO(data))
+
+                with open(os.path.join(site_path, name), 'wb') as output:
+                    output.write(b'on disk!')
+                manifest.add(name, os.lstat(os.path.join(site_path, name)))
+
+            content = manifest.to_json()
+            member = tarfile.TarInfo(MANIFEST_ARCNAME)
+            member.size = len(content)
+            archive.addfile(member, io.BytesIO(content))
+
+        # Same size and mtime as the archived file: taken as unchanged
+        os.utime(os.path.join(site_path, 'same.txt'), (1500000000, 1500000000))
+
+        with open(os.path.join(site_path, 'extra.txt'), 'w') as output:
+            output.write('not in the backup')
+
+        wp_site = WpSite(site_home=None, site_url=None, site_path=site_path, db_host=None, db_name=None, credentials=None)
+        instance = WpInternalRestore(wp_site, self._temp_dir.name, self._what_if)
+        instance.restore(archive_filename, WpRestoreMode.FILES | WpRestoreMode.SYNCFILES | WpRestoreMode.REMOVEFILESBEFORERESTORE, update_config=False)
+
+        self.assertEqual(sorted(os.listdir(site_path)), ['changed.txt', 'same.txt'])
+
+        with open(os.path.join(site_path, 'same.txt'), 'rb') as source:
+            self.assertEqual(source.read(), b'on disk!')
+
+        with open(os.path.join(site_path, 'changed.txt'), 'rb') as source:
+            self.assertEqual(source.read(), b'archived')
+
+    #########################################################################
+    def test_what_if_per_table_dump(self):
+        """ A what-if restore of a spooled per-table dump only logs the tables it would load """
+
+        site_path = os.path.join(self._temp_dir.name, 'what-if')
+        os.makedirs(site_path)
+        shutil.copy2(os.path.join(os.getcwd(), 'tests/data/wp-config.php'), site_path)
+
+        archive_filename = os.path.join(self._temp_dir.name, 'per-table.tar.gz')
+
+        with tarfile.open(archive_filename, 'w:gz') as archive:
+            archive.add(os.path.join(site_path, 'wp-config.php'), 'wp-root/wp-config.php')
+
+            for name in ('database/schema.sql', 'database/wp_options.sql', 'database/wp_posts.sql'):
+                data = 'INSERT INTO `{}` VALUES (1);\n'.format(name).encode('utf-8')
+                member = tarfile.TarInfo(name)
+                member.size = len(data)
+                archive.addfile(member, io.BytesIO(data))
+
+        wp_site = WpSite.from_wp_path(site_path)
+
+        with self.assertLogs('wpbackup2.classes.wp_internal_restore', level='INFO') as logs:
+            WpInternalRestore(wp_site, self._temp_dir.name, what_if=True).restore(archive_filename, WpRestoreMode.ALLOVERWRITE)
+
+        self.assertTrue(any('wp_options, wp_posts' in line for line in logs.output))
+        self.assertEqual(os.listdir(site_path), ['wp-config.php'])
+
+    #########################################################################
+    def test_seekable_restore_hard_link(self):
+        """ Hard links of a seekable archive are restored as links to their restored target """
+
+        site_path = os.path.join(self._temp_dir.name, 'linked')
+        os.makedirs(os.path.join(site_path, 'wp-content'))
+        shutil.copy2(os.path.join(os.getcwd(), 'tests/data/wp-config.php'), site_path)
+
+        with open(os.path.join(site_path, 'wp-content', 'index.php'), 'w') as output:
+            output.write('<?php // Silence is golden.')
+        os.link(os.path.join(site_path, 'wp-content', 'index.php'), os.path.join(site_path, 'hard.php'))
+
+        archive_filename = os.path.join(self._temp_dir.name, 'linked.tar.gz')
+        WpInternalBackup(WpSite.from_wp_path(site_path), self._temp_dir.name).backup(archive_filename, WpBackupMode.FILES, seekable=True)
+
+        for extract_workers in (1, 4):
+            restored_path = os.path.join(self._temp_dir.name, 'linked-{}'.format(extract_workers))
+            wp_site = WpSite(site_home=None, site_url=None, site_path=restored_path, db_host=None, db_name=None, credentials=None)
+            WpInternalRestore(wp_site, self._temp_dir.name, self._what_if).restore(archive_filename, WpRestoreMode.FILES, update_config=False, extract_workers=extract_workers)
+
+            self.assertTrue(os.path.samefile(os.path.join(restored_path, 'hard.php'), os.path.join(restored_path, 'wp-content', 'index.php')))
+
+    #########################################################################
+    def test_streamed_restore_hard_link(self):
+        """ Hard links of an archive read sequentially are restored as links, or as copies where linking fails """
+
+        site_path = os.path.join(self._temp_dir.name, 'streamed-linked')
+        os.makedirs(os.path.join(site_path, 'wp-content'))
+        shutil.copy2(os.path.join(os.getcwd(), 'tests/data/wp-config.php'), site_path)
+
+        with open(os.path.join(site_path, 'wp-content', 'index.php'), 'w') as output:
+            output.write('<?php // Silence is golden.')
+        os.link(os.path.join(site_path, 'wp-content', 'index.php'), os.path.join(site_path, 'hard.php'))
+
+        archive_filename = os.path.join(self._temp_dir.name, 'streamed-linked.tar.gz')
+        WpInternalBackup(WpSite.from_wp_path(site_path), self._temp_dir.name).backup(archive_filename, WpBackupMode.FILES)
+
+        for extract_workers in (1, 4):
+            restored_path = os.path.join(self._temp_dir.name, 'streamed-linked-{}'.format(extract_workers))
+            wp_site = WpSite(site_home=None, site_url=None, site_path=restored_path, db_host=None, db_name=None, credentials=None)
+            WpInternalRestore(wp_site, self._temp_dir.name, self._what_if).restore(archive_filename, WpRestoreMode.FILES, update_config=False, extract_workers=extract_workers)
+
+            self.assertTrue(os.path.samefile(os.path.join(restored_path, 'hard.php'), os.path.join(restored_path, 'wp-content', 'index.php')))
+
+        restored_path = os.path.join(self._temp_dir.name, 'streamed-copied')
+        wp_site = WpSite(site_home=None, site_url=None, site_path=restored_path, db_host=None, db_name=None, credentials=None)
+
+        with mock.patch('os.link', side_effect=OSError(errno.EXDEV, 'Invalid cross-device link')):
+            WpInternalRestore(wp_site, self._temp_dir.name, self._what_if).restore(archive_filename, WpRestoreMode.FILES, update_config=False)
+
+        self.assertFalse(os.path.samefile(os.path.join(restored_path, 'hard.php'), os.path.join(restored_path, 'wp-content', 'index.php')))
+
+        with open(os.path.join(restored_path, 'hard.php')) as source:
+            self.assertEqual(source.read(), '<?php // Silence is golden.')
+
+    #########################################################################
+    def test_sync_restore_hard_link(self):
+        """ A sync restore onto the tree it backed up relinks its hard links """
+
+        site_path = os.path.join(self._temp_dir.name, 'sync-linked')
+        os.makedirs(os.path.join(site_path, 'wp-content'))
+        shutil.copy2(os.path.join(os.getcwd(), 'tests/data/wp-config.php'), site_path)
+
+        with open(os.path.join(site_path, 'wp-content', 'index.php'), 'w') as output:
+            output.write('<?php // Silence is golden.')
+        os.link(os.path.join(site_path, 'wp-content', 'index.php'), os.path.join(site_path, 'hard.php'))
+
+        restore_mode = WpRestoreMode.FILES | WpRestoreMode.SYNCFILES | WpRestoreMode.REMOVEFILESBEFORERESTORE
+
+        for seekable in (False, True):
+            archive_filename = os.path.join(self._temp_dir.name, 'sync-linked-{}.tar.gz'.format(seekable))
+            WpInternalBackup(WpSite.from_wp_path(site_path), self._temp_dir.name).backup(archive_filename, WpBackupMode.FILES, seekable=seekable)
+
+            wp_site = WpSite(site_home=None, site_url=None, site_path=site_path, db_host=None, db_name=None, credentials=None)
+
+            # Once onto the unchanged tree, then with the hard link replaced by another file
+            for _ in range(2):
+                WpInternalRestore(wp_site, self._temp_dir.name, self._what_if).restore(archive_filename, restore_mode, update_config=False)
+
+                self.assertTrue(os.path.samefile(os.path.join(site_path, 'hard.php'), os.path.join(site_path, 'wp-content', 'index.php')))
+
+                os.remove(os.path.join(site_path, 'hard.php'))
+                with open(os.path.join(site_path, 'hard.php'), 'w') as output:
+                    output.write('<?php // Changed.')
+
+            os.remove(os.path.join(site_path, 'hard.php'))
+            os.link(os.path.join(site_path, 'wp-content', 'index.php'), os.path.join(site_path, 'hard.php'))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,109 @@
+""" Tests for the WpManifest class. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import io
+import os
+import tarfile
+import tempfile
+
+from wpbackup2.classes.wp_manifest import ARCHIVE_COMMENT_KEY
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import XXHASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.classes.wp_manifest import hash_available
+from wpbackup2.classes.wp_manifest import new_hasher
+from wpbackup2.classes.wp_manifest import read_archive_comment
+from wpbackup2.classes.wp_manifest import read_archive_hash_algorithm
+from wpbackup2.exceptions import WpHashNotAvailableError
+
+class WpManifestTestCase(unittest.TestCase):
+    """ Tests for the WpManifest class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_manifest_round_trip(self):
+        """ Test a manifest survives serialisation """
+
+        filename = os.path.join(self._temp_dir.name, 'index.php')
+        with open(filename, 'w') as file:
+            file.write('<?php')
+
+        manifest = WpManifest(parent_id='parent', hash_algorithm='blake2b')
+        manifest.add('index.php', os.lstat(filename), 'abc123')
+        manifest.deleted = ['wp-content/old.php']
+
+        instance = WpManifest.from_json(manifest.to_json())
+
+        self.assertEqual(instance.backup_id, manifest.backup_id)
+        self.assertEqual(instance.parent_id, 'parent')
+        self.assertTrue(instance.is_incremental)
+        self.assertEqual(instance.entries, manifest.entries)
+        self.assertEqual(instance.deleted, ['wp-content/old.php'])
+
+    #########################################################################
+    def test_manifest_change_detection(self):
+        """ Test changed files are detected from their stat result """
+
+        filename = os.path.join(self._temp_dir.name, 'wp-load.php')
+        with open(filename, 'w') as file:
+            file.write('<?php')
+
+        manifest = WpManifest()
+        manifest.add('wp-load.php', os.lstat(filename))
+
+        self.assertFalse(manifest.is_incremental)
+        self.assertTrue(manifest.is_unchanged('wp-load.php', os.lstat(filename)))
+        self.assertFalse(manifest.is_unchanged('wp-login.php', os.lstat(filename)))
+
+        with open(filename, 'a') as file:
+            file.write(' echo 1;')
+
+        self.assertFalse(manifest.is_unchanged('wp-load.php', os.lstat(filename)))
+
+    #########################################################################
+    def test_archive_comment(self):
+        """ Test the backup ids are read back from the pax global header """
+
+        manifest = WpManifest(parent_id='parent', hash_algorithm=HASH_ALGORITHM)
+
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode='w', format=tarfile.PAX_FORMAT, pax_headers={ARCHIVE_COMMENT_KEY: manifest.archive_comment()}) as stream:
+            stream.addfile(tarfile.TarInfo('wp-root'))
+
+        buffer.seek(0)
+        with tarfile.open(fileobj=buffer, mode='r|') as stream:
+            self.assertEqual(read_archive_comment(stream.pax_headers), (manifest.backup_id, 'parent'))
+            self.assertEqual(read_archive_hash_algorithm(stream.pax_headers), HASH_ALGORITHM)
+
+        self.assertIsNone(read_archive_comment({}))
+        self.assertIsNone(read_archive_hash_algorithm({}))
+
+    #########################################################################
+    def test_new_hasher(self):
+        """ Test the hash algorithms, xxh3 only when xxhash is installed """
+
+        hasher = new_hasher()
+        hasher.update(b'<?php')
+        self.assertEqual(len(hasher.hexdigest()), 32)
+
+        if hash_available(XXHASH_ALGORITHM):
+            hasher = new_hasher(XXHASH_ALGORITHM)
+            hasher.update(b'<?php')
+            self.assertEqual(len(hasher.hexdigest()), 32)
+        else:
+            with self.assertRaises(WpHashNotAvailableError):
+                new_hasher(XXHASH_ALGORITHM)
+
+        with self.assertRaises(ValueError):
+            new_hasher('md5')
+        self.assertFalse(hash_available('md5'))
+
+if __name__ == '__main__':
+    unittest.main()
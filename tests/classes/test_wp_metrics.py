@@ -0,0 +1,65 @@
+""" Tests for the WpMetrics class. """
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from wpbackup2.classes.wp_metrics import WpMetrics
+
+class WpMetricsTestCase(unittest.TestCase):
+    """ Tests for the WpMetrics class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    def __del__(self):
+        self._temp_dir = None
+
+    def test_phases(self):
+        """ Phases add up and give the compression ratio """
+
+        metrics = WpMetrics('backup', '/var/www/site')
+
+        with metrics.phase('files'):
+            data = metrics.reader(io.BytesIO(b'x' * 100), 'read').read()
+        metrics.add('compress', bytes_in=100, bytes_out=25)
+        metrics.add('compress', bytes_in=100, bytes_out=25)
+        metrics.finish()
+
+        self.assertEqual(len(data), 100)
+        self.assertEqual(metrics.phases['read']['bytes_in'], 100)
+        self.assertGreaterEqual(metrics.phases['files']['seconds'], metrics.phases['read']['seconds'])
+        self.assertEqual(metrics.compression_ratio, 4.0)
+        self.assertTrue(metrics.succeeded)
+        self.assertIsNotNone(metrics.duration)
+
+    def test_write(self):
+        """ Metrics are written as JSON or as a Prometheus textfile """
+
+        metrics = WpMetrics('restore', '/var/www/"site"')
+        metrics.add('extract', seconds=1.5, bytes_out=10, files=2)
+        metrics.finish(ValueError('boom'))
+
+        json_filename = os.path.join(self._temp_dir.name, 'metrics.json')
+        metrics.write(json_filename)
+
+        with open(json_filename) as file:
+            content = json.load(file)
+
+        self.assertFalse(content['succeeded'])
+        self.assertEqual(content['error'], 'ValueError: boom')
+        self.assertEqual(content['phases']['extract']['files'], 2)
+
+        prometheus_filename = os.path.join(self._temp_dir.name, 'metrics.prom')
+        metrics.write(prometheus_filename)
+
+        with open(prometheus_filename) as file:
+            lines = file.read().splitlines()
+
+        self.assertIn('wpbackup2_success{operation="restore",site="/var/www/\\"site\\""} 0.0', lines)
+        self.assertIn('wpbackup2_phase_seconds{operation="restore",site="/var/www/\\"site\\"",phase="extract"} 1.5', lines)
+        self.assertEqual(sorted(os.listdir(self._temp_dir.name)), ['metrics.json', 'metrics.prom'])
+
+if __name__ == '__main__':
+    unittest.main()
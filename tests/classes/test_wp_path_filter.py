@@ -0,0 +1,37 @@
+""" Tests for the wp_path_filter module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+
+from wpbackup2.classes.wp_path_filter import WpPathFilter
+
+class WpPathFilterTestCase(unittest.TestCase):
+    """ Tests for the WpPathFilter class. """
+
+    #########################################################################
+    def test_empty_filter_selects_everything(self):
+        """ Test a filter without patterns selects every path """
+
+        path_filter = WpPathFilter()
+
+        self.assertTrue(path_filter.is_empty)
+        self.assertTrue(path_filter.matches('wp-config.php'))
+        self.assertTrue(path_filter.matches('wp-content/uploads/2024/03/image.jpg'))
+
+    #########################################################################
+    def test_directory_pattern_selects_content(self):
+        """ Test a pattern naming a directory selects everything below it, and excludes win """
+
+        path_filter = WpPathFilter(includes=['./wp-content/plugins/akismet/', 'wp-content/uploads/2024/0[3]'], excludes=['*/cache'])
+
+        self.assertTrue(path_filter.matches('wp-content/plugins/akismet'))
+        self.assertTrue(path_filter.matches('wp-content/plugins/akismet/akismet.php'))
+        self.assertTrue(path_filter.matches('wp-content/uploads/2024/03/image.jpg'))
+        self.assertFalse(path_filter.matches('wp-content/plugins/akismet-extra/index.php'))
+        self.assertFalse(path_filter.matches('wp-content/uploads/2024/04/image.jpg'))
+        self.assertFalse(path_filter.matches('wp-content/plugins/akismet/cache/page.html'))
+        self.assertFalse(path_filter.matches('wp-config.php'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+""" Tests for the WpProfiler class. """
+
+import os
+import tempfile
+import threading
+import unittest
+
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_profiler import WpProfiler
+
+def _walk_work():
+    return sum(range(1000))
+
+def _compress_work():
+    return sorted(range(1000), reverse=True)
+
+class WpProfilerTestCase(unittest.TestCase):
+    """ Tests for the WpProfiler class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    def __del__(self):
+        self._temp_dir = None
+
+    def test_nested_phases(self):
+        """ Calls are attributed to the innermost phase of their thread """
+
+        metrics = WpMetrics('backup', profiler=WpProfiler())
+
+        with metrics.phase('files'):
+            with metrics.profile('walk'):
+                _walk_work()
+            with metrics.profile('compress'):
+                _compress_work()
+
+        def compress():
+            with metrics.profile('compress'):
+                _compress_work()
+
+        worker = threading.Thread(target=compress)
+        worker.start()
+        worker.join()
+
+        stats = metrics.profiler.stats()
+        functions = {phase: {name for (_, _, name) in phase_stats.stats} for phase, phase_stats in stats.items()}
+
+        self.assertIn('_walk_work', functions['walk'])
+        self.assertNotIn('_walk_work', functions['files'])
+        self.assertIn('_compress_work', functions['compress'])
+        self.assertIn('files', metrics.phases)
+
+    def test_write(self):
+        """ A profile per phase and a summary are written """
+
+        profiler = WpProfiler(top=5)
+
+        with profiler.phase('extract'):
+            _compress_work()
+
+        directory = os.path.join(self._temp_dir.name, 'archive.tar.gz.profile')
+        filenames = profiler.write(directory)
+
+        self.assertEqual(sorted(os.path.basename(filename) for filename in filenames), ['extract.prof', 'summary.txt'])
+
+        with open(os.path.join(directory, 'summary.txt')) as file:
+            summary = file.read()
+
+        self.assertTrue(summary.startswith("Phase 'extract'"))
+        self.assertIn('_compress_work', summary)
+
+if __name__ == '__main__':
+    unittest.main()
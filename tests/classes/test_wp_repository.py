@@ -0,0 +1,62 @@
+""" Tests for the WpRepository class. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import os
+import random
+import tempfile
+
+from wpbackup2.classes.wp_repository import WpChunker
+from wpbackup2.classes.wp_repository import WpRepository
+
+class WpRepositoryTestCase(unittest.TestCase):
+    """ Tests for the WpRepository class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def _chunk(self, data):
+        chunker = WpChunker(min_size=1024, max_size=65536, mask=(1 << 6) - 1)
+
+        return list(chunker.feed(data)) + list(chunker.finish())
+
+    #########################################################################
+    def test_chunker_is_content_defined(self):
+        """ Test an insert only changes the chunks around it """
+
+        rng = random.Random(42)
+        data = bytes(rng.getrandbits(8) for _ in range(400000))
+
+        chunks = self._chunk(data)
+        shifted = self._chunk(b'inserted' + data)
+
+        self.assertEqual(b''.join(chunks), data)
+        self.assertGreater(len(chunks), 1)
+        self.assertGreater(len(set(chunks) & set(shifted)), len(chunks) - 3)
+
+    #########################################################################
+    def test_repository_deduplicates(self):
+        """ Test identical content is stored once and read back intact """
+
+        repository = WpRepository(os.path.join(self._temp_dir.name, 'repository'))
+        data = os.urandom(300000) + b'INSERT INTO wp_posts VALUES (1);\n' * 20000
+
+        first = repository.store_stream([data[:1000], data[1000:]])
+        second = repository.store_stream([data])
+
+        self.assertEqual(first, second)
+        self.assertEqual(repository.new_chunks, len(first))
+        self.assertEqual(b''.join(repository.iter_stream(first)), data)
+
+        snapshot_id = repository.save_snapshot({'site_path': '/var/www/html', 'files': [], 'database': first})
+
+        self.assertEqual(repository.list_snapshots(), [snapshot_id])
+        self.assertEqual(repository.latest_snapshot('/var/www/html')['database'], first)
+
+if __name__ == '__main__':
+    unittest.main()
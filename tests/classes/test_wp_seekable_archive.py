@@ -0,0 +1,100 @@
+""" Tests for the wp_seekable_archive module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import gzip
+import io
+import json
+import os
+import tarfile
+import tempfile
+
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import WpParallelCompressor
+from wpbackup2.classes.wp_seekable_archive import INDEX_ARCNAME
+from wpbackup2.classes.wp_seekable_archive import WpSeekableArchive
+from wpbackup2.classes.wp_seekable_archive import build_trailer
+from wpbackup2.classes.wp_seekable_archive import is_seekable
+
+class WpSeekableArchiveTestCase(unittest.TestCase):
+    """ Tests for the WpSeekableArchive class. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def __write_archive(self, filename, compression, members):
+        compressor = WpParallelCompressor(filename, workers=2, block_size=4096, compression=compression, record_frames=True)
+        stream = tarfile.open(fileobj=compressor, mode='w')
+
+        index = []
+        for name, data in members:
+            tarinfo = tarfile.TarInfo(name)
+            tarinfo.size = len(data)
+            header_offset = stream.offset
+            stream.addfile(tarinfo, io.BytesIO(data))
+            index.append([name, header_offset, stream.offset - (-(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE), len(data), None])
+
+        index_offset = compressor.flush_frame()
+        index_header_offset = stream.offset
+
+        data = json.dumps({'version': 1, 'frames': compressor.frames, 'members': index}).encode('utf-8')
+        tarinfo = tarfile.TarInfo(INDEX_ARCNAME)
+        tarinfo.size = len(data)
+        stream.addfile(tarinfo, io.BytesIO(data))
+        stream.close()
+
+        index_length = compressor.flush_frame() - index_offset
+        compressor.write_raw(build_trailer(compression, index_offset, index_length, index_header_offset))
+        compressor.close()
+
+    #########################################################################
+    def test_read_members(self):
+        """ Test members are read back from the index for each seekable codec """
+
+        members = [('wp-root/index.php', b'<?php require "wp-blog-header.php";\n' * 500),
+                   ('wp-root/empty.txt', b''),
+                   ('wp-root/wp-content/uploads/image.jpg', os.urandom(20000))]
+
+        for compression in [WpCompression.GZIP, WpCompression.NONE]:
+            filename = os.path.join(self._temp_dir.name, 'archive-' + compression.value)
+            self.__write_archive(filename, compression, members)
+
+            self.assertTrue(is_seekable(filename))
+
+            with WpSeekableArchive(filename) as archive:
+                self.assertEqual(archive.getnames(), [name for name, _ in members])
+                for name, data in members:
+                    self.assertEqual(archive.read_member(name), data)
+                    self.assertEqual(archive.getmember(name).size, len(data))
+
+    #########################################################################
+    def test_gzip_trailer_is_standard(self):
+        """ Test the gzip trailer is skipped by standard gzip and tar readers """
+
+        filename = os.path.join(self._temp_dir.name, 'archive.tar.gz')
+        self.__write_archive(filename, WpCompression.GZIP, [('wp-root/wp-config.php', b'<?php\n')])
+
+        with gzip.open(filename, 'rb') as stream:
+            stream.read()
+
+        with tarfile.open(filename, 'r:gz') as stream:
+            self.assertEqual(stream.extractfile('wp-root/wp-config.php').read(), b'<?php\n')
+
+    #########################################################################
+    def test_plain_archive_is_not_seekable(self):
+        """ Test an archive without a trailer is not reported as seekable """
+
+        filename = os.path.join(self._temp_dir.name, 'plain.tar.gz')
+        with tarfile.open(filename, 'w:gz') as stream:
+            tarinfo = tarfile.TarInfo('wp-root/index.php')
+            stream.addfile(tarinfo, io.BytesIO(b''))
+
+        self.assertFalse(is_seekable(filename))
+
+if __name__ == '__main__':
+    unittest.main()
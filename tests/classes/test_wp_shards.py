@@ -0,0 +1,72 @@
+""" Tests for the wp_shards module. """
+
+# pylint: disable=line-too-long
+
+import unittest
+import os
+import tempfile
+
+from wpbackup2.classes.wp_ignore_rules import WpIgnoreRules
+from wpbackup2.classes.wp_internal_backup import WpBackupMode
+from wpbackup2.classes.wp_shards import WpShardRules
+from wpbackup2.classes.wp_shards import WpShardsManifest
+from wpbackup2.classes.wp_shards import plan_shards
+
+class WpShardsTestCase(unittest.TestCase):
+    """ Tests for the sharded backup layout. """
+
+    _temp_dir = tempfile.TemporaryDirectory(prefix='test_wpbackup_')
+
+    #########################################################################
+    def __del__(self):
+        self._temp_dir = None
+
+    #########################################################################
+    def test_plan_and_scope(self):
+        """ Every path belongs to exactly one file shard """
+
+        site_path = os.path.join(self._temp_dir.name, 'site')
+        for directory in ['wp-admin', 'wp-content/plugins/akismet', 'wp-content/uploads/2023/05', 'wp-content/uploads/2024', 'wp-content/uploads/sites']:
+            os.makedirs(os.path.join(site_path, directory))
+
+        shards = plan_shards(site_path, WpBackupMode.ALL, split_uploads=True)
+
+        self.assertEqual([shard.name for shard in shards], ['core', 'plugins', 'uploads', 'uploads-2023', 'uploads-2024', 'database'])
+
+        file_shards = [shard for shard in shards if not shard.is_database]
+        for path in ['wp-config.php', 'wp-admin/index.php', 'wp-content/index.php', 'wp-content/plugins/akismet/akismet.php',
+                     'wp-content/uploads/sites/1.jpg', 'wp-content/uploads/2023/05/a.jpg', 'wp-content/uploads/2024']:
+            self.assertEqual(len([shard.name for shard in file_shards if shard.contains(path)]), 1, path)
+
+        # The walk passes through the directories above the root
+        rules = WpShardRules(shards[3], WpIgnoreRules(['*.log']))
+        self.assertFalse(rules.is_ignored('wp-content', True))
+        self.assertFalse(rules.is_ignored('wp-content/uploads', True))
+        self.assertTrue(rules.is_ignored('wp-content/index.php'))
+        self.assertTrue(rules.is_ignored('wp-content/uploads/2024', True))
+        self.assertFalse(rules.is_ignored('wp-content/uploads/2023/05/a.jpg'))
+        self.assertTrue(rules.is_ignored('wp-content/uploads/2023/debug.log'))
+
+        self.assertEqual([shard.name for shard in plan_shards(site_path, WpBackupMode.DATABASE)], ['database'])
+
+    #########################################################################
+    def test_manifest(self):
+        """ The shards manifest survives a round trip through its file """
+
+        directory = os.path.join(self._temp_dir.name, 'backup')
+        os.makedirs(directory)
+
+        manifest = WpShardsManifest(settings={'compression': 'gzip'}, shards=plan_shards(self._temp_dir.name, WpBackupMode.ALL))
+        manifest.shard('core').archive = 'core.tar.gz'
+        manifest.shard('core').fingerprint = 'abc'
+        manifest.write(directory)
+
+        loaded = WpShardsManifest.from_directory(directory)
+
+        self.assertEqual(loaded.backup_id, manifest.backup_id)
+        self.assertEqual(loaded.settings, {'compression': 'gzip'})
+        self.assertEqual([shard.to_dict() for shard in loaded.shards], [shard.to_dict() for shard in manifest.shards])
+        self.assertIsNone(loaded.shard('plugins'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,18 +1,50 @@
 """ Tests for the WpBackup class. """
 
+import asyncio
 import unittest
 import shutil
 #from pathlib import Path
 import json
 import os
 import logging
+import stat
+import sys
+import tarfile
 import tempfile
 
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
 from wpbackup2 import WpSite
 from wpbackup2 import WpBackup
+from wpbackup2 import WpBackupMode
+from wpbackup2 import WpRestoreMode
+from wpbackup2 import WpCredentials
 
 LOG = logging.getLogger(__name__)
 
+# Stands in for mysqldump and mysql: records its pid, waits until
+# FAKE_MYSQL_WAIT_FOR of them started when it is set, writes a statement
+# (mysql reads the statements fed to it) and then blocks when
+# FAKE_MYSQL_BLOCK is set
+FAKE_MYSQL = """#!{}
+import os, sys, time
+with open(os.environ['FAKE_MYSQL_PIDS'], 'a') as pids:
+    pids.write('%d\\n' % os.getpid())
+if os.environ.get('FAKE_MYSQL_WAIT_FOR'):
+    deadline = time.monotonic() + 30
+    while len(open(os.environ['FAKE_MYSQL_PIDS']).read().split()) < int(os.environ['FAKE_MYSQL_WAIT_FOR']):
+        if time.monotonic() > deadline:
+            sys.exit('the other processes were not started')
+        time.sleep(0.01)
+sys.stdout.write('SELECT 1;\\n')
+sys.stdout.flush()
+if os.environ.get('FAKE_MYSQL_BLOCK'):
+    time.sleep(60)
+if os.path.basename(sys.argv[0]) == 'mysql':
+    sys.stdin.read()
+"""
+
 class WpBackupTestCase(unittest.TestCase):
     """ Tests for the WpSite class. """
     _wp_site = None
@@ -72,5 +104,106 @@ class WpBackupTestCase(unittest.TestCase):
 
         self._cleanup_test_data()
 
+    #########################################################################
+    def _fake_mysql_environ(self, name):
+        bin_path = os.path.join(self._temp_dir.name, name, 'bin')
+        os.makedirs(bin_path)
+
+        for program in ('mysqldump', 'mysql'):
+            program_path = os.path.join(bin_path, program)
+            with open(program_path, 'w') as output:
+                output.write(FAKE_MYSQL.format(sys.executable))
+            os.chmod(program_path, os.stat(program_path).st_mode | stat.S_IXUSR)
+
+        return {'PATH': bin_path + os.pathsep + os.environ.get('PATH', ''),
+                'FAKE_MYSQL_PIDS': os.path.join(self._temp_dir.name, name, 'pids')}
+
+    #########################################################################
+    async def _cancel_when_started(self, coroutine, pids_path):
+        task = asyncio.ensure_future(coroutine)
+
+        while not os.path.exists(pids_path) and not task.done():
+            await asyncio.sleep(0.01)
+
+        task.cancel()
+
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+    #########################################################################
+    def _assert_reaped(self, pids_path):
+        with open(pids_path) as pids:
+            for pid in pids.read().split():
+                with self.assertRaises(ProcessLookupError):
+                    os.kill(int(pid), 0)
+
+    #########################################################################
+    def test_wpbackup_backup_async_cancelled(self):
+        """ Cancelling backup_async reaps mysqldump and removes the partial archive """
+
+        environ = self._fake_mysql_environ('backup_cancelled')
+        environ['FAKE_MYSQL_BLOCK'] = '1'
+
+        self._setup_test_data()
+        archive_filename = os.path.join(self._temp_dir.name, 'backup_cancelled.tar.gz')
+
+        with mock.patch.dict(os.environ, environ):
+            asyncio.run(self._cancel_when_started(WpBackup(temp_path=self._temp_dir.name).backup_async(self._wp_site, archive_filename, WpBackupMode.DATABASE), environ['FAKE_MYSQL_PIDS']))
+
+        self.assertFalse(os.path.exists(archive_filename))
+        self._assert_reaped(environ['FAKE_MYSQL_PIDS'])
+
+    #########################################################################
+    def test_wpbackup_restore_async_cancelled(self):
+        """ Cancelling restore_async reaps mysql """
+
+        environ = self._fake_mysql_environ('restore_cancelled')
+
+        self._setup_test_data()
+        self._wp_site.admin_credentials = WpCredentials.from_username_and_password('root', 'secret')
+        archive_filename = os.path.join(self._temp_dir.name, 'restore_cancelled.tar.gz')
+
+        with mock.patch.dict(os.environ, environ):
+            WpBackup(temp_path=self._temp_dir.name).backup(self._wp_site, archive_filename, WpBackupMode.DATABASE)
+
+        os.remove(environ['FAKE_MYSQL_PIDS'])
+        environ['FAKE_MYSQL_BLOCK'] = '1'
+
+        with mock.patch.dict(os.environ, environ):
+            asyncio.run(self._cancel_when_started(WpBackup(temp_path=self._temp_dir.name).restore_async(self._wp_site, archive_filename, WpRestoreMode.DATABASE), environ['FAKE_MYSQL_PIDS']))
+
+        self._assert_reaped(environ['FAKE_MYSQL_PIDS'])
+
+    #########################################################################
+    def test_wpbackup_async_jobs_share_a_thread(self):
+        """ Concurrent backup_async and restore_async jobs do not need an executor thread each """
+
+        jobs = 4
+        environ = self._fake_mysql_environ('many_jobs')
+        # Every mysqldump (and then mysql) waits until all of them started,
+        # which never happens if a job holds the only thread meanwhile
+        environ['FAKE_MYSQL_WAIT_FOR'] = str(jobs)
+
+        self._setup_test_data()
+        self._wp_site.admin_credentials = WpCredentials.from_username_and_password('root', 'secret')
+        archives = [os.path.join(self._temp_dir.name, 'many_jobs', 'site{}.tar.gz'.format(job)) for job in range(jobs)]
+
+        async def run_on_one_thread(operation):
+            asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+            return await asyncio.gather(*(operation(archive) for archive in archives))
+
+        with mock.patch.dict(os.environ, environ):
+            asyncio.run(run_on_one_thread(lambda archive: WpBackup(temp_path=self._temp_dir.name).backup_async(self._wp_site, archive, WpBackupMode.DATABASE)))
+
+            for archive in archives:
+                with tarfile.open(archive) as stream:
+                    self.assertEqual(stream.extractfile('database.sql').read(), b'SELECT 1;\n')
+
+            os.remove(environ['FAKE_MYSQL_PIDS'])
+
+            metrics = asyncio.run(run_on_one_thread(lambda archive: WpBackup(temp_path=self._temp_dir.name).restore_async(self._wp_site, archive, WpRestoreMode.DATABASE)))
+
+        self.assertEqual([restore.phases['mysql']['bytes_out'] for restore in metrics], [len(b'SELECT 1;\n')] * jobs)
+
 if __name__ == '__main__':
     unittest.main()
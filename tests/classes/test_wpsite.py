@@ -1,5 +1,7 @@
 """ Tests for the WpSite class. """
 
+import os
+import tempfile
 import unittest
 
 from wpdatabase2.classes import WpCredentials
@@ -112,6 +114,20 @@ class WpSiteTestCase(unittest.TestCase):
         self.assertEqual(instance.db_name, 'wp_default')
         self.assertIsNone(instance.credentials)
 
+    def test_wpsite_find_sites(self):
+        """ Test WpSite.find_sites """
+
+        with tempfile.TemporaryDirectory(prefix='test_wpbackup_') as directory:
+            for name in ('site-b', 'site-a', 'not-a-site'):
+                os.makedirs(os.path.join(directory, name))
+            for name in ('site-b', 'site-a'):
+                with open(os.path.join(directory, name, 'wp-config.php'), 'w') as file:
+                    file.write('<?php\n')
+
+            sites = WpSite.find_sites(directory)
+
+            self.assertEqual([os.path.basename(site) for site in sites], ['site-a', 'site-b'])
+
 
 if __name__ == '__main__':
     unittest.main()
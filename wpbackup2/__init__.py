@@ -7,13 +7,27 @@
 from wpdatabase2.classes import WpCredentials
 
 from wpbackup2.exceptions.backup_not_found import WpBackupNotFoundError
+from wpbackup2.exceptions.backup_chain_invalid import WpBackupChainInvalidError
 from wpbackup2.exceptions.config_not_found import WpConfigNotFoundError
+from wpbackup2.exceptions.compression_not_available import WpCompressionNotAvailableError
+from wpbackup2.exceptions.core_release_corrupt import WpCoreReleaseCorruptError
+from wpbackup2.exceptions.core_release_not_found import WpCoreReleaseNotFoundError
+from wpbackup2.exceptions.hash_not_available import WpHashNotAvailableError
+from wpbackup2.exceptions.repository_corrupt import WpRepositoryCorruptError
 
 from wpbackup2.exceptions.database_mysql_failed import WpDatabaseMysqlFailed
 from wpbackup2.exceptions.database_backup_failed import WpDatabaseBackupFailed
 from wpbackup2.exceptions.database_restore_failed import WpDatabaseRestoreFailed
 
+from wpbackup2.classes.wp_backup_result import WpBackupResult
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_core_cache import WpCoreCache
 from wpbackup2.classes.wp_internal_backup import WpBackupMode
 from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_profiler import WpProfiler
+from wpbackup2.classes.wp_repository import WpRepository
+from wpbackup2.classes.wp_shards import WpShardsManifest
+from wpbackup2.classes.wp_verify_result import WpVerifyResult
 from wpbackup2.classes.wpbackup import WpBackup
 from wpbackup2.classes.wpsite import WpSite
@@ -5,13 +5,20 @@ Backup or restore WordPress content.
 # pylint: disable=line-too-long
 
 import argparse
+import json
 import logging
+import sys
 import chesney
 
 from wpdatabase2.classes import WpCredentials
 
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
 from wpbackup2.classes.wp_internal_backup import WpBackupMode
 from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHMS
+from wpbackup2.classes.wp_shards import is_sharded
 from wpbackup2.classes.wpbackup import WpBackup
 from wpbackup2.classes.wpsite import WpSite
 from wpbackup2.__version__ import __version__
@@ -59,18 +66,296 @@ def run_from_cli():
                                help='Indicate what to be Backup/Restore')
 
     shared_parser.add_argument('--archive',
-                            help='Path and filename of the archive (.tar.gz) '
-                                 'to backup to/restore from.',
+                            help='Path and filename of the archive (.tar.gz, .tar.zst, '
+                                 '.tar.lz4, .tar.xz or .tar) to backup to/restore from '
+                                 '(- restores from stdin).',
                             default=None,
                             required=False)
 
+    shared_parser.add_argument('--core-cache',
+                            default=None,
+                            help='Directory holding one unpacked WordPress release '
+                                 'per version (e.g. CACHE/6.4.2/wp-includes); '
+                                 'unmodified core files are then only referenced '
+                                 'by backups and copied back from it on restore',
+                            required=False)
+
+    shared_parser.add_argument('--shard-workers',
+                            type=int,
+                            default=4,
+                            help='Number of shards of a sharded backup written or '
+                                 'restored at once (0 = one per CPU core)',
+                            required=False)
+
+    shared_parser.add_argument('--metrics-file',
+                            default=None,
+                            help='Write the time, bytes and files of every phase to '
+                                 'this file, as a Prometheus textfile when it ends in '
+                                 '.prom (for the node_exporter textfile collector) '
+                                 'and as JSON otherwise (not with --repository)',
+                            required=False)
+
+    shared_parser.add_argument('--profile',
+                            nargs='?',
+                            const=True,
+                            default=False,
+                            metavar='DIR',
+                            help='Profile every phase (dump, walk, compress, '
+                                 'extract, database load...) with cProfile, '
+                                 'writing the profiles and a summary of the '
+                                 'hottest functions to DIR (default: next to the '
+                                 'archive, as <archive>.profile; not with '
+                                 '--repository)',
+                            required=False)
+
+    # Options of the archives written by backup and backup-fleet
+    archive_parser = argparse.ArgumentParser(add_help=False)
+
+    archive_parser.add_argument('--exclude',
+                            action='append',
+                            default=None,
+                            dest='excludes',
+                            help='gitignore-style pattern of paths to leave out of '
+                                 'the backup (e.g. node_modules/ or *.log.[0-9]); '
+                                 'may be repeated',
+                            required=False)
+
+    archive_parser.add_argument('--include',
+                            action='append',
+                            default=None,
+                            dest='includes',
+                            help='Pattern of otherwise excluded paths to back up '
+                                 'anyway; may be repeated',
+                            required=False)
+
+    archive_parser.add_argument('--no-default-excludes',
+                            action='store_false',
+                            dest='default_excludes',
+                            help='Also back up the well-known cache, upgrade and '
+                                 'backup plugin directories (wp-content/cache, '
+                                 'wp-content/upgrade, wp-content/updraft, ...). '
+                                 'They are left out by default, whereas earlier '
+                                 'releases archived the whole WordPress directory')
+
+    archive_parser.add_argument('--dump-workers',
+                            type=int,
+                            default=1,
+                            help='Number of tables dumped concurrently, each stored '
+                                 'as its own archive entry (1 = a single dump of the '
+                                 'whole database, 0 = one per CPU core)',
+                            required=False)
+
+    archive_parser.add_argument('--db-host-concurrency',
+                            action='append',
+                            default=None,
+                            metavar='HOST=N',
+                            help='Maximum number of concurrent connections to a '
+                                 'database host; may be repeated',
+                            required=False)
+
+    archive_parser.add_argument('--seekable',
+                            action='store_true',
+                            help='Embed a member index so single files can be '
+                                 'listed and extracted without reading the whole '
+                                 'archive')
+
+    archive_parser.add_argument('--no-hash',
+                            action='store_false',
+                            dest='hash_files',
+                            help='Do not record a content hash for every file '
+                                 'in the archive manifest (a restore with --sync '
+                                 'and verify then only compare sizes and mtimes)')
+
+    archive_parser.add_argument('--hash-algorithm',
+                            choices=HASH_ALGORITHMS,
+                            default=HASH_ALGORITHM,
+                            help='Algorithm of the content hashes (xxh3_128 '
+                                 'needs the xxhash package)',
+                            required=False)
+
+    archive_parser.add_argument('--compression',
+                            choices=[compression.value for compression in WpCompression],
+                            default=WpCompression.GZIP.value,
+                            help='Compression codec used for the archive',
+                            required=False)
+
+    archive_parser.add_argument('--compression-level',
+                            type=int,
+                            default=None,
+                            help='Codec specific compression level (defaults to the '
+                                 'codec default)',
+                            required=False)
+
+    archive_parser.add_argument('--compression-workers',
+                            type=int,
+                            default=1,
+                            help='Number of threads used to compress the archive '
+                                 '(1 = single threaded, 0 = one per CPU core)',
+                            required=False)
+
     # Setup the individual sub parers
-    backup_parser = subparsers.add_parser("backup", parents=[shared_parser],
+    backup_parser = subparsers.add_parser("backup", parents=[shared_parser, archive_parser],
                             help='Perform a wordpress backup')
 
+    backup_parser.add_argument('--repository',
+                            default=None,
+                            help='Back up into this deduplicating repository '
+                                 'instead of writing an archive',
+                            required=False)
+
+    backup_parser.add_argument('--incremental-from',
+                            default=None,
+                            help='Previous backup archive to take an incremental '
+                                 'file backup against',
+                            required=False)
+
+    backup_parser.add_argument('--sharded',
+                            action='store_true',
+                            help='Write the core, plugins, themes, uploads and '
+                                 'database as separate archives to the directory '
+                                 '--archive, in parallel (--incremental-from then '
+                                 'names a previous sharded backup whose unchanged '
+                                 'shards are reused)')
+
+    backup_parser.add_argument('--split-uploads',
+                            action='store_true',
+                            help='With --sharded, give every year directory of '
+                                 'the uploads a shard of its own')
+
+    fleet_parser = subparsers.add_parser("backup-fleet", parents=[archive_parser],
+                            help='Back up many wordpress sites concurrently')
+
+    fleet_parser.add_argument('--sites-dir',
+                            default=None,
+                            help='Directory whose subdirectories are the WordPress '
+                                 'sites to back up',
+                            required=False)
+
+    fleet_parser.add_argument('--wp-dir',
+                            action='append',
+                            default=None,
+                            dest='wp_dirs',
+                            help='WordPress directory to back up; may be repeated',
+                            required=False)
+
+    fleet_parser.add_argument('--archive-dir',
+                            help='Directory the archives are written to (one per site)',
+                            required=True)
+
+    fleet_parser.add_argument('--mode',
+                               choices=['files', 'db', 'all'],
+                               default='all',
+                            help='Indicate what to be Backup')
+
+    fleet_parser.add_argument('--core-cache',
+                            default=None,
+                            help='Directory holding one unpacked WordPress release '
+                                 'per version (e.g. CACHE/6.4.2/wp-includes); '
+                                 'unmodified core files are then only referenced '
+                                 'by backups and copied back from it on restore',
+                            required=False)
+
+    fleet_parser.add_argument('--site-workers',
+                            type=int,
+                            default=4,
+                            help='Number of sites backed up at once (0 = one per '
+                                 'CPU core)',
+                            required=False)
+
+    fleet_parser.add_argument('--io-workers',
+                            type=int,
+                            default=2,
+                            help='Number of sites reading their files at once',
+                            required=False)
+
+    fleet_parser.add_argument('--cpu-workers',
+                            type=int,
+                            default=0,
+                            help='Number of compression threads shared by all sites '
+                                 '(0 = one per CPU core)',
+                            required=False)
+
+    fleet_parser.add_argument('--results',
+                            default=None,
+                            help='Write the per-site results to this JSON file',
+                            required=False)
+
     restore_parser = subparsers.add_parser("restore", parents=[shared_parser],
                             help='Perform a wordpress restore')
 
+    restore_parser.add_argument('--repository',
+                            default=None,
+                            help='Restore from this deduplicating repository '
+                                 'instead of an archive',
+                            required=False)
+
+    restore_parser.add_argument('--snapshot',
+                            default=None,
+                            help='Repository snapshot to restore (defaults to the '
+                                 'newest)',
+                            required=False)
+
+    restore_parser.add_argument('--incremental',
+                            action='append',
+                            default=None,
+                            dest='incremental_archives',
+                            help='Incremental backup to apply on top of --archive '
+                                 '(repeat in order, oldest first)',
+                            required=False)
+
+    restore_parser.add_argument('--load-workers',
+                            type=int,
+                            default=1,
+                            help='Number of tables loaded concurrently when the '
+                                 'archive holds a per-table database dump (0 = one '
+                                 'per CPU core)',
+                            required=False)
+
+    restore_parser.add_argument('--extract-workers',
+                            type=int,
+                            default=1,
+                            help='Number of threads writing the restored files '
+                                 '(1 = written by the thread reading the archive; '
+                                 'use 16 or more on EFS/NFS, where every file '
+                                 'waits on the network)',
+                            required=False)
+
+    restore_parser.add_argument('--sync',
+                            action='store_true',
+                            help='Only write the files that differ from those '
+                                 'on disk (size and mtime, or the content hash '
+                                 'of a seekable archive)')
+
+    restore_parser.add_argument('--delete',
+                            action='store_true',
+                            help='With --sync (which it requires), remove the '
+                                 'files that are not in the backup')
+
+    restore_parser.add_argument('--db-host-concurrency',
+                            action='append',
+                            default=None,
+                            metavar='HOST=N',
+                            help='Maximum number of concurrent connections to a '
+                                 'database host; may be repeated',
+                            required=False)
+
+    restore_parser.add_argument('--include',
+                            action='append',
+                            default=None,
+                            dest='includes',
+                            help='Only restore the files matching this glob, relative '
+                                 'to the WordPress directory (e.g. '
+                                 'wp-content/plugins/akismet); may be repeated',
+                            required=False)
+
+    restore_parser.add_argument('--exclude',
+                            action='append',
+                            default=None,
+                            dest='excludes',
+                            help='Do not restore the files matching this glob; may '
+                                 'be repeated',
+                            required=False)
+
     restore_parser.add_argument('--cleanfirst',
                             action='store_true',
                             help='Removes existing files/db before restoring data')
@@ -132,12 +417,61 @@ def run_from_cli():
                             help='Force restore even if already exists',
                             required=False)
 
+    list_parser = subparsers.add_parser("list",
+                            help='List the members of an archive')
+
+    list_parser.add_argument('--archive',
+                            help='Path and filename of the archive',
+                            required=True)
+
+    extract_parser = subparsers.add_parser("extract",
+                            help='Extract a single member of an archive')
+
+    extract_parser.add_argument('--archive',
+                            help='Path and filename of the archive',
+                            required=True)
+
+    extract_parser.add_argument('--member',
+                            help='Name of the member to extract (e.g. '
+                                 'wp-root/wp-config.php)',
+                            required=True)
+
+    extract_parser.add_argument('--output',
+                            help='File to write the member to',
+                            required=True)
+
+    verify_parser = subparsers.add_parser("verify",
+                            help='Check that archives can be restored, without '
+                                 'restoring them')
+
+    verify_parser.add_argument('--archive',
+                            action='append',
+                            dest='archives',
+                            help='Path and filename of the archive (- reads it from '
+                                 'stdin); may be repeated',
+                            required=True)
+
+    verify_parser.add_argument('--results',
+                            default=None,
+                            help='Write the result of every archive, with its '
+                                 'throughput and metrics, to this JSON file',
+                            required=False)
+
     args = arg_parser.parse_args()
 
+    if args.action == "restore" and args.delete and not args.sync:
+        restore_parser.error('--delete only applies to a --sync restore')
+
+    if args.action in ("backup", "restore") and args.repository and (args.metrics_file is not None or args.profile):
+        (backup_parser if args.action == "backup" else restore_parser).error('--metrics-file and --profile are not supported with --repository')
+
     logging.basicConfig(level=str(args.log_level).upper())
     log = logging.getLogger(__name__)
 
-    wpbackup = WpBackup(args.what_if)
+    wpbackup = WpBackup(args.what_if,
+                        compression_workers=args.compression_workers if "compression_workers" in args else 1,
+                        db_host_limits=WpDbHostLimiter.parse(args.db_host_concurrency) if "db_host_concurrency" in args else None,
+                        core_cache=args.core_cache if "core_cache" in args else None)
 
     if args.what_if:
         log.info("***** WHAT IF MODE ENABLED *******")
@@ -147,16 +481,122 @@ def run_from_cli():
         wp_site = WpSite.from_wp_path(args.wp_dir)
 
         backup_mode = WpBackupMode.ALL
-        if str(args.mode).upper() == "DATABASE":
+        if str(args.mode).upper() in ("DB", "DATABASE"):
             backup_mode = WpBackupMode.DATABASE
         elif str(args.mode).upper() == "FILES":
             backup_mode = WpBackupMode.FILES
 
+        if args.repository:
+            snapshot_id = wpbackup.backup_to_repository(wp_site=wp_site,
+                                                        repository_path=args.repository,
+                                                        backup_mode=backup_mode,
+                                                        compression=WpCompression(args.compression),
+                                                        compression_level=args.compression_level,
+                                                        excludes=args.excludes,
+                                                        includes=args.includes,
+                                                        default_excludes=args.default_excludes)
+            log.info("Created snapshot '%s' in repository '%s'", snapshot_id, args.repository)
+            return 0
+
+        if args.sharded:
+            wpbackup.backup_sharded(wp_site=wp_site,
+                                    backup_directory=args.archive,
+                                    backup_mode=backup_mode,
+                                    compression=WpCompression(args.compression),
+                                    compression_level=args.compression_level,
+                                    hash_files=args.hash_files,
+                                    seekable=args.seekable,
+                                    excludes=args.excludes,
+                                    includes=args.includes,
+                                    default_excludes=args.default_excludes,
+                                    dump_workers=args.dump_workers,
+                                    shard_workers=args.shard_workers,
+                                    split_uploads=args.split_uploads,
+                                    previous_directory=args.incremental_from,
+                                    metrics_file=args.metrics_file,
+                                    profile=args.profile,
+                                    hash_algorithm=args.hash_algorithm
+                                    )
+            return 0
+
         wpbackup.backup(wp_site=wp_site,
                         archive_filename=args.archive,
-                        backup_mode=backup_mode
+                        backup_mode=backup_mode,
+                        compression=WpCompression(args.compression),
+                        compression_level=args.compression_level,
+                        base_archive=args.incremental_from,
+                        hash_files=args.hash_files,
+                        seekable=args.seekable,
+                        excludes=args.excludes,
+                        includes=args.includes,
+                        default_excludes=args.default_excludes,
+                        dump_workers=args.dump_workers,
+                        metrics_file=args.metrics_file,
+                        profile=args.profile,
+                        hash_algorithm=args.hash_algorithm
                         )
 
+    elif args.action == "backup-fleet":
+        sites = list(args.wp_dirs or [])
+        if args.sites_dir:
+            sites += WpSite.find_sites(args.sites_dir)
+
+        if len(sites) == 0:
+            log.fatal('No sites to back up, use --sites-dir or --wp-dir.')
+            return -1
+
+        backup_mode = WpBackupMode.ALL
+        if str(args.mode).upper() in ("DB", "DATABASE"):
+            backup_mode = WpBackupMode.DATABASE
+        elif str(args.mode).upper() == "FILES":
+            backup_mode = WpBackupMode.FILES
+
+        results = wpbackup.backup_many(sites,
+                                       archive_directory=args.archive_dir,
+                                       site_workers=args.site_workers,
+                                       io_workers=args.io_workers,
+                                       cpu_workers=args.cpu_workers,
+                                       backup_mode=backup_mode,
+                                       compression=WpCompression(args.compression),
+                                       compression_level=args.compression_level,
+                                       seekable=args.seekable,
+                                       excludes=args.excludes,
+                                       includes=args.includes,
+                                       default_excludes=args.default_excludes,
+                                       hash_files=args.hash_files,
+                                       hash_algorithm=args.hash_algorithm,
+                                       dump_workers=args.dump_workers)
+
+        for result in results:
+            print(result)
+
+        if args.results:
+            with open(args.results, 'w', encoding='utf-8') as stream:
+                json.dump([result.to_dict() for result in results], stream, indent=2)
+
+        return 0 if all(result.succeeded for result in results) else 1
+
+    elif args.action == "list":
+        for name, size in wpbackup.list_archive(args.archive):
+            print("{:>12}  {}".format(size, name))
+
+    elif args.action == "extract":
+        wpbackup.extract_from_archive(args.archive, args.member, args.output)
+
+    elif args.action == "verify":
+        results = [wpbackup.verify(archive) for archive in args.archives]
+
+        for result in results:
+            print(result)
+            for warning in result.warnings:
+                log.warning('%s: %s', result.archive_filename, warning)
+
+        if args.results:
+            with open(args.results, 'w', encoding='utf-8') as stream:
+                json.dump([result.to_dict() for result in results], stream, indent=2)
+
+        return 0 if all(result.succeeded for result in results) else 1
+
     elif args.action == "restore":
         log.info("Starting wordpress restore for site to '%s' from file '%s'", args.wp_dir, args.archive)
 
@@ -185,10 +625,51 @@ def run_from_cli():
                         admin_credentials=admin_credentials
                         )
 
+        restore_mode = WpRestoreMode.ALLCLEAN if args.force else WpRestoreMode.ALLOVERWRITE
+        if str(args.mode).upper() in ("DB", "DATABASE"):
+            restore_mode &= WpRestoreMode.DATABASE | WpRestoreMode.DELETEDATABASEBEFORERESTORE
+        elif str(args.mode).upper() == "FILES":
+            restore_mode &= WpRestoreMode.FILES | WpRestoreMode.REMOVEFILESBEFORERESTORE
+
+        if args.sync and WpRestoreMode.FILES in restore_mode:
+            restore_mode |= WpRestoreMode.SYNCFILES
+            if args.delete:
+                restore_mode |= WpRestoreMode.REMOVEFILESBEFORERESTORE
+
+        if args.repository:
+            wpbackup.restore_from_repository(wp_site=wp_site,
+                                             repository_path=args.repository,
+                                             snapshot_id=args.snapshot,
+                                             restore_mode=restore_mode,
+                                             includes=args.includes,
+                                             excludes=args.excludes)
+            return 0
+
+        if args.archive is not None and is_sharded(args.archive):
+            wpbackup.restore_sharded(wp_site=wp_site,
+                                     backup_directory=args.archive,
+                                     restore_mode=restore_mode,
+                                     includes=args.includes,
+                                     excludes=args.excludes,
+                                     load_workers=args.load_workers,
+                                     extract_workers=args.extract_workers,
+                                     shard_workers=args.shard_workers,
+                                     metrics_file=args.metrics_file,
+                                     profile=args.profile
+                                     )
+            return 0
+
         wpbackup.restore(wp_site=wp_site,
                          archive_filename=args.archive,
-                         restore_mode=WpRestoreMode.ALLCLEAN if args.force else WpRestoreMode.ALLOVERWRITE
+                         restore_mode=restore_mode,
+                         incremental_archives=args.incremental_archives,
+                         includes=args.includes,
+                         excludes=args.excludes,
+                         load_workers=args.load_workers,
+                         extract_workers=args.extract_workers,
+                         metrics_file=args.metrics_file,
+                         profile=args.profile
                          )
 
 if __name__ == '__main__':
-    run_from_cli()
+    sys.exit(run_from_cli())
@@ -1,6 +1,14 @@
 """ wpbackup2 classses """
 
+from wpbackup2.classes.wp_backup_result import WpBackupResult
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_core_cache import WpCoreCache
 from wpbackup2.classes.wp_internal_backup import WpBackupMode
 from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_profiler import WpProfiler
+from wpbackup2.classes.wp_repository import WpRepository
+from wpbackup2.classes.wp_shards import WpShardsManifest
+from wpbackup2.classes.wp_verify_result import WpVerifyResult
 from wpbackup2.classes.wpbackup import WpBackup
 from wpbackup2.classes.wpsite import WpSite
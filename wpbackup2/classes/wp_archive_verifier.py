@@ -0,0 +1,273 @@
+"""
+wp_archive_verifier
+
+Checks that an archive can be restored without restoring it. The archive is
+read once, from start to end, and nothing is written to disk:
+
+  * the compressed stream and the tar stream must decode to their end
+    (which checks the CRC of every gzip member)
+  * the content of every file is hashed and, with its size, compared with
+    the manifest at the end of the archive; a full backup must also hold
+    every path of its manifest (except the core files it only references)
+  * every database dump must be complete: its segments numbered without
+    gaps and its last line the "-- Dump completed" marker mysqldump writes
+
+File contents are read in bounded chunks, so memory use depends on the
+number of files (a hash per file) and not on their size.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import logging
+import os
+import sys
+import tarfile
+import time
+
+from wpbackup2.classes.wp_compression import open_archive_reader
+from wpbackup2.classes.wp_compression import stream_members
+from wpbackup2.classes.wp_internal_restore import DB_DUMP_ARCNAME
+from wpbackup2.classes.wp_internal_restore import DB_DUMP_DIRECTORY_PREFIX
+from wpbackup2.classes.wp_internal_restore import DB_DUMP_SEGMENT_PREFIX
+from wpbackup2.classes.wp_internal_restore import DB_SCHEMA_ARCNAME
+from wpbackup2.classes.wp_internal_restore import STDIN_ARCHIVE
+from wpbackup2.classes.wp_internal_restore import WP_DIR_ARCNAME
+from wpbackup2.classes.wp_manifest import ENTRY_FILE
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import MANIFEST_ARCNAME
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.classes.wp_manifest import hash_available
+from wpbackup2.classes.wp_manifest import new_hasher
+from wpbackup2.classes.wp_manifest import read_archive_comment
+from wpbackup2.classes.wp_manifest import read_archive_hash_algorithm
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_seekable_archive import INDEX_ARCNAME
+from wpbackup2.classes.wp_verify_result import WpVerifyResult
+
+READ_SIZE = 1024 * 1024
+
+# Last line of a complete mysqldump output ("-- Dump completed on <date>",
+# or without the date with --skip-dump-date)
+DUMP_COMPLETED_MARKER = b'-- Dump completed'
+
+# Bytes kept from the end of each dump to find the marker in
+DUMP_TAIL_SIZE = 256
+
+class WpArchiveVerifier:
+    """ WpArchiveVerifier """
+
+    #########################################################################
+    def __init__(self, metrics=None):
+        """
+        Constructor
+
+        Args:
+            metrics (WpMetrics):    metrics the reads are recorded in
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__metrics = metrics
+
+    #########################################################################
+    @staticmethod
+    def __dump_segment(name):
+        """
+        (dump name, segment number) of a database dump member, the segment
+        number being None for a dump stored as a single member
+        """
+
+        base, _, segment = name.rpartition('.')
+
+        if len(segment) == 6 and segment.isdigit():
+            return base, int(segment)
+
+        return name, None
+
+    #########################################################################
+    def __read_member(self, stream, member, phase, hasher=None, tail=None):
+        """
+        Read the content of ``member``, updating ``hasher`` and returning
+        the last ``tail`` bytes (when given)
+        """
+
+        last = b''
+        started = time.monotonic()
+
+        with self.__metrics.profile(phase):
+            source = stream.extractfile(member)
+            for data in iter(lambda: source.read(READ_SIZE), b''):
+                if hasher is not None:
+                    hasher.update(data)
+                if tail is not None:
+                    last = (last + data)[-tail:]
+
+        self.__metrics.add(phase, seconds=time.monotonic() - started, bytes_in=member.size, files=1)
+
+        return last
+
+    #########################################################################
+    @staticmethod
+    def __check_dumps(dumps, result):
+        """
+        Check that every database dump (``dumps`` maps a dump name to
+        (segments read, whether they are numbered, whether they came in
+        order, last bytes)) is complete
+        """
+
+        for name, (segments, _, in_order, tail) in sorted(dumps.items()):
+            if not in_order:
+                result.add_error("database dump '{}' has missing or out of order segments".format(name))
+                continue
+
+            last_line = tail.rstrip().rpartition(b'\n')[2]
+
+            if not last_line.startswith(DUMP_COMPLETED_MARKER):
+                result.add_error("database dump '{}' is incomplete ({} segment(s), no '{}' line at its end)".format(name, segments, DUMP_COMPLETED_MARKER.decode('ascii')))
+                continue
+
+            result.database_dumps.append(name)
+
+        if any(name.startswith(DB_DUMP_DIRECTORY_PREFIX) for name in dumps) and DB_SCHEMA_ARCNAME not in dumps:
+            result.add_error("the per-table database dump has no '{}'".format(DB_SCHEMA_ARCNAME))
+
+    #########################################################################
+    @staticmethod
+    def __check_manifest(manifest, files, paths, hash_algorithm, result):
+        """
+        Compare the files read from the archive (``files`` maps their paths
+        to (size, hash of ``hash_algorithm``)) and every path it holds
+        (``paths``) with the manifest
+        """
+
+        hashed = hash_algorithm is not None and manifest.hash_algorithm == hash_algorithm
+
+        if manifest.hash_algorithm is None:
+            result.add_warning('The manifest holds no content hashes (backup taken with --no-hash), only the sizes of the files were checked')
+        elif not hash_available(manifest.hash_algorithm):
+            result.add_warning("The content hashes of the manifest use '{}', which is not installed, only the sizes of the files were checked".format(manifest.hash_algorithm))
+        elif not hashed:
+            result.add_warning("The content hashes of the manifest use '{}', only the sizes of the files were checked".format(manifest.hash_algorithm))
+
+        for path, (size, file_hash) in files.items():
+            entry = manifest.entries.get(path)
+
+            if entry is None:
+                result.add_error("'{}' is not in the manifest".format(path))
+            elif entry[0] != ENTRY_FILE or entry[1] != size:
+                result.add_error("'{}' holds {} bytes, the manifest records {}".format(path, size, entry[1] if entry[0] == ENTRY_FILE else 'another type of entry'))
+            elif hashed and entry[4] is not None:
+                result.hashed_files += 1
+                if entry[4] != file_hash:
+                    result.add_error("the content of '{}' does not match the hash of the manifest".format(path))
+
+        # An incremental backup only holds what changed
+        if not manifest.is_incremental:
+            for path in manifest.entries:
+                if path not in paths and path not in manifest.core_files:
+                    result.add_error("'{}' is in the manifest but not in the archive".format(path))
+
+    #########################################################################
+    def verify(self, archive_filename):
+        """
+        Verify the archive ``archive_filename`` (STDIN_ARCHIVE reads it
+        from stdin), returning a WpVerifyResult
+        """
+
+        if self.__metrics is None:
+            self.__metrics = WpMetrics('verify', archive_filename)
+
+        result = WpVerifyResult(archive_filename, self.__metrics)
+
+        self.__log.info('Verifying archive: %s', archive_filename)
+
+        source = sys.stdin.buffer if archive_filename == STDIN_ARCHIVE else archive_filename
+
+        if source is archive_filename:
+            self.__metrics.archive_bytes = os.path.getsize(archive_filename)
+            self.__metrics.add('decompress', bytes_in=self.__metrics.archive_bytes)
+
+        manifest = None
+        header_ids = None
+        hash_algorithm = None
+
+        # path -> (size, hash) of the files, and every path of the site held
+        files = {}
+        paths = set()
+
+        # dump name -> (segments read, whether they are numbered, whether
+        # they came in order, last bytes)
+        dumps = {}
+
+        root_dir = WP_DIR_ARCNAME + '/'
+
+        try:
+            with open_archive_reader(source) as fileobj:
+                reader = self.__metrics.reader(fileobj, 'decompress', 'bytes_out')
+
+                with tarfile.open(fileobj=reader, mode='r|') as stream:
+                    header_ids = read_archive_comment(stream.pax_headers)
+
+                    # The files are hashed as they are read, before the
+                    # manifest at the end of the archive says how
+                    hash_algorithm = read_archive_hash_algorithm(stream.pax_headers) or HASH_ALGORITHM
+                    if not hash_available(hash_algorithm):
+                        hash_algorithm = None
+
+                    for member in stream_members(stream):
+                        if member.name == MANIFEST_ARCNAME:
+                            manifest = WpManifest.from_json(stream.extractfile(member).read())
+                        elif member.name == DB_DUMP_ARCNAME or member.name.startswith(DB_DUMP_SEGMENT_PREFIX) or member.name.startswith(DB_DUMP_DIRECTORY_PREFIX):
+                            name, segment = self.__dump_segment(member.name)
+                            segments, numbered, in_order, _ = dumps.get(name, (0, segment is not None, True, b''))
+
+                            # A dump is a single member or segments numbered from 0
+                            in_order = in_order and (segment == segments if numbered else segments == 0 and segment is None)
+
+                            dumps[name] = (segments + 1, numbered, in_order, self.__read_member(stream, member, 'dump', tail=DUMP_TAIL_SIZE))
+                        elif member.name == WP_DIR_ARCNAME or member.name.startswith(root_dir):
+                            relative = member.name[len(root_dir):]
+                            paths.add(relative)
+
+                            if member.isreg():
+                                hasher = new_hasher(hash_algorithm) if hash_algorithm is not None else None
+                                self.__read_member(stream, member, 'hash', hasher=hasher)
+                                files[relative] = (member.size, hasher.hexdigest() if hasher is not None else None)
+                        elif member.name != INDEX_ARCNAME:
+                            self.__log.debug('Ignoring member: %s', member.name)
+
+                # Read what follows the end of the tar stream, so the
+                # checksum at the very end of the compressed stream is
+                # checked as well
+                for _ in iter(lambda: reader.read(READ_SIZE), b''):
+                    pass
+        except Exception as error: # pylint: disable=broad-except
+            # tarfile, gzip, zlib, zstandard and lz4 each raise their own
+            # errors for a truncated or corrupt archive
+            result.add_error("the archive cannot be read: {}: {}".format(type(error).__name__, error))
+
+        result.files = len(files)
+
+        if header_ids is not None:
+            result.backup_id, result.parent_id = header_ids
+
+        self.__check_dumps(dumps, result)
+
+        if manifest is None:
+            if result.succeeded:
+                result.add_warning('The archive has no manifest (written by an earlier version), the files were only read')
+        else:
+            if header_ids is not None and header_ids[0] != manifest.backup_id:
+                result.add_error("the header names backup {} but the manifest backup {}".format(header_ids[0], manifest.backup_id))
+
+            result.backup_id, result.parent_id = manifest.backup_id, manifest.parent_id
+
+            self.__check_manifest(manifest, files, paths, hash_algorithm, result)
+
+        if result.succeeded:
+            self.__log.info('Archive "%s" verified: %d file(s), %d hashed, %d database dump(s)', archive_filename, result.files, result.hashed_files, len(result.database_dumps))
+        else:
+            self.__log.error('Archive "%s" failed verification with %d error(s), the first is: %s', archive_filename, result.error_count, result.errors[0])
+
+        return result
@@ -0,0 +1,165 @@
+"""
+wp_async_runner
+
+Runs a backup or restore on an asyncio event loop for WpBackup.backup_async
+and WpBackup.restore_async.
+
+The operation itself is a coroutine on the loop: mysqldump and mysql are
+started with asyncio.create_subprocess_exec and their pipes are read and
+written by the loop. tarfile and the compressors block, so the work on the
+archive (writing and compressing members, reading and decompressing them,
+writing the restored files) is cut into steps that are run on an executor
+(see ``call`` and ``drive``). A thread of the executor is only held for the
+length of a step, so any number of operations can share a small pool.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import asyncio
+import functools
+import time
+
+# Bytes buffered from the stdout / stderr of a child before it is paused
+PIPE_BUFFER_LIMIT = 1024 * 1024
+
+# Steps of a generator run back to back on the executor before the thread
+# is handed back
+STEP_SLICE = 0.05
+
+#########################################################################
+async def start_process(args, stdin=None, stdout=None, stderr=None):
+    """
+    Start ``args`` as an asyncio child process
+
+    Raises:
+        FileNotFoundError:  the program was not found.
+    """
+
+    return await asyncio.create_subprocess_exec(*args, stdin=stdin, stdout=stdout, stderr=stderr, limit=PIPE_BUFFER_LIMIT)
+
+#########################################################################
+def kill_process(process):
+    """
+    Kill an asyncio child unless it already exited
+    """
+
+    if process.returncode is None:
+        try:
+            process.kill()
+        except ProcessLookupError:
+            pass
+
+#########################################################################
+async def stop_process(process):
+    """
+    Kill an asyncio child unless it already exited, and reap it
+    """
+
+    kill_process(process)
+
+    await process.wait()
+
+#########################################################################
+async def run_concurrently(coroutines, workers):
+    """
+    Await ``coroutines``, at most ``workers`` at a time. The first failure
+    cancels the others, which are waited for before it is raised.
+    """
+
+    slots = asyncio.Semaphore(max(workers, 1))
+
+    async def run(coroutine):
+        async with slots:
+            return await coroutine
+
+    tasks = [asyncio.ensure_future(run(coroutine)) for coroutine in coroutines]
+
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+class WpAsyncRunner:
+    """ WpAsyncRunner """
+
+    #########################################################################
+    def __init__(self, executor=None):
+        """
+        Constructor
+
+        Args:
+            executor (concurrent.futures.Executor): runs the blocking steps
+                                                    (None = the default
+                                                    executor of the loop)
+        """
+
+        self.__executor = executor
+
+    #########################################################################
+    async def call(self, function, *args):
+        """
+        Run ``function(*args)`` on the executor and return its result.
+
+        A step cannot be interrupted: when the awaiting task is cancelled
+        the step is waited for before CancelledError is raised, so whatever
+        it was writing is in a consistent state when the operation cleans
+        up.
+        """
+
+        future = asyncio.get_running_loop().run_in_executor(self.__executor, functools.partial(function, *args))
+
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            try:
+                await future
+            except Exception: # pylint: disable=broad-except
+                pass
+
+            raise
+
+    #########################################################################
+    async def drive(self, steps, action=None):
+        """
+        Run the generator ``steps`` on the executor and return what it
+        returns.
+
+        A step is what the generator does up to its next ``yield``; steps
+        yielding None are run back to back for up to STEP_SLICE seconds
+        per executor call. Any other value is a request for work on the
+        loop: it is handed to the coroutine function ``action``, and the
+        result is sent back into the generator. When the work fails or is
+        cancelled the generator is closed (on the executor) so it cleans up
+        before the error is raised.
+        """
+
+        def advance(value):
+            deadline = time.monotonic() + STEP_SLICE
+
+            try:
+                request = steps.send(value)
+                while request is None and time.monotonic() < deadline:
+                    request = next(steps)
+            except StopIteration as stop:
+                return True, stop.value
+
+            return False, request
+
+        value = None
+
+        try:
+            while True:
+                done, request = await self.call(advance, value)
+                if done:
+                    return request
+
+                value = None if request is None else await action(request)
+        except BaseException:
+            await self.call(steps.close)
+            raise
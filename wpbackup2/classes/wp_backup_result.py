@@ -0,0 +1,61 @@
+"""
+wp_backup_result
+
+Outcome of the backup of one site in a fleet backup (see
+WpBackup.backup_many): whether it succeeded, how long it took, the size of
+the archive written and, for a failed backup, the error.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+class WpBackupResult:
+    """ WpBackupResult """
+
+    #########################################################################
+    def __init__(self, site_path, archive_filename, duration=0.0, archive_bytes=0, error=None, metrics=None):
+        """
+        Constructor
+
+        Args:
+            site_path (str):        path of the WordPress directory
+            archive_filename (str): archive written (or that would have been)
+            duration (float):       seconds the backup took
+            archive_bytes (int):    size of the archive written
+            error (Exception):      what made the backup fail (None on success)
+            metrics (WpMetrics):    time, bytes and files of every phase
+        """
+        self.site_path = str(site_path)
+        self.archive_filename = archive_filename
+        self.duration = duration
+        self.archive_bytes = archive_bytes
+        self.error = error
+        self.metrics = metrics
+
+    #########################################################################
+    @property
+    def succeeded(self):
+        """ True when the backup completed """
+        return self.error is None
+
+    #########################################################################
+    def to_dict(self):
+        """ The result as a JSON serialisable dict """
+
+        return {
+            'site_path': self.site_path,
+            'archive': self.archive_filename,
+            'succeeded': self.succeeded,
+            'duration': round(self.duration, 3),
+            'bytes': self.archive_bytes,
+            'error': None if self.error is None else "{}: {}".format(type(self.error).__name__, self.error),
+            'metrics': None if self.metrics is None else self.metrics.to_dict()
+        }
+
+    #########################################################################
+    def __str__(self):
+        if self.succeeded:
+            return "{}: {} ({} bytes in {:.1f}s)".format(self.site_path, self.archive_filename, self.archive_bytes, self.duration)
+
+        return "{}: FAILED after {:.1f}s: {}".format(self.site_path, self.duration, self.error)
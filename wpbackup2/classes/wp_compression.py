@@ -0,0 +1,777 @@
+"""
+wp_compression
+
+Compression codecs and block-parallel compression for backup archives.
+
+The archive is cut into fixed size blocks which are compressed on a pool of
+worker threads (the codecs release the GIL while compressing) and written
+out in order. Every block becomes a complete member/frame of the selected
+codec, and gzip, zstd, lz4 and xz all define a stream of concatenated
+members as equivalent to one stream of the concatenated data. The result is
+therefore a standard archive (the same layout pigz produces for gzip) that
+the usual command line tools read without any special handling.
+
+Files that are compressed already (JPEG, PNG, MP4, ZIP...) gain next to
+nothing from another pass, so they are written in frames of their own at
+the codec's store level (stored deflate blocks for gzip, the fastest level
+of the other codecs) instead, see ``is_incompressible`` and
+WpParallelCompressor.stored. Those are ordinary frames of the codec, so
+reading the archive back needs nothing special either.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import collections
+import contextlib
+import gzip
+import io
+import logging
+import lzma
+import os
+import time
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+
+from wpbackup2.exceptions import WpCompressionNotAvailableError
+
+COMPRESSION_BLOCK_SIZE = 1024 * 1024
+COMPRESSION_LEVEL = 9
+
+DECOMPRESSION_READ_SIZE = 64 * 1024
+
+# Bytes read from the start of an archive to tell its codec by its magic
+# bytes (the longest magic, xz's, takes 6)
+MAGIC_SIZE = 8
+
+# Formats that are compressed already
+INCOMPRESSIBLE_EXTENSIONS = frozenset([
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic', '.jxl',
+    '.mp4', '.m4v', '.mov', '.webm', '.mkv', '.avi', '.wmv', '.flv', '.ogv',
+    '.mp3', '.m4a', '.aac', '.ogg', '.oga', '.opus', '.flac',
+    '.pdf', '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.lz4', '.7z', '.rar',
+    '.woff', '.woff2', '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.jar'
+])
+
+# Formats that are always worth compressing
+COMPRESSIBLE_EXTENSIONS = frozenset([
+    '.php', '.inc', '.css', '.scss', '.less', '.js', '.mjs', '.jsx', '.ts', '.tsx', '.map', '.json',
+    '.html', '.htm', '.xml', '.svg', '.txt', '.md', '.csv', '.log', '.sql', '.po', '.pot',
+    '.ini', '.yml', '.yaml', '.twig', '.lock'
+])
+
+# Smaller files stay in the compressed frames, a frame of their own would
+# cost more compression on the files around them than it saves
+INCOMPRESSIBLE_MIN_SIZE = 16 * 1024
+
+# Files of other types are sampled: when zlib at its fastest level cannot
+# take this share off the first ENTROPY_SAMPLE_SIZE bytes, they are stored
+ENTROPY_SAMPLE_SIZE = 16 * 1024
+ENTROPY_SAMPLE_MIN_SAVING = 0.05
+
+class WpCompression(Enum):
+    '''
+    Enum for archive compression codecs
+    '''
+    GZIP = 'gzip'
+    ZSTD = 'zstd'
+    LZ4 = 'lz4'
+    XZ = 'xz'
+    NONE = 'none'
+
+#########################################################################
+def resolve_workers(workers):
+    """
+    Turn a configured worker count into an actual one (0 or None means
+    "one per CPU core")
+    """
+
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+
+    return workers
+
+#########################################################################
+def _import_zstandard():
+    try:
+        import zstandard # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise WpCompressionNotAvailableError(WpCompression.ZSTD.value, 'zstandard') from error
+
+    return zstandard
+
+#########################################################################
+def _import_lz4_frame():
+    try:
+        import lz4.frame # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise WpCompressionNotAvailableError(WpCompression.LZ4.value, 'lz4') from error
+
+    return lz4.frame
+
+#########################################################################
+def gzip_compress_block(data, level=COMPRESSION_LEVEL):
+    """
+    Compress a block into a complete, self-contained gzip member
+    """
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    return compressor.compress(data) + compressor.flush()
+
+#########################################################################
+def zstd_compress_block(data, level):
+    """
+    Compress a block into a complete zstd frame
+    """
+
+    return _import_zstandard().ZstdCompressor(level=level).compress(data)
+
+#########################################################################
+def lz4_compress_block(data, level):
+    """
+    Compress a block into a complete lz4 frame
+    """
+
+    return _import_lz4_frame().compress(data, compression_level=level)
+
+#########################################################################
+def xz_compress_block(data, level):
+    """
+    Compress a block into a complete xz stream
+    """
+
+    return lzma.compress(data, format=lzma.FORMAT_XZ, preset=level)
+
+#########################################################################
+def gzip_decompress_block(data):
+    """
+    Decompress a single gzip member
+    """
+
+    return zlib.decompress(data, 31)
+
+#########################################################################
+def zstd_decompress_block(data):
+    """
+    Decompress a single zstd frame
+    """
+
+    return _import_zstandard().ZstdDecompressor().decompress(data)
+
+#########################################################################
+def lz4_decompress_block(data):
+    """
+    Decompress a single lz4 frame
+    """
+
+    return _import_lz4_frame().decompress(data)
+
+#########################################################################
+def xz_decompress_block(data):
+    """
+    Decompress a single xz stream
+    """
+
+    return lzma.decompress(data, format=lzma.FORMAT_XZ)
+
+class _ZstdReader(io.RawIOBase):
+    """
+    Read-only file object over a stream of concatenated zstd frames.
+
+    Backward seeks rewind to the start of the file and decompress forward
+    again (the same strategy gzip.GzipFile uses), which is all tarfile needs.
+    """
+
+    #########################################################################
+    def __init__(self, fileobj):
+        super().__init__()
+
+        self.__zstandard = _import_zstandard()
+        self.__fileobj = fileobj
+        self.__reset()
+
+    #########################################################################
+    def __rewind(self):
+        self.__fileobj.seek(0)
+        self.__reset()
+
+    #########################################################################
+    def __reset(self):
+        self.__decompressor = self.__zstandard.ZstdDecompressor().decompressobj()
+        self.__in_frame = False
+        self.__buffer = b''
+        self.__offset = 0
+        self.__position = 0
+
+    #########################################################################
+    def __fill(self):
+        while self.__offset == len(self.__buffer):
+            data = self.__fileobj.read(DECOMPRESSION_READ_SIZE)
+
+            if not data:
+                if self.__in_frame:
+                    raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                return False
+
+            output = []
+            while data:
+                self.__in_frame = True
+                output.append(self.__decompressor.decompress(data))
+
+                data = b''
+                if self.__decompressor.eof:
+                    data = self.__decompressor.unused_data
+                    self.__decompressor = self.__zstandard.ZstdDecompressor().decompressobj()
+                    self.__in_frame = False
+
+            self.__buffer = b''.join(output)
+            self.__offset = 0
+
+        return True
+
+    #########################################################################
+    def readable(self):
+        return True
+
+    #########################################################################
+    def seekable(self):
+        return True
+
+    #########################################################################
+    def readinto(self, buffer):
+        if not self.__fill():
+            return 0
+
+        size = min(len(buffer), len(self.__buffer) - self.__offset)
+        buffer[:size] = self.__buffer[self.__offset:self.__offset + size]
+        self.__offset += size
+        self.__position += size
+
+        return size
+
+    #########################################################################
+    def tell(self):
+        return self.__position
+
+    #########################################################################
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset = self.__position + offset
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("can only seek relative to the start or current position")
+
+        if offset < self.__position:
+            self.__rewind()
+
+        while self.__position < offset:
+            if not self.__fill():
+                break
+
+            size = min(offset - self.__position, len(self.__buffer) - self.__offset)
+            self.__offset += size
+            self.__position += size
+
+        return self.__position
+
+    #########################################################################
+    def close(self):
+        if not self.closed:
+            self.__fileobj.close()
+        super().close()
+
+class _StreamReader(io.RawIOBase):
+    """
+    Read-only view of a file object (such as stdin) that leaves it open
+    when the view is closed. ``prefix`` (bytes already read from the file
+    object) is read back first.
+    """
+
+    #########################################################################
+    def __init__(self, fileobj, prefix=b''):
+        super().__init__()
+
+        self.__fileobj = fileobj
+        self.__prefix = prefix
+
+    #########################################################################
+    def readable(self):
+        return True
+
+    #########################################################################
+    def readinto(self, buffer):
+        if len(self.__prefix) > 0:
+            data = self.__prefix[:len(buffer)]
+            self.__prefix = self.__prefix[len(data):]
+        else:
+            data = self.__fileobj.read(len(buffer))
+
+        buffer[:len(data)] = data
+
+        return len(data)
+
+#########################################################################
+def _open_zstd(filename):
+    if not isinstance(filename, (str, bytes, os.PathLike)):
+        return io.BufferedReader(_ZstdReader(filename))
+    return io.BufferedReader(_ZstdReader(open(filename, 'rb'))) # pylint: disable=consider-using-with
+
+#########################################################################
+def _open_lz4(filename):
+    return _import_lz4_frame().open(filename, 'rb')
+
+_Codec = collections.namedtuple('_Codec', ['extension', 'level', 'store_level', 'magic', 'block_size', 'compress_block', 'decompress_block', 'open_reader'])
+
+_CODECS = {
+    WpCompression.GZIP: _Codec('.tar.gz', COMPRESSION_LEVEL, 0, b'\x1f\x8b', COMPRESSION_BLOCK_SIZE, gzip_compress_block, gzip_decompress_block, lambda filename: gzip.open(filename, 'rb')),
+    WpCompression.ZSTD: _Codec('.tar.zst', 3, 1, b'\x28\xb5\x2f\xfd', 4 * COMPRESSION_BLOCK_SIZE, zstd_compress_block, zstd_decompress_block, _open_zstd),
+    WpCompression.LZ4: _Codec('.tar.lz4', 0, 0, b'\x04\x22\x4d\x18', 4 * COMPRESSION_BLOCK_SIZE, lz4_compress_block, lz4_decompress_block, _open_lz4),
+    WpCompression.XZ: _Codec('.tar.xz', 6, 0, b'\xfd7zXZ\x00', 4 * COMPRESSION_BLOCK_SIZE, xz_compress_block, xz_decompress_block, lambda filename: lzma.open(filename, 'rb')),
+    WpCompression.NONE: _Codec('.tar', None, None, None, COMPRESSION_BLOCK_SIZE, None, None, lambda filename: open(filename, 'rb') if isinstance(filename, (str, bytes, os.PathLike)) else filename) # pylint: disable=consider-using-with
+}
+
+#########################################################################
+def archive_extension(compression):
+    """
+    File extension used for archives written with ``compression``
+    """
+
+    return _CODECS[compression].extension
+
+#########################################################################
+def default_level(compression):
+    """
+    Level used when no compression level was requested
+    """
+
+    return _CODECS[compression].level
+
+#########################################################################
+def store_level(compression):
+    """
+    Level used for data that is compressed already
+    """
+
+    return _CODECS[compression].store_level
+
+#########################################################################
+def is_incompressible(name, size, fileobj=None):
+    """
+    True when a file ``name`` of ``size`` bytes is compressed already: a
+    known compressed format, or a file of another type whose first bytes
+    (read from ``fileobj``, which is then rewound) zlib cannot shrink.
+    Files smaller than INCOMPRESSIBLE_MIN_SIZE are never reported.
+    """
+
+    if size < INCOMPRESSIBLE_MIN_SIZE:
+        return False
+
+    extension = os.path.splitext(name)[1].lower()
+
+    if extension in INCOMPRESSIBLE_EXTENSIONS:
+        return True
+
+    if extension in COMPRESSIBLE_EXTENSIONS or fileobj is None:
+        return False
+
+    sample = fileobj.read(ENTROPY_SAMPLE_SIZE)
+    fileobj.seek(0)
+
+    return len(zlib.compress(sample, 1)) > len(sample) * (1 - ENTROPY_SAMPLE_MIN_SAVING)
+
+#########################################################################
+def compress_block(compression, data, level=None):
+    """
+    Compress ``data`` into one complete member/frame of ``compression``
+    """
+
+    codec = _CODECS[compression]
+
+    if codec.compress_block is None:
+        return data
+
+    return codec.compress_block(data, level if level is not None else codec.level)
+
+#########################################################################
+def decompress_block(compression, data):
+    """
+    Decompress one complete member/frame written by ``compress_block``
+    """
+
+    codec = _CODECS[compression]
+
+    if codec.decompress_block is None:
+        return data
+
+    return codec.decompress_block(data)
+
+#########################################################################
+def _new_decompressor(compression):
+    if compression == WpCompression.GZIP:
+        return zlib.decompressobj(31)
+
+    if compression == WpCompression.ZSTD:
+        return _import_zstandard().ZstdDecompressor().decompressobj()
+
+    if compression == WpCompression.LZ4:
+        return _import_lz4_frame().LZ4FrameDecompressor()
+
+    return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+#########################################################################
+def decompress_frames(compression, data):
+    """
+    Decompress any number of consecutive complete members/frames
+    """
+
+    if compression == WpCompression.NONE:
+        return data
+
+    output = []
+
+    while data:
+        decompressor = _new_decompressor(compression)
+        output.append(decompressor.decompress(data))
+
+        if not decompressor.eof:
+            raise EOFError("Compressed data ended before the end-of-stream marker was reached")
+
+        data = decompressor.unused_data
+
+    return b''.join(output)
+
+#########################################################################
+def _read_magic(stream):
+    """
+    Read the first MAGIC_SIZE bytes of ``stream`` (fewer at its end). A
+    pipe may return them over several reads.
+    """
+
+    header = b''
+
+    while len(header) < MAGIC_SIZE:
+        data = stream.read(MAGIC_SIZE - len(header))
+        if not data:
+            break
+        header += data
+
+    return header
+
+#########################################################################
+def _match_magic(header):
+    """
+    Compression codec whose magic bytes start ``header``
+    """
+
+    for compression, codec in _CODECS.items():
+        if codec.magic is not None and header.startswith(codec.magic):
+            return compression
+
+    return WpCompression.NONE
+
+#########################################################################
+def detect_compression(filename):
+    """
+    Detect the compression codec of an archive from its magic bytes
+    """
+
+    with open(filename, 'rb') as stream:
+        return _match_magic(_read_magic(stream))
+
+#########################################################################
+def open_archive_reader(filename):
+    """
+    Open an archive for reading, returning a seekable file object over the
+    decompressed tar data whatever codec it was written with.
+
+    ``filename`` may also be a readable binary file object such as
+    ``sys.stdin.buffer``; the result can then only be read sequentially
+    (tarfile mode 'r|'), and closing it leaves the file object open.
+    """
+
+    name = filename
+
+    if not isinstance(filename, (str, bytes, os.PathLike)):
+        name = getattr(filename, 'name', filename)
+        # The magic bytes cannot be peeked at on a pipe, they are read and
+        # then handed to the codec ahead of the rest
+        header = _read_magic(filename)
+        compression = _match_magic(header)
+        filename = io.BufferedReader(_StreamReader(filename, header))
+    else:
+        compression = detect_compression(filename)
+
+    logging.getLogger(__name__).info('Archive "%s" is compressed with: %s', name, compression.value)
+
+    return _CODECS[compression].open_reader(filename)
+
+#########################################################################
+def stream_members(stream):
+    """
+    Yield the members of a tarfile opened for sequential reading (mode
+    'r|') without keeping them. tarfile otherwise appends the TarInfo of
+    every member read to ``stream.members``, so memory grows with the
+    number of members, millions of them for a site with a large uploads
+    directory. The members can then not be looked up by name.
+    """
+
+    while True:
+        member = stream.next()
+        stream.members.clear()
+
+        if member is None:
+            return
+
+        yield member
+
+class WpStoringReader:
+    """
+    Wraps a readable file object and switches ``compressor`` to stored
+    frames (see WpParallelCompressor.stored) on the first read, so the tar
+    header written ahead of a member's data is still compressed. Closing
+    the reader switches back.
+    """
+
+    #########################################################################
+    def __init__(self, fileobj, compressor):
+        self.__fileobj = fileobj
+        self.__compressor = compressor
+        self.__stack = contextlib.ExitStack()
+        self.__storing = False
+
+    #########################################################################
+    def read(self, size=-1):
+        """ Read from the wrapped file, storing from here on """
+
+        if not self.__storing:
+            self.__stack.enter_context(self.__compressor.stored())
+            self.__storing = True
+
+        return self.__fileobj.read(size)
+
+    #########################################################################
+    def close(self):
+        """ Switch the compressor back to compressing """
+        self.__stack.close()
+
+class WpParallelCompressor:
+    """
+    Write-only file object that compresses what is written to it on a pool
+    of worker threads and writes the compressed blocks to ``filename`` in
+    their original order.
+
+    At most ``2 * workers`` blocks are in flight at any time, so memory use is
+    bounded by the block size and the worker count.
+
+    With ``record_frames`` the position of every block ("frame") in both the
+    compressed file and the uncompressed stream is kept in ``frames`` as
+    (compressed offset, compressed length, uncompressed offset,
+    uncompressed length), which is what a seekable archive index needs.
+
+    An ``executor`` shared by several compressors (see WpBackup.backup_many)
+    caps the CPU used by all of them; ``workers`` then only sizes the number
+    of blocks this compressor keeps in flight, and the executor is left
+    running on close.
+
+    What is written inside a ``stored()`` block goes into frames of its own
+    at the store level of the codec.
+
+    With ``metrics`` (a WpMetrics) the time spent compressing, storing,
+    waiting for the workers and writing the file is recorded as the
+    ``compress``, ``store``, ``compress_wait`` and ``write`` phases.
+    """
+
+    #########################################################################
+    def __init__(self, filename, workers=None, level=None, block_size=None, compression=WpCompression.GZIP, record_frames=False, executor=None, metrics=None):
+        self.__log = logging.getLogger(__name__)
+
+        codec = _CODECS[compression]
+
+        self.__workers = resolve_workers(workers) if codec.compress_block is not None else 1
+        self.__level = level if level is not None else codec.level
+        self.__store_level = codec.store_level
+        self.__storing = False
+        self.__block_size = block_size if block_size is not None else codec.block_size
+        self.__compress_block = codec.compress_block
+
+        if compression == WpCompression.ZSTD:
+            _import_zstandard()
+        elif compression == WpCompression.LZ4:
+            _import_lz4_frame()
+
+        self.__log.info('Compressing with %s using %d worker(s), level %s, %d byte blocks', compression.value, self.__workers, self.__level, self.__block_size)
+
+        self.__owns_executor = executor is None and self.__workers > 1
+        self.__executor = executor if executor is not None and codec.compress_block is not None else None
+        if self.__owns_executor:
+            self.__executor = ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='wpbackup2-compress')
+        self.__pending = collections.deque()
+        self.__max_pending = self.__workers * 2
+
+        self.__buffer = bytearray()
+        self.__position = 0
+        self.__block_position = 0
+        self.__compressed_position = 0
+        self.__closed = False
+
+        self.frames = [] if record_frames else None
+        self.__metrics = metrics
+
+        self.__fileobj = open(filename, 'wb') # pylint: disable=consider-using-with
+
+    #########################################################################
+    def __compress(self, block, store=False):
+        if self.__compress_block is None:
+            return block
+
+        level = self.__store_level if store else self.__level
+
+        if self.__metrics is None:
+            return self.__compress_block(block, level)
+
+        phase = 'store' if store else 'compress'
+
+        started = time.monotonic()
+        with self.__metrics.profile(phase):
+            compressed = self.__compress_block(block, level)
+        self.__metrics.add(phase, seconds=time.monotonic() - started, bytes_in=len(block), bytes_out=len(compressed))
+
+        return compressed
+
+    #########################################################################
+    def __write_frame(self, offset, length, compressed):
+        if self.frames is not None:
+            self.frames.append((self.__compressed_position, len(compressed), offset, length))
+
+        if self.__metrics is None:
+            self.__fileobj.write(compressed)
+        else:
+            started = time.monotonic()
+            self.__fileobj.write(compressed)
+            self.__metrics.add('write', seconds=time.monotonic() - started, bytes_out=len(compressed))
+
+        self.__compressed_position += len(compressed)
+
+    #########################################################################
+    def __write_next(self):
+        offset, length, future = self.__pending.popleft()
+
+        if self.__metrics is None:
+            compressed = future.result()
+        else:
+            started = time.monotonic()
+            compressed = future.result()
+            self.__metrics.add('compress_wait', seconds=time.monotonic() - started)
+
+        self.__write_frame(offset, length, compressed)
+
+    #########################################################################
+    def __submit(self, block):
+        offset = self.__block_position
+        self.__block_position += len(block)
+
+        if self.__executor is None:
+            self.__write_frame(offset, len(block), self.__compress(block, self.__storing))
+            return
+
+        self.__pending.append((offset, len(block), self.__executor.submit(self.__compress, block, self.__storing)))
+
+        while len(self.__pending) > self.__max_pending:
+            self.__write_next()
+
+    #########################################################################
+    def write(self, data):
+        """
+        Buffer ``data`` and hand every complete block to the workers
+        """
+
+        if self.__closed:
+            raise ValueError("write to closed compressor")
+
+        self.__buffer += data
+        self.__position += len(data)
+
+        while len(self.__buffer) >= self.__block_size:
+            self.__submit(bytes(self.__buffer[:self.__block_size]))
+            del self.__buffer[:self.__block_size]
+
+        return len(data)
+
+    #########################################################################
+    def tell(self):
+        """
+        Number of uncompressed bytes written so far
+        """
+
+        return self.__position
+
+    #########################################################################
+    def __end_frame(self):
+        if len(self.__buffer) > 0:
+            self.__submit(bytes(self.__buffer))
+            self.__buffer = bytearray()
+
+    #########################################################################
+    @contextlib.contextmanager
+    def stored(self):
+        """
+        Write what is written in the ``with`` block in frames of its own at
+        the store level of the codec, for data that is compressed already
+        """
+
+        self.__end_frame()
+        self.__storing = True
+
+        try:
+            yield self
+        finally:
+            self.__end_frame()
+            self.__storing = False
+
+    #########################################################################
+    def flush_frame(self):
+        """
+        End the current frame and wait until everything written so far is
+        on disk, so the next write starts a new frame. Returns the compressed
+        offset at which that next frame will start.
+        """
+
+        self.__end_frame()
+
+        while len(self.__pending) > 0:
+            self.__write_next()
+
+        return self.__compressed_position
+
+    #########################################################################
+    def write_raw(self, data):
+        """
+        Append ``data`` to the file as is, after everything written so far
+        """
+
+        self.flush_frame()
+
+        self.__fileobj.write(data)
+        self.__compressed_position += len(data)
+
+    #########################################################################
+    def close(self):
+        """
+        Compress whatever is still buffered, wait for the workers and close
+        the underlying file
+        """
+
+        if self.__closed:
+            return
+
+        self.__closed = True
+
+        try:
+            self.flush_frame()
+        finally:
+            if self.__owns_executor:
+                self.__executor.shutdown(wait=True)
+            self.__fileobj.close()
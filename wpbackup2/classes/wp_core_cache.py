@@ -0,0 +1,261 @@
+"""
+wp_core_cache
+
+A local cache of WordPress releases, so backups can leave out the core
+files (wp-admin, wp-includes, the root PHP files, the bundled themes and
+plugins) that are identical across sites running the same version.
+
+The cache is a directory holding one unpacked release per version:
+
+    <cache>/6.4.2/wp-includes/version.php
+    <cache>/6.4.2/wp-admin/...
+
+(``<cache>/6.4.2/wordpress/...``, the layout of an unpacked
+wordpress-6.4.2.tar.gz, works as well). The version of a site is read from
+its ``wp-includes/version.php``. The size and content hash of every file of
+a release are computed the first time the release is used and kept in a
+``.wpbackup2-checksums.json`` file next to it; they are computed again when
+a file or directory of the release is newer than that file.
+
+A backup hashes each file that the release of the site also holds. When the
+size and hash match, the file is not archived: the manifest records it as a
+reference to the release, with its mode, owner and mtime. Modified core
+files are archived as usual. A restore copies the referenced files back
+from the cache, checking each against the size and hash of the manifest.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import json
+import logging
+import os
+import re
+import threading
+
+from wpbackup2.exceptions import WpCoreReleaseCorruptError
+
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import new_hasher
+
+VERSION_FILENAME = 'wp-includes/version.php'
+VERSION_PATTERN = re.compile(rb"^\$wp_version\s*=\s*'([^']+)'\s*;", re.MULTILINE)
+
+# Versions name a directory of the cache (6.4.2, 6.5-RC1...), anything that
+# could point outside of it is refused
+VALID_VERSION = re.compile(r'^[0-9A-Za-z][0-9A-Za-z.+_-]*$')
+
+CHECKSUMS_FILENAME = '.wpbackup2-checksums.json'
+RELEASE_SUBDIRECTORY = 'wordpress'
+
+HASH_READ_SIZE = 1024 * 1024
+
+#########################################################################
+def detect_version(site_path):
+    """
+    WordPress version of the site at ``site_path``, from its
+    wp-includes/version.php (None when it cannot be read)
+    """
+
+    try:
+        with open(os.path.join(str(site_path), VERSION_FILENAME), 'rb') as source:
+            match = VERSION_PATTERN.search(source.read())
+    except OSError:
+        return None
+
+    return match.group(1).decode('ascii', 'replace') if match is not None else None
+
+#########################################################################
+def hash_file(path, algorithm=HASH_ALGORITHM):
+    """ Content hash of the file at ``path`` """
+
+    hasher = new_hasher(algorithm)
+
+    with open(path, 'rb') as source:
+        for data in iter(lambda: source.read(HASH_READ_SIZE), b''):
+            hasher.update(data)
+
+    return hasher.hexdigest()
+
+class WpCoreRelease:
+    """ One release of the cache: its files and their checksums """
+
+    #########################################################################
+    def __init__(self, version, path, checksums):
+        """
+        Constructor
+
+        Args:
+            version (str):      WordPress version of the release
+            path (str):         directory the release is unpacked in
+            checksums (dict):   path relative to the release -> (size, hash)
+        """
+        self.version = version
+        self.path = path
+        self.checksums = checksums
+
+    #########################################################################
+    def matching_hash(self, relative, path, size):
+        """
+        Content hash of the file ``path`` of a site when it is identical to
+        the file ``relative`` of the release, None otherwise
+        """
+
+        checksum = self.checksums.get(relative)
+
+        # Comparing the size first spares hashing most modified files
+        if checksum is None or checksum[0] != size:
+            return None
+
+        file_hash = hash_file(path)
+
+        return file_hash if file_hash == checksum[1] else None
+
+    #########################################################################
+    def materialize(self, relative, target, size, file_hash=None):
+        """
+        Copy the file ``relative`` of the release to ``target``, checking
+        while it is copied that it still holds ``size`` bytes with the
+        content hash ``file_hash`` (when given). A file that does not is
+        removed and WpCoreReleaseCorruptError raised.
+        """
+
+        hasher = new_hasher()
+        copied = 0
+
+        with open(os.path.join(self.path, relative), 'rb') as source, open(target, 'wb') as output:
+            for data in iter(lambda: source.read(HASH_READ_SIZE), b''):
+                hasher.update(data)
+                output.write(data)
+                copied += len(data)
+
+        if copied != size or (file_hash is not None and hasher.hexdigest() != file_hash):
+            os.remove(target)
+            raise WpCoreReleaseCorruptError(self.version, os.path.join(self.path, relative))
+
+class WpCoreCache:
+    """ WpCoreCache """
+
+    #########################################################################
+    def __init__(self, directory):
+        """
+        Constructor
+
+        Args:
+            directory (str):    directory holding one unpacked release per version
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.directory = str(directory)
+
+        # version -> WpCoreRelease (None when the release is not cached)
+        self.__releases = {}
+        self.__lock = threading.Lock()
+
+    #########################################################################
+    def __release_path(self, version):
+        if not VALID_VERSION.match(version) or '..' in version:
+            self.__log.warning('Refusing the WordPress version "%s", it is not a valid directory name', version)
+            return None
+
+        path = os.path.join(self.directory, version)
+
+        for candidate in [path, os.path.join(path, RELEASE_SUBDIRECTORY)]:
+            if os.path.isfile(os.path.join(candidate, VERSION_FILENAME)):
+                return candidate
+
+        return None
+
+    #########################################################################
+    @staticmethod
+    def __newest_change_ns(path):
+        """
+        Newest change of the files and directories of the release in
+        ``path``. The ctime counts as well: tar gives extracted files the
+        mtime they were archived with, however recently it unpacked them.
+        The release directory itself changes when the checksums file is
+        written, so it does not count.
+        """
+
+        newest = 0
+
+        for directory, directories, files in os.walk(path):
+            for name in directories + files:
+                if directory == path and name == CHECKSUMS_FILENAME:
+                    continue
+
+                stat_result = os.lstat(os.path.join(directory, name))
+                newest = max(newest, stat_result.st_mtime_ns, stat_result.st_ctime_ns)
+
+        return newest
+
+    #########################################################################
+    def __load_checksums(self, path):
+        """
+        Checksums of the release in ``path``, read from its checksums file
+        or computed (and written to it when the cache is writable)
+        """
+
+        filename = os.path.join(path, CHECKSUMS_FILENAME)
+
+        if os.path.isfile(filename):
+            if self.__newest_change_ns(path) <= os.stat(filename).st_mtime_ns:
+                with open(filename, 'r') as source:
+                    return {relative: tuple(checksum) for relative, checksum in json.load(source).items()}
+
+            self.__log.info('The core release in "%s" changed since its checksums were computed', path)
+
+        self.__log.info('Computing the checksums of the core release in "%s"...', path)
+
+        checksums = {}
+
+        for directory, _, files in os.walk(path):
+            for name in files:
+                file_path = os.path.join(directory, name)
+                relative = os.path.relpath(file_path, path).replace(os.path.sep, '/')
+
+                if relative == CHECKSUMS_FILENAME or os.path.islink(file_path):
+                    continue
+
+                checksums[relative] = (os.path.getsize(file_path), hash_file(file_path))
+
+        try:
+            with open(filename + '.tmp', 'w') as output:
+                json.dump(checksums, output, separators=(',', ':'))
+            os.replace(filename + '.tmp', filename)
+        except OSError as error:
+            self.__log.warning('Unable to write the checksums of "%s": %s', path, error)
+
+        return checksums
+
+    #########################################################################
+    def release(self, version):
+        """ The cached release of WordPress ``version``, None when it is not cached """
+
+        if version is None:
+            return None
+
+        with self.__lock:
+            if version not in self.__releases:
+                path = self.__release_path(version)
+
+                if path is None:
+                    self.__log.warning('WordPress %s is not in the core release cache "%s", its core files are archived', version, self.directory)
+                    self.__releases[version] = None
+                else:
+                    self.__releases[version] = WpCoreRelease(version, path, self.__load_checksums(path))
+
+            return self.__releases[version]
+
+    #########################################################################
+    def release_for_site(self, site_path):
+        """ The cached release of the WordPress version the site at ``site_path`` runs """
+
+        version = detect_version(site_path)
+
+        if version is None:
+            self.__log.warning('No WordPress version found in "%s", its core files are archived', os.path.join(str(site_path), VERSION_FILENAME))
+            return None
+
+        return self.release(version)
@@ -0,0 +1,508 @@
+"""
+wp_database_loader
+
+Loads database dumps into MySQL by streaming them to the stdin of mysql,
+so a dump never has to be extracted to disk first. The dump is read by the
+caller's thread and handed to a feeder thread through a queue of at most
+PIPE_QUEUE_SIZE chunks: reading (and decompressing) the archive overlaps
+with mysql executing the SQL, and stops whenever mysql falls behind. If
+mysql exits early, feeding stops and its error output is raised in a
+WpDatabaseRestoreFailed.
+
+A dump is given as a source: a callable returning an iterable of bytes.
+
+A per-table dump (see WpInternalBackup, --dump-workers) is loaded over
+several connections:
+
+  1. the schema, with the secondary indexes (plain, FULLTEXT and SPATIAL
+     keys) of each table taken out of its CREATE TABLE statement
+  2. the data of every table, several tables at a time, largest first
+  3. the secondary indexes, one ALTER TABLE per table, so each index is
+     built once from sorted data instead of being maintained row by row
+  4. the triggers, once the data is in place so they do not fire on it
+
+Primary and unique keys stay in the CREATE TABLE statements (InnoDB
+clusters rows on the primary key, and unique keys enforce constraints
+while loading). Tables with foreign keys keep all their indexes, as the
+constraints rely on them.
+
+WpAsyncDatabaseLoader loads dumps the same way on an asyncio event loop
+(for WpBackup.restore_async): mysql is fed and read by the loop, and only
+the reads of the dump run on an executor.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import asyncio
+import logging
+import queue
+import re
+import subprocess
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wpbackup2.exceptions import WpDatabaseMysqlFailed
+from wpbackup2.exceptions import WpDatabaseRestoreFailed
+
+from wpbackup2.classes.wp_async_runner import run_concurrently
+from wpbackup2.classes.wp_async_runner import start_process
+from wpbackup2.classes.wp_async_runner import stop_process
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
+from wpbackup2.classes.wp_metrics import WpMetrics
+
+CREATE_TABLE_START = re.compile(r'^CREATE TABLE `((?:[^`]|``)+)` \($')
+CREATE_TABLE_END = re.compile(r'^\)')
+SECONDARY_KEY = re.compile(r'^(?:KEY|INDEX|FULLTEXT (?:KEY|INDEX)|SPATIAL (?:KEY|INDEX)) ')
+FULLTEXT_KEY = re.compile(r'^FULLTEXT ')
+FOREIGN_KEY = re.compile(r'^CONSTRAINT .* FOREIGN KEY ')
+
+# Chunks of a dump buffered between the reader and mysql
+PIPE_QUEUE_SIZE = 8
+
+FILE_READ_SIZE = 1024 * 1024
+
+#########################################################################
+def file_source(filename):
+    """
+    Source reading a dump from a file
+    """
+
+    def read():
+        with open(filename, 'rb') as stream:
+            while True:
+                data = stream.read(FILE_READ_SIZE)
+                if not data:
+                    return
+                yield data
+
+    return read
+
+#########################################################################
+def read_source(source):
+    """
+    The whole content of a source
+    """
+
+    return b''.join(source())
+
+#########################################################################
+def defer_secondary_keys(schema):
+    """
+    Take the secondary keys out of the CREATE TABLE statements of a
+    mysqldump schema, returning (schema, {table: [ALTER TABLE statement]})
+    """
+
+    output = []
+    deferred = {}
+
+    table = None
+    body = []
+
+    for line in schema.splitlines():
+        if table is None:
+            match = CREATE_TABLE_START.match(line)
+            if match:
+                table = match.group(1).replace('``', '`')
+                body = []
+            output.append(line)
+            continue
+
+        if not CREATE_TABLE_END.match(line):
+            body.append(line.strip().rstrip(','))
+            continue
+
+        keys = [definition for definition in body if SECONDARY_KEY.match(definition)]
+
+        if len(keys) == 0 or any(FOREIGN_KEY.match(definition) for definition in body):
+            keys = []
+            kept = body
+        else:
+            kept = [definition for definition in body if not SECONDARY_KEY.match(definition)]
+
+        output.append(',\n'.join('  ' + definition for definition in kept))
+        output.append(line)
+
+        if len(keys) > 0:
+            quoted = '`{}`'.format(table.replace('`', '``'))
+            statements = []
+
+            # InnoDB builds one FULLTEXT index per ALTER TABLE
+            plain = [definition for definition in keys if not FULLTEXT_KEY.match(definition)]
+            if len(plain) > 0:
+                statements.append('ALTER TABLE {} {};'.format(quoted, ', '.join('ADD ' + definition for definition in plain)))
+            for definition in keys:
+                if FULLTEXT_KEY.match(definition):
+                    statements.append('ALTER TABLE {} ADD {};'.format(quoted, definition))
+
+            deferred[table] = statements
+
+        table = None
+
+    return '\n'.join(output) + '\n', deferred
+
+class WpDatabaseLoader:
+    """ WpDatabaseLoader """
+
+    #########################################################################
+    def __init__(self, connection_args, database, db_host, workers=1, host_limiter=None, what_if=False, popen=None, metrics=None):
+        """
+        Constructor
+
+        Args:
+            connection_args (list):         mysql options selecting the server and
+                                            credentials
+            database (str):                 name of the database to load into
+            db_host (str):                  database host, for ``host_limiter``
+            workers (int):                  tables loaded concurrently
+            host_limiter (WpDbHostLimiter): limits connections per database host
+            what_if (bool):                 log what would be loaded only
+            popen (callable):               starts mysql (subprocess.Popen by default)
+            metrics (WpMetrics):            records the time mysql ran and the bytes
+                                            fed to it as the ``mysql`` phase
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__connection_args = list(connection_args)
+        self.__database = database
+        self.__db_host = db_host
+        self.__host_limiter = host_limiter if host_limiter is not None else WpDbHostLimiter()
+        self.__workers = self.__host_limiter.workers(db_host, max(workers, 1))
+        self.__what_if = what_if
+        self.__popen = popen if popen is not None else subprocess.Popen
+        self.__metrics = metrics if metrics is not None else WpMetrics('restore')
+
+    #########################################################################
+    def __mysql(self, name, chunks):
+        """
+        Run mysql on the database, feeding it ``chunks`` (an iterable of
+        bytes), and return the time it took
+        """
+
+        args = ['mysql'] + self.__connection_args + [self.__database]
+
+        if self.__what_if:
+            self.__log.debug('Would load "%s"', name)
+            return 0.0
+
+        with self.__host_limiter.acquire(self.__db_host):
+            started = time.monotonic()
+
+            try:
+                process = self.__popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except FileNotFoundError as error:
+                self.__log.exception(error)
+                self.__log.fatal('mysql was not found. Please install it and try again.')
+                raise WpDatabaseMysqlFailed(message="mysql was not found", stdOut=None, stdError=None) from error
+
+            output = {}
+
+            def drain(key, pipe):
+                output[key] = pipe.read()
+
+            readers = [threading.Thread(target=drain, args=(key, pipe), daemon=True)
+                       for key, pipe in (('stdout', process.stdout), ('stderr', process.stderr))]
+
+            pending = queue.Queue(maxsize=PIPE_QUEUE_SIZE)
+            broken = threading.Event()
+
+            def feed():
+                data = b''
+                try:
+                    while True:
+                        data = pending.get()
+                        if data is None:
+                            break
+                        process.stdin.write(data)
+                    process.stdin.close()
+                except OSError:
+                    # mysql went away; keep emptying the queue up to the end
+                    # marker so the reader never blocks on it
+                    broken.set()
+                    while data is not None:
+                        data = pending.get()
+
+            feeder = threading.Thread(target=feed, name='wpbackup2-feed', daemon=True)
+
+            for thread in readers + [feeder]:
+                thread.start()
+
+            fed = 0
+
+            try:
+                for data in chunks:
+                    if broken.is_set():
+                        break
+                    pending.put(data)
+                    fed += len(data)
+            except BaseException:
+                # Never let mysql commit a partial dump
+                process.kill()
+                raise
+            finally:
+                pending.put(None)
+                feeder.join()
+                process.wait()
+                for thread in readers:
+                    thread.join()
+
+                for pipe in (process.stdin, process.stdout, process.stderr):
+                    try:
+                        pipe.close()
+                    except OSError:
+                        pass
+
+            elapsed = time.monotonic() - started
+            self.__metrics.add('mysql', seconds=elapsed, bytes_out=fed)
+
+        if process.returncode != 0 or broken.is_set():
+            self.__log.fatal('Loading "%s" failed (mysql exited with %s).\n\nmysql stdout:\n%s\n\nmysql stderr:\n%s', name, process.returncode, output.get('stdout'), output.get('stderr'))
+            raise WpDatabaseRestoreFailed(name, output.get('stdout'), output.get('stderr'))
+
+        return elapsed
+
+    #########################################################################
+    def __load(self, name, source):
+        return self.__mysql(name, source())
+
+    #########################################################################
+    def __run_parallel(self, phase, tasks):
+        """
+        Run (name, function, args) tasks on the worker pool, logging the time
+        each one took. The first failure stops tasks that have not started.
+        """
+
+        cancelled = threading.Event()
+
+        def run(name, function, args):
+            if cancelled.is_set():
+                return
+            with self.__metrics.profile('database'):
+                elapsed = function(*args)
+            self.__log.info('%s "%s" in %.1fs', phase, name, elapsed)
+
+        with ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='wpbackup2-load') as executor:
+            futures = [executor.submit(run, *task) for task in tasks]
+
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                cancelled.set()
+                raise
+
+    #########################################################################
+    def load_dump(self, name, source):
+        """
+        Load a single dump
+
+        Args:
+            name (str):         name of the dump, for logging
+            source (callable):  returns the content of the dump as an
+                                iterable of bytes
+        """
+
+        self.__log.info('Loading "%s"...', name)
+        elapsed = self.__load(name, source)
+        self.__log.info('Database load complete in %.1fs', elapsed)
+
+    #########################################################################
+    def load(self, schema_source, table_sources, triggers_source=None):
+        """
+        Load a per-table dump
+
+        Args:
+            schema_source (callable):   the schema dump
+            table_sources (dict):       table name -> (size, source) of its data dump
+            triggers_source (callable): the triggers dump (None if there is none)
+        """
+
+        if self.__what_if:
+            self.__log.info('Would load the schema, data and indexes of %d table(s)', len(table_sources))
+            return
+
+        started = time.monotonic()
+
+        schema, deferred = defer_secondary_keys(read_source(schema_source).decode('utf-8', errors='surrogateescape'))
+
+        self.__log.info('Loading schema (%d table(s) with deferred indexes)...', len(deferred))
+        elapsed = self.__mysql('schema', [schema.encode('utf-8', errors='surrogateescape')])
+        self.__log.info('Loaded schema in %.1fs', elapsed)
+
+        # Largest tables first, so the biggest one does not start last
+        tables = sorted(table_sources.items(), key=lambda item: item[1][0], reverse=True)
+
+        self.__log.info('Loading data of %d table(s) with %d worker(s)...', len(tables), self.__workers)
+        self.__run_parallel('Loaded data of', [(table, self.__load, (table, source)) for table, (_, source) in tables])
+
+        if len(deferred) > 0:
+            self.__log.info('Building secondary indexes of %d table(s)...', len(deferred))
+            self.__run_parallel('Built indexes of', [(table, self.__mysql, (table, ['\n'.join(statements).encode('utf-8')]))
+                                                      for table, statements in deferred.items()])
+
+        if triggers_source is not None:
+            self.__log.info('Loading triggers...')
+            self.__load('triggers', triggers_source)
+
+        self.__log.info('Database load complete in %.1fs', time.monotonic() - started)
+
+class WpAsyncDatabaseLoader:
+    """ WpAsyncDatabaseLoader """
+
+    #########################################################################
+    def __init__(self, runner, connection_args, database, db_host, workers=1, host_limiter=None, what_if=False, metrics=None):
+        """
+        Constructor
+
+        Args:
+            runner (WpAsyncRunner):         reads the dumps on its executor
+            connection_args (list):         mysql options selecting the server and
+                                            credentials
+            database (str):                 name of the database to load into
+            db_host (str):                  database host, for ``host_limiter``
+            workers (int):                  tables loaded concurrently
+            host_limiter (WpDbHostLimiter): limits connections per database host
+            what_if (bool):                 log what would be loaded only
+            metrics (WpMetrics):            records the time mysql ran and the bytes
+                                            fed to it as the ``mysql`` phase
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__runner = runner
+        self.__connection_args = list(connection_args)
+        self.__database = database
+        self.__db_host = db_host
+        self.__host_limiter = host_limiter if host_limiter is not None else WpDbHostLimiter()
+        self.__workers = self.__host_limiter.workers(db_host, max(workers, 1))
+        self.__what_if = what_if
+        self.__metrics = metrics if metrics is not None else WpMetrics('restore')
+
+    #########################################################################
+    async def __mysql(self, name, chunks):
+        """
+        Run mysql on the database, feeding it ``chunks`` (an iterable of
+        bytes, read on the executor), and return the time it took
+        """
+
+        args = ['mysql'] + self.__connection_args + [self.__database]
+
+        if self.__what_if:
+            self.__log.debug('Would load "%s"', name)
+            return 0.0
+
+        async with self.__host_limiter.acquire_async(self.__db_host):
+            started = time.monotonic()
+
+            try:
+                process = await start_process(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            except FileNotFoundError as error:
+                self.__log.exception(error)
+                self.__log.fatal('mysql was not found. Please install it and try again.')
+                raise WpDatabaseMysqlFailed(message="mysql was not found", stdOut=None, stdError=None) from error
+
+            readers = [asyncio.ensure_future(process.stdout.read()), asyncio.ensure_future(process.stderr.read())]
+            iterator = iter(chunks)
+            broken = False
+            fed = 0
+
+            try:
+                while True:
+                    data = await self.__runner.call(next, iterator, None)
+                    if data is None:
+                        break
+
+                    try:
+                        process.stdin.write(data)
+                        await process.stdin.drain()
+                    except (BrokenPipeError, ConnectionResetError):
+                        # mysql went away, its error output says why
+                        broken = True
+                        break
+
+                    fed += len(data)
+
+                process.stdin.close()
+                stdout, stderr = await asyncio.gather(*readers)
+                await process.wait()
+            except BaseException:
+                # Never let mysql commit a partial dump
+                for reader in readers:
+                    reader.cancel()
+                await stop_process(process)
+                raise
+
+            elapsed = time.monotonic() - started
+            self.__metrics.add('mysql', seconds=elapsed, bytes_out=fed)
+
+        if process.returncode != 0 or broken:
+            self.__log.fatal('Loading "%s" failed (mysql exited with %s).\n\nmysql stdout:\n%s\n\nmysql stderr:\n%s', name, process.returncode, stdout, stderr)
+            raise WpDatabaseRestoreFailed(name, stdout, stderr)
+
+        return elapsed
+
+    #########################################################################
+    async def __load(self, name, source):
+        return await self.__mysql(name, source())
+
+    #########################################################################
+    async def __run_parallel(self, phase, tasks):
+        """
+        Run (name, coroutine function, args) tasks ``workers`` at a time,
+        logging the time each one took. The first failure cancels the
+        others.
+        """
+
+        async def run(name, function, args):
+            elapsed = await function(*args)
+            self.__log.info('%s "%s" in %.1fs', phase, name, elapsed)
+
+        await run_concurrently([run(*task) for task in tasks], self.__workers)
+
+    #########################################################################
+    async def load_dump(self, name, source):
+        """
+        Load a single dump (see WpDatabaseLoader.load_dump)
+        """
+
+        self.__log.info('Loading "%s"...', name)
+        elapsed = await self.__load(name, source)
+        self.__log.info('Database load complete in %.1fs', elapsed)
+
+    #########################################################################
+    async def load(self, schema_source, table_sources, triggers_source=None):
+        """
+        Load a per-table dump (see WpDatabaseLoader.load)
+        """
+
+        if self.__what_if:
+            self.__log.info('Would load the schema, data and indexes of %d table(s)', len(table_sources))
+            return
+
+        started = time.monotonic()
+
+        schema = await self.__runner.call(read_source, schema_source)
+        schema, deferred = defer_secondary_keys(schema.decode('utf-8', errors='surrogateescape'))
+
+        self.__log.info('Loading schema (%d table(s) with deferred indexes)...', len(deferred))
+        elapsed = await self.__mysql('schema', [schema.encode('utf-8', errors='surrogateescape')])
+        self.__log.info('Loaded schema in %.1fs', elapsed)
+
+        # Largest tables first, so the biggest one does not start last
+        tables = sorted(table_sources.items(), key=lambda item: item[1][0], reverse=True)
+
+        self.__log.info('Loading data of %d table(s) with %d worker(s)...', len(tables), self.__workers)
+        await self.__run_parallel('Loaded data of', [(table, self.__load, (table, source)) for table, (_, source) in tables])
+
+        if len(deferred) > 0:
+            self.__log.info('Building secondary indexes of %d table(s)...', len(deferred))
+            await self.__run_parallel('Built indexes of', [(table, self.__mysql, (table, ['\n'.join(statements).encode('utf-8')]))
+                                                            for table, statements in deferred.items()])
+
+        if triggers_source is not None:
+            self.__log.info('Loading triggers...')
+            await self.__load('triggers', triggers_source)
+
+        self.__log.info('Database load complete in %.1fs', time.monotonic() - started)
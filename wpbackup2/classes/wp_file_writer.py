@@ -0,0 +1,219 @@
+"""
+wp_file_writer
+
+A pool of threads writing the files of a restore. On network filesystems
+(EFS, NFS) every file costs several round trips (create, write, chmod,
+utime), so writing one file at a time leaves the restore waiting on
+latency rather than on bandwidth.
+
+The thread reading the archive stays the only one decompressing: it reads
+the content of each file and hands it to a writer thread, creating missing
+parent directories itself first so the writers never race to create them.
+A writer creates the file, writes it and applies its owner, mode and
+modification time on the open descriptor, which spares the path lookups of
+separate chmod and utime calls. The attributes of directories are applied
+once every file is written, as before.
+
+Files larger than ``large_file_size`` are written by the reading thread, so
+they are streamed rather than held in memory, and at most
+``max_buffered_bytes`` of file contents are waiting for a writer at any
+time.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import logging
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+WRITE_SIZE = 1024 * 1024
+LARGE_FILE_SIZE = 8 * 1024 * 1024
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+# Every queued file counts as at least this many bytes against
+# ``max_buffered_bytes``, which bounds the number of queued empty files
+MIN_FILE_CHARGE = 4096
+
+OPEN_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_CLOEXEC', 0) | getattr(os, 'O_BINARY', 0)
+
+class WpFileWriterPool:
+    """ WpFileWriterPool """
+
+    #########################################################################
+    def __init__(self, root, workers, metrics, large_file_size=LARGE_FILE_SIZE, max_buffered_bytes=MAX_BUFFERED_BYTES):
+        """
+        Constructor
+
+        Args:
+            root (str):                 directory the files are written to
+            workers (int):              number of writer threads
+            metrics (WpMetrics):        metrics the writes are recorded in (``extract``)
+            large_file_size (int):      files larger than this are written by the
+                                        reading thread
+            max_buffered_bytes (int):   most bytes of file contents queued at once
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__root = os.path.abspath(str(root))
+        self.__metrics = metrics
+        self.__large_file_size = large_file_size
+        self.__max_buffered_bytes = max_buffered_bytes
+        self.__is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+
+        self.__executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wpbackup2-write')
+        self.__condition = threading.Condition()
+        self.__buffered = 0
+        self.__queued = 0
+        self.__error = None
+        self.__directories = set()
+
+    #########################################################################
+    def __enter__(self):
+        return self
+
+    #########################################################################
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            # Queued files are dropped, the restore failed anyway
+            with self.__condition:
+                if self.__error is None:
+                    self.__error = exc_value
+            self.__executor.shutdown(wait=True)
+            return
+
+        self.close()
+
+    #########################################################################
+    def __target(self, relative):
+        path = os.path.normpath(os.path.join(self.__root, relative))
+
+        if not path.startswith(self.__root + os.path.sep):
+            raise ValueError("refusing to write '{}' outside of '{}'".format(relative, self.__root))
+
+        return path
+
+    #########################################################################
+    def __ensure_directory(self, directory):
+        if directory in self.__directories:
+            return
+
+        os.makedirs(directory, exist_ok=True)
+        self.__directories.add(directory)
+
+    #########################################################################
+    def __raise_error(self):
+        with self.__condition:
+            error = self.__error
+
+        if error is not None:
+            raise error
+
+    #########################################################################
+    def __write(self, path, member, chunks):
+        """ Create the file ``path`` from ``chunks`` with the attributes of ``member`` """
+
+        started = time.monotonic()
+
+        with self.__metrics.profile('extract'):
+            try:
+                fd = os.open(path, OPEN_FLAGS, 0o600)
+            except OSError:
+                # O_NOFOLLOW refuses to write through a symlink, which is
+                # replaced like tarfile does
+                if not os.path.islink(path):
+                    raise
+                os.remove(path)
+                fd = os.open(path, OPEN_FLAGS, 0o600)
+
+            try:
+                for data in chunks:
+                    view = memoryview(data)
+                    while len(view) > 0:
+                        view = view[os.write(fd, view):]
+
+                if self.__is_root:
+                    os.fchown(fd, member.uid, member.gid)
+                os.fchmod(fd, member.mode)
+                if os.utime in os.supports_fd:
+                    os.utime(fd, (member.mtime, member.mtime))
+            finally:
+                os.close(fd)
+
+            if os.utime not in os.supports_fd:
+                os.utime(path, (member.mtime, member.mtime))
+
+        self.__metrics.add('extract', seconds=time.monotonic() - started, bytes_out=member.size, files=1)
+
+    #########################################################################
+    def __write_queued(self, path, member, data, charge):
+        try:
+            with self.__condition:
+                failed = self.__error is not None
+
+            if not failed:
+                self.__write(path, member, [data])
+        except BaseException as error: # pylint: disable=broad-except
+            with self.__condition:
+                if self.__error is None:
+                    self.__error = error
+        finally:
+            with self.__condition:
+                self.__buffered -= charge
+                self.__queued -= 1
+                self.__condition.notify_all()
+
+    #########################################################################
+    def add(self, stream, member, relative):
+        """
+        Write the regular file ``member`` of the tarfile ``stream`` to
+        ``relative`` under the root. Its content is read now, it is written
+        by a writer thread unless it is large.
+        """
+
+        self.__raise_error()
+
+        path = self.__target(relative)
+        self.__ensure_directory(os.path.dirname(path))
+
+        source = stream.extractfile(member)
+
+        if member.size > self.__large_file_size:
+            self.__write(path, member, iter(lambda: source.read(WRITE_SIZE), b''))
+            return
+
+        data = source.read()
+        charge = max(len(data), MIN_FILE_CHARGE)
+
+        with self.__condition:
+            while self.__buffered > 0 and self.__buffered + charge > self.__max_buffered_bytes and self.__error is None:
+                self.__condition.wait()
+
+            self.__buffered += charge
+            self.__queued += 1
+
+        self.__executor.submit(self.__write_queued, path, member, data, charge)
+
+    #########################################################################
+    def wait(self):
+        """
+        Wait until every queued file is written (before extracting a hard
+        link to one of them), raising the first error of a writer
+        """
+
+        with self.__condition:
+            while self.__queued > 0:
+                self.__condition.wait()
+
+        self.__raise_error()
+
+    #########################################################################
+    def close(self):
+        """ Wait for the queued files and stop the writer threads """
+
+        self.__executor.shutdown(wait=True)
+        self.__raise_error()
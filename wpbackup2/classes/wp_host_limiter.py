@@ -0,0 +1,163 @@
+"""
+wp_host_limiter
+
+Limits the number of concurrent connections (mysqldump / mysql processes)
+opened against each database host, so parallel dumps and restores do not
+swamp a shared database server such as an RDS instance.
+
+Limits are looked up by the DB_HOST value of wp-config.php and, failing
+that, by the host name without its port. One limiter is shared by every
+operation started from the same WpBackup instance.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import asyncio
+import contextlib
+import logging
+import threading
+
+# Seconds between two attempts of acquire_async to take a slot
+ASYNC_POLL_INTERVAL = 0.05
+
+class WpDbHostLimiter:
+    """ WpDbHostLimiter """
+
+    #########################################################################
+    def __init__(self, limits=None, default_limit=None):
+        """
+        Constructor
+
+        Args:
+            limits (dict):          host -> maximum concurrent connections
+            default_limit (int):    limit for hosts not in ``limits``
+                                    (None = unlimited)
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__limits = dict(limits or {})
+        self.__default_limit = default_limit
+
+        self.__semaphores = {}
+        self.__lock = threading.Lock()
+
+    #########################################################################
+    @staticmethod
+    def parse(values):
+        """
+        Parse HOST=N strings (as given on the command line) into a dict
+        """
+
+        limits = {}
+
+        for value in values or []:
+            host, separator, limit = value.rpartition('=')
+
+            if separator == '' or len(host) == 0 or not limit.isdigit() or int(limit) < 1:
+                raise ValueError("invalid database host concurrency '{}', expected HOST=N".format(value))
+
+            limits[host] = int(limit)
+
+        return limits
+
+    #########################################################################
+    def __key(self, host):
+        host = str(host)
+
+        if host in self.__limits:
+            return host
+
+        name = host.rsplit(':', 1)[0]
+        if name in self.__limits:
+            return name
+
+        return host
+
+    #########################################################################
+    def limit(self, host):
+        """
+        Maximum number of concurrent connections to ``host`` (None when
+        unlimited)
+        """
+
+        return self.__limits.get(self.__key(host), self.__default_limit)
+
+    #########################################################################
+    def workers(self, host, requested):
+        """
+        Number of workers to use for ``requested`` parallel connections to
+        ``host``
+        """
+
+        limit = self.limit(host)
+
+        return requested if limit is None else max(min(requested, limit), 1)
+
+    #########################################################################
+    def __semaphore(self, host, limit):
+        """
+        Slots of ``host``, shared by every host name with the same limit key
+        """
+
+        key = self.__key(host)
+
+        with self.__lock:
+            semaphore = self.__semaphores.get(key)
+            if semaphore is None:
+                semaphore = self.__semaphores[key] = threading.BoundedSemaphore(limit)
+
+        return key, semaphore
+
+    #########################################################################
+    @contextlib.contextmanager
+    def acquire(self, host):
+        """
+        Hold one connection slot for ``host`` while the context is active
+        """
+
+        limit = self.limit(host)
+
+        if limit is None:
+            yield
+            return
+
+        key, semaphore = self.__semaphore(host, limit)
+
+        if not semaphore.acquire(blocking=False):
+            self.__log.debug('Waiting for a connection slot on database host "%s" (limit %d)', key, limit)
+            semaphore.acquire()
+
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    #########################################################################
+    @contextlib.asynccontextmanager
+    async def acquire_async(self, host):
+        """
+        Hold one connection slot for ``host`` while the ``async with`` block
+        is active. The slots are shared with acquire, so a coroutine waits
+        for one by polling every ASYNC_POLL_INTERVAL seconds instead of
+        blocking the event loop.
+        """
+
+        limit = self.limit(host)
+
+        if limit is None:
+            yield
+            return
+
+        key, semaphore = self.__semaphore(host, limit)
+
+        if not semaphore.acquire(blocking=False):
+            self.__log.debug('Waiting for a connection slot on database host "%s" (limit %d)', key, limit)
+            while not semaphore.acquire(blocking=False):
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+
+        try:
+            yield
+        finally:
+            semaphore.release()
@@ -0,0 +1,234 @@
+"""
+wp_ignore_rules
+
+gitignore-style rules deciding which paths under the WordPress directory
+are left out of a backup.
+
+Rules come, in increasing order of precedence, from the built-in defaults
+(well-known cache, upgrade and backup plugin directories), the site's
+``.wpbackupignore`` file and the command line. The syntax is the one of
+``.gitignore``:
+
+  * blank lines and lines starting with ``#`` are ignored
+  * ``!pattern`` re-includes what an earlier rule excluded
+  * a trailing ``/`` only matches directories
+  * a pattern containing a ``/`` (other than a trailing one) is anchored at
+    the WordPress directory, otherwise it matches at any depth
+  * ``*`` and ``?`` do not match ``/``; ``**`` matches any number of
+    directories
+
+As with git, nothing below an excluded directory can be re-included: the
+directory is pruned from the walk and never read.
+
+Consecutive rules of the same kind are compiled into a single regular
+expression, so matching a path costs one regex match per block of rules
+(one in the common case of a list of excludes).
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import logging
+import os
+import re
+
+IGNORE_FILENAME = '.wpbackupignore'
+
+DEFAULT_EXCLUDES = [
+    # Page, object and asset caches
+    '/wp-content/cache/',
+    '/wp-content/et-cache/',
+    '/wp-content/litespeed/',
+    '/wp-content/uploads/cache/',
+    '/wp-content/uploads/wpo-cache/',
+    # Core / plugin update staging
+    '/wp-content/upgrade/',
+    '/wp-content/upgrade-temp-backup/',
+    # Output of backup plugins
+    '/wp-content/ai1wm-backups/',
+    '/wp-content/backups-dup-lite/',
+    '/wp-content/backups-dup-pro/',
+    '/wp-content/updraft/',
+    '/wp-content/uploads/backwpup-*/',
+    '/wp-content/wpvividbackups/',
+]
+
+#########################################################################
+def translate(pattern):
+    """
+    Translate a gitignore glob (without its leading '!', trailing '/' or
+    anchoring '/') into a regular expression
+    """
+
+    result = []
+    index = 0
+    length = len(pattern)
+
+    while index < length:
+        char = pattern[index]
+
+        if pattern.startswith('**/', index):
+            result.append('(?:.*/)?')
+            index += 3
+            continue
+
+        if pattern.startswith('**', index):
+            result.append('.*')
+            index += 2
+            continue
+
+        if char == '*':
+            result.append('[^/]*')
+        elif char == '?':
+            result.append('[^/]')
+        elif char == '\\' and index + 1 < length:
+            index += 1
+            result.append(re.escape(pattern[index]))
+        elif char == '[':
+            end = pattern.find(']', index + 2 if pattern.startswith('[!', index) or pattern.startswith('[^', index) else index + 1)
+            if end < 0:
+                result.append(re.escape(char))
+            else:
+                body = pattern[index + 1:end]
+                if body[:1] in ('!', '^'):
+                    body = '^' + body[1:]
+                result.append('[' + body.replace('\\', '\\\\') + ']')
+                index = end
+        else:
+            result.append(re.escape(char))
+
+        index += 1
+
+    return ''.join(result)
+
+class WpIgnoreRules:
+    """ WpIgnoreRules """
+
+    #########################################################################
+    def __init__(self, rules=None):
+        """
+        Constructor
+
+        Args:
+            rules (list):   gitignore-style rule lines, lowest precedence first
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.rules = []
+
+        # [(negated, regex for files, regex for directories)], compiled lazily
+        self.__groups = None
+
+        self.extend(rules or [])
+
+    #########################################################################
+    @classmethod
+    def for_site(cls, site_path, excludes=None, includes=None, default_excludes=True):
+        """
+        Build the rules for a site: the defaults, then the site's
+        .wpbackupignore, then ``excludes`` and finally ``includes`` (which
+        re-include paths)
+        """
+
+        rules = cls(DEFAULT_EXCLUDES if default_excludes else [])
+
+        ignore_filename = os.path.join(str(site_path), IGNORE_FILENAME)
+        if os.path.isfile(ignore_filename):
+            logging.getLogger(__name__).info('Reading exclusion rules from "%s"', ignore_filename)
+            with open(ignore_filename, 'r', encoding='utf-8') as stream:
+                rules.extend(stream.read().splitlines())
+
+        rules.extend(excludes or [])
+        rules.extend('!' + pattern.lstrip('!') for pattern in includes or [])
+
+        return rules
+
+    #########################################################################
+    def extend(self, lines):
+        """
+        Append rule lines (taking precedence over the existing ones)
+        """
+
+        for line in lines:
+            line = line.rstrip('\n').rstrip('\r')
+
+            # Trailing spaces are ignored unless escaped, as in git
+            if not line.endswith('\\ '):
+                line = line.rstrip(' ')
+
+            if len(line) == 0 or line.startswith('#'):
+                continue
+
+            self.rules.append(line)
+
+        self.__groups = None
+
+    #########################################################################
+    @staticmethod
+    def __parse(rule):
+        """
+        Parse a rule into (negated, directory only, regex)
+        """
+
+        negated = rule.startswith('!')
+        if negated:
+            rule = rule[1:]
+        elif rule.startswith('\\!') or rule.startswith('\\#'):
+            rule = rule[1:]
+
+        directory_only = rule.endswith('/')
+        rule = rule.rstrip('/')
+
+        if '/' in rule:
+            regex = translate(rule.lstrip('/'))
+        else:
+            regex = '(?:.*/)?' + translate(rule)
+
+        return negated, directory_only, regex
+
+    #########################################################################
+    def __compile(self):
+        groups = []
+
+        for rule in self.rules:
+            negated, directory_only, regex = self.__parse(rule)
+
+            if len(groups) == 0 or groups[-1][0] != negated:
+                groups.append((negated, [], []))
+
+            if not directory_only:
+                groups[-1][1].append(regex)
+            groups[-1][2].append(regex)
+
+        def combine(regexes):
+            if len(regexes) == 0:
+                return None
+            return re.compile('(?:{})\\Z'.format('|'.join('(?:{})'.format(regex) for regex in regexes)), re.DOTALL)
+
+        # Later rules win, so groups are tried from the last one
+        self.__groups = [(negated, combine(files), combine(directories)) for negated, files, directories in reversed(groups)]
+
+    #########################################################################
+    def is_ignored(self, path, is_dir=False):
+        """
+        True when ``path`` (relative to the WordPress directory, '/'
+        separated) is excluded from the backup. Only the path itself is
+        checked: callers prune excluded directories instead of checking
+        every path below them.
+        """
+
+        if self.__groups is None:
+            self.__compile()
+
+        for negated, files_regex, directories_regex in self.__groups:
+            regex = directories_regex if is_dir else files_regex
+
+            if regex is not None and regex.match(path):
+                return not negated
+
+        return False
+
+    #########################################################################
+    def __len__(self):
+        return len(self.rules)
@@ -9,11 +9,19 @@ This class should NOT be called directly
 
 # pylint: disable=line-too-long
 
+import asyncio
+import contextlib
+import io
+import json
 import logging
 import os
+import stat
 import subprocess
 import tarfile
+import threading
+import time
 
+from concurrent.futures import ThreadPoolExecutor
 from enum import Flag, auto
 
 from wpconfigr import WpConfigFile
@@ -23,10 +31,49 @@ from wpbackup2.exceptions import WpDatabaseMysqlFailed
 from wpbackup2.exceptions import WpDatabaseBackupFailed
 
 from wpbackup2.classes.wpsite import WpSite
+from wpbackup2.classes.wp_async_runner import kill_process
+from wpbackup2.classes.wp_async_runner import run_concurrently
+from wpbackup2.classes.wp_async_runner import start_process
+from wpbackup2.classes.wp_async_runner import stop_process
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import WpParallelCompressor
+from wpbackup2.classes.wp_compression import WpStoringReader
+from wpbackup2.classes.wp_compression import is_incompressible
+from wpbackup2.classes.wp_compression import resolve_workers
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
+from wpbackup2.classes.wp_manifest import ARCHIVE_COMMENT_KEY
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import MANIFEST_ARCNAME
+from wpbackup2.classes.wp_manifest import WpHashingReader
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.classes.wp_manifest import new_hasher
+from wpbackup2.classes.wp_manifest import entry_type
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_seekable_archive import INDEX_ARCNAME
+from wpbackup2.classes.wp_seekable_archive import INDEX_VERSION
+from wpbackup2.classes.wp_seekable_archive import SEEKABLE_COMPRESSIONS
+from wpbackup2.classes.wp_seekable_archive import build_trailer
 
 DB_DUMP_ARCNAME = 'database.sql'
 WP_DIR_ARCNAME = 'wp-root'
 
+# The dump is streamed from mysqldump in reads of DB_DUMP_READ_SIZE bytes and
+# written to the archive in segments of at most DB_DUMP_SEGMENT_SIZE bytes
+# (a tar header needs the member size up front, so one segment is the most
+# that is ever held in memory).  A dump that fits in a single segment is
+# stored as DB_DUMP_ARCNAME, larger dumps as DB_DUMP_ARCNAME.000000,
+# DB_DUMP_ARCNAME.000001, ...
+DB_DUMP_READ_SIZE = 1024 * 1024
+DB_DUMP_SEGMENT_SIZE = 16 * 1024 * 1024
+DB_DUMP_SEGMENT_FORMAT = '{}.{:06d}'
+
+# Per-table dumps store the schema (tables and views), the data of each table
+# and the triggers as separate members, segmented in the same way
+DB_SCHEMA_ARCNAME = 'database/schema.sql'
+DB_TRIGGERS_ARCNAME = 'database/triggers.sql'
+DB_TABLE_ARCNAME_FORMAT = 'database/{}.sql'
+DB_LOCK_MARKER = b'wpbackup2-tables-locked'
+
 class WpBackupMode(Flag):
     '''
     Enum for backup methods
@@ -35,6 +82,53 @@ class WpBackupMode(Flag):
     DATABASE = auto()
     ALL = FILES | DATABASE
 
+class _WpDumpSegments:
+    """
+    Cuts a dump into the members it is stored as: segments of at most
+    DB_DUMP_SEGMENT_SIZE bytes, or a single member named ``arcname`` when
+    the dump fits in one
+    """
+
+    #########################################################################
+    def __init__(self, arcname):
+        self.__arcname = arcname
+        self.__buffer = bytearray()
+        self.__segment = 0
+        self.total = 0
+
+    #########################################################################
+    def feed(self, chunk):
+        """ Add a chunk of the dump, returning the (name, data) segments completed """
+
+        self.__buffer += chunk
+        self.total += len(chunk)
+
+        completed = []
+
+        # Only flush once we know more data follows the segment, so a
+        # dump that fits in one segment keeps the plain member name
+        while len(self.__buffer) > DB_DUMP_SEGMENT_SIZE:
+            completed.append((DB_DUMP_SEGMENT_FORMAT.format(self.__arcname, self.__segment), bytes(self.__buffer[:DB_DUMP_SEGMENT_SIZE])))
+            del self.__buffer[:DB_DUMP_SEGMENT_SIZE]
+            self.__segment += 1
+
+        return completed
+
+    #########################################################################
+    def finish(self):
+        """ The (name, data) of the last segment, once the dump ended """
+
+        if self.__segment == 0:
+            return self.__arcname, bytes(self.__buffer)
+
+        return DB_DUMP_SEGMENT_FORMAT.format(self.__arcname, self.__segment), bytes(self.__buffer)
+
+    #########################################################################
+    @property
+    def count(self):
+        """ Number of segments, the last one included """
+        return self.__segment + 1
+
 class WpInternalBackup:
     """ WpInternalBackup """
 
@@ -42,18 +136,34 @@ class WpInternalBackup:
     __wp_config = None
     __temp_path = None
     __what_if = False
+    __compression_workers = 1
+    __host_limiter = None
+    __index = None
+    __compressor = None
+    __core_release = None
+    __hash_algorithm = HASH_ALGORITHM
 
     __log = None
 
     #########################################################################
-    def __init__(self, wp_site, temp_path, what_if=False):
+    def __init__(self, wp_site, temp_path, what_if=False, compression_workers=1, host_limiter=None, compression_executor=None, io_limiter=None, popen=None, cancelled=None, metrics=None):
         self.__log = logging.getLogger(__name__)
 
         self.__what_if = what_if
+        self.__compression_workers = compression_workers
+        self.__host_limiter = host_limiter if host_limiter is not None else WpDbHostLimiter()
+        self.__compression_executor = compression_executor
+        self.__io_limiter = io_limiter if io_limiter is not None else contextlib.nullcontext()
+        # Starts mysqldump and mysql (backup_async starts them on the event
+        # loop instead)
+        self.__popen = popen if popen is not None else subprocess.Popen
+        self.__cancelled = cancelled if cancelled is not None else threading.Event()
 
         if not isinstance(wp_site, WpSite):
             raise TypeError("wp_site must be an instance of WpSite")
 
+        self.__metrics = metrics if metrics is not None else WpMetrics('backup', wp_site.site_path)
+
         self.__wp_site = wp_site
         self.__wp_config = WpConfigFile(self.__wp_site.wp_config_filename)
 
@@ -63,52 +173,336 @@ class WpInternalBackup:
         self.__temp_path = temp_path
 
     #########################################################################
-    def __backup_files(self, archive_filename, include_database_dump=True):
+    def __walk_site(self, ignore_rules=None):
+        """
+        Walk the WordPress directory, yielding (path, relative path, lstat
+        result) for the directory itself and everything below it. Parents
+        are always yielded before their children. Paths excluded by
+        ``ignore_rules`` are skipped, and excluded directories are not
+        entered at all.
+
+        The time spent listing and stat'ing is recorded as the ``walk``
+        phase.
+        """
+
+        root = str(self.__wp_site.site_path)
+
+        yield root, '', os.lstat(root)
+
+        pending = [(root, '')]
+
+        while len(pending) > 0:
+            directory, relative = pending.pop()
+
+            started = time.monotonic()
+
+            with self.__metrics.profile('walk'):
+                with os.scandir(directory) as iterator:
+                    entries = sorted(iterator, key=lambda entry: entry.name)
+
+                selected = []
+                subdirectories = []
+
+                for entry in entries:
+                    entry_relative = entry.name if relative == '' else relative + '/' + entry.name
+                    is_dir = entry.is_dir(follow_symlinks=False)
+
+                    if ignore_rules is not None and ignore_rules.is_ignored(entry_relative, is_dir):
+                        self.__log.debug('Excluding: %s', entry.path)
+                        continue
+
+                    selected.append((entry.path, entry_relative, entry.stat(follow_symlinks=False)))
+
+                    if is_dir:
+                        subdirectories.append((entry.path, entry_relative))
+
+            self.__metrics.add('walk', seconds=time.monotonic() - started, files=len(selected))
+
+            yield from selected
+
+            pending.extend(reversed(subdirectories))
+
+    #########################################################################
+    def fingerprint(self, ignore_rules=None):
+        """
+        Hash of the path, type, mode, size, mtime and inode of everything a
+        file backup with ``ignore_rules`` would hold. It only changes when
+        one of those paths was added, removed or modified.
+        """
+
+        hasher = new_hasher()
+
+        for _, relative, stat_result in self.__walk_site(ignore_rules):
+            hasher.update('{}\0{}\0{}\0{}\0{}\0{}\n'.format(relative, entry_type(stat_result.st_mode), stat_result.st_mode, 0 if stat.S_ISDIR(stat_result.st_mode) else stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino).encode('utf-8', 'surrogateescape'))
+
+        return hasher.hexdigest()
+
+    #########################################################################
+    def __backup_path(self, stream, path, relative, stat_result, manifest, base_manifest=None):
+        """
+        Add one path of the WordPress directory to the archive and the
+        manifest, returning False when it is unchanged since the base
+        manifest and was left out
+        """
+
+        arcname = WP_DIR_ARCNAME if relative == '' else WP_DIR_ARCNAME + '/' + relative
+
+        if base_manifest is not None and not stat.S_ISDIR(stat_result.st_mode) and base_manifest.is_unchanged(relative, stat_result):
+            # Carry the previous hash forward so the manifest stays complete,
+            # unless the base backup hashed the files with another algorithm
+            entry = base_manifest.entries[relative]
+            manifest.entries[relative] = entry if base_manifest.hash_algorithm == manifest.hash_algorithm else entry[:4] + (None,)
+            return False
+
+        if self.__core_release is not None and stat.S_ISREG(stat_result.st_mode):
+            started = time.monotonic()
+
+            with self.__metrics.profile('core'):
+                file_hash = self.__core_release.matching_hash(relative, path, stat_result.st_size)
+
+            self.__metrics.add('core', seconds=time.monotonic() - started, bytes_in=stat_result.st_size if file_hash is not None else 0, files=1 if file_hash is not None else 0)
+
+            # Unmodified core files are restored from the release cache
+            if file_hash is not None:
+                # The checksums of a release are blake2b hashes
+                manifest.add_core(relative, stat_result, file_hash if manifest.hash_algorithm == HASH_ALGORITHM else None)
+                return True
+
+        if self.__what_if:
+            manifest.add(relative, stat_result)
+            return True
+
+        tarinfo = stream.gettarinfo(name=path, arcname=arcname)
+        if tarinfo is None:
+            self.__log.debug('Skipping unsupported file type: %s', path)
+            return True
+
+        file_hash = None
+        if tarinfo.isreg():
+            with open(path, 'rb') as fileobj:
+                store = is_incompressible(relative, tarinfo.size, fileobj)
+
+                fileobj = self.__metrics.reader(fileobj, 'read')
+                self.__metrics.add('read', files=1)
+
+                # Media and archives are stored rather than compressed again
+                if store:
+                    fileobj = WpStoringReader(fileobj, self.__compressor)
+
+                with contextlib.closing(fileobj) if store else contextlib.nullcontext():
+                    if manifest.hash_algorithm is not None:
+                        file_hash = self.__add_member(stream, tarinfo, WpHashingReader(fileobj, new_hasher(manifest.hash_algorithm)))
+                    else:
+                        self.__add_member(stream, tarinfo, fileobj)
+        else:
+            self.__add_member(stream, tarinfo)
+
+        manifest.add(relative, stat_result, file_hash)
+
+        return True
+
+    #########################################################################
+    def __backup_config(self, stream, manifest, base_manifest=None, ignore_rules=None):
+        """
+        Add wp-config.php ahead of the database dump, so a restore reading
+        the archive in a single pass has the database settings before the
+        dump arrives. Returns True when it was handled.
+        """
+
+        relative = os.path.relpath(self.__wp_site.wp_config_filename, self.__wp_site.site_path).replace(os.path.sep, '/')
+
+        if ignore_rules is not None and ignore_rules.is_ignored(relative):
+            return False
+
+        self.__log.info('Adding "%s" ahead of the database dump', relative)
+
+        self.__backup_path(stream, self.__wp_site.wp_config_filename, relative, os.lstat(self.__wp_site.wp_config_filename), manifest, base_manifest)
+
+        return True
+
+    #########################################################################
+    def __backup_files(self, stream, archive_filename, manifest, base_manifest=None, ignore_rules=None, config_added=False):
         """
         Backup Wordpress Files
+
+        Every path is recorded in the manifest. When a base manifest is
+        given only new or changed files are added to the archive, and paths
+        that no longer exist are recorded as deleted. wp-config.php is
+        skipped when ``config_added`` (see __backup_config).
+
+        Yields after every path (see __backup_steps).
         """
 
         self.__log.info("Backing up Wordpress Files stored in '%s' to '%s'", self.__wp_site.site_path, archive_filename)
 
-        self.__log.info('Will build the archive content in: %s', self.__temp_path)
+        self.__log.info('Adding WordPress directory "%s" to archive "%s" with '
+                    'arcname "%s"...',
+                    self.__wp_site.site_path,
+                    archive_filename,
+                    WP_DIR_ARCNAME)
 
-        if not os.path.exists(self.__wp_site.wp_config_filename):
-            raise WpConfigNotFoundError(wp_directory=self.__wp_site.site_path)
+        archive_path = os.path.abspath(archive_filename)
+        config_path = os.path.abspath(self.__wp_site.wp_config_filename)
+        added = 0
+        skipped = 0
+
+        for path, relative, stat_result in self.__walk_site(ignore_rules):
+            if self.__cancelled.is_set():
+                raise InterruptedError("backup of '{}' cancelled".format(self.__wp_site.site_path))
+
+            if os.path.abspath(path) == archive_path:
+                continue
+
+            if config_added and os.path.abspath(path) == config_path:
+                continue
+
+            if self.__backup_path(stream, path, relative, stat_result, manifest, base_manifest):
+                added += 1
+            else:
+                skipped += 1
+
+            yield
+
+        if base_manifest is not None:
+            manifest.deleted = [path for path in base_manifest.entries if path not in manifest.entries]
+
+        self.__log.info('Added %d path(s), skipped %d unchanged file(s), %d path(s) deleted since the previous backup', added, skipped, len(manifest.deleted))
+
+    #########################################################################
+    def __add_manifest(self, stream, manifest):
+        """
+        Add the manifest as the last member of the archive
+        """
+
+        self.__log.info('Adding manifest "%s" for backup %s', MANIFEST_ARCNAME, manifest.backup_id)
 
-        self.__log.info('Creating archive: %s', archive_filename)
         if not self.__what_if:
-            with tarfile.open(archive_filename, 'w:gz') as stream:
+            self.__add_segment(stream, MANIFEST_ARCNAME, manifest.to_json())
 
-                if include_database_dump:
-                    db_dump_filename = os.path.join(self.__temp_path, DB_DUMP_ARCNAME)
+    #########################################################################
+    def __add_segment(self, stream, arcname, data):
+        """
+        Add a single in-memory member (a database dump segment or the
+        manifest) to the archive
+        """
 
-                    self.__log.info('Adding database dump "%s" to archive "%s" with arcname '
-                                '"%s"...',
-                                db_dump_filename,
-                                archive_filename,
-                                DB_DUMP_ARCNAME)
-                    stream.add(db_dump_filename, arcname=DB_DUMP_ARCNAME)
+        self.__log.debug('Adding in-memory member "%s" (%d bytes)', arcname, len(data))
 
-                self.__log.info('Adding WordPress directory "%s" to archive "%s" with '
-                            'arcname "%s"...',
-                            self.__wp_site.site_path,
-                            archive_filename,
-                            WP_DIR_ARCNAME)
-                stream.add(self.__wp_site.site_path, arcname=WP_DIR_ARCNAME)
+        tarinfo = tarfile.TarInfo(arcname)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        tarinfo.mode = 0o600
 
-        self.__log.info('Completed archive creation process...')
+        if self.__index is not None:
+            self.__add_member(stream, tarinfo, WpHashingReader(io.BytesIO(data), new_hasher(self.__hash_algorithm)))
+        else:
+            stream.addfile(tarinfo, io.BytesIO(data))
 
     #########################################################################
-    def __backup_database(self):
+    def __add_member(self, stream, tarinfo, fileobj=None):
         """
-        Backup Wordpress Database
+        Add a member to the archive, recording it in the index of seekable
+        archives. Returns the content hash when ``fileobj`` is a
+        WpHashingReader.
         """
 
-        self.__log.info("Backing up Wordpress Database from '%s'", self.__wp_site.db_host)
+        header_offset = stream.offset
+
+        stream.addfile(tarinfo, fileobj)
+
+        checksum = fileobj.hexdigest() if isinstance(fileobj, WpHashingReader) else None
+
+        if self.__index is not None:
+            # The data ends where the next header starts, padded to a block
+            data_offset = stream.offset - (-(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE if tarinfo.isreg() else 0)
+            self.__index.append([tarinfo.name, header_offset, data_offset, tarinfo.size if tarinfo.isreg() else 0, checksum])
+
+        return checksum
+
+    #########################################################################
+    def __add_index(self, stream, compressor):
+        """
+        Add the index of a seekable archive in frames of its own, returning
+        its compressed offset and the uncompressed offset of its header
+        """
 
-        self.__log.info("Saving database to temp sql file for backup..")
+        index_offset = compressor.flush_frame()
+        index_header_offset = stream.offset
 
-        db_dump_filename = os.path.join(self.__temp_path, DB_DUMP_ARCNAME)
+        self.__log.info('Adding index "%s" (%d member(s), %d frame(s))', INDEX_ARCNAME, len(self.__index), len(compressor.frames))
+
+        data = json.dumps({
+            'version': INDEX_VERSION,
+            'hash_algorithm': self.__hash_algorithm,
+            'frames': compressor.frames,
+            'members': self.__index
+        }, separators=(',', ':')).encode('utf-8')
+
+        tarinfo = tarfile.TarInfo(INDEX_ARCNAME)
+        tarinfo.size = len(data)
+        tarinfo.mtime = int(time.time())
+        tarinfo.mode = 0o600
+
+        stream.addfile(tarinfo, io.BytesIO(data))
+
+        return index_offset, index_header_offset
+
+    #########################################################################
+    def __iter_database_dump(self, args, arcname=DB_DUMP_ARCNAME):
+        """
+        Run mysqldump and yield its output in chunks of DB_DUMP_READ_SIZE bytes
+        """
+
+        try:
+            process = self.__popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as error:
+            raise self.__program_not_found('mysqldump', error) from error
+
+        # stderr is drained on its own thread so a chatty mysqldump can never
+        # block on a full stderr pipe while we are reading stdout
+        stderr_chunks = []
+        stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+        stderr_thread.start()
+
+        try:
+            while True:
+                started = time.monotonic()
+                chunk = process.stdout.read(DB_DUMP_READ_SIZE)
+                self.__metrics.add('mysqldump', seconds=time.monotonic() - started, bytes_in=len(chunk))
+                if not chunk:
+                    break
+                yield chunk
+        except GeneratorExit:
+            process.kill()
+            raise
+        finally:
+            process.stdout.close()
+            returncode = process.wait()
+            stderr_thread.join()
+            process.stderr.close()
+
+        if returncode != 0:
+            stderr = b''.join(stderr_chunks)
+            self.__log.fatal('Database backup failed.\n\nmysqldump stderr:\n%s', stderr)
+            raise WpDatabaseBackupFailed(fileName=arcname, stdOut=None, stdError=stderr)
+
+    #########################################################################
+    def __program_not_found(self, program, error):
+        """
+        Log that ``program`` (mysqldump or mysql) could not be started,
+        returning the error to raise
+        """
+
+        self.__log.exception(error)
+        self.__log.fatal('%s was not found. Please install it and try again.', program)
+
+        return WpDatabaseMysqlFailed(message="{} was not found".format(program), stdOut=None, stdError=None)
+
+    #########################################################################
+    def __mysqldump_args(self):
+        """
+        Build the mysqldump command line from wp-config.php
+        """
 
         args = [
             'mysqldump',
@@ -124,36 +518,733 @@ class WpInternalBackup:
 
         self.__log.debug("CMD: %s", args)
 
+        return args
+    #########################################################################
+    def __dump_database(self, stream, dump_workers):
+        """
+        Backup Wordpress Database, as a whole or per table (see
+        __backup_database and __backup_database_tables)
+        """
+
+        if dump_workers is not None and dump_workers != 1:
+            self.__backup_database_tables(stream, resolve_workers(dump_workers))
+        else:
+            self.__backup_database(stream)
+
+    #########################################################################
+    async def __dump_database_async(self, runner, stream, dump_workers):
+        """
+        Backup Wordpress Database like __dump_database, reading the output
+        of mysqldump on the event loop
+        """
+
+        if dump_workers is not None and dump_workers != 1:
+            await self.__backup_database_tables_async(runner, stream, resolve_workers(dump_workers))
+        else:
+            await self.__backup_database_async(runner, stream)
+
+    #########################################################################
+    def __backup_database(self, stream):
+        """
+        Backup Wordpress Database
+
+        The output of mysqldump is streamed straight into the archive in
+        bounded segments, so memory use does not depend on the database size
+        and nothing is staged in the temp path.
+        """
+
+        self.__log.info("Backing up Wordpress Database from '%s'", self.__wp_site.db_host)
+
+        args = self.__mysqldump_args()
+
+        if self.__what_if:
+            return
+
+        self.__log.info('Streaming database dump into archive as "%s"...', DB_DUMP_ARCNAME)
+
+        with self.__host_limiter.acquire(self.__wp_config.get('DB_HOST')):
+            total, segments = self.__add_dump(stream, DB_DUMP_ARCNAME, self.__iter_database_dump(args), cancelled=self.__cancelled)
+
+        self.__log.info('Database dump complete (%d bytes in %d segment(s)).', total, segments)
+
+    #########################################################################
+    async def __backup_database_async(self, runner, stream):
+        """
+        Backup Wordpress Database like __backup_database, on the event loop
+        """
+
+        self.__log.info("Backing up Wordpress Database from '%s'", self.__wp_site.db_host)
+
+        args = self.__mysqldump_args()
+
+        if self.__what_if:
+            return
+
+        self.__log.info('Streaming database dump into archive as "%s"...', DB_DUMP_ARCNAME)
+
+        async with self.__host_limiter.acquire_async(self.__wp_config.get('DB_HOST')):
+            total, segments = await self.__add_dump_async(runner, stream, DB_DUMP_ARCNAME, args, asyncio.Lock())
+
+        self.__log.info('Database dump complete (%d bytes in %d segment(s)).', total, segments)
+
+    #########################################################################
+    def __add_dump(self, stream, arcname, chunks, archive_lock=None, cancelled=None):
+        """
+        Add a dump to the archive as ``arcname`` (or segments of it),
+        returning (bytes, segments). With ``archive_lock`` several dumps can
+        be added from different threads: each segment is written while
+        holding the lock. Setting ``cancelled`` stops the dump.
+        """
+
+        def add_segment(name, data):
+            if archive_lock is None:
+                self.__add_segment(stream, name, data)
+            else:
+                with archive_lock:
+                    self.__add_segment(stream, name, data)
+
+        segments = _WpDumpSegments(arcname)
+
+        for chunk in chunks:
+            if cancelled is not None and cancelled.is_set():
+                chunks.close()
+                raise InterruptedError("dump of '{}' cancelled".format(arcname))
+
+            for name, data in segments.feed(chunk):
+                add_segment(name, data)
+
+        add_segment(*segments.finish())
+
+        return segments.total, segments.count
+
+    #########################################################################
+    async def __add_dump_async(self, runner, stream, arcname, args, archive_lock):
+        """
+        Run mysqldump on the event loop and add its output to the archive
+        like __add_dump, returning (bytes, segments). Each segment is
+        written on the executor of ``runner`` while holding ``archive_lock``
+        (an asyncio.Lock shared by the dumps written to the same archive).
+        """
+
         try:
-            if not self.__what_if:
-                completed = subprocess.run(args, capture_output=True) # pylint: disable=subprocess-run-check
+            process = await start_process(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as error:
+            raise self.__program_not_found('mysqldump', error) from error
+
+        # stderr is drained concurrently so a chatty mysqldump can never
+        # block on a full stderr pipe while we are reading stdout
+        errors = asyncio.ensure_future(process.stderr.read())
+        segments = _WpDumpSegments(arcname)
+
+        try:
+            while True:
+                started = time.monotonic()
+                chunk = await process.stdout.read(DB_DUMP_READ_SIZE)
+                self.__metrics.add('mysqldump', seconds=time.monotonic() - started, bytes_in=len(chunk))
+                if not chunk:
+                    break
+
+                for name, data in segments.feed(chunk):
+                    async with archive_lock:
+                        await runner.call(self.__add_segment, stream, name, data)
+
+            returncode = await process.wait()
+            stderr = await errors
+        except BaseException:
+            errors.cancel()
+            await stop_process(process)
+            raise
+
+        if returncode != 0:
+            self.__log.fatal('Database backup failed.\n\nmysqldump stderr:\n%s', stderr)
+            raise WpDatabaseBackupFailed(fileName=arcname, stdOut=None, stdError=stderr)
+
+        async with archive_lock:
+            await runner.call(self.__add_segment, stream, *segments.finish())
+
+        return segments.total, segments.count
+
+    #########################################################################
+    def __mysql_connection_args(self):
+        """
+        Connection options shared by mysql and mysqldump
+        """
+
+        return [
+            '-h',
+            self.__wp_config.get('DB_HOST'),
+            '-u',
+            self.__wp_config.get('DB_USER'),
+            '-p' + self.__wp_config.get('DB_PASSWORD')
+        ]
+
+    #########################################################################
+    def __list_tables_args(self):
+        """
+        mysql command line listing the base tables (not views) of the
+        WordPress database
+        """
+
+        return ['mysql', '--batch', '--skip-column-names'] + self.__mysql_connection_args() + [
+            self.__wp_config.get('DB_NAME'),
+            '--execute',
+            "SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'"
+        ]
+
+    #########################################################################
+    def __listed_tables(self, returncode, stdout, stderr):
+        """
+        Names of the tables in the output of the __list_tables_args command
+        """
+
+        if returncode != 0:
+            self.__log.fatal('Listing the database tables failed.\n\nmysql stderr:\n%s', stderr)
+            raise WpDatabaseBackupFailed(fileName=DB_SCHEMA_ARCNAME, stdOut=stdout, stdError=stderr)
+
+        return [line.split('\t')[0] for line in stdout.decode('utf-8').splitlines() if len(line) > 0]
+
+    #########################################################################
+    def __list_tables(self):
+        """
+        Names of the base tables (not views) of the WordPress database
+        """
+
+        try:
+            process = self.__popen(self.__list_tables_args(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as error:
+            raise self.__program_not_found('mysql', error) from error
+
+        stdout, stderr = process.communicate()
+
+        return self.__listed_tables(process.returncode, stdout, stderr)
+
+    #########################################################################
+    async def __list_tables_async(self):
+        """
+        Names of the base tables (not views) of the WordPress database,
+        listed on the event loop
+        """
+
+        try:
+            process = await start_process(self.__list_tables_args(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as error:
+            raise self.__program_not_found('mysql', error) from error
+
+        try:
+            stdout, stderr = await process.communicate()
+        except BaseException:
+            await stop_process(process)
+            raise
+
+        return self.__listed_tables(process.returncode, stdout, stderr)
+
+    #########################################################################
+    @staticmethod
+    def __quote_identifier(name):
+        return '`{}`'.format(name.replace('`', '``'))
+
+    #########################################################################
+    def __lock_tables_args(self, tables):
+        """
+        mysql command line of the session locking ``tables``, and the
+        statement taking the lock
+        """
+
+        args = ['mysql', '--unbuffered', '--batch', '--skip-column-names'] + self.__mysql_connection_args() + [self.__wp_config.get('DB_NAME')]
+
+        statement = 'LOCK TABLES {}; SELECT \'{}\';\n'.format(', '.join(self.__quote_identifier(table) + ' READ' for table in tables),
+                                                           DB_LOCK_MARKER.decode('ascii'))
+
+        return args, statement.encode('utf-8')
+
+    #########################################################################
+    def __lock_failed(self, line, stderr):
+        self.__log.fatal('Locking the database tables failed.\n\nmysql stderr:\n%s', stderr)
+
+        return WpDatabaseBackupFailed(fileName=DB_SCHEMA_ARCNAME, stdOut=line, stdError=stderr)
+
+    #########################################################################
+    def __lock_tables(self, tables):
+        """
+        Open a mysql session holding a read lock on ``tables``, so dumps
+        taken over other connections see one consistent state. Writers are
+        blocked until __unlock_tables is called; readers are not.
+        """
+
+        args, statement = self.__lock_tables_args(tables)
+
+        self.__log.info('Locking %d table(s) for a consistent dump...', len(tables))
+
+        try:
+            process = self.__popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        except FileNotFoundError as error:
+            raise self.__program_not_found('mysql', error) from error
+
+        try:
+            process.stdin.write(statement)
+            process.stdin.flush()
+            line = process.stdout.readline()
+        except BrokenPipeError:
+            line = b''
+
+        if line.strip() != DB_LOCK_MARKER:
+            process.kill()
+            _, stderr = process.communicate()
+            raise self.__lock_failed(line, stderr)
+
+        return process
+
+    #########################################################################
+    async def __lock_tables_async(self, tables):
+        """
+        Open the session of __lock_tables on the event loop
+        """
 
-                if completed.returncode != 0:
-                    self.__log.fatal('Database backup failed.\n\nmysqldump stdout:\n%s\n\nmysql '
-                                    'stderr:\n%s',
-                                    completed.stdout,
-                                    completed.stderr)
-                    raise WpDatabaseBackupFailed(fileName=db_dump_filename, stdOut=completed.stdout, stdError=completed.stderr)
+        args, statement = self.__lock_tables_args(tables)
 
-                with open(db_dump_filename, 'wb') as stream:
-                    stream.write(completed.stdout)
+        self.__log.info('Locking %d table(s) for a consistent dump...', len(tables))
+
+        try:
+            process = await start_process(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         except FileNotFoundError as error:
-            self.__log.exception(error)
-            self.__log.fatal('mysqldump was not found. Please install it and try again.')
-            raise WpDatabaseMysqlFailed(message="mysqldump was not found", stdOut=None, stdError=None) from error
+            raise self.__program_not_found('mysql', error) from error
+
+        try:
+            try:
+                process.stdin.write(statement)
+                await process.stdin.drain()
+                line = await process.stdout.readline()
+            except (BrokenPipeError, ConnectionResetError):
+                line = b''
+
+            if line.strip() != DB_LOCK_MARKER:
+                kill_process(process)
+                _, stderr = await process.communicate()
+                raise self.__lock_failed(line, stderr)
+        except BaseException:
+            await stop_process(process)
+            raise
+
+        return process
+
+    #########################################################################
+    def __unlock_tables(self, process):
+        """
+        Release the locks taken by __lock_tables and end the session
+        """
+
+        self.__log.info('Unlocking tables.')
+
+        try:
+            process.communicate(input=b'UNLOCK TABLES;\n', timeout=60)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+
+    #########################################################################
+    async def __unlock_tables_async(self, process):
+        """
+        Release the locks taken by __lock_tables_async and end the session
+        """
+
+        self.__log.info('Unlocking tables.')
+
+        try:
+            await asyncio.wait_for(process.communicate(input=b'UNLOCK TABLES;\n'), 60)
+        except asyncio.TimeoutError:
+            await stop_process(process)
+        except BaseException:
+            await stop_process(process)
+            raise
+
+    #########################################################################
+    def __dump_table(self, stream, db_host, arcname, args, archive_lock, cancelled):
+        """
+        Dump one table (or the schema) into the archive, holding a connection
+        slot for the database host
+        """
+
+        with self.__host_limiter.acquire(db_host), self.__metrics.profile('database'):
+            if cancelled.is_set():
+                return
+
+            started = time.monotonic()
+            total, segments = self.__add_dump(stream, arcname, self.__iter_database_dump(args, arcname), archive_lock, cancelled)
+
+        self.__log.info('Dumped "%s": %d bytes in %d segment(s) in %.1fs', arcname, total, segments, time.monotonic() - started)
+
+    #########################################################################
+    async def __dump_table_async(self, runner, stream, db_host, arcname, args, archive_lock):
+        """
+        Dump one table (or the schema) into the archive like __dump_table,
+        on the event loop
+        """
+
+        async with self.__host_limiter.acquire_async(db_host):
+            started = time.monotonic()
+            total, segments = await self.__add_dump_async(runner, stream, arcname, args, archive_lock)
+
+        self.__log.info('Dumped "%s": %d bytes in %d segment(s) in %.1fs', arcname, total, segments, time.monotonic() - started)
+
+    #########################################################################
+    def __table_dumps(self, tables):
+        """
+        (arcname, mysqldump command line) of the schema, the triggers and
+        every table of a per-table dump
+        """
+
+        dumps = [(DB_SCHEMA_ARCNAME, ['mysqldump', '--no-data', '--skip-triggers', '--skip-lock-tables', '--add-drop-table'] + self.__mysql_connection_args() + [self.__wp_config.get('DB_NAME')]),
+                 (DB_TRIGGERS_ARCNAME, ['mysqldump', '--no-data', '--no-create-info', '--triggers', '--skip-lock-tables'] + self.__mysql_connection_args() + [self.__wp_config.get('DB_NAME')])]
+
+        # Biggest tables are not known up front; dumping in listing order
+        # keeps the archive layout stable between backups
+        for table in tables:
+            dumps.append((DB_TABLE_ARCNAME_FORMAT.format(table),
+                          ['mysqldump', '--no-create-info', '--skip-triggers', '--skip-lock-tables'] + self.__mysql_connection_args() + [self.__wp_config.get('DB_NAME'), table]))
+
+        return dumps
+
+    #########################################################################
+    def __has_reserved_table(self, tables):
+        """
+        True when a table is named like the schema or triggers entry, and
+        the database has to be dumped as a whole instead
+        """
+
+        if any(DB_TABLE_ARCNAME_FORMAT.format(table) in (DB_SCHEMA_ARCNAME, DB_TRIGGERS_ARCNAME) for table in tables):
+            self.__log.warning('A table is named like the schema or triggers entry, dumping the database as a whole instead.')
+            return True
+
+        return False
+
+    #########################################################################
+    def __backup_database_tables(self, stream, dump_workers):
+        """
+        Backup Wordpress Database, one table at a time
 
-        self.__log.info('Saving database dump to "%s"...', db_dump_filename)
+        The schema, the triggers and every table are dumped by separate mysqldump processes
+        running concurrently (at most ``dump_workers``, and no more than the
+        limit configured for the database host), while a separate session
+        holds a read lock on all tables so the dumps form one consistent
+        snapshot. Each dump is stored as its own archive member.
+        """
+
+        db_host = self.__wp_config.get('DB_HOST')
+
+        self.__log.info("Backing up Wordpress Database from '%s' per table", self.__wp_site.db_host)
+
+        if self.__what_if:
+            return
+
+        tables = self.__list_tables()
+
+        if self.__has_reserved_table(tables):
+            self.__backup_database(stream)
+            return
+
+        workers = self.__host_limiter.workers(db_host, dump_workers)
+
+        self.__log.info('Dumping schema and %d table(s) with %d worker(s)...', len(tables), workers)
+
+        dumps = self.__table_dumps(tables)
+        archive_lock = threading.Lock()
+        cancelled = self.__cancelled
+
+        locker = self.__lock_tables(tables) if len(tables) > 0 else None
+
+        try:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='wpbackup2-dump') as executor:
+                futures = [executor.submit(self.__dump_table, stream, db_host, arcname, args, archive_lock, cancelled) for arcname, args in dumps]
+
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    cancelled.set()
+                    raise
+        finally:
+            if locker is not None:
+                self.__unlock_tables(locker)
 
         self.__log.info('Database dump complete.')
 
     #########################################################################
-    def backup(self, archive_filename, backup_mode = WpBackupMode.ALL):
+    async def __backup_database_tables_async(self, runner, stream, dump_workers):
+        """
+        Backup Wordpress Database one table at a time like
+        __backup_database_tables, with the mysqldump processes read
+        concurrently on the event loop instead of by a thread each
+        """
+
+        db_host = self.__wp_config.get('DB_HOST')
+
+        self.__log.info("Backing up Wordpress Database from '%s' per table", self.__wp_site.db_host)
+
+        if self.__what_if:
+            return
+
+        tables = await self.__list_tables_async()
+
+        if self.__has_reserved_table(tables):
+            await self.__backup_database_async(runner, stream)
+            return
+
+        workers = self.__host_limiter.workers(db_host, dump_workers)
+
+        self.__log.info('Dumping schema and %d table(s) with %d worker(s)...', len(tables), workers)
+
+        archive_lock = asyncio.Lock()
+
+        locker = await self.__lock_tables_async(tables) if len(tables) > 0 else None
+
+        try:
+            await run_concurrently([self.__dump_table_async(runner, stream, db_host, arcname, args, archive_lock) for arcname, args in self.__table_dumps(tables)], workers)
+        finally:
+            if locker is not None:
+                await self.__unlock_tables_async(locker)
+
+        self.__log.info('Database dump complete.')
+
+    #########################################################################
+    @staticmethod
+    def __close_archive(stream, compressor, compression=None, index_location=None):
+        """
+        Close the tar stream and the compressor underneath it (tarfile does
+        not close file objects it was handed). For seekable archives the
+        trailer locating the index is appended after the tar end blocks.
+        """
+
+        try:
+            stream.close()
+
+            if index_location is not None:
+                index_offset, index_header_offset = index_location
+                index_length = compressor.flush_frame() - index_offset
+                compressor.write_raw(build_trailer(compression, index_offset, index_length, index_header_offset))
+        finally:
+            compressor.close()
+
+    #########################################################################
+    def backup(self, archive_filename, backup_mode = WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, base_archive=None, hash_files=True, seekable=False, ignore_rules=None, dump_workers=1, core_cache=None, hash_algorithm=HASH_ALGORITHM):
         """
         Executes the backup process using the specified archive file
+
+        When ``base_archive`` is given the file backup is incremental: only
+        files that are new or changed since that backup are archived.
+
+        A ``seekable`` archive carries an index of its members and frames, so
+        members can be listed and extracted without reading the whole
+        archive. Its members are always hashed.
+
+        With ``hash_files`` every file is hashed with ``hash_algorithm``
+        while it is read into the archive, and its hash recorded in the
+        manifest.
+
+        Paths excluded by ``ignore_rules`` (a WpIgnoreRules) are left out.
+
+        With ``dump_workers`` other than 1 the database is dumped per table,
+        ``dump_workers`` tables at a time (0 = one per CPU core).
+
+        With a ``core_cache`` (a WpCoreCache) holding the WordPress release
+        of the site, unmodified core files are only referenced in the
+        manifest.
+        """
+
+        steps = self.__backup_steps(archive_filename, backup_mode, compression, compression_level, base_archive, hash_files, seekable, ignore_rules, dump_workers, core_cache, hash_algorithm)
+
+        # The database is dumped on this thread where the steps ask for it
+        with contextlib.closing(steps):
+            for request in steps:
+                if request is not None:
+                    self.__dump_database(*request)
+
+    #########################################################################
+    async def backup_async(self, runner, archive_filename, backup_mode = WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, base_archive=None, hash_files=True, seekable=False, ignore_rules=None, dump_workers=1, core_cache=None, hash_algorithm=HASH_ALGORITHM):
+        """
+        Executes the backup process like backup, on the running event loop:
+        the output of mysqldump is read by the loop, and the archive is
+        written in steps on the executor of ``runner`` (a WpAsyncRunner)
+        """
+
+        await runner.drive(self.__backup_steps(archive_filename, backup_mode, compression, compression_level, base_archive, hash_files, seekable, ignore_rules, dump_workers, core_cache, hash_algorithm),
+                           lambda request: self.__dump_database_async(runner, *request))
+
+    #########################################################################
+    def __backup_steps(self, archive_filename, backup_mode, compression, compression_level, base_archive, hash_files, seekable, ignore_rules, dump_workers, core_cache, hash_algorithm):
         """
+        The backup (see backup) as a generator yielding between its steps.
+        It yields (stream, dump_workers) where the database is to be dumped
+        into the archive.
+        """
+
+        if not os.path.exists(self.__wp_site.wp_config_filename):
+            raise WpConfigNotFoundError(wp_directory=self.__wp_site.site_path)
+
+        if seekable and compression not in SEEKABLE_COMPRESSIONS:
+            raise ValueError("seekable archives are not supported with {} compression".format(compression.value))
+
+        hash_files = hash_files or seekable
+
+        # Fails before anything is written when xxhash is not installed
+        new_hasher(hash_algorithm)
+        self.__hash_algorithm = hash_algorithm
+
+        base_manifest = None
+        if base_archive is not None and WpBackupMode.FILES in backup_mode:
+            base_manifest = WpManifest.from_archive(base_archive)
+            if base_manifest is None:
+                raise ValueError("base archive '{}' has no manifest and cannot be used for an incremental backup".format(base_archive))
+
+            self.__log.info('Incremental backup based on backup %s from "%s"', base_manifest.backup_id, base_archive)
+
+        manifest = WpManifest(parent_id=base_manifest.backup_id if base_manifest is not None else None,
+                              hash_algorithm=hash_algorithm if hash_files else None)
+
+        self.__core_release = None
+        if core_cache is not None and WpBackupMode.FILES in backup_mode:
+            self.__core_release = core_cache.release_for_site(self.__wp_site.site_path)
+            if self.__core_release is not None:
+                self.__log.info('Leaving out the unmodified core files of WordPress %s', self.__core_release.version)
+                manifest.core_version = self.__core_release.version
+
+        self.__log.info('Creating archive: %s', archive_filename)
+
+        stream = None
+        compressor = None
+        index_location = None
+        self.__index = [] if seekable and not self.__what_if else None
+
+        if not self.__what_if:
+            compressor = WpParallelCompressor(archive_filename,
+                                              workers=self.__compression_workers,
+                                              level=compression_level,
+                                              compression=compression,
+                                              record_frames=seekable,
+                                              executor=self.__compression_executor,
+                                              metrics=self.__metrics)
+            # The ids in the global header let a restore check an incremental
+            # chain before it reads (or writes) anything else
+            stream = tarfile.open(fileobj=compressor, mode='w', format=tarfile.PAX_FORMAT, pax_headers={ARCHIVE_COMMENT_KEY: manifest.archive_comment()}) # pylint: disable=consider-using-with
+            self.__compressor = compressor
+
+        try:
+            config_added = False
+            if WpBackupMode.FILES in backup_mode:
+                with self.__metrics.phase('config'):
+                    config_added = self.__backup_config(stream, manifest, base_manifest, ignore_rules)
+
+            if WpBackupMode.DATABASE in backup_mode:
+                with self.__metrics.phase('database'):
+                    yield stream, dump_workers
+
+            if WpBackupMode.FILES in backup_mode:
+                # Reading the site is what loads the disk, so this is the
+                # part limited by ``io_limiter``
+                with self.__io_limiter, self.__metrics.phase('files'):
+                    yield from self.__backup_files(stream, archive_filename, manifest, base_manifest, ignore_rules, config_added)
+
+            with self.__metrics.phase('finish'):
+                self.__add_manifest(stream, manifest)
+
+                if self.__index is not None:
+                    index_location = self.__add_index(stream, compressor)
+        except BaseException:
+            self.__index = None
+            self.__compressor = None
+            self.__core_release = None
+            if stream is not None:
+                self.__close_archive(stream, compressor)
+                self.__log.info('Removing incomplete archive: %s', archive_filename)
+                os.remove(archive_filename)
+            raise
+
+        self.__index = None
+        self.__compressor = None
+        self.__core_release = None
+
+        if len(manifest.core_files) > 0:
+            self.__log.info('Referenced %d unmodified core file(s) of WordPress %s', len(manifest.core_files), manifest.core_version)
+
+        if stream is not None:
+            with self.__metrics.phase('finish'):
+                self.__close_archive(stream, compressor, compression, index_location)
+
+            self.__metrics.archive_bytes = os.path.getsize(archive_filename)
+
+        self.__log.info('Completed archive creation process...')
+
+    #########################################################################
+    def backup_to_repository(self, repository, backup_mode=WpBackupMode.ALL, ignore_rules=None):
+        """
+        Executes the backup process into a deduplicating repository, returning
+        the id of the new snapshot
+
+        Files that are unchanged (size, mtime and inode) since the previous
+        snapshot of this site reuse its chunk list without being read again.
+        Paths excluded by ``ignore_rules`` are left out.
+        """
+
+        if not os.path.exists(self.__wp_site.wp_config_filename):
+            raise WpConfigNotFoundError(wp_directory=self.__wp_site.site_path)
+
+        self.__log.info('Backing up to repository: %s', repository.path)
+
+        previous = repository.latest_snapshot(self.__wp_site.site_path)
+        previous_files = {}
+        if previous is not None:
+            self.__log.info('Previous snapshot of this site: %s', previous['id'])
+            previous_files = {entry['path']: entry for entry in previous['files']}
+
+        snapshot = {
+            'site_path': str(self.__wp_site.site_path),
+            'files': [],
+            'database': None
+        }
+
+        if WpBackupMode.DATABASE in backup_mode:
+            self.__log.info("Backing up Wordpress Database from '%s'", self.__wp_site.db_host)
+            args = self.__mysqldump_args()
+            if not self.__what_if:
+                snapshot['database'] = repository.store_stream(self.__iter_database_dump(args))
+
+        if WpBackupMode.FILES in backup_mode:
+            self.__log.info("Backing up Wordpress Files stored in '%s'", self.__wp_site.site_path)
+
+            repository_path = os.path.abspath(repository.path) + os.path.sep
+
+            for path, relative, stat_result in self.__walk_site(ignore_rules):
+                if (os.path.abspath(path) + os.path.sep).startswith(repository_path):
+                    continue
+
+                entry = {
+                    'path': relative,
+                    'mode': stat_result.st_mode,
+                    'uid': stat_result.st_uid,
+                    'gid': stat_result.st_gid,
+                    'mtime_ns': stat_result.st_mtime_ns,
+                    'size': stat_result.st_size,
+                    'inode': stat_result.st_ino
+                }
+
+                if stat.S_ISLNK(stat_result.st_mode):
+                    entry['linkname'] = os.readlink(path)
+                elif stat.S_ISREG(stat_result.st_mode):
+                    unchanged = previous_files.get(relative)
+                    if unchanged is not None and all(unchanged.get(key) == entry[key] for key in ('mode', 'mtime_ns', 'size', 'inode')):
+                        entry['chunks'] = unchanged['chunks']
+                    elif not self.__what_if:
+                        entry['chunks'] = repository.store_file(path)
+                elif not stat.S_ISDIR(stat_result.st_mode):
+                    self.__log.debug('Skipping unsupported file type: %s', path)
+                    continue
+
+                snapshot['files'].append(entry)
+
+        if self.__what_if:
+            return None
+
+        snapshot_id = repository.save_snapshot(snapshot)
 
-        if WpBackupMode.ALL in backup_mode or WpBackupMode.DATABASE in backup_mode:
-            self.__backup_database()
+        self.__log.info('Repository backup complete: snapshot %s, %d new bytes read', snapshot_id, repository.new_bytes)
 
-        if WpBackupMode.ALL in backup_mode or WpBackupMode.FILES in backup_mode:
-            self.__backup_files(archive_filename, True if WpBackupMode.DATABASE in backup_mode else False)
+        return snapshot_id
@@ -9,10 +9,15 @@ This class should NOT be called directly
 
 # pylint: disable=line-too-long
 
+import contextlib
 import logging
 import os
-import subprocess
+import stat
+import sys
 import tarfile
+import tempfile
+import threading
+import time
 import shutil
 
 from enum import Flag, auto
@@ -20,13 +25,45 @@ from enum import Flag, auto
 import wpdatabase2
 from wpconfigr import WpConfigFile
 
+from wpbackup2.exceptions import WpBackupChainInvalidError
+from wpbackup2.exceptions import WpCoreReleaseNotFoundError
 from wpbackup2.exceptions import WpDatabaseMysqlFailed
 from wpbackup2.exceptions import WpDatabaseRestoreFailed
 
 from wpbackup2.classes.wpsite import WpSite
+from wpbackup2.classes.wp_compression import open_archive_reader
+from wpbackup2.classes.wp_compression import stream_members
+from wpbackup2.classes.wp_core_cache import hash_file
+from wpbackup2.classes.wp_database_loader import WpAsyncDatabaseLoader
+from wpbackup2.classes.wp_database_loader import WpDatabaseLoader
+from wpbackup2.classes.wp_database_loader import file_source
+from wpbackup2.classes.wp_file_writer import WpFileWriterPool
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_manifest import MANIFEST_ARCNAME
+from wpbackup2.classes.wp_manifest import WpManifest
+from wpbackup2.classes.wp_manifest import hash_available
+from wpbackup2.classes.wp_manifest import read_archive_comment
+from wpbackup2.classes.wp_manifest import read_archive_core_version
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_path_filter import WpPathFilter
+from wpbackup2.classes.wp_seekable_archive import WpSeekableArchive
+from wpbackup2.classes.wp_seekable_archive import is_seekable
+from wpbackup2.classes.wp_seekable_archive import iter_members
 
 DB_DUMP_ARCNAME = 'database.sql'
 WP_DIR_ARCNAME = 'wp-root'
+WP_CONFIG_PATH = 'wp-config.php'
+
+# Archive name reading the archive from stdin
+STDIN_ARCHIVE = '-'
+
+DB_DUMP_SEGMENT_PREFIX = DB_DUMP_ARCNAME + '.'
+DB_DUMP_DIRECTORY_PREFIX = 'database/'
+DB_SCHEMA_ARCNAME = 'database/schema.sql'
+DB_TRIGGERS_ARCNAME = 'database/triggers.sql'
+
+DB_DUMP_READ_SIZE = 1024 * 1024
 
 class WpRestoreMode(Flag):
     '''
@@ -36,6 +73,10 @@ class WpRestoreMode(Flag):
     DATABASE = auto()
     REMOVEFILESBEFORERESTORE = auto()
     DELETEDATABASEBEFORERESTORE = auto()
+    # Only write the files that differ from those on disk; combined with
+    # REMOVEFILESBEFORERESTORE the files the backup does not hold are
+    # removed afterwards instead of everything being removed first
+    SYNCFILES = auto()
     ALLOVERWRITE = FILES | DATABASE
     ALLCLEAN = FILES | DATABASE | REMOVEFILESBEFORERESTORE | DELETEDATABASEBEFORERESTORE
 
@@ -45,19 +86,42 @@ class WpInternalRestore:
     __wp_site = None
     __temp_path = None
     __what_if = False
+    __host_limiter = None
+
+    # Loads the database dump found in the archive(s) into a WpDatabaseLoader
+    __database_dump = None
+    __database_loaded = False
+
+    # Directory of the temp path the database dump of this restore is
+    # spooled to, removed once the restore is done
+    __spool_path = None
+
+    # WpCoreCache the core files referenced by an archive are copied from
+    __core_cache = None
+
+    # Number of threads writing the restored files (see WpFileWriterPool)
+    __extract_workers = 1
+
+    # Files identical to those on disk are left alone (SYNCFILES)
+    __sync_files = False
 
     __log = None
 
     #########################################################################
-    def __init__(self, wp_site, temp_path, what_if=False):
+    def __init__(self, wp_site, temp_path, what_if=False, host_limiter=None, popen=None, cancelled=None, metrics=None):
         self.__log = logging.getLogger(__name__)
 
         self.__what_if = what_if
+        self.__host_limiter = host_limiter if host_limiter is not None else WpDbHostLimiter()
+        # Starts mysql (restore_async starts it on the event loop instead)
+        self.__popen = popen
+        self.__cancelled = cancelled if cancelled is not None else threading.Event()
 
         if not isinstance(wp_site, WpSite):
             raise TypeError("wp_site must be an instance of WpSite")
 
         self.__wp_site = wp_site
+        self.__metrics = metrics if metrics is not None else WpMetrics('restore', wp_site.site_path)
 
         if temp_path is None or len(temp_path) == 0:
             raise ValueError("temp_path must be specified")
@@ -101,55 +165,872 @@ class WpInternalRestore:
                         )
 
     #########################################################################
-    def __restore_files(self, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN):
+    @staticmethod
+    def __is_database_dump(name):
+        return name == DB_DUMP_ARCNAME or name.startswith(DB_DUMP_SEGMENT_PREFIX) or name.startswith(DB_DUMP_DIRECTORY_PREFIX)
+
+    #########################################################################
+    @staticmethod
+    def __dump_base(name):
+        """
+        Name of the dump a member belongs to, without its segment number
+        """
+
+        base, _, segment = name.rpartition('.')
+
+        return base if len(segment) == 6 and segment.isdigit() else name
+
+    #########################################################################
+    @classmethod
+    def __dump_order(cls, name):
+        """
+        Sort key putting the schema of a per-table dump first and its
+        triggers last, and keeping the segments of each dump together and
+        in order
+        """
+
+        base = cls.__dump_base(name)
+        rank = 0 if base == DB_SCHEMA_ARCNAME else 2 if base == DB_TRIGGERS_ARCNAME else 1
+
+        return (rank, base, name)
+
+    #########################################################################
+    def __find_database_dump(self, sizes, source):
+        """
+        Find the database dump among the members of an archive (``sizes``
+        maps their names to their sizes) and remember how to load it.
+        ``source(names)`` returns a source (see WpDatabaseLoader) of the
+        content of the members ``names``, one after the other.
+
+        An archive without a dump leaves the dump of an earlier archive of
+        an incremental chain in place.
+        """
+
+        segments = sorted((name for name in sizes if self.__is_database_dump(name)), key=self.__dump_order)
+
+        if len(segments) == 0:
+            self.__log.info('No database dump found in the archive.')
+            return
+
+        if not segments[0].startswith(DB_DUMP_DIRECTORY_PREFIX):
+            dump_source = source(segments)
+            self.__database_dump = lambda loader: loader.load_dump(DB_DUMP_ARCNAME, dump_source)
+            return
+
+        dumps = {}
+        for name in segments:
+            dumps.setdefault(self.__dump_base(name), []).append(name)
+
+        schema = dumps.pop(DB_SCHEMA_ARCNAME, None)
+        triggers = dumps.pop(DB_TRIGGERS_ARCNAME, None)
+
+        if schema is None:
+            self.__log.fatal('The per-table database dump has no "%s". Possible corrupt backup.', DB_SCHEMA_ARCNAME)
+            raise WpDatabaseRestoreFailed(DB_SCHEMA_ARCNAME, None, None)
+
+        schema_source = source(schema)
+        triggers_source = source(triggers) if triggers is not None else None
+        table_sources = {base[len(DB_DUMP_DIRECTORY_PREFIX):-len('.sql')]: (sum(sizes[name] for name in names), source(names))
+                         for base, names in dumps.items()}
+
+        self.__database_dump = lambda loader: loader.load(schema_source, table_sources, triggers_source)
+
+    #########################################################################
+    def __spool_dump_member(self, stream, member, spooled):
+        """
+        Write a member of the database dump of an archive read sequentially
+        to the temp path, appending the segments of each dump. ``spooled``
+        maps the names of the members spooled so far to their sizes.
+        """
+
+        if len(spooled) == 0 and not self.__what_if:
+            # Replaces what an earlier archive of an incremental chain spooled
+            self.__remove_spool_path()
+            self.__spool_path = tempfile.mkdtemp(prefix='wpbackup2-spool-', dir=self.__temp_path)
+
+        spooled[member.name] = member.size
+
+        self.__log.debug('Spooling database dump segment "%s"', member.name)
+        if self.__what_if:
+            return
+
+        filename = os.path.join(self.__spool_path, self.__dump_base(member.name))
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with self.__metrics.phase('spool'), open(filename, 'ab') as output:
+            shutil.copyfileobj(stream.extractfile(member), output)
+
+        self.__metrics.add('spool', bytes_out=member.size)
+
+    #########################################################################
+    def __log_spooled_dump(self, spooled):
+        """
+        Log the dump (or the tables of a per-table dump) a what-if restore
+        would have spooled and loaded
+        """
+
+        bases = sorted({self.__dump_base(name) for name in spooled})
+        tables = [base[len(DB_DUMP_DIRECTORY_PREFIX):-len('.sql')] for base in bases
+                  if base.startswith(DB_DUMP_DIRECTORY_PREFIX) and base not in (DB_SCHEMA_ARCNAME, DB_TRIGGERS_ARCNAME)]
+
+        if bases[0].startswith(DB_DUMP_DIRECTORY_PREFIX):
+            self.__log.info('Would load the per-table database dump of %d table(s): %s', len(tables), ', '.join(tables))
+        else:
+            self.__log.info('Would load the database dump "%s"', DB_DUMP_ARCNAME)
+
+    #########################################################################
+    def __remove_spool_path(self):
+        if self.__spool_path is not None:
+            shutil.rmtree(self.__spool_path, ignore_errors=True)
+            self.__spool_path = None
+
+    #########################################################################
+    def __load_streamed_dump(self, stream, members, member, restore_mode, load_workers):
+        """
+        Load the (single) database dump starting at ``member`` straight from
+        an archive read sequentially (``members`` yielding the members
+        after it), returning the first member after the dump. The load is
+        requested from the driver of the steps (see __restore_chain).
+        """
+
+        following = []
+
+        def segments():
+            current = member
+            while current is not None and (current.name == DB_DUMP_ARCNAME or current.name.startswith(DB_DUMP_SEGMENT_PREFIX)):
+                member_stream = stream.extractfile(current)
+                while True:
+                    data = member_stream.read(DB_DUMP_READ_SIZE)
+                    if not data:
+                        break
+                    yield data
+                current = next(members, None)
+            following.append(current)
+
+        chunks = segments()
+
+        self.__update_config()
+        yield restore_mode, load_workers, lambda loader: loader.load_dump(DB_DUMP_ARCNAME, lambda: chunks)
+
+        # Skip what was not loaded (an existing database that is kept, or a
+        # what-if run)
+        for _ in chunks:
+            pass
+
+        self.__database_loaded = True
+
+        return following[0]
+
+    #########################################################################
+    def __read_parent_id(self, stream, archive_filename, parent_manifest):
+        """
+        Id of the backup the archive opened with ``stream`` builds on, from
+        its pax global header. Archives written before the header was added
+        have their manifest read first when a parent has to be checked.
+        """
+
+        ids = read_archive_comment(stream.pax_headers)
+
+        if ids is not None:
+            return ids[1]
+
+        if parent_manifest is None:
+            return None
+
+        self.__log.info('Archive "%s" has no backup ids in its header, reading its manifest first', archive_filename)
+
+        manifest = WpManifest.from_archive(archive_filename)
+
+        return manifest.parent_id if manifest is not None else None
+
+    #########################################################################
+    @staticmethod
+    def __check_chain(parent_id, archive_filename, parent_manifest):
+        """
+        For an incremental backup, check that the archive (built on
+        ``parent_id``) follows on from the previously restored backup
+        """
+
+        if parent_manifest is not None:
+            if parent_id is None or parent_id != parent_manifest.backup_id:
+                raise WpBackupChainInvalidError(archive_filename, parent_manifest.backup_id, parent_id)
+
+    #########################################################################
+    def __apply_deletions(self, manifest, path_filter):
+        """
+        Remove the paths an incremental backup recorded as deleted
+        """
+
+        deleted = [relative for relative in manifest.deleted if path_filter.matches(relative)]
+
+        self.__log.info('Removing %d path(s) deleted since the previous backup...', len(deleted))
+
+        for relative in deleted:
+            path = os.path.join(self.__wp_site.site_path, relative)
+
+            self.__log.debug('Removing deleted path: %s', path)
+            if self.__what_if:
+                continue
+
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.lexists(path):
+                os.remove(path)
+
+    #########################################################################
+    def __core_release(self, version):
+        """
+        The cached release whose core files an archive references
+        (raises WpCoreReleaseNotFoundError when it is not cached)
+        """
+
+        release = self.__core_cache.release(version) if self.__core_cache is not None else None
+
+        if release is None:
+            raise WpCoreReleaseNotFoundError(version, self.__core_cache.directory if self.__core_cache is not None else None)
+
+        return release
+
+    #########################################################################
+    def __restore_core_files(self, manifest, path_filter):
+        """
+        Copy the core files the archive only references back from the
+        release cache, with the mode, owner and mtime they were backed up
+        with. A cached file that no longer matches the size and hash of the
+        manifest raises WpCoreReleaseCorruptError. Yields after every file.
+        """
+
+        release = self.__core_release(manifest.core_version)
+        selected = [relative for relative in manifest.core_files if path_filter.matches(relative)]
+
+        self.__log.info('Restoring %d core file(s) from WordPress %s in "%s"...', len(selected), release.version, release.path)
+
+        if self.__what_if:
+            return
+
+        is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+        started = time.monotonic()
+        restored_bytes = 0
+        restored_files = 0
+
+        with self.__metrics.profile('core'):
+            for relative in selected:
+                self.__check_cancelled()
+
+                path = os.path.join(str(self.__wp_site.site_path), relative)
+                mode, uid, gid = manifest.core_files[relative]
+                mtime_ns = manifest.entries[relative][2]
+
+                if self.__sync_files and self.__is_unchanged_file(path, manifest.entries[relative][1], mtime_ns / 1e9, mode, uid, gid, manifest.entries[relative][4]):
+                    self.__metrics.add('unchanged', bytes_in=manifest.entries[relative][1], files=1)
+                    continue
+
+                if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+                    os.remove(path)
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+                # The checksums of a release are blake2b hashes
+                release.materialize(relative, path, manifest.entries[relative][1], manifest.entries[relative][4] if manifest.hash_algorithm == HASH_ALGORITHM else None)
+
+                if is_root:
+                    os.chown(path, uid, gid)
+                os.chmod(path, mode)
+                os.utime(path, ns=(mtime_ns, mtime_ns))
+
+                restored_bytes += manifest.entries[relative][1]
+                restored_files += 1
+
+                yield
+
+        self.__metrics.add('core', seconds=time.monotonic() - started, bytes_out=restored_bytes, files=restored_files)
+
+    #########################################################################
+    @staticmethod
+    def __is_unchanged_file(path, size, mtime, mode, uid, gid, file_hash=None, hash_algorithm=HASH_ALGORITHM):
+        """
+        True when ``path`` is a regular file of ``size`` bytes modified at
+        ``mtime`` (to the second), or of that size with the content hash
+        ``file_hash`` (of ``hash_algorithm``). Its mode, owner and mtime are then brought in line
+        with those given.
+        """
+
+        try:
+            stat_result = os.lstat(path)
+        except OSError:
+            return False
+
+        if not stat.S_ISREG(stat_result.st_mode) or stat_result.st_size != size:
+            return False
+
+        if int(stat_result.st_mtime) != int(mtime):
+            # Touched but identical (a redeployed plugin, a copied tree)
+            if file_hash is None or hash_file(path, hash_algorithm) != file_hash:
+                return False
+
+            os.utime(path, (mtime, mtime))
+
+        if hasattr(os, 'geteuid') and os.geteuid() == 0 and (stat_result.st_uid, stat_result.st_gid) != (uid, gid):
+            os.chown(path, uid, gid)
+
+        if stat.S_IMODE(stat_result.st_mode) != mode:
+            os.chmod(path, mode)
+
+        return True
+
+    #########################################################################
+    def __is_unchanged(self, relative, member, file_hash=None, hash_algorithm=HASH_ALGORITHM):
+        """
+        When restoring with SYNCFILES, True when the site already holds the
+        regular file or symlink ``member`` at ``relative``, so it is not
+        written again (see __is_unchanged_file)
+        """
+
+        if not self.__sync_files or self.__what_if:
+            return False
+
+        path = os.path.join(str(self.__wp_site.site_path), relative)
+
+        if member.issym():
+            unchanged = os.path.islink(path) and os.readlink(path) == member.linkname
+        elif member.isreg():
+            unchanged = self.__is_unchanged_file(path, member.size, member.mtime, member.mode, member.uid, member.gid, file_hash, hash_algorithm)
+        else:
+            unchanged = False
+
+        if unchanged:
+            self.__log.debug('Unchanged: %s', relative)
+            self.__metrics.add('unchanged', bytes_in=member.size, files=1)
+
+        return unchanged
+
+    #########################################################################
+    def remove_unlisted_files(self, listed, path_filter=None):
+        """
+        Remove the files and directories of the site selected by
+        ``path_filter`` that are not in ``listed`` (relative paths, such as
+        the entries of a manifest), completing a restore with SYNCFILES and
+        REMOVEFILESBEFORERESTORE
+        """
+
+        if path_filter is None:
+            path_filter = WpPathFilter()
+
+        site_path = str(self.__wp_site.site_path)
+
+        self.__log.info('Removing the content of "%s" that is not in the backup...', site_path)
+
+        removed = 0
+
+        for directory, directories, files in os.walk(site_path):
+            relative_directory = os.path.relpath(directory, site_path)
+            relative_directory = '' if relative_directory == '.' else relative_directory.replace(os.path.sep, '/') + '/'
+
+            kept = []
+            for name in directories + files:
+                path = os.path.join(directory, name)
+                relative = relative_directory + name
+
+                if relative in listed or not path_filter.matches(relative):
+                    if name in directories:
+                        kept.append(name)
+                    continue
+
+                self.__log.debug('Removing: %s', path)
+                removed += 1
+                if self.__what_if:
+                    continue
+
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+            # Only descend into directories that were not removed
+            directories[:] = kept
+
+        self.__log.info('Removed %d path(s) not in the backup', removed)
+
+    #########################################################################
+    def __remove_existing_files(self, path_filter):
+        """
+        Remove the existing WordPress content selected by ``path_filter``
+        (the whole directory when the filter selects everything)
+        """
+
+        site_path = str(self.__wp_site.site_path)
+
+        if not os.path.exists(site_path):
+            return
+
+        if path_filter.is_empty:
+            self.__log.info('Removing existing WordPress content at "%s"...', site_path)
+            if not self.__what_if:
+                shutil.rmtree(site_path, ignore_errors=True)
+            return
+
+        self.__log.info('Removing existing WordPress content at "%s" matching %s...', site_path, path_filter)
+
+        for directory, directories, files in os.walk(site_path):
+            relative_directory = os.path.relpath(directory, site_path)
+            relative_directory = '' if relative_directory == '.' else relative_directory.replace(os.path.sep, '/') + '/'
+
+            kept = []
+            for name in directories + files:
+                path = os.path.join(directory, name)
+
+                if not path_filter.matches(relative_directory + name):
+                    if name in directories:
+                        kept.append(name)
+                    continue
+
+                self.__log.debug('Removing: %s', path)
+                if self.__what_if:
+                    continue
+
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+
+            # Only descend into directories that were not removed
+            directories[:] = kept
+
+    #########################################################################
+    @staticmethod
+    def __selected_path(name, path_filter):
+        """
+        Path of the member ``name`` relative to the WordPress directory, or
+        None when it is not a WordPress file selected by ``path_filter``
+        """
+
+        root_dir = WP_DIR_ARCNAME + '/'
+
+        if not name.startswith(root_dir):
+            return None
+
+        relative = name[len(root_dir):]
+
+        return relative if path_filter.matches(relative) else None
+
+    #########################################################################
+    def __restore_files(self, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN, parent_manifest=None, path_filter=None, load_database=True, load_workers=1):
         """
         Restore Wordpress Files
+
+        Returns the manifest of the archive (None for archives without one).
+        When ``parent_manifest`` is given the archive must be an incremental
+        backup taken against it. Only the files selected by ``path_filter``
+        are restored. Yields between its steps (see __restore_chain).
         """
 
         self.__log.info('Restoring from archive: %s', archive_filename)
 
-        with tarfile.open(archive_filename, 'r:gz') as stream:
+        if path_filter is None:
+            path_filter = WpPathFilter()
+
+        if archive_filename != STDIN_ARCHIVE and is_seekable(archive_filename):
+            return (yield from self.__restore_indexed_files(archive_filename, restore_mode, parent_manifest, path_filter))
+
+        return (yield from self.__restore_streamed_files(archive_filename, restore_mode, parent_manifest, path_filter, load_database, load_workers))
+
+    #########################################################################
+    def __restore_streamed_files(self, archive_filename, restore_mode, parent_manifest, path_filter, load_database, load_workers):
+        """
+        Restore from an archive without an index in a single sequential
+        pass, which also works when reading from stdin
+
+        Each member is dispatched as it arrives: WordPress files are written
+        to the site and a single database dump is streamed into mysql (when
+        ``load_database``), so the archive is decompressed only once. The
+        dump is spooled to the temp path and loaded after the pass instead
+        when it has to wait: a per-table dump (its tables are loaded
+        concurrently), a dump that comes before wp-config.php (archives
+        written by earlier versions) or one that a later archive of an
+        incremental chain may replace.
+        """
+
+        restore_files = WpRestoreMode.FILES in restore_mode
+        restore_database = WpRestoreMode.DATABASE in restore_mode
+
+        # The dump is loaded with the settings of the restored wp-config.php
+        config_pending = restore_files and path_filter.matches(WP_CONFIG_PATH)
+
+        manifest = None
+        directories = []
+        spooled = {}
+
+        source = sys.stdin.buffer if archive_filename == STDIN_ARCHIVE else archive_filename
+
+        if source is archive_filename:
+            self.__metrics.add('decompress', bytes_in=os.path.getsize(archive_filename))
+
+        # The reads of the decompressed tar data are what decompresses it
+        with open_archive_reader(source) as fileobj, tarfile.open(fileobj=self.__metrics.reader(fileobj, 'decompress', 'bytes_out'), mode='r|') as stream:
+            self.__check_chain(self.__read_parent_id(stream, archive_filename, parent_manifest), archive_filename, parent_manifest)
+
+            # Fail before anything is written when the core files cannot be
+            # restored
+            core_version = read_archive_core_version(stream.pax_headers)
+            if restore_files and core_version is not None:
+                self.__core_release(core_version)
+
+            if restore_files:
+                if WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode and WpRestoreMode.SYNCFILES not in restore_mode:
+                    with self.__metrics.phase('remove'):
+                        self.__remove_existing_files(path_filter)
+
+                self.__log.info('Extracting WordPress directory "%s" to "%s"...',
+                            WP_DIR_ARCNAME,
+                            self.__wp_site.site_path)
+
+            with self.__file_writer(restore_files) as writer:
+                # Members are dropped once processed, so memory does not grow
+                # with the number of files in the archive
+                members = stream_members(stream)
+                member = next(members, None)
+
+                while member is not None:
+                    self.__check_cancelled()
+
+                    if member.name == MANIFEST_ARCNAME:
+                        manifest = WpManifest.from_json(stream.extractfile(member).read())
+                    elif self.__is_database_dump(member.name):
+                        if restore_database:
+                            if load_database and not config_pending and len(spooled) == 0 and not member.name.startswith(DB_DUMP_DIRECTORY_PREFIX):
+                                # The dump is loaded with the settings of
+                                # wp-config.php, which must be written first
+                                if writer is not None:
+                                    writer.wait()
+
+                                member = yield from self.__load_streamed_dump(stream, members, member, restore_mode, load_workers)
+                                continue
+
+                            self.__spool_dump_member(stream, member, spooled)
+                    elif restore_files:
+                        relative = self.__selected_path(member.name, path_filter)
+                        if relative is not None:
+                            self.__relocate_member(member, relative)
+                            if not self.__is_unchanged(relative, member):
+                                self.__extract_member(stream, member, relative, directories, writer)
+                            if relative == WP_CONFIG_PATH:
+                                config_pending = False
+
+                    yield
+
+                    member = next(members, None)
+
+        if restore_files and manifest is not None and len(manifest.core_files) > 0:
+            yield from self.__restore_core_files(manifest, path_filter)
+
+        # Directory attributes are applied last, writing the files inside
+        # would otherwise change the mtime again
+        is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+        for member in sorted(directories, key=lambda member: member.name, reverse=True):
+            self.__apply_member_attributes(os.path.join(str(self.__wp_site.site_path), member.name), member, is_root)
+
+        if restore_files and manifest is not None and manifest.is_incremental:
+            with self.__metrics.phase('remove'):
+                self.__apply_deletions(manifest, path_filter)
+
+        if len(spooled) > 0:
+            if self.__what_if:
+                # Nothing was spooled, so there is no dump to read back
+                self.__log_spooled_dump(spooled)
+                self.__database_dump = lambda loader: None
+            else:
+                spool_path = self.__spool_path
+                self.__log.info('Database dump spooled to "%s"', spool_path)
+                self.__find_database_dump(spooled, lambda names: file_source(os.path.join(spool_path, self.__dump_base(names[0]))))
+
+        self.__log.info('File restore complete...')
+
+        return manifest
+
+    #########################################################################
+    def __check_cancelled(self):
+        if self.__cancelled.is_set():
+            raise InterruptedError("restore of '{}' cancelled".format(self.__wp_site.site_path))
+
+    #########################################################################
+    def __until_cancelled(self, members):
+        for member in members:
+            self.__check_cancelled()
+            yield member
+
+    #########################################################################
+    @staticmethod
+    def __relocate_member(member, relative):
+        """
+        Extract ``member`` to ``relative`` under the WordPress directory,
+        and a hard link to where its target is extracted (hard links name
+        their target by its path in the archive)
+        """
+
+        member.path = relative
+
+        if member.islnk() and member.linkname.startswith(WP_DIR_ARCNAME + '/'):
+            member.linkname = member.linkname[len(WP_DIR_ARCNAME) + 1:]
+
+    #########################################################################
+    def __extract_member(self, stream, member, relative, directories, writer=None):
+        """
+        Extract the current member of an archive (relocated to ``relative``
+        under the WordPress directory, see __relocate_member). Directories
+        are created without their attributes and appended to
+        ``directories``. Regular files are handed to ``writer`` (a
+        WpFileWriterPool) when given.
+        """
+
+        self.__log.debug('Extracting: %s', relative)
+        if self.__what_if:
+            return
+
+        if writer is not None:
+            if member.isreg():
+                writer.add(stream, member, relative)
+                return
+
+            # The file a hard link points to may still be queued
+            if member.islnk():
+                writer.wait()
+
+        started = time.monotonic()
+
+        with self.__metrics.profile('extract'):
+            if member.isdir():
+                stream.extract(member, path=str(self.__wp_site.site_path), set_attrs=False)
+                directories.append(member)
+            elif member.islnk():
+                self.__extract_hard_link(member, relative)
+            else:
+                stream.extract(member, path=str(self.__wp_site.site_path))
+
+        self.__metrics.add('extract', seconds=time.monotonic() - started, bytes_out=member.size if member.isreg() else 0, files=1 if member.isreg() else 0)
+
+    #########################################################################
+    def __extract_hard_link(self, member, relative):
+        """
+        Restore the hard link ``member`` as a link to the file it points to,
+        which the archive holds (and the restore wrote) ahead of it, or as a
+        copy of that file where it cannot be linked. tarfile would look the
+        target up among the members it kept, which an archive read
+        sequentially does not keep (see stream_members).
+        """
+
+        site_path = str(self.__wp_site.site_path)
+        path = os.path.join(site_path, relative)
+
+        if os.path.isabs(member.linkname) or '..' in member.linkname.split('/'):
+            self.__log.warning('Skipping hard link "%s" to "%s", outside of the WordPress directory', relative, member.linkname)
+            return
+
+        target = os.path.join(site_path, member.linkname)
+
+        if not os.path.isfile(target):
+            self.__log.warning('Skipping hard link "%s", its target "%s" was not restored', relative, member.linkname)
+            return
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # A sync restore leaves the existing tree in place, link or file
+        if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+            os.remove(path)
+
+        try:
+            os.link(target, path)
+        except OSError as error:
+            self.__log.debug('Copying "%s" to "%s", it cannot be linked: %s', member.linkname, relative, error)
+            shutil.copy2(target, path)
+
+        self.__apply_member_attributes(path, member, hasattr(os, 'geteuid') and os.geteuid() == 0)
+
+    #########################################################################
+    def __file_writer(self, restore_files):
+        """
+        A WpFileWriterPool writing the restored files on
+        ``extract_workers`` threads, or a context manager giving None when
+        the reading thread writes them itself
+        """
+
+        if not restore_files or self.__what_if or self.__extract_workers <= 1:
+            return contextlib.nullcontext()
+
+        return WpFileWriterPool(self.__wp_site.site_path, self.__extract_workers, self.__metrics)
+
+    #########################################################################
+    @staticmethod
+    def __apply_member_attributes(path, member, is_root):
+        if is_root:
+            os.chown(path, member.uid, member.gid)
+        os.chmod(path, member.mode)
+        os.utime(path, (member.mtime, member.mtime))
+
+    #########################################################################
+    def __restore_indexed_files(self, archive_filename, restore_mode, parent_manifest, path_filter):
+        """
+        Restore Wordpress Files from a seekable archive
+
+        The index is used to pick the selected members, so only the frames
+        that hold them are read and decompressed.
+
+        Members are read from their headers one at a time and not kept,
+        but the index and the manifest are loaded whole: memory still grows
+        with the number of members, by a few hundred bytes each. Archives
+        read sequentially do not have that limit.
+        """
+
+        self.__log.info('Using the index of seekable archive: %s', archive_filename)
+
+        with WpSeekableArchive(archive_filename) as archive, archive.open_tarfile() as stream:
+            manifest = None
+            if MANIFEST_ARCNAME in archive:
+                manifest = WpManifest.from_json(archive.read_member(MANIFEST_ARCNAME))
+
+            self.__check_chain(manifest.parent_id if manifest is not None else None, archive_filename, parent_manifest)
+
+            has_core_files = WpRestoreMode.FILES in restore_mode and manifest is not None and len(manifest.core_files) > 0
+            if has_core_files:
+                self.__core_release(manifest.core_version)
+
             if WpRestoreMode.FILES in restore_mode:
-                if os.path.exists(self.__wp_site.site_path) and WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode:
-                    self.__log.info('Removing existing WordPress content at "%s"...',
-                                self.__wp_site.site_path)
-                    if not self.__what_if:
-                        shutil.rmtree(self.__wp_site.site_path, ignore_errors=True)
+                if WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode and WpRestoreMode.SYNCFILES not in restore_mode:
+                    with self.__metrics.phase('remove'):
+                        self.__remove_existing_files(path_filter)
 
-                self.__log.info("Restoring Wordpress Files stored in '%s' to '%s'", self.__wp_site.site_path, archive_filename)
                 self.__log.info('Extracting WordPress directory "%s" to "%s"...',
                             WP_DIR_ARCNAME,
                             self.__wp_site.site_path)
 
-                root_dir = WP_DIR_ARCNAME + os.path.sep
-                root_dir_len = len(root_dir)
+                # Files of the same size and mtime are left alone by a sync, as
+                # are those whose content hash matches the manifest
+                hashed = manifest is not None and manifest.hash_algorithm is not None and hash_available(manifest.hash_algorithm)
+                entries = manifest.entries if hashed else {}
 
-                wp_members = []
+                # The TarInfo of a member is read from its header when it is
+                # extracted and dropped afterwards, only directories are kept
+                # to apply their attributes last
+                directories = []
+                extracted = [0]
 
-                for member in stream.getmembers():
-                    if member.path.startswith(root_dir):
-                        member.path = member.path[root_dir_len:]
-                        wp_members.append(member)
+                def selected_members():
+                    for name in archive.getnames():
+                        relative = self.__selected_path(name, path_filter)
+                        if relative is None:
+                            continue
 
-                self.__log.debug('Extracting members: "%s"', wp_members)
-                if not self.__what_if:
-                    stream.extractall(members=wp_members, path=self.__wp_site.site_path)
+                        member = archive.gettarinfo(stream, name)
+                        self.__relocate_member(member, relative)
 
-            if WpRestoreMode.DATABASE in restore_mode:
-                self.__log.info('Extracting database dump "%s" to "%s"...',
-                            DB_DUMP_ARCNAME,
-                            self.__temp_path)
+                        if self.__is_unchanged(relative, member, entries[relative][4] if relative in entries else None, manifest.hash_algorithm if hashed else None):
+                            continue
+
+                        if member.isdir():
+                            directories.append(member)
+                        extracted[0] += 1
+
+                        yield member
+
+                self.__log.info('Extracting the selected of %d member(s)', len(archive))
+                with self.__file_writer(True) as writer:
+                    for member in self.__until_cancelled(selected_members()):
+                        self.__extract_member(stream, member, member.path, [], writer)
+                        yield
+
+                self.__log.info('Extracted %d of %d member(s)', extracted[0], len(archive))
+
+                if has_core_files:
+                    yield from self.__restore_core_files(manifest, path_filter)
+
+                # Directory attributes are applied last, writing the files
+                # inside would otherwise change the mtime again
                 if not self.__what_if:
-                    stream.extract(DB_DUMP_ARCNAME, path=self.__temp_path)
+                    is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+                    for member in sorted(directories, key=lambda member: member.name, reverse=True):
+                        self.__apply_member_attributes(os.path.join(str(self.__wp_site.site_path), member.name), member, is_root)
 
-        self.__update_config()
+                if manifest is not None and manifest.is_incremental:
+                    with self.__metrics.phase('remove'):
+                        self.__apply_deletions(manifest, path_filter)
+
+            if WpRestoreMode.DATABASE in restore_mode:
+                # Each source opens the archive again, so tables can be
+                # read by several loader threads at once
+                self.__find_database_dump({name: size for name, size, _ in archive.members()},
+                                          lambda names: lambda: iter_members(archive_filename, names))
 
         self.__log.info('File restore complete...')
 
+        return manifest
+
     #########################################################################
-    def __restore_database(self, restore_mode=WpRestoreMode.ALLCLEAN):
+    def __restore_database(self, restore_mode=WpRestoreMode.ALLCLEAN, load_workers=1, database_dump=None):
         """
         Restore Wordpress Database
+
+        ``database_dump`` (by default the dump found by the file restore)
+        is streamed into mysql by WpDatabaseLoader; per-table dumps are
+        loaded ``load_workers`` tables at a time.
+        """
+
+        if database_dump is None:
+            database_dump = self.__database_dump
+
+        self.__check_cancelled()
+
+        wp_config = self.__prepare_database(restore_mode, database_dump)
+        if wp_config is None:
+            return
+
+        loader = WpDatabaseLoader(*self.__loader_target(wp_config),
+                                  workers=load_workers,
+                                  host_limiter=self.__host_limiter,
+                                  what_if=self.__what_if,
+                                  popen=self.__popen,
+                                  metrics=self.__metrics)
+
+        self.__log.info('Streaming the database dump into mysql...')
+        with self.__metrics.phase('database'):
+            database_dump(loader)
+
+        self.__log.info('Database restoration complete.')
+
+    #########################################################################
+    async def __restore_database_async(self, runner, restore_mode=WpRestoreMode.ALLCLEAN, load_workers=1, database_dump=None):
+        """
+        Restore Wordpress Database like __restore_database, with
+        WpAsyncDatabaseLoader feeding mysql from the event loop
+        """
+
+        if database_dump is None:
+            database_dump = self.__database_dump
+
+        wp_config = await runner.call(self.__prepare_database, restore_mode, database_dump)
+        if wp_config is None:
+            return
+
+        loader = WpAsyncDatabaseLoader(runner,
+                                       *self.__loader_target(wp_config),
+                                       workers=load_workers,
+                                       host_limiter=self.__host_limiter,
+                                       what_if=self.__what_if,
+                                       metrics=self.__metrics)
+
+        self.__log.info('Streaming the database dump into mysql...')
+        with self.__metrics.phase('database'):
+            # Nothing to await for a dump a what-if restore did not spool
+            loading = database_dump(loader)
+            if loading is not None:
+                await loading
+
+        self.__log.info('Database restoration complete.')
+
+    #########################################################################
+    def __prepare_database(self, restore_mode, database_dump):
+        """
+        Make sure the database to restore ``database_dump`` into exists,
+        returning the wp-config.php to load it with (None when an existing
+        database is kept)
         """
 
         self.__log.info("Restore Wordpress Database to '%s'", self.__wp_site.db_host)
@@ -161,7 +1042,7 @@ class WpInternalRestore:
             if WpRestoreMode.DELETEDATABASEBEFORERESTORE in restore_mode and not self.__what_if:
                 if wpdb.does_database_exist():
                     self.__log.info('Existing Database found. Skipping database restore')
-                    return
+                    return None
 
             self.__log.info('Ensuring the database exists...')
             if not self.__what_if:
@@ -172,53 +1053,253 @@ class WpInternalRestore:
 
             raise WpDatabaseMysqlFailed(message="mysql was not found", stdOut=None, stdError=None) from error
 
-        db_dump_filename = str(os.path.join(self.__temp_path, DB_DUMP_ARCNAME))
+        if database_dump is None:
+            self.__log.fatal('No database dump was found in the backup. Possible corrupt backup.')
+            raise WpDatabaseRestoreFailed(DB_DUMP_ARCNAME, None, None)
+
+        return wp_config
+
+    #########################################################################
+    def __loader_target(self, wp_config):
+        """
+        (connection_args, database, db_host) a database loader connects with
+        """
+
+        return (['--host',
+                 wp_config.get('DB_HOST'),
+                 '--user',
+                 self.__wp_site.admin_credentials.username,
+                 '-p' + self.__wp_site.admin_credentials.password],
+                wp_config.get('DB_NAME'),
+                wp_config.get('DB_HOST'))
+
+    #########################################################################
+    def restore(self, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN, incremental_archives=None, path_filter=None, load_workers=1, update_config=True, core_cache=None, extract_workers=1):
+        """
+        Executes the restore process using the specified archive file
+
+        ``incremental_archives`` is an optional chain of incremental backups,
+        oldest first, applied on top of ``archive_filename``. The database is
+        restored from the newest archive in the chain that contains a dump.
+        ``path_filter`` (a WpPathFilter) limits the files that are restored.
+        Per-table database dumps are loaded ``load_workers`` tables at a time.
+
+        ``archive_filename`` may be STDIN_ARCHIVE ('-') to read the archive
+        from stdin.
+
+        Core files the archives only reference are copied from
+        ``core_cache`` (a WpCoreCache). With ``extract_workers`` above 1 the
+        files are written by that many threads while the archive is read
+        and decompressed on this one (see WpFileWriterPool).
+
+        With SYNCFILES in ``restore_mode`` the files already on disk with
+        the same size and mtime (or content hash, for seekable archives
+        whose manifest has hashes) are not written again, and
+        REMOVEFILESBEFORERESTORE removes the files the backup does not hold
+        once it is restored instead of everything up front.
+
+        Returns the manifest of the last archive restored (None for
+        archives without one).
 
-        if not os.path.exists(db_dump_filename):
-            self.__log.info('Failed to extract database.sql from the backup.  Possible corrupt backup.')
-            raise WpDatabaseRestoreFailed(db_dump_filename, None, None)
+        wp-config.php is updated with the settings of the site unless
+        ``update_config`` is False (the shards of a sharded backup leave it
+        to the core shard).
+        """
+
+        incremental_archives, path_filter = self.__start_restore(archive_filename, restore_mode, incremental_archives, path_filter, core_cache, extract_workers)
 
-        restore_args = [
-            'mysql',
-            '--host',
-            wp_config.get('DB_HOST'),
-            '--user',
-            self.__wp_site.admin_credentials.username,
-            '-p' + self.__wp_site.admin_credentials.password,
-            wp_config.get('DB_NAME'),
-            '--execute',
-            'source {};'.format(db_dump_filename)
-        ]
+        steps = self.__restore_chain(archive_filename, restore_mode, incremental_archives, path_filter, load_workers, update_config)
 
         try:
-            self.__log.info("Restoring database from '%s'", db_dump_filename)
-            self.__log.debug("RESTORE CMD: %s", restore_args)
+            # The database is loaded on this thread where the steps ask for it
+            with contextlib.closing(steps):
+                while True:
+                    try:
+                        request = next(steps)
+                    except StopIteration as stop:
+                        return stop.value
 
-            if not self.__what_if:
-                completed = subprocess.run(restore_args, capture_output=True) # pylint: disable=subprocess-run-check
-                if completed.returncode != 0:
-                    self.__log.fatal('Database restoration failed.\n\nmysql stdout:\n%s\n\n'
-                                    'mysql stderr:\n%s',
-                                    completed.stdout,
-                                    completed.stderr)
-                    raise WpDatabaseRestoreFailed(db_dump_filename, completed.stdout, completed.stderr)
-        except FileNotFoundError as error:
-            self.__log.exception(error)
-            self.__log.fatal('mysql was not found. Please install it and try again.')
-            raise WpDatabaseMysqlFailed(message="mysql was not found", stdOut=None, stdError=None) from error
+                    if request is not None:
+                        self.__restore_database(*request)
+        finally:
+            self.__remove_spool_path()
 
-        self.__log.info('Database restoration complete.')
+    #########################################################################
+    async def restore_async(self, runner, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN, incremental_archives=None, path_filter=None, load_workers=1, update_config=True, core_cache=None, extract_workers=1):
+        """
+        Executes the restore process like restore, on the running event
+        loop: mysql is fed by the loop, and the archive is read and the
+        files written in steps on the executor of ``runner`` (a
+        WpAsyncRunner)
+        """
+
+        incremental_archives, path_filter = self.__start_restore(archive_filename, restore_mode, incremental_archives, path_filter, core_cache, extract_workers)
+
+        try:
+            return await runner.drive(self.__restore_chain(archive_filename, restore_mode, incremental_archives, path_filter, load_workers, update_config),
+                                      lambda request: self.__restore_database_async(runner, *request))
+        finally:
+            await runner.call(self.__remove_spool_path)
 
     #########################################################################
-    def restore(self, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN):
+    def __start_restore(self, archive_filename, restore_mode, incremental_archives, path_filter, core_cache, extract_workers):
         """
-        Executes the restore process using the specified archive file
+        Check the arguments of a restore and reset the state of the previous
+        one, returning the chain of incremental archives and the path filter
         """
 
         if archive_filename is None or len(archive_filename) == 0:
             raise ValueError("archive_filename must be specified")
 
-        self.__restore_files(archive_filename)
+        incremental_archives = list(incremental_archives or [])
+
+        if STDIN_ARCHIVE in incremental_archives:
+            raise ValueError("only the first archive of a chain can be read from stdin")
+
+        if path_filter is None:
+            path_filter = WpPathFilter()
+
+        self.__database_dump = None
+        self.__database_loaded = False
+        self.__core_cache = core_cache
+        self.__extract_workers = extract_workers
+        self.__sync_files = WpRestoreMode.SYNCFILES in restore_mode and WpRestoreMode.FILES in restore_mode
+
+        return incremental_archives, path_filter
+
+    #########################################################################
+    def __restore_chain(self, archive_filename, restore_mode, incremental_archives, path_filter, load_workers, update_config):
+        """
+        Restore the archives of a chain and then the database (see restore),
+        as a generator yielding between its steps. Where the database is to
+        be loaded it yields (restore_mode, load_workers, database_dump), the
+        arguments of __restore_database, and the driver of the steps loads
+        it before they go on.
+        """
+
+        manifest = yield from self.__restore_files(archive_filename, restore_mode=restore_mode, path_filter=path_filter, load_database=len(incremental_archives) == 0, load_workers=load_workers)
+
+        for position, incremental_archive in enumerate(incremental_archives):
+            if manifest is None:
+                raise WpBackupChainInvalidError(incremental_archive, None, None)
+
+            manifest = yield from self.__restore_files(incremental_archive, restore_mode=restore_mode & (WpRestoreMode.ALLOVERWRITE | WpRestoreMode.SYNCFILES), parent_manifest=manifest, path_filter=path_filter,
+                                                       load_database=position == len(incremental_archives) - 1, load_workers=load_workers)
+
+        if self.__sync_files and WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode:
+            if manifest is None:
+                self.__log.warning('Archive "%s" has no manifest, files that are not in the backup are kept', incremental_archives[-1] if len(incremental_archives) > 0 else archive_filename)
+            else:
+                with self.__metrics.phase('remove'):
+                    self.remove_unlisted_files(manifest.entries, path_filter)
+
+        if update_config:
+            self.__update_config()
+
+        if WpRestoreMode.DATABASE in restore_mode and not self.__database_loaded:
+            yield restore_mode, load_workers, None
+
+        return manifest
+
+    #########################################################################
+    def __restore_repository_files(self, repository, snapshot, path_filter):
+        """
+        Recreate the WordPress directory from a repository snapshot
+        """
+
+        self.__log.info("Restoring Wordpress Files from snapshot %s to '%s'", snapshot['id'], self.__wp_site.site_path)
+
+        is_root = hasattr(os, 'geteuid') and os.geteuid() == 0
+        directories = []
+
+        for entry in snapshot['files']:
+            if not path_filter.is_empty and not path_filter.matches(entry['path']):
+                continue
+
+            path = os.path.join(str(self.__wp_site.site_path), entry['path']) if entry['path'] else str(self.__wp_site.site_path)
+            mode = entry['mode']
+
+            self.__log.debug('Restoring: %s', path)
+            if self.__what_if:
+                continue
+
+            if stat.S_ISDIR(mode):
+                os.makedirs(path, exist_ok=True)
+                # Directory attributes are applied last, writing the files
+                # inside would otherwise change the mtime again
+                directories.append((path, entry))
+                continue
+
+            if self.__sync_files:
+                if stat.S_ISLNK(mode) and os.path.islink(path) and os.readlink(path) == entry['linkname']:
+                    continue
+
+                if stat.S_ISREG(mode) and self.__is_unchanged_file(path, entry['size'], entry['mtime_ns'] / 1e9, stat.S_IMODE(mode), entry['uid'], entry['gid']):
+                    self.__metrics.add('unchanged', bytes_in=entry['size'], files=1)
+                    continue
+
+            if os.path.lexists(path) and (os.path.islink(path) or not os.path.isdir(path)):
+                os.remove(path)
+            elif not path_filter.is_empty:
+                # The parent directory may not have been selected itself
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            if stat.S_ISLNK(mode):
+                os.symlink(entry['linkname'], path)
+                if is_root:
+                    os.lchown(path, entry['uid'], entry['gid'])
+                continue
+
+            with open(path, 'wb') as stream:
+                for data in repository.iter_stream(entry['chunks']):
+                    stream.write(data)
+
+            self.__apply_attributes(path, entry, is_root)
+
+        for path, entry in reversed(directories):
+            self.__apply_attributes(path, entry, is_root)
+
+    #########################################################################
+    @staticmethod
+    def __apply_attributes(path, entry, is_root):
+        if is_root:
+            os.chown(path, entry['uid'], entry['gid'])
+        os.chmod(path, stat.S_IMODE(entry['mode']))
+        os.utime(path, ns=(entry['mtime_ns'], entry['mtime_ns']))
+
+    #########################################################################
+    def restore_from_repository(self, repository, snapshot_id=None, restore_mode=WpRestoreMode.ALLCLEAN, path_filter=None):
+        """
+        Executes the restore process from a snapshot in a deduplicating
+        repository (the newest snapshot when ``snapshot_id`` is None)
+        """
+
+        snapshot = repository.load_snapshot(snapshot_id)
+
+        if path_filter is None:
+            path_filter = WpPathFilter()
+
+        self.__log.info('Restoring snapshot %s from repository: %s', snapshot['id'], repository.path)
+
+        self.__sync_files = WpRestoreMode.SYNCFILES in restore_mode
+
+        if WpRestoreMode.FILES in restore_mode:
+            if WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode and not self.__sync_files:
+                with self.__metrics.phase('remove'):
+                    self.__remove_existing_files(path_filter)
+
+            self.__restore_repository_files(repository, snapshot, path_filter)
+
+            if WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode and self.__sync_files:
+                with self.__metrics.phase('remove'):
+                    self.remove_unlisted_files({entry['path'] for entry in snapshot['files']}, path_filter)
+
+        self.__database_dump = None
+
+        if snapshot['database'] is not None:
+            self.__database_dump = lambda loader: loader.load_dump(DB_DUMP_ARCNAME, lambda: repository.iter_stream(snapshot['database']))
+
+        self.__update_config()
 
-        if WpRestoreMode.DATABASE in restore_mode:
-            self.__restore_database()
+        if WpRestoreMode.DATABASE in restore_mode and snapshot['database'] is not None:
+            self.__restore_database(restore_mode)
@@ -0,0 +1,323 @@
+"""
+wp_manifest
+
+The manifest stored inside every archive. It records each path under the
+WordPress directory with the metadata used to detect changes between
+backups (type, size, mtime, inode and, optionally, a content hash), the id
+of the backup and, for incremental backups, the id of the backup it builds
+on plus the paths deleted since then. Core files left out of the archive
+because they are identical to those of a cached WordPress release (see
+wp_core_cache) are listed with the version of that release.
+
+The manifest is the last member of an archive, as it is only complete once
+every file was added. The ids of the backup and of its parent are also
+written to the pax global header (the standard "comment" keyword, which
+tar ignores) at the very start of the archive, so a restore reading the
+archive in a single pass can check an incremental chain up front.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import datetime
+import hashlib
+import json
+import logging
+import stat
+import tarfile
+import uuid
+
+from wpbackup2.exceptions import WpHashNotAvailableError
+
+from wpbackup2.classes.wp_compression import open_archive_reader
+from wpbackup2.classes.wp_compression import stream_members
+from wpbackup2.classes.wp_seekable_archive import WpSeekableArchive
+from wpbackup2.classes.wp_seekable_archive import is_seekable
+
+MANIFEST_ARCNAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+ARCHIVE_COMMENT_KEY = 'comment'
+ARCHIVE_COMMENT_PREFIX = 'wpbackup2 '
+
+# Content hash of the files: blake2b from hashlib by default, or the much
+# faster xxh3 of the optional xxhash package
+HASH_ALGORITHM = 'blake2b'
+HASH_DIGEST_SIZE = 16
+XXHASH_ALGORITHM = 'xxh3_128'
+HASH_ALGORITHMS = [HASH_ALGORITHM, XXHASH_ALGORITHM]
+
+ENTRY_FILE = 'f'
+ENTRY_DIRECTORY = 'd'
+ENTRY_SYMLINK = 'l'
+ENTRY_OTHER = 'o'
+
+#########################################################################
+def entry_type(mode):
+    """
+    Manifest entry type for a ``st_mode``
+    """
+
+    if stat.S_ISREG(mode):
+        return ENTRY_FILE
+
+    if stat.S_ISDIR(mode):
+        return ENTRY_DIRECTORY
+
+    if stat.S_ISLNK(mode):
+        return ENTRY_SYMLINK
+
+    return ENTRY_OTHER
+
+#########################################################################
+def read_archive_comment(pax_headers):
+    """
+    (backup id, parent id) from the pax global header of an archive, None
+    for archives written without it
+    """
+
+    comment = pax_headers.get(ARCHIVE_COMMENT_KEY, '')
+
+    if not comment.startswith(ARCHIVE_COMMENT_PREFIX):
+        return None
+
+    content = json.loads(comment[len(ARCHIVE_COMMENT_PREFIX):])
+
+    return content['backup_id'], content.get('parent_id')
+
+#########################################################################
+def read_archive_core_version(pax_headers):
+    """
+    WordPress release whose core files the archive references instead of
+    holding them, from the pax global header (None when it holds them all)
+    """
+
+    comment = pax_headers.get(ARCHIVE_COMMENT_KEY, '')
+
+    if not comment.startswith(ARCHIVE_COMMENT_PREFIX):
+        return None
+
+    return json.loads(comment[len(ARCHIVE_COMMENT_PREFIX):]).get('core_version')
+
+#########################################################################
+def read_archive_hash_algorithm(pax_headers):
+    """
+    Algorithm of the content hashes of the manifest of an archive, from the
+    pax global header (None when the files are not hashed or the archive
+    was written before the header recorded it)
+    """
+
+    comment = pax_headers.get(ARCHIVE_COMMENT_KEY, '')
+
+    if not comment.startswith(ARCHIVE_COMMENT_PREFIX):
+        return None
+
+    return json.loads(comment[len(ARCHIVE_COMMENT_PREFIX):]).get('hash_algorithm')
+
+#########################################################################
+def _import_xxhash():
+    try:
+        import xxhash # pylint: disable=import-outside-toplevel
+    except ImportError as error:
+        raise WpHashNotAvailableError(XXHASH_ALGORITHM, 'xxhash') from error
+
+    return xxhash
+
+#########################################################################
+def new_hasher(algorithm=HASH_ALGORITHM):
+    """
+    Create the hash object used for file content hashes
+    """
+
+    if algorithm == HASH_ALGORITHM:
+        return hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+
+    if algorithm == XXHASH_ALGORITHM:
+        return _import_xxhash().xxh3_128()
+
+    raise ValueError("unknown hash algorithm '{}'".format(algorithm))
+
+#########################################################################
+def hash_available(algorithm):
+    """ True when content hashes can be computed with ``algorithm`` """
+
+    try:
+        new_hasher(algorithm)
+    except (WpHashNotAvailableError, ValueError):
+        return False
+
+    return True
+
+class WpHashingReader:
+    """
+    Wraps a readable file object and hashes everything read through it, so
+    a file can be hashed in the same pass that copies it into the archive
+    """
+
+    #########################################################################
+    def __init__(self, fileobj, hasher):
+        self.__fileobj = fileobj
+        self.__hasher = hasher
+
+    #########################################################################
+    def read(self, size=-1):
+        """ Read from the wrapped file, updating the hash """
+
+        data = self.__fileobj.read(size)
+        self.__hasher.update(data)
+
+        return data
+
+    #########################################################################
+    def hexdigest(self):
+        """ Hash of everything read so far """
+
+        return self.__hasher.hexdigest()
+
+class WpManifest:
+    """ WpManifest """
+
+    #########################################################################
+    def __init__(self, backup_id=None, parent_id=None, created=None, hash_algorithm=None):
+        """
+        Constructor
+
+        Args:
+            backup_id (str):        unique id of the backup (generated when None)
+            parent_id (str):        id of the backup an incremental backup builds on
+            created (str):          ISO 8601 creation time (now when None)
+            hash_algorithm (str):   algorithm of the content hashes, None if not hashed
+        """
+        self.backup_id = backup_id if backup_id is not None else uuid.uuid4().hex
+        self.parent_id = parent_id
+        self.created = created if created is not None else datetime.datetime.now().isoformat()
+        self.hash_algorithm = hash_algorithm
+
+        # path -> (type, size, mtime_ns, inode, hash)
+        self.entries = {}
+        self.deleted = []
+
+        # WordPress release the core files were left out for, and
+        # path -> (mode, uid, gid) of those files
+        self.core_version = None
+        self.core_files = {}
+
+    #########################################################################
+    @property
+    def is_incremental(self):
+        """ True when the backup only holds the changes since its parent """
+        return self.parent_id is not None
+
+    #########################################################################
+    def add(self, path, stat_result, file_hash=None):
+        """
+        Record ``path`` (relative to the WordPress directory) with its stat
+        result and optional content hash
+        """
+
+        self.entries[path] = (entry_type(stat_result.st_mode),
+                              stat_result.st_size,
+                              stat_result.st_mtime_ns,
+                              stat_result.st_ino,
+                              file_hash)
+
+    #########################################################################
+    def add_core(self, path, stat_result, file_hash=None):
+        """
+        Record ``path`` as a core file that is not in the archive but
+        restored from the cached release ``core_version``
+        """
+
+        self.add(path, stat_result, file_hash)
+        self.core_files[path] = (stat_result.st_mode & 0o7777, stat_result.st_uid, stat_result.st_gid)
+
+    #########################################################################
+    def is_unchanged(self, path, stat_result):
+        """
+        True when ``path`` is recorded with the same type, size, mtime and
+        inode as ``stat_result``
+        """
+
+        entry = self.entries.get(path)
+
+        if entry is None:
+            return False
+
+        return entry[:4] == (entry_type(stat_result.st_mode),
+                             stat_result.st_size,
+                             stat_result.st_mtime_ns,
+                             stat_result.st_ino)
+
+    #########################################################################
+    def to_json(self):
+        """ Serialise the manifest """
+
+        return json.dumps({
+            'version': MANIFEST_VERSION,
+            'backup_id': self.backup_id,
+            'parent_id': self.parent_id,
+            'created': self.created,
+            'hash_algorithm': self.hash_algorithm,
+            'entries': [[path] + list(entry) for path, entry in self.entries.items()],
+            'deleted': self.deleted,
+            'core_version': self.core_version,
+            'core_files': [[path] + list(attributes) for path, attributes in self.core_files.items()]
+        }, separators=(',', ':')).encode('utf-8')
+
+    #########################################################################
+    def archive_comment(self):
+        """ The ids of the backup, for the pax global header of its archive """
+
+        return ARCHIVE_COMMENT_PREFIX + json.dumps({
+            'backup_id': self.backup_id,
+            'parent_id': self.parent_id,
+            'core_version': self.core_version,
+            'hash_algorithm': self.hash_algorithm
+        }, separators=(',', ':'))
+
+    #########################################################################
+    @classmethod
+    def from_json(cls, data):
+        """ Create an instance of WpManifest from its serialised form """
+
+        content = json.loads(data)
+
+        manifest = cls(backup_id=content['backup_id'],
+                       parent_id=content.get('parent_id'),
+                       created=content.get('created'),
+                       hash_algorithm=content.get('hash_algorithm'))
+
+        for entry in content.get('entries', []):
+            manifest.entries[entry[0]] = tuple(entry[1:])
+
+        manifest.deleted = content.get('deleted', [])
+
+        manifest.core_version = content.get('core_version')
+        for core_file in content.get('core_files', []):
+            manifest.core_files[core_file[0]] = tuple(core_file[1:])
+
+        return manifest
+
+    #########################################################################
+    @classmethod
+    def from_archive(cls, archive_filename):
+        """
+        Read the manifest of an existing archive (None for archives written
+        before manifests were added)
+        """
+
+        logging.getLogger(__name__).info('Reading manifest from archive: %s', archive_filename)
+
+        if is_seekable(archive_filename):
+            with WpSeekableArchive(archive_filename) as archive:
+                if MANIFEST_ARCNAME in archive:
+                    return cls.from_json(archive.read_member(MANIFEST_ARCNAME))
+                return None
+
+        with open_archive_reader(archive_filename) as fileobj, tarfile.open(fileobj=fileobj, mode='r|') as stream:
+            for member in stream_members(stream):
+                if member.name == MANIFEST_ARCNAME:
+                    return cls.from_json(stream.extractfile(member).read())
+
+        return None
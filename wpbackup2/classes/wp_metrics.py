@@ -0,0 +1,281 @@
+"""
+wp_metrics
+
+Throughput metrics of a backup or restore: the wall time, bytes in, bytes
+out and files processed of each phase, the compression ratio of the archive
+and the peak resident set size of the process.
+
+Phases are recorded by name. The top level phases of an operation follow
+each other (for a backup: config, database, files, finish), while the
+measurements taken inside them overlap those (time blocked reading
+mysqldump, walking the directory, reading files, hashing core files,
+compressing, storing already compressed media, waiting for the compressor
+and writing the archive). Time spent on worker threads is
+summed, so ``compress`` can exceed the wall time of the backup.
+
+The metrics can be written as JSON or as a Prometheus textfile for the
+node_exporter textfile collector (a filename ending in ``.prom``).
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import contextlib
+import datetime
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+PROMETHEUS_EXTENSION = '.prom'
+PROMETHEUS_PREFIX = 'wpbackup2_'
+
+# (name, dict key, help) of the per-phase series
+PHASE_SERIES = [
+    ('phase_seconds', 'seconds', 'Time spent in the phase (summed over threads)'),
+    ('phase_bytes_in', 'bytes_in', 'Bytes read by the phase'),
+    ('phase_bytes_out', 'bytes_out', 'Bytes written by the phase'),
+    ('phase_files', 'files', 'Files processed by the phase')
+]
+
+#########################################################################
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes (None where unknown)
+    """
+
+    if resource is None:
+        return None
+
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Kilobytes on Linux, bytes on macOS
+    return usage if sys.platform == 'darwin' else usage * 1024
+
+#########################################################################
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+class WpMeteredReader:
+    """
+    Wraps a readable file object and records the time spent in and the
+    bytes returned by its reads under a phase of a WpMetrics, counting the
+    bytes as ``counter`` ('bytes_in' or 'bytes_out')
+    """
+
+    #########################################################################
+    def __init__(self, fileobj, metrics, phase, counter='bytes_in'):
+        self.__fileobj = fileobj
+        self.__metrics = metrics
+        self.__phase = phase
+        self.__counter = counter
+
+    #########################################################################
+    def read(self, size=-1):
+        """ Read from the wrapped file, recording the time and bytes """
+
+        started = time.monotonic()
+        data = self.__fileobj.read(size)
+        self.__metrics.add(self.__phase, seconds=time.monotonic() - started, **{self.__counter: len(data)})
+
+        return data
+
+class WpMetrics:
+    """ WpMetrics """
+
+    #########################################################################
+    def __init__(self, operation, site_path=None, profiler=None):
+        """
+        Constructor
+
+        Args:
+            operation (str):        'backup' or 'restore'
+            site_path (str):        WordPress directory the operation works on
+            profiler (WpProfiler):  also profile the phases (None does not)
+        """
+        self.operation = operation
+        self.profiler = profiler
+        self.site_path = str(site_path) if site_path is not None else None
+        self.started = datetime.datetime.now().isoformat()
+
+        self.duration = None
+        self.archive_bytes = None
+        self.peak_rss = None
+        self.error = None
+
+        # phase -> {'seconds', 'bytes_in', 'bytes_out', 'files'}
+        self.phases = {}
+
+        self.__start = time.monotonic()
+        self.__lock = threading.Lock()
+
+    #########################################################################
+    def add(self, phase, seconds=0.0, bytes_in=0, bytes_out=0, files=0):
+        """ Add to the totals of ``phase`` (safe to call from any thread) """
+
+        with self.__lock:
+            totals = self.phases.get(phase)
+            if totals is None:
+                totals = self.phases[phase] = {'seconds': 0.0, 'bytes_in': 0, 'bytes_out': 0, 'files': 0}
+
+            totals['seconds'] += seconds
+            totals['bytes_in'] += bytes_in
+            totals['bytes_out'] += bytes_out
+            totals['files'] += files
+
+    #########################################################################
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """
+        Record the wall time of the ``with`` block under ``phase`` (and
+        profile it when profiling)
+        """
+
+        started = time.monotonic()
+
+        try:
+            with self.profile(phase):
+                yield self
+        finally:
+            self.add(phase, seconds=time.monotonic() - started)
+
+    #########################################################################
+    def profile(self, phase):
+        """
+        Profile the ``with`` block under ``phase`` when profiling, for
+        phases whose time is recorded with ``add``
+        """
+
+        if self.profiler is None:
+            return contextlib.nullcontext()
+
+        return self.profiler.phase(phase)
+
+    #########################################################################
+    def reader(self, fileobj, phase, counter='bytes_in'):
+        """ Wrap ``fileobj`` so its reads are recorded under ``phase`` """
+        return WpMeteredReader(fileobj, self, phase, counter)
+
+    #########################################################################
+    def finish(self, error=None):
+        """ Record the total duration, the peak RSS and the outcome """
+
+        self.duration = time.monotonic() - self.__start
+        self.peak_rss = peak_rss()
+        self.error = error
+
+    #########################################################################
+    @property
+    def succeeded(self):
+        """ True when the operation completed """
+        return self.error is None
+
+    #########################################################################
+    @property
+    def compression_ratio(self):
+        """
+        Uncompressed bytes per byte of archive, counting the blocks that
+        were stored rather than compressed (None when nothing was
+        compressed or decompressed)
+        """
+
+        written = [self.phases[phase] for phase in ('compress', 'store') if phase in self.phases]
+
+        if len(written) > 0:
+            compressed = sum(totals['bytes_out'] for totals in written)
+            uncompressed = sum(totals['bytes_in'] for totals in written)
+        elif 'decompress' in self.phases:
+            compressed = self.phases['decompress']['bytes_in']
+            uncompressed = self.phases['decompress']['bytes_out']
+        else:
+            return None
+
+        if compressed == 0:
+            return None
+
+        return uncompressed / compressed
+
+    #########################################################################
+    def to_dict(self):
+        """ The metrics as a JSON serialisable dict """
+
+        with self.__lock:
+            phases = {phase: dict(totals, seconds=round(totals['seconds'], 6)) for phase, totals in self.phases.items()}
+
+        return {
+            'operation': self.operation,
+            'site_path': self.site_path,
+            'started': self.started,
+            'succeeded': self.succeeded,
+            'error': None if self.error is None else "{}: {}".format(type(self.error).__name__, self.error),
+            'duration': None if self.duration is None else round(self.duration, 6),
+            'archive_bytes': self.archive_bytes,
+            'compression_ratio': self.compression_ratio,
+            'peak_rss_bytes': self.peak_rss,
+            'phases': phases
+        }
+
+    #########################################################################
+    def to_json(self):
+        """ Serialise the metrics as JSON """
+        return json.dumps(self.to_dict(), indent=2)
+
+    #########################################################################
+    def to_prometheus(self):
+        """ Serialise the metrics in the Prometheus text exposition format """
+
+        labels = 'operation="{}",site="{}"'.format(_escape_label(self.operation), _escape_label(self.site_path or ''))
+        content = self.to_dict()
+        lines = []
+
+        def gauge(name, help_text, samples):
+            lines.append('# HELP {}{} {}'.format(PROMETHEUS_PREFIX, name, help_text))
+            lines.append('# TYPE {}{} gauge'.format(PROMETHEUS_PREFIX, name))
+            for sample_labels, value in samples:
+                lines.append('{}{}{{{}}} {}'.format(PROMETHEUS_PREFIX, name, sample_labels, repr(float(value))))
+
+        gauge('success', 'Whether the last run succeeded', [(labels, 1 if self.succeeded else 0)])
+        gauge('last_run_timestamp_seconds', 'When the last run finished', [(labels, time.time())])
+
+        for name, key, help_text in [('duration_seconds', 'duration', 'Wall time of the last run'),
+                                     ('archive_bytes', 'archive_bytes', 'Size of the archive'),
+                                     ('compression_ratio', 'compression_ratio', 'Uncompressed bytes per archive byte'),
+                                     ('peak_rss_bytes', 'peak_rss_bytes', 'Peak resident set size of the process')]:
+            if content[key] is not None:
+                gauge(name, help_text, [(labels, content[key])])
+
+        for name, key, help_text in PHASE_SERIES:
+            gauge(name, help_text, [('{},phase="{}"'.format(labels, _escape_label(phase)), totals[key])
+                                    for phase, totals in sorted(content['phases'].items())])
+
+        return '\n'.join(lines) + '\n'
+
+    #########################################################################
+    def write(self, filename):
+        """
+        Write the metrics to ``filename``: a Prometheus textfile when it ends
+        in ``.prom``, JSON otherwise. The file is replaced atomically, so a
+        scraper never reads it half written.
+        """
+
+        content = self.to_prometheus() if str(filename).endswith(PROMETHEUS_EXTENSION) else self.to_json() + '\n'
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        descriptor, temp_filename = tempfile.mkstemp(prefix='.wpbackup2-metrics-', dir=directory)
+
+        try:
+            with os.fdopen(descriptor, 'w') as output:
+                output.write(content)
+            os.chmod(temp_filename, 0o644)
+            os.replace(temp_filename, filename)
+        except BaseException:
+            os.remove(temp_filename)
+            raise
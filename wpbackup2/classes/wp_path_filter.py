@@ -0,0 +1,92 @@
+"""
+wp_path_filter
+
+Include / exclude filtering of paths relative to the WordPress directory,
+used to restore part of a backup.
+
+Patterns are shell-style globs (``*``, ``?``, ``[...]``) matched against the
+whole relative path, e.g. ``wp-content/uploads/2024/03`` or
+``wp-content/plugins/*`` (as with fnmatch, ``*`` also matches ``/``, so
+``*.php`` selects PHP files at any depth). A pattern that matches a directory also matches
+everything below it. A path is selected when it matches an include pattern
+(or no include patterns were given) and does not match an exclude pattern.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import fnmatch
+import re
+
+TRANSLATE_ANCHOR = re.compile(r'\\[Zz]$')
+
+class WpPathFilter:
+    """ WpPathFilter """
+
+    #########################################################################
+    def __init__(self, includes=None, excludes=None):
+        """
+        Constructor
+
+        Args:
+            includes (list):    globs of the paths to select (None selects all)
+            excludes (list):    globs of the paths to leave out
+        """
+        self.includes = [self.__normalise(pattern) for pattern in includes or []]
+        self.excludes = [self.__normalise(pattern) for pattern in excludes or []]
+
+        self.__include_regex = self.__compile(self.includes)
+        self.__exclude_regex = self.__compile(self.excludes)
+
+    #########################################################################
+    @staticmethod
+    def __normalise(pattern):
+        pattern = pattern.strip()
+
+        while pattern.startswith('./'):
+            pattern = pattern[2:]
+
+        return pattern.strip('/')
+
+    #########################################################################
+    @staticmethod
+    def __compile(patterns):
+        """
+        Compile the globs into a single regular expression matching a path
+        or any of its parent directories
+        """
+
+        if len(patterns) == 0:
+            return None
+
+        # fnmatch.translate anchors each pattern at the end; allowing a
+        # trailing "/..." lets a pattern naming a directory match its content
+        alternatives = ['(?:{}(?:/.*)?)'.format(TRANSLATE_ANCHOR.sub('', fnmatch.translate(pattern))) for pattern in patterns]
+
+        return re.compile('(?:{})\\Z'.format('|'.join(alternatives)), re.DOTALL)
+
+    #########################################################################
+    @property
+    def is_empty(self):
+        """ True when the filter selects every path """
+        return self.__include_regex is None and self.__exclude_regex is None
+
+    #########################################################################
+    def matches(self, path):
+        """
+        True when ``path`` (relative to the WordPress directory, '/'
+        separated) is selected
+        """
+
+        if self.__include_regex is not None and not self.__include_regex.match(path):
+            return False
+
+        if self.__exclude_regex is not None and self.__exclude_regex.match(path):
+            return False
+
+        return True
+
+    #########################################################################
+    def __str__(self):
+        return "includes={} excludes={}".format(self.includes, self.excludes)
@@ -0,0 +1,187 @@
+"""
+wp_profiler
+
+Per-phase cProfile data of a backup or restore, switched on with
+``profile`` (see WpBackup.backup and WpBackup.restore) or ``--profile``.
+
+Every thread keeps a stack of the phases it is in. Entering a phase stops
+the profile of the enclosing one and starts that of the new phase, and
+leaving it switches back, so each function call is attributed to the
+innermost phase only. Worker threads (compression, per-table dumps and
+loads) profile the phases they run in the same way, and the profiles of a
+phase are merged over all threads. Work done outside any named phase is
+profiled as ``other``.
+
+When the operation ends, one ``<phase>.prof`` file per phase (readable with
+``python -m pstats`` or snakeviz) and a ``summary.txt`` of the hottest
+functions of every phase are written to the profile directory, and the
+summary is logged.
+
+From Python 3.12 on a single profiler can be active in the process, and it
+sees every thread. The phases of worker threads are then part of the phase
+their operation was in.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import contextlib
+import cProfile
+import logging
+import os
+import pstats
+import threading
+
+OTHER_PHASE = 'other'
+PROFILE_EXTENSION = '.prof'
+SUMMARY_FILENAME = 'summary.txt'
+
+class WpProfiler:
+    """ WpProfiler """
+
+    #########################################################################
+    def __init__(self, top=15):
+        """
+        Constructor
+
+        Args:
+            top (int):  number of functions listed per phase in the summary
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.__top = top
+
+        # (phase, thread id) -> cProfile.Profile
+        self.__profiles = {}
+        self.__lock = threading.Lock()
+        self.__local = threading.local()
+
+    #########################################################################
+    def __profile(self, phase):
+        key = (phase, threading.get_ident())
+
+        with self.__lock:
+            profile = self.__profiles.get(key)
+            if profile is None:
+                profile = self.__profiles[key] = cProfile.Profile()
+
+        return profile
+
+    #########################################################################
+    @staticmethod
+    def __enable(profile):
+        """ Start ``profile``, False when another profiler is active """
+
+        try:
+            profile.enable()
+        except ValueError:
+            return False
+
+        return True
+
+    #########################################################################
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """ Profile the ``with`` block of the current thread under ``phase`` """
+
+        stack = getattr(self.__local, 'stack', None)
+        if stack is None:
+            stack = self.__local.stack = []
+
+        outer = stack[-1] if len(stack) > 0 else None
+
+        # Nested in the same phase, it is profiled already
+        if outer is not None and outer[0] == phase:
+            yield self
+            return
+
+        if outer is not None and outer[2]:
+            outer[1].disable()
+
+        profile = self.__profile(phase)
+        entry = (phase, profile, self.__enable(profile))
+        stack.append(entry)
+
+        try:
+            yield self
+        finally:
+            stack.pop()
+
+            if entry[2]:
+                profile.disable()
+
+            if outer is not None and outer[2]:
+                outer[1].enable()
+
+    #########################################################################
+    def stats(self):
+        """ Merged pstats.Stats of every phase profiled, by phase """
+
+        with self.__lock:
+            profiles = list(self.__profiles.items())
+
+        stats = {}
+
+        for (phase, _), profile in profiles:
+            profile.create_stats()
+            if len(profile.stats) == 0:
+                continue
+
+            if phase in stats:
+                stats[phase].add(profile)
+            else:
+                stats[phase] = pstats.Stats(profile)
+
+        return stats
+
+    #########################################################################
+    def summary(self, stats=None):
+        """
+        The ``top`` functions with the most time spent in themselves, for
+        every phase
+        """
+
+        stats = stats if stats is not None else self.stats()
+        lines = []
+
+        for phase, phase_stats in sorted(stats.items()):
+            functions = sorted(phase_stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+            total = sum(values[2] for _, values in functions)
+
+            lines.append("Phase '{}': {:.3f}s profiled".format(phase, total))
+
+            for (filename, line, name), (_, calls, own_time, cumulative_time, _) in functions[:self.__top]:
+                lines.append("  {:>9.3f}s {:>5.1f}% {:>9.3f}s cum {:>9} calls  {}:{}({})".format(
+                    own_time, own_time * 100 / total if total > 0 else 0, cumulative_time, calls, os.path.basename(filename), line, name))
+
+        return '\n'.join(lines)
+
+    #########################################################################
+    def write(self, directory):
+        """
+        Write the profile of every phase and the summary to ``directory``
+        (created when missing), log the summary and return the files
+        written
+        """
+
+        os.makedirs(directory, exist_ok=True)
+
+        stats = self.stats()
+        filenames = []
+
+        for phase, phase_stats in sorted(stats.items()):
+            filename = os.path.join(directory, phase + PROFILE_EXTENSION)
+            phase_stats.dump_stats(filename)
+            filenames.append(filename)
+
+        summary = self.summary(stats)
+
+        filename = os.path.join(directory, SUMMARY_FILENAME)
+        with open(filename, 'w') as output:
+            output.write(summary + '\n')
+        filenames.append(filename)
+
+        self.__log.info('Hottest functions by phase (profiles written to %s):\n%s', directory, summary)
+
+        return filenames
@@ -0,0 +1,341 @@
+"""
+wp_repository
+
+A content-addressed, deduplicating backup repository.
+
+Files and the database dump are split into content-defined chunks. Each
+chunk is stored once under the SHA-256 of its content, so a snapshot only
+costs the chunks that are not already in the repository, and every backup
+is recorded as a small snapshot index listing the chunks of each file.
+
+Chunk boundaries are placed after "anchor" bytes (newlines and commas, which
+are frequent in PHP, SQL dumps and text, and occur every ~128 bytes in
+binary data) whose preceding CHUNK_WINDOW bytes hash to zero under
+CHUNK_MASK. Because the decision only depends on nearby content, an insert
+or delete only changes the chunks around it. Anchors are located with a
+compiled regular expression and hashed with zlib.crc32, so chunking runs at
+C speed instead of rolling a hash over every byte in Python.
+
+Layout::
+
+    <repository>/config.json
+    <repository>/chunks/<first two hex digits>/<sha256>
+    <repository>/snapshots/<snapshot id>.json.gz
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import collections
+import datetime
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import uuid
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wpbackup2.exceptions import WpBackupNotFoundError
+from wpbackup2.exceptions import WpRepositoryCorruptError
+
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import compress_block
+from wpbackup2.classes.wp_compression import decompress_block
+from wpbackup2.classes.wp_compression import is_incompressible
+from wpbackup2.classes.wp_compression import resolve_workers
+from wpbackup2.classes.wp_compression import store_level
+
+REPOSITORY_VERSION = 1
+REPOSITORY_CONFIG = 'config.json'
+REPOSITORY_CHUNKS = 'chunks'
+REPOSITORY_SNAPSHOTS = 'snapshots'
+SNAPSHOT_EXTENSION = '.json.gz'
+
+CHUNK_MIN_SIZE = 256 * 1024
+CHUNK_MAX_SIZE = 8 * 1024 * 1024
+CHUNK_WINDOW = 32
+CHUNK_MASK = (1 << 13) - 1
+CHUNK_ANCHORS = re.compile(rb'[\n,]')
+
+READ_SIZE = 1024 * 1024
+
+class WpChunker:
+    """
+    Splits a byte stream into content-defined chunks of between
+    ``min_size`` and ``max_size`` bytes
+    """
+
+    #########################################################################
+    def __init__(self, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE, mask=CHUNK_MASK):
+        self.__min_size = max(min_size, CHUNK_WINDOW)
+        self.__max_size = max_size
+        self.__mask = mask
+
+        self.__buffer = bytearray()
+        self.__scan_from = self.__min_size
+
+    #########################################################################
+    def __find_cut(self):
+        size = len(self.__buffer)
+
+        if size < self.__min_size:
+            return None
+
+        limit = min(size, self.__max_size)
+
+        for match in CHUNK_ANCHORS.finditer(self.__buffer, self.__scan_from, limit):
+            end = match.end()
+            if zlib.crc32(self.__buffer[end - CHUNK_WINDOW:end]) & self.__mask == 0:
+                return end
+
+        if size >= self.__max_size:
+            return self.__max_size
+
+        # Everything up to limit has been rejected, carry on from there
+        self.__scan_from = limit
+
+        return None
+
+    #########################################################################
+    def feed(self, data):
+        """
+        Add ``data`` and yield every chunk that is now complete
+        """
+
+        self.__buffer += data
+
+        while True:
+            cut = self.__find_cut()
+
+            if cut is None:
+                return
+
+            chunk = bytes(self.__buffer[:cut])
+            del self.__buffer[:cut]
+            self.__scan_from = self.__min_size
+
+            yield chunk
+
+    #########################################################################
+    def finish(self):
+        """
+        Yield whatever is left once the stream has ended
+        """
+
+        if len(self.__buffer) > 0:
+            chunk = bytes(self.__buffer)
+            self.__buffer = bytearray()
+
+            yield chunk
+
+class WpRepository:
+    """ WpRepository """
+
+    #########################################################################
+    def __init__(self, path, compression=WpCompression.GZIP, compression_level=None, workers=1):
+        """
+        Open the repository at ``path``, creating it when it does not exist.
+
+        Args:
+            path (str):                     root directory of the repository
+            compression (WpCompression):    codec used for new repositories
+                                            (existing ones keep their codec)
+            compression_level (int):        codec specific compression level
+            workers (int):                  threads hashing, compressing and
+                                            writing chunks (0 = one per core)
+        """
+        self.__log = logging.getLogger(__name__)
+
+        self.path = str(path)
+        self.__compression_level = compression_level
+        self.__workers = resolve_workers(workers)
+
+        self.new_chunks = 0
+        self.new_bytes = 0
+        self.reused_chunks = 0
+
+        config_filename = os.path.join(self.path, REPOSITORY_CONFIG)
+
+        if os.path.exists(config_filename):
+            with open(config_filename, 'r') as stream:
+                config = json.load(stream)
+            self.compression = WpCompression(config['compression'])
+        else:
+            self.__log.info('Creating backup repository in "%s"', self.path)
+
+            os.makedirs(os.path.join(self.path, REPOSITORY_CHUNKS), exist_ok=True)
+            os.makedirs(os.path.join(self.path, REPOSITORY_SNAPSHOTS), exist_ok=True)
+
+            self.compression = compression
+            with open(config_filename, 'w') as stream:
+                json.dump({'version': REPOSITORY_VERSION, 'compression': compression.value}, stream)
+
+    #########################################################################
+    def __chunk_filename(self, chunk_id):
+        return os.path.join(self.path, REPOSITORY_CHUNKS, chunk_id[:2], chunk_id)
+
+    #########################################################################
+    def __store_chunk(self, data, store=False):
+        chunk_id = hashlib.sha256(data).hexdigest()
+        filename = self.__chunk_filename(chunk_id)
+
+        if os.path.exists(filename):
+            return chunk_id, False
+
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+
+        # Write under a unique name and rename, so concurrent backups and
+        # interrupted writes never leave a partial chunk behind
+        temp_filename = '{}.{}.tmp'.format(filename, uuid.uuid4().hex)
+        with open(temp_filename, 'wb') as stream:
+            stream.write(compress_block(self.compression, data, store_level(self.compression) if store else self.__compression_level))
+        os.replace(temp_filename, filename)
+
+        return chunk_id, True
+
+    #########################################################################
+    def __record(self, future):
+        chunk_id, is_new = future.result()
+
+        if is_new:
+            self.new_chunks += 1
+        else:
+            self.reused_chunks += 1
+
+        return chunk_id
+
+    #########################################################################
+    def store_stream(self, data_iterator, store=False):
+        """
+        Chunk, deduplicate and store a stream of byte strings, returning the
+        list of chunk ids it is made of. With ``store`` new chunks are
+        written at the store level of the codec (for data that is
+        compressed already).
+        """
+
+        chunker = WpChunker()
+        chunk_ids = []
+        pending = collections.deque()
+
+        def chunks():
+            for data in data_iterator:
+                self.new_bytes += len(data)
+                yield from chunker.feed(data)
+            yield from chunker.finish()
+
+        with ThreadPoolExecutor(max_workers=self.__workers, thread_name_prefix='wpbackup2-repository') as executor:
+            for chunk in chunks():
+                pending.append(executor.submit(self.__store_chunk, chunk, store))
+
+                while len(pending) > self.__workers * 2:
+                    chunk_ids.append(self.__record(pending.popleft()))
+
+            while len(pending) > 0:
+                chunk_ids.append(self.__record(pending.popleft()))
+
+        return chunk_ids
+
+    #########################################################################
+    def store_file(self, filename):
+        """
+        Store the content of ``filename``, returning its chunk ids. Media
+        and archives (see is_incompressible) are stored rather than
+        compressed again.
+        """
+
+        with open(filename, 'rb') as stream:
+            store = is_incompressible(filename, os.fstat(stream.fileno()).st_size, stream)
+
+            def read():
+                while True:
+                    data = stream.read(READ_SIZE)
+                    if not data:
+                        return
+                    yield data
+
+            return self.store_stream(read(), store)
+
+    #########################################################################
+    def iter_stream(self, chunk_ids):
+        """
+        Yield the content of the given chunks, checking each one against
+        its id
+        """
+
+        for chunk_id in chunk_ids:
+            with open(self.__chunk_filename(chunk_id), 'rb') as stream:
+                data = decompress_block(self.compression, stream.read())
+
+            if hashlib.sha256(data).hexdigest() != chunk_id:
+                raise WpRepositoryCorruptError(self.__chunk_filename(chunk_id))
+
+            yield data
+
+    #########################################################################
+    def save_snapshot(self, snapshot):
+        """
+        Save a snapshot index, returning its id
+        """
+
+        snapshot_id = '{}-{}'.format(datetime.datetime.now().strftime('%Y%m%dT%H%M%S'), uuid.uuid4().hex[:8])
+
+        snapshot['version'] = REPOSITORY_VERSION
+        snapshot['id'] = snapshot_id
+        snapshot['created'] = datetime.datetime.now().isoformat()
+
+        filename = os.path.join(self.path, REPOSITORY_SNAPSHOTS, snapshot_id + SNAPSHOT_EXTENSION)
+        with gzip.open(filename + '.tmp', 'wt', encoding='utf-8') as stream:
+            json.dump(snapshot, stream, separators=(',', ':'))
+        os.replace(filename + '.tmp', filename)
+
+        self.__log.info('Saved snapshot %s (%d new chunk(s), %d reused chunk(s))', snapshot_id, self.new_chunks, self.reused_chunks)
+
+        return snapshot_id
+
+    #########################################################################
+    def list_snapshots(self):
+        """
+        Ids of all snapshots, oldest first
+        """
+
+        return sorted(name[:-len(SNAPSHOT_EXTENSION)]
+                      for name in os.listdir(os.path.join(self.path, REPOSITORY_SNAPSHOTS))
+                      if name.endswith(SNAPSHOT_EXTENSION))
+
+    #########################################################################
+    def load_snapshot(self, snapshot_id=None):
+        """
+        Load a snapshot index (the newest one when ``snapshot_id`` is None)
+        """
+
+        if snapshot_id is None:
+            snapshots = self.list_snapshots()
+            if len(snapshots) == 0:
+                raise WpBackupNotFoundError(os.path.join(self.path, REPOSITORY_SNAPSHOTS))
+            snapshot_id = snapshots[-1]
+
+        filename = os.path.join(self.path, REPOSITORY_SNAPSHOTS, snapshot_id + SNAPSHOT_EXTENSION)
+
+        if not os.path.exists(filename):
+            raise WpBackupNotFoundError(filename)
+
+        with gzip.open(filename, 'rt', encoding='utf-8') as stream:
+            return json.load(stream)
+
+    #########################################################################
+    def latest_snapshot(self, site_path):
+        """
+        The newest snapshot taken of ``site_path`` (None if there is none)
+        """
+
+        for snapshot_id in reversed(self.list_snapshots()):
+            snapshot = self.load_snapshot(snapshot_id)
+            if snapshot.get('site_path') == str(site_path):
+                return snapshot
+
+        return None
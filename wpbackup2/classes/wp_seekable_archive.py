@@ -0,0 +1,462 @@
+"""
+wp_seekable_archive
+
+Seekable archives: a normal compressed tar made of independently compressed
+frames (see WpParallelCompressor) plus an index member, ``index.json``,
+listing every frame (compressed offset and length, uncompressed offset and
+length) and every member (header offset, data offset, size and checksum).
+
+The index is located through a fixed size trailer at the very end of the
+file which the standard tools skip:
+
+  * gzip: an empty gzip member whose header carries the locator in an
+    extra field (subfield id "WI")
+  * zstd, lz4 and uncompressed tar: a skippable frame (magic 0x184D2A57)
+
+Listing an archive then only reads the trailer and the index, and
+extracting a member only decompresses the frames that hold it.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import bisect
+import io
+import json
+import logging
+import os
+import shutil
+import struct
+import tarfile
+
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import decompress_block
+from wpbackup2.classes.wp_compression import decompress_frames
+from wpbackup2.classes.wp_compression import detect_compression
+from wpbackup2.classes.wp_compression import open_archive_reader
+from wpbackup2.classes.wp_compression import stream_members
+
+INDEX_ARCNAME = 'index.json'
+INDEX_VERSION = 1
+
+LOCATOR_MAGIC = b'WPIX'
+LOCATOR_FORMAT = '<4sQQQ'
+LOCATOR_SIZE = struct.calcsize(LOCATOR_FORMAT)
+
+GZIP_EXTRA_ID = b'WI'
+GZIP_TRAILER_SIZE = 10 + 2 + 4 + LOCATOR_SIZE + 2 + 8
+
+SKIPPABLE_FRAME_MAGIC = 0x184D2A57
+SKIPPABLE_TRAILER_SIZE = 8 + LOCATOR_SIZE
+
+SEEKABLE_COMPRESSIONS = [WpCompression.GZIP, WpCompression.ZSTD, WpCompression.LZ4, WpCompression.NONE]
+
+#########################################################################
+def build_trailer(compression, index_offset, index_length, index_header_offset):
+    """
+    Build the trailer pointing at the index, which starts ``index_offset``
+    bytes into the file, is ``index_length`` compressed bytes long and has
+    its tar header at ``index_header_offset`` in the uncompressed stream
+    """
+
+    if compression not in SEEKABLE_COMPRESSIONS:
+        raise ValueError("seekable archives are not supported with {} compression".format(compression.value))
+
+    locator = struct.pack(LOCATOR_FORMAT, LOCATOR_MAGIC, index_offset, index_length, index_header_offset)
+
+    if compression == WpCompression.GZIP:
+        extra = GZIP_EXTRA_ID + struct.pack('<H', len(locator)) + locator
+
+        # header with FEXTRA set, the extra field, an empty final deflate
+        # block and a zero CRC32 / ISIZE
+        return (b'\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff' +
+                struct.pack('<H', len(extra)) + extra +
+                b'\x03\x00' + b'\x00' * 8)
+
+    return struct.pack('<II', SKIPPABLE_FRAME_MAGIC, len(locator)) + locator
+
+#########################################################################
+def read_locator(filename):
+    """
+    Read the index locator of an archive, returning (compression, index
+    offset, index length, index header offset) or None if the archive has
+    no index
+    """
+
+    compression = detect_compression(filename)
+
+    if compression not in SEEKABLE_COMPRESSIONS:
+        return None
+
+    trailer_size = GZIP_TRAILER_SIZE if compression == WpCompression.GZIP else SKIPPABLE_TRAILER_SIZE
+
+    if os.path.getsize(filename) < trailer_size:
+        return None
+
+    with open(filename, 'rb') as stream:
+        stream.seek(-trailer_size, io.SEEK_END)
+        trailer = stream.read(trailer_size)
+
+    if compression == WpCompression.GZIP:
+        if trailer[:4] != b'\x1f\x8b\x08\x04' or trailer[12:14] != GZIP_EXTRA_ID:
+            return None
+        locator = trailer[16:16 + LOCATOR_SIZE]
+    else:
+        magic, size = struct.unpack('<II', trailer[:8])
+        if magic != SKIPPABLE_FRAME_MAGIC or size != LOCATOR_SIZE:
+            return None
+        locator = trailer[8:]
+
+    magic, index_offset, index_length, index_header_offset = struct.unpack(LOCATOR_FORMAT, locator)
+
+    if magic != LOCATOR_MAGIC:
+        return None
+
+    return compression, index_offset, index_length, index_header_offset
+
+#########################################################################
+def is_seekable(filename):
+    """
+    True when ``filename`` is a seekable archive with an embedded index
+    """
+
+    return read_locator(filename) is not None
+
+class WpSeekableArchive:
+    """ WpSeekableArchive """
+
+    #########################################################################
+    def __init__(self, filename):
+        """
+        Open a seekable archive and load its index
+
+        Args:
+            filename (str): path of the archive
+        Raises:
+            ValueError: the archive has no index
+        """
+        self.__log = logging.getLogger(__name__)
+
+        locator = read_locator(filename)
+
+        if locator is None:
+            raise ValueError("'{}' is not a seekable archive".format(filename))
+
+        self.filename = filename
+        self.compression, index_offset, index_length, index_header_offset = locator
+
+        self.__fileobj = open(filename, 'rb') # pylint: disable=consider-using-with
+
+        self.__fileobj.seek(index_offset)
+        index_data = decompress_frames(self.compression, self.__fileobj.read(index_length))
+
+        with tarfile.open(fileobj=io.BytesIO(index_data), mode='r:') as stream:
+            index = json.loads(stream.extractfile(INDEX_ARCNAME).read())
+
+        self.__log.debug('Loaded index of "%s" (header at %d): %d frame(s), %d member(s)', filename, index_header_offset, len(index['frames']), len(index['members']))
+
+        self.__frames = index['frames']
+        self.__frame_offsets = [frame[2] for frame in self.__frames]
+
+        self.__frame_cache = (None, None)
+
+        # name -> (header offset, data offset, size, checksum)
+        self.__members = {member[0]: tuple(member[1:]) for member in index['members']}
+        self.__names = [member[0] for member in index['members']]
+
+    #########################################################################
+    def __enter__(self):
+        return self
+
+    #########################################################################
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    #########################################################################
+    def close(self):
+        """ Close the archive """
+        self.__fileobj.close()
+
+    #########################################################################
+    def getnames(self):
+        """ Names of all members, in archive order """
+        return list(self.__names)
+
+    #########################################################################
+    def members(self):
+        """ (name, size, checksum) of all members, in archive order """
+        return [(name, self.__members[name][2], self.__members[name][3]) for name in self.__names]
+
+    #########################################################################
+    def __contains__(self, name):
+        return name in self.__members
+
+    #########################################################################
+    def __len__(self):
+        return len(self.__names)
+
+    #########################################################################
+    def __load_frame(self, frame_number):
+        """
+        Uncompressed content of a frame (the last frame read is kept)
+        """
+
+        cached_number, cached_data = self.__frame_cache
+
+        if cached_number == frame_number:
+            return cached_data
+
+        compressed_offset, compressed_length, _, _ = self.__frames[frame_number]
+
+        self.__fileobj.seek(compressed_offset)
+        data = decompress_block(self.compression, self.__fileobj.read(compressed_length))
+
+        self.__frame_cache = (frame_number, data)
+
+        return data
+
+    #########################################################################
+    def __find_frame(self, position):
+        return max(bisect.bisect_right(self.__frame_offsets, position) - 1, 0)
+
+    #########################################################################
+    @property
+    def size(self):
+        """ Uncompressed size of everything before the index """
+
+        if len(self.__frames) == 0:
+            return 0
+
+        return self.__frames[-1][2] + self.__frames[-1][3]
+
+    #########################################################################
+    def read_at(self, position, size):
+        """
+        Read up to ``size`` uncompressed bytes at ``position``, from a single
+        frame (so possibly fewer). Returns b'' past the end.
+        """
+
+        if position >= self.size or size <= 0:
+            return b''
+
+        frame_number = self.__find_frame(position)
+        offset = self.__frames[frame_number][2]
+
+        data = self.__load_frame(frame_number)
+
+        return data[position - offset:position - offset + size]
+
+    #########################################################################
+    def iter_range(self, start, end, chunk_size=None):
+        """
+        Yield the uncompressed bytes from ``start`` to ``end``, decompressing
+        only the frames that overlap that range
+        """
+
+        frame_number = self.__find_frame(start)
+
+        while start < end and frame_number < len(self.__frames):
+            _, _, offset, length = self.__frames[frame_number]
+
+            data = self.__load_frame(frame_number)
+
+            piece = data[start - offset:min(end, offset + length) - offset]
+            if chunk_size is None:
+                yield piece
+            else:
+                for position in range(0, len(piece), chunk_size):
+                    yield piece[position:position + chunk_size]
+
+            start = offset + length
+            frame_number += 1
+
+    #########################################################################
+    def open_tarfile(self):
+        """
+        Open a random access TarFile over the archive. Use ``gettarinfo`` to
+        get members from it: only the frames that are read are decompressed.
+        """
+
+        return tarfile.open(fileobj=_WpFrameReader(self), mode='r:')
+
+    #########################################################################
+    def gettarinfo(self, stream, name):
+        """
+        TarInfo of a member of a TarFile returned by ``open_tarfile``, read
+        from its header, ready for ``extractfile`` / ``extractall``
+        """
+
+        stream.fileobj.seek(self.__members[name][0])
+
+        return tarfile.TarInfo.fromtarfile(stream)
+
+    #########################################################################
+    def getmember(self, name):
+        """
+        TarInfo of a member, read from its own header
+        """
+
+        header_offset, data_offset, _, _ = self.__members[name]
+
+        header = b''.join(self.iter_range(header_offset, data_offset))
+
+        # An empty tar stream after the header lets tarfile resolve pax and
+        # GNU extended headers exactly as it does for a full archive
+        stream = tarfile.open(fileobj=io.BytesIO(header + b'\0' * 2 * tarfile.BLOCKSIZE), mode='r:')
+        tarinfo = stream.next()
+        stream.close()
+
+        return tarinfo
+
+    #########################################################################
+    def iter_member(self, name):
+        """
+        Yield the content of a member
+        """
+
+        _, data_offset, size, _ = self.__members[name]
+
+        return self.iter_range(data_offset, data_offset + size)
+
+    #########################################################################
+    def read_member(self, name):
+        """
+        Content of a (small) member
+        """
+
+        return b''.join(self.iter_member(name))
+
+    #########################################################################
+    def extract_member(self, name, path):
+        """
+        Write the content of a member to ``path``
+        """
+
+        self.__log.info('Extracting "%s" from "%s" to "%s"', name, self.filename, path)
+
+        with open(path, 'wb') as output:
+            for data in self.iter_member(name):
+                output.write(data)
+
+        tarinfo = self.getmember(name)
+        os.chmod(path, tarinfo.mode)
+        os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+
+    #########################################################################
+    def copy_member(self, name, output):
+        """
+        Copy the content of a member to the writable file object ``output``
+        """
+
+        for data in self.iter_member(name):
+            output.write(data)
+
+class _WpFrameReader(io.RawIOBase):
+    """
+    Seekable, readable view of the uncompressed content of a seekable
+    archive
+    """
+
+    #########################################################################
+    def __init__(self, archive):
+        super().__init__()
+
+        self.__archive = archive
+        self.__position = 0
+
+    #########################################################################
+    def readable(self):
+        return True
+
+    #########################################################################
+    def seekable(self):
+        return True
+
+    #########################################################################
+    def tell(self):
+        return self.__position
+
+    #########################################################################
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.__position
+        elif whence == io.SEEK_END:
+            offset += self.__archive.size
+
+        self.__position = max(offset, 0)
+
+        return self.__position
+
+    #########################################################################
+    def readinto(self, buffer):
+        data = self.__archive.read_at(self.__position, len(buffer))
+
+        buffer[:len(data)] = data
+        self.__position += len(data)
+
+        return len(data)
+
+    #########################################################################
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.__archive.size - self.__position, 0)
+
+        # tarfile reads whole members at once: gather them across frames
+        pieces = []
+        while size > 0:
+            data = self.__archive.read_at(self.__position, size)
+            if not data:
+                break
+            pieces.append(data)
+            self.__position += len(data)
+            size -= len(data)
+
+        return b''.join(pieces)
+
+#########################################################################
+def list_archive(filename):
+    """
+    (name, size) of every member of an archive, read from the index when
+    the archive has one and by scanning it otherwise
+    """
+
+    if is_seekable(filename):
+        with WpSeekableArchive(filename) as archive:
+            return [(name, size) for name, size, _ in archive.members()]
+
+    with open_archive_reader(filename) as fileobj, tarfile.open(fileobj=fileobj, mode='r|') as stream:
+        return [(member.name, member.size) for member in stream_members(stream)]
+
+#########################################################################
+def copy_member(filename, name, output):
+    """
+    Copy one member of an archive to the writable file object ``output``
+    """
+
+    if is_seekable(filename):
+        with WpSeekableArchive(filename) as archive:
+            if name not in archive:
+                raise KeyError("member '{}' not found".format(name))
+            archive.copy_member(name, output)
+            return
+
+    with open_archive_reader(filename) as fileobj, tarfile.open(fileobj=fileobj, mode='r|') as stream:
+        for member in stream_members(stream):
+            if member.name == name:
+                shutil.copyfileobj(stream.extractfile(member), output)
+                return
+
+    raise KeyError("member '{}' not found".format(name))
+
+#########################################################################
+def iter_members(filename, names):
+    """
+    Yield the content of the members ``names`` of a seekable archive, one
+    after the other. The archive is opened by the generator itself, so
+    several of them can read the same archive from different threads.
+    """
+
+    with WpSeekableArchive(filename) as archive:
+        for name in names:
+            yield from archive.iter_member(name)
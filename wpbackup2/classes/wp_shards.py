@@ -0,0 +1,491 @@
+"""
+wp_shards
+
+Sharded backups. Instead of a single archive, the WordPress core, the
+plugins, the themes, the uploads (optionally one shard per year directory)
+and the database are each written to an archive of their own in a backup
+directory, several shards at a time. A ``shards.json`` manifest ties them
+together:
+
+    {
+      "version": 1,
+      "backup_id": "...",
+      "created": "2024-05-01T12:00:00",
+      "settings": {"compression": "gzip", "compression_level": null, "hash_files": true, "hash_algorithm": "blake2b", "seekable": false},
+      "shards": [
+        {"name": "core", "archive": "core.tar.gz", "root": "", "excluded": ["wp-content/plugins", ...],
+         "size": 123456, "fingerprint": "...", "reused": false},
+        {"name": "database", "archive": "database.tar.gz", "root": null, ...},
+        ...
+      ]
+    }
+
+Every shard is an ordinary archive, so a single shard can be listed,
+extracted or restored on its own. The core shard holds everything outside
+the other file shards, wp-config.php included.
+
+When a previous sharded backup is given, a file shard whose fingerprint (the
+path, type, mode, size, mtime and inode of everything it holds) and archive
+settings are unchanged is hard linked (or copied) from that backup instead
+of being written again. The database is always dumped.
+
+A restore extracts the core shard first, as it carries wp-config.php (read
+by the database restore) and clears the site when asked to, then restores
+the other shards in parallel.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+import datetime
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import archive_extension
+from wpbackup2.classes.wp_compression import resolve_workers
+from wpbackup2.classes.wp_internal_backup import WpBackupMode
+from wpbackup2.classes.wp_internal_backup import WpInternalBackup
+from wpbackup2.classes.wp_internal_restore import WpInternalRestore
+from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_metrics import WpMetrics
+
+SHARDS_MANIFEST = 'shards.json'
+SHARDS_VERSION = 1
+
+CORE_SHARD = 'core'
+DATABASE_SHARD = 'database'
+
+UPLOADS_PATH = 'wp-content/uploads'
+YEAR_SHARD_PREFIX = 'uploads-'
+YEAR_PATTERN = re.compile(r'^\d{4}$')
+
+# (name, root) of the shards split off the core
+DIRECTORY_SHARDS = [
+    ('plugins', 'wp-content/plugins'),
+    ('themes', 'wp-content/themes'),
+    ('uploads', UPLOADS_PATH)
+]
+
+#########################################################################
+def is_sharded(path):
+    """ True when ``path`` is the directory of a sharded backup """
+    return os.path.isfile(os.path.join(str(path), SHARDS_MANIFEST))
+
+#########################################################################
+def plan_shards(site_path, backup_mode=WpBackupMode.ALL, split_uploads=False):
+    """
+    The shards of a backup of the site at ``site_path``: the core, a shard
+    per directory of DIRECTORY_SHARDS that exists, with ``split_uploads``
+    a shard per year directory of the uploads, and the database
+    """
+
+    shards = []
+
+    if WpBackupMode.FILES in backup_mode:
+        uploads = os.path.join(str(site_path), UPLOADS_PATH)
+        years = []
+
+        if split_uploads and os.path.isdir(uploads):
+            years = sorted(entry.name for entry in os.scandir(uploads) if YEAR_PATTERN.match(entry.name) and entry.is_dir(follow_symlinks=False))
+
+        shards.append(WpShard(CORE_SHARD, '', [root for _, root in DIRECTORY_SHARDS]))
+
+        for name, root in DIRECTORY_SHARDS:
+            if not os.path.isdir(os.path.join(str(site_path), root)):
+                continue
+
+            shards.append(WpShard(name, root, [UPLOADS_PATH + '/' + year for year in years] if root == UPLOADS_PATH else None))
+
+        shards.extend(WpShard(YEAR_SHARD_PREFIX + year, UPLOADS_PATH + '/' + year) for year in years)
+
+    if WpBackupMode.DATABASE in backup_mode:
+        shards.append(WpShard(DATABASE_SHARD))
+
+    return shards
+
+#########################################################################
+def _raise_first_error(futures):
+    """
+    Raise the error of the shard that failed first: the shards it stopped
+    fail with an InterruptedError
+    """
+
+    errors = [future.exception() for future in futures if future.exception() is not None]
+
+    for error in errors:
+        if not isinstance(error, InterruptedError):
+            raise error
+
+    if len(errors) > 0:
+        raise errors[0]
+
+#########################################################################
+def _link_or_copy(source, destination):
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+class WpShard:
+    """
+    A shard of a backup: the paths under ``root`` (relative to the
+    WordPress directory, '' for all of it) except those under one of
+    ``excluded``; or the database when ``root`` is None
+    """
+
+    #########################################################################
+    def __init__(self, name, root=None, excluded=None, archive=None, size=None, fingerprint=None, reused=False):
+        """
+        Constructor
+
+        Args:
+            name (str):         name of the shard, also names its archive
+            root (str):         directory the shard holds (None for the database)
+            excluded (list):    directories below ``root`` left to other shards
+            archive (str):      filename of the archive, relative to the backup directory
+            size (int):         size of the archive in bytes
+            fingerprint (str):  hash of the metadata of every path in the shard
+            reused (bool):      the archive was taken over from a previous backup
+        """
+        self.name = name
+        self.root = root
+        self.excluded = list(excluded or [])
+        self.archive = archive
+        self.size = size
+        self.fingerprint = fingerprint
+        self.reused = reused
+
+    #########################################################################
+    @property
+    def is_database(self):
+        """ True for the database shard """
+        return self.root is None
+
+    #########################################################################
+    def contains(self, path, is_dir=False):
+        """
+        True when ``path`` (relative to the WordPress directory) belongs to
+        the shard. The directories above the root belong to it as well, so
+        the walk reaches the root.
+        """
+
+        if self.root is None:
+            return False
+
+        if self.root != '' and path != self.root and not path.startswith(self.root + '/'):
+            return is_dir and self.root.startswith(path + '/')
+
+        return not any(path == excluded or path.startswith(excluded + '/') for excluded in self.excluded)
+
+    #########################################################################
+    def to_dict(self):
+        """ The shard as stored in the shards manifest """
+        return {'name': self.name, 'archive': self.archive, 'root': self.root, 'excluded': self.excluded, 'size': self.size, 'fingerprint': self.fingerprint, 'reused': self.reused}
+
+    #########################################################################
+    @classmethod
+    def from_dict(cls, content):
+        """ Read a shard of the shards manifest """
+        return cls(content['name'], content.get('root'), content.get('excluded'), content.get('archive'), content.get('size'), content.get('fingerprint'), content.get('reused', False))
+
+class WpShardRules:
+    """
+    Ignore rules of a shard: everything outside the shard is ignored, on
+    top of the rules of the whole backup (a WpIgnoreRules)
+    """
+
+    #########################################################################
+    def __init__(self, shard, ignore_rules=None):
+        self.__shard = shard
+        self.__ignore_rules = ignore_rules
+
+    #########################################################################
+    def is_ignored(self, path, is_dir=False):
+        """ True when ``path`` is outside the shard or ignored by the backup """
+
+        if not self.__shard.contains(path, is_dir):
+            return True
+
+        return self.__ignore_rules is not None and self.__ignore_rules.is_ignored(path, is_dir)
+
+class WpShardsManifest:
+    """ WpShardsManifest """
+
+    #########################################################################
+    def __init__(self, backup_id=None, created=None, settings=None, shards=None):
+        """
+        Constructor
+
+        Args:
+            backup_id (str):    unique id of the backup (generated when None)
+            created (str):      ISO 8601 creation time (now when None)
+            settings (dict):    compression, level, seekable and hashing of the
+                                archives (a shard is only reused with the same)
+            shards (list):      WpShard instances
+        """
+        self.backup_id = backup_id if backup_id is not None else uuid.uuid4().hex
+        self.created = created if created is not None else datetime.datetime.now().isoformat()
+        self.settings = settings or {}
+        self.shards = list(shards or [])
+
+    #########################################################################
+    def shard(self, name):
+        """ The shard called ``name``, None when there is none """
+        return next((shard for shard in self.shards if shard.name == name), None)
+
+    #########################################################################
+    def to_json(self):
+        """ Serialize to JSON """
+        return json.dumps({'version': SHARDS_VERSION, 'backup_id': self.backup_id, 'created': self.created, 'settings': self.settings, 'shards': [shard.to_dict() for shard in self.shards]}, indent=2)
+
+    #########################################################################
+    @classmethod
+    def from_json(cls, data):
+        """ Deserialize from JSON (str or bytes) """
+
+        content = json.loads(data)
+
+        if content.get('version') != SHARDS_VERSION:
+            raise ValueError("unsupported shards manifest version {}".format(content.get('version')))
+
+        return cls(content['backup_id'], content['created'], content.get('settings'), [WpShard.from_dict(shard) for shard in content['shards']])
+
+    #########################################################################
+    def write(self, directory):
+        """ Write the manifest to the backup ``directory`` """
+
+        filename = os.path.join(str(directory), SHARDS_MANIFEST)
+
+        # Written under another name first, a backup directory holding a
+        # manifest is always complete
+        with open(filename + '.tmp', 'w') as output:
+            output.write(self.to_json() + '\n')
+        os.replace(filename + '.tmp', filename)
+
+    #########################################################################
+    @classmethod
+    def from_directory(cls, directory):
+        """ Read the manifest of the sharded backup in ``directory`` """
+
+        with open(os.path.join(str(directory), SHARDS_MANIFEST), 'r') as source:
+            return cls.from_json(source.read())
+
+class WpShardedBackup:
+    """ WpShardedBackup """
+
+    #########################################################################
+    def __init__(self, wp_site, temp_path, what_if=False, compression_workers=1, host_limiter=None, compression_executor=None, core_cache=None, metrics=None):
+        self.__log = logging.getLogger(__name__)
+
+        self.__wp_site = wp_site
+        self.__temp_path = temp_path
+        self.__what_if = what_if
+        self.__compression_workers = compression_workers
+        self.__host_limiter = host_limiter
+        self.__compression_executor = compression_executor
+        self.__core_cache = core_cache
+        self.__metrics = metrics if metrics is not None else WpMetrics('backup', wp_site.site_path)
+
+    #########################################################################
+    def __backup_shard(self, shard, backup_directory, archive_options, previous_directory, previous, ignore_rules, dump_workers, cancelled):
+        """ Write the archive of ``shard``, or reuse that of ``previous`` """
+
+        shard.archive = shard.name + archive_extension(archive_options['compression'])
+        archive_filename = os.path.join(str(backup_directory), shard.archive)
+
+        wp_op = WpInternalBackup(self.__wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter,
+                                 compression_executor=self.__compression_executor, cancelled=cancelled, metrics=self.__metrics)
+
+        rules = None if shard.is_database else WpShardRules(shard, ignore_rules)
+
+        if not shard.is_database:
+            shard.fingerprint = wp_op.fingerprint(rules)
+
+            reusable = previous.shard(shard.name) if previous is not None else None
+            if reusable is not None and reusable.root == shard.root and reusable.excluded == shard.excluded and reusable.fingerprint == shard.fingerprint:
+                self.__log.info('Shard %s is unchanged, reusing "%s"', shard.name, os.path.join(str(previous_directory), reusable.archive))
+
+                if not self.__what_if:
+                    _link_or_copy(os.path.join(str(previous_directory), reusable.archive), archive_filename)
+                    shard.size = os.path.getsize(archive_filename)
+
+                shard.reused = True
+                return shard
+
+        self.__log.info('Backing up shard %s to "%s"', shard.name, archive_filename)
+
+        wp_op.backup(archive_filename=archive_filename, backup_mode=WpBackupMode.DATABASE if shard.is_database else WpBackupMode.FILES,
+                     ignore_rules=rules, dump_workers=dump_workers, core_cache=self.__core_cache, **archive_options)
+
+        if not self.__what_if:
+            shard.size = os.path.getsize(archive_filename)
+
+        return shard
+
+    #########################################################################
+    def backup(self, backup_directory, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, hash_files=True, seekable=False, ignore_rules=None, dump_workers=1, shard_workers=4, split_uploads=False, previous_directory=None, hash_algorithm=HASH_ALGORITHM):
+        """
+        Write a sharded backup to ``backup_directory`` (created when
+        missing), ``shard_workers`` shards at a time (0 = one per CPU core),
+        and return its WpShardsManifest.
+
+        With ``split_uploads`` every year directory of the uploads is a
+        shard of its own. File shards unchanged since the sharded backup in
+        ``previous_directory`` are reused from it. The other arguments are
+        those of WpInternalBackup.backup.
+
+        When a shard fails the others are stopped, and no shards manifest
+        is written.
+        """
+
+        shards = plan_shards(self.__wp_site.site_path, backup_mode, split_uploads)
+        manifest = WpShardsManifest(settings={'compression': compression.value, 'compression_level': compression_level, 'hash_files': hash_files or seekable, 'hash_algorithm': hash_algorithm if hash_files or seekable else None, 'seekable': seekable}, shards=shards)
+
+        previous = None
+        if previous_directory is not None:
+            if not is_sharded(previous_directory):
+                raise ValueError("'{}' is not a sharded backup".format(previous_directory))
+
+            previous = WpShardsManifest.from_directory(previous_directory)
+            if previous.settings != manifest.settings:
+                self.__log.info('The archives of "%s" were written with other settings, no shard is reused', previous_directory)
+                previous = None
+
+        self.__log.info('Creating sharded backup in "%s": %s', backup_directory, ', '.join(shard.name for shard in shards))
+
+        if not self.__what_if:
+            os.makedirs(str(backup_directory), exist_ok=True)
+
+        archive_options = {'compression': compression, 'compression_level': compression_level, 'hash_files': hash_files, 'hash_algorithm': hash_algorithm, 'seekable': seekable}
+
+        # The first shard to fail stops the others
+        cancelled = threading.Event()
+
+        def backup_shard(shard):
+            try:
+                if cancelled.is_set():
+                    raise InterruptedError("backup of shard {} cancelled".format(shard.name))
+
+                return self.__backup_shard(shard, backup_directory, archive_options, previous_directory, previous, ignore_rules, dump_workers, cancelled)
+            except BaseException:
+                cancelled.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=resolve_workers(shard_workers), thread_name_prefix='wpbackup2-shard') as executor:
+            futures = [executor.submit(backup_shard, shard) for shard in shards]
+
+        _raise_first_error(futures)
+
+        if not self.__what_if:
+            manifest.write(backup_directory)
+            self.__metrics.archive_bytes = sum(shard.size for shard in shards)
+
+        self.__log.info('Sharded backup complete: %d shard(s), %d reused', len(shards), sum(1 for shard in shards if shard.reused))
+
+        return manifest
+
+class WpShardedRestore:
+    """ WpShardedRestore """
+
+    #########################################################################
+    def __init__(self, wp_site, temp_path, what_if=False, host_limiter=None, core_cache=None, metrics=None):
+        self.__log = logging.getLogger(__name__)
+
+        self.__wp_site = wp_site
+        self.__temp_path = temp_path
+        self.__what_if = what_if
+        self.__host_limiter = host_limiter
+        self.__core_cache = core_cache
+        self.__metrics = metrics if metrics is not None else WpMetrics('restore', wp_site.site_path)
+
+    #########################################################################
+    def __restore_shard(self, shard, backup_directory, restore_mode, path_filter, load_workers, extract_workers, update_config, cancelled):
+        archive_filename = os.path.join(str(backup_directory), shard.archive)
+
+        self.__log.info('Restoring shard %s from "%s"', shard.name, archive_filename)
+
+        wp_op = WpInternalRestore(self.__wp_site, self.__temp_path, what_if=self.__what_if, host_limiter=self.__host_limiter, cancelled=cancelled, metrics=self.__metrics)
+
+        try:
+            if cancelled.is_set():
+                raise InterruptedError("restore of shard {} cancelled".format(shard.name))
+
+            return wp_op.restore(archive_filename=archive_filename, restore_mode=restore_mode, path_filter=path_filter, load_workers=load_workers, update_config=update_config, core_cache=self.__core_cache, extract_workers=extract_workers)
+        except BaseException:
+            cancelled.set()
+            raise
+
+    #########################################################################
+    def restore(self, backup_directory, restore_mode=WpRestoreMode.ALLCLEAN, path_filter=None, load_workers=1, extract_workers=1, shard_workers=4):
+        """
+        Restore the sharded backup in ``backup_directory``: the core shard
+        first, then the other shards ``shard_workers`` at a time (0 = one
+        per CPU core). The other arguments are those of
+        WpInternalRestore.restore.
+
+        wp-config.php is updated once, by the core shard (by the database
+        shard when the files are not restored), so shards restoring at the
+        same time never rewrite it concurrently.
+
+        With SYNCFILES and REMOVEFILESBEFORERESTORE the files that no shard
+        holds are removed once every shard is restored, as each shard only
+        knows its own files.
+        """
+
+        manifest = WpShardsManifest.from_directory(backup_directory)
+
+        self.__log.info('Restoring sharded backup %s from "%s": %s', manifest.backup_id, backup_directory, ', '.join(shard.name for shard in manifest.shards))
+
+        restore_files = WpRestoreMode.FILES in restore_mode
+        core = manifest.shard(CORE_SHARD) if restore_files else None
+
+        sync_files = restore_mode & WpRestoreMode.SYNCFILES
+        remove_unlisted = bool(sync_files) and WpRestoreMode.REMOVEFILESBEFORERESTORE in restore_mode
+        core_mode = WpRestoreMode.FILES | sync_files if remove_unlisted else restore_mode & (WpRestoreMode.FILES | WpRestoreMode.REMOVEFILESBEFORERESTORE | WpRestoreMode.SYNCFILES)
+
+        cancelled = threading.Event()
+
+        file_manifests = []
+
+        if core is not None:
+            file_manifests.append(self.__restore_shard(core, backup_directory, core_mode, path_filter, load_workers, extract_workers, True, cancelled))
+
+        pending = []
+        for shard in manifest.shards:
+            if shard.is_database and WpRestoreMode.DATABASE in restore_mode:
+                pending.append((shard, restore_mode & (WpRestoreMode.DATABASE | WpRestoreMode.DELETEDATABASEBEFORERESTORE), core is None))
+            elif not shard.is_database and shard is not core and restore_files:
+                pending.append((shard, WpRestoreMode.FILES | sync_files, False))
+
+        with ThreadPoolExecutor(max_workers=resolve_workers(shard_workers), thread_name_prefix='wpbackup2-shard') as executor:
+            futures = [executor.submit(self.__restore_shard, shard, backup_directory, mode, path_filter, load_workers, extract_workers, update_config, cancelled) for shard, mode, update_config in pending]
+
+        _raise_first_error(futures)
+
+        if remove_unlisted:
+            file_manifests += [future.result() for future, (shard, _, _) in zip(futures, pending) if not shard.is_database]
+
+            if None in file_manifests:
+                self.__log.warning('A shard of "%s" has no manifest, files that are not in the backup are kept', backup_directory)
+            else:
+                listed = set()
+                for shard_manifest in file_manifests:
+                    listed.update(shard_manifest.entries)
+
+                wp_op = WpInternalRestore(self.__wp_site, self.__temp_path, what_if=self.__what_if, metrics=self.__metrics)
+                with self.__metrics.phase('remove'):
+                    wp_op.remove_unlisted_files(listed, path_filter)
+
+        self.__log.info('Sharded restore complete.')
+
+        return manifest
@@ -0,0 +1,116 @@
+"""
+wp_verify_result
+
+Outcome of the verification of one archive (see WpBackup.verify): the
+backup it holds, how many files and database dumps were checked, the
+problems found and how fast the archive was read.
+
+This class should NOT be called directly
+"""
+
+# pylint: disable=line-too-long
+
+# Only the first errors are kept, an archive with a corrupt manifest would
+# otherwise report every one of its files
+MAX_REPORTED_ERRORS = 100
+
+class WpVerifyResult:
+    """ WpVerifyResult """
+
+    #########################################################################
+    def __init__(self, archive_filename, metrics=None):
+        """
+        Constructor
+
+        Args:
+            archive_filename (str): archive verified ('-' for stdin)
+            metrics (WpMetrics):    time, bytes and files of every phase
+        """
+        self.archive_filename = archive_filename
+        self.metrics = metrics
+
+        self.backup_id = None
+        self.parent_id = None
+
+        # Files read from the archive, and how many of them were compared
+        # with a content hash of the manifest
+        self.files = 0
+        self.hashed_files = 0
+
+        # Names of the complete database dumps (DB_DUMP_ARCNAME or the
+        # members of a per-table dump, without their segment numbers)
+        self.database_dumps = []
+
+        self.errors = []
+        self.error_count = 0
+        self.warnings = []
+
+    #########################################################################
+    def add_error(self, message):
+        """ Record a problem that makes the archive fail verification """
+
+        self.error_count += 1
+
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    #########################################################################
+    def add_warning(self, message):
+        """ Record something that was not verified """
+        self.warnings.append(message)
+
+    #########################################################################
+    @property
+    def succeeded(self):
+        """ True when no problem was found """
+        return self.error_count == 0
+
+    #########################################################################
+    @property
+    def bytes_read(self):
+        """ Uncompressed bytes of the archive that were read """
+
+        if self.metrics is None:
+            return 0
+
+        return self.metrics.phases.get('decompress', {}).get('bytes_out', 0)
+
+    #########################################################################
+    @property
+    def throughput(self):
+        """ Uncompressed bytes read per second (None until the metrics are finished) """
+
+        if self.metrics is None or not self.metrics.duration:
+            return None
+
+        return self.bytes_read / self.metrics.duration
+
+    #########################################################################
+    def to_dict(self):
+        """ The result as a JSON serialisable dict """
+
+        return {
+            'archive': self.archive_filename,
+            'succeeded': self.succeeded,
+            'backup_id': self.backup_id,
+            'parent_id': self.parent_id,
+            'files': self.files,
+            'hashed_files': self.hashed_files,
+            'database_dumps': self.database_dumps,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'warnings': self.warnings,
+            'bytes': self.bytes_read,
+            'throughput_mb_s': round(self.throughput / 1000000, 3) if self.throughput is not None else None,
+            'metrics': None if self.metrics is None else self.metrics.to_dict()
+        }
+
+    #########################################################################
+    def __str__(self):
+        summary = "{} file(s), {} hashed, {} database dump(s), {:.1f} MB/s".format(
+            self.files, self.hashed_files, len(self.database_dumps), (self.throughput or 0) / 1000000)
+
+        if self.succeeded:
+            return "{}: OK ({})".format(self.archive_filename, summary)
+
+        return "{}: FAILED with {} error(s), the first is: {} ({})".format(self.archive_filename, self.error_count, self.errors[0], summary)
@@ -2,68 +2,488 @@
 
 # pylint: disable=line-too-long
 
+import contextlib
 import logging
 import datetime
+import os
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from wpbackup2.exceptions import WpBackupNotFoundError
 
 from wpbackup2.classes.wp_internal_restore import WpInternalRestore
 from wpbackup2.classes.wp_internal_backup import WpInternalBackup
+from wpbackup2.classes.wp_backup_result import WpBackupResult
+from wpbackup2.classes.wp_async_runner import WpAsyncRunner
+from wpbackup2.classes.wp_archive_verifier import WpArchiveVerifier
 
+from wpbackup2.classes.wp_compression import WpCompression
+from wpbackup2.classes.wp_compression import archive_extension
+from wpbackup2.classes.wp_compression import resolve_workers
+from wpbackup2.classes.wp_core_cache import WpCoreCache
 from wpbackup2.classes.wp_internal_backup import WpBackupMode
 from wpbackup2.classes.wp_internal_restore import WpRestoreMode
+from wpbackup2.classes.wp_host_limiter import WpDbHostLimiter
+from wpbackup2.classes.wp_ignore_rules import WpIgnoreRules
+from wpbackup2.classes.wp_manifest import HASH_ALGORITHM
+from wpbackup2.classes.wp_metrics import WpMetrics
+from wpbackup2.classes.wp_path_filter import WpPathFilter
+from wpbackup2.classes.wp_profiler import OTHER_PHASE
+from wpbackup2.classes.wp_profiler import WpProfiler
+from wpbackup2.classes.wp_repository import WpRepository
+from wpbackup2.classes.wp_seekable_archive import copy_member
+from wpbackup2.classes.wp_seekable_archive import list_archive
+from wpbackup2.classes.wp_shards import WpShardedBackup
+from wpbackup2.classes.wp_shards import WpShardedRestore
+from wpbackup2.classes.wp_shards import is_sharded
 from wpbackup2.classes.wpsite import WpSite
 
+PROFILE_DIRECTORY_SUFFIX = '.profile'
+
 class WpBackup:
     """ WpBackup """
 
     __what_if = False
     __temp_path = "/tmp"
+    __compression_workers = 1
+    __host_limiter = None
+    __core_cache = None
 
     #########################################################################
-    def __init__(self, what_if=False, temp_path=None):
+    def __init__(self, what_if=False, temp_path=None, compression_workers=1, db_host_limits=None, core_cache=None):
+        """
+        Constructor
+
+        Args:
+            what_if (bool):             Log what would happen without changing anything
+            temp_path (str):            Path used for temporary files
+            compression_workers (int):  Number of threads compressing the archive
+                                        (1 keeps single threaded gzip, 0 uses one
+                                        thread per CPU core)
+            db_host_limits (dict):      Maximum number of concurrent database
+                                        connections per DB_HOST, shared by all
+                                        operations of this instance
+            core_cache (str):           Directory of unpacked WordPress releases (one
+                                        per version); backups then only reference
+                                        unmodified core files, and restores copy
+                                        them back from it
+        """
         self.__log = logging.getLogger(__name__)
 
         self.__what_if = what_if
         self.__temp_path = temp_path if not temp_path is None else "/tmp"
+        self.__compression_workers = compression_workers
+        self.__host_limiter = WpDbHostLimiter(db_host_limits)
+        self.__core_cache = WpCoreCache(core_cache) if core_cache is not None else None
 
     #########################################################################
-    def backup(self, wp_site, archive_filename, backup_mode=WpBackupMode.ALL):
+    def backup(self, wp_site, archive_filename, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, base_archive=None, hash_files=True, seekable=False, excludes=None, includes=None, default_excludes=True, dump_workers=1, metrics_file=None, profile=False, hash_algorithm=HASH_ALGORITHM):
         """
         Performs a backup.
 
         Args:
-            wp_site (WpSite):           WordPress Site Details.e
-            archive_filename (str):     Path and filename of tar gzip file to create.
-            backup_mode (WpBackupMode): The backup mode to use
+            wp_site (WpSite):               WordPress Site Details.e
+            archive_filename (str):         Path and filename of the archive to create.
+            backup_mode (WpBackupMode):     The backup mode to use
+            compression (WpCompression):    The compression codec to use
+            compression_level (int):        The codec specific compression level
+                                            (None uses the codec default)
+            base_archive (str):             Previous backup to take an incremental
+                                            file backup against (None for a full backup)
+            hash_files (bool):              Record a content hash for every file in
+                                            the manifest, computed while the file is
+                                            archived
+            seekable (bool):                Embed a member index so single members can
+                                            be listed and extracted without reading the
+                                            whole archive (not available with xz)
+            excludes (list):                gitignore-style patterns of paths to leave out
+                                            (added to the site's .wpbackupignore)
+            includes (list):                Patterns of excluded paths to back up anyway
+            default_excludes (bool):        Leave out well-known cache, upgrade and backup
+                                            plugin directories
+            dump_workers (int):             Number of tables dumped concurrently (1 = a
+                                            single mysqldump of the whole database, 0 =
+                                            one per CPU core); capped by db_host_limits
+            metrics_file (str):             Write the metrics of the backup to this file,
+                                            also when it fails (a Prometheus textfile
+                                            when it ends in .prom, JSON otherwise)
+            profile (bool|str):             Profile every phase with cProfile and write
+                                            the profiles to this directory (True =
+                                            <archive>.profile next to the archive)
+            hash_algorithm (str):           Algorithm of the content hashes (blake2b, or
+                                            xxh3_128 with the xxhash package)
+        Returns:
+            WpMetrics: Time, bytes and files of every phase of the backup.
         Raises:
-            WpConfigNotFoundError:  wp-config.php was not found.
+            WpConfigNotFoundError:      wp-config.php was not found.
+            WpHashNotAvailableError:    The package of hash_algorithm is not installed.
+        """
+
+        return self.__backup(wp_site, archive_filename, backup_mode, compression, compression_level, base_archive, hash_files, seekable, excludes, includes, default_excludes, dump_workers, metrics_file, profile, hash_algorithm)
+
+    #########################################################################
+    async def backup_async(self, wp_site, archive_filename, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, base_archive=None, hash_files=True, seekable=False, excludes=None, includes=None, default_excludes=True, dump_workers=1, metrics_file=None, hash_algorithm=HASH_ALGORITHM):
+        """
+        Performs a backup without blocking the event loop.
+
+        Takes the same arguments as backup, but profile (its steps run on
+        several threads, which cProfile does not follow). The backup runs
+        on the loop: mysqldump and mysql are asyncio subprocesses read by
+        the loop, and the archive is written (and compressed) on the loop's
+        default executor one short step at a time, so concurrent backups
+        and restores share its threads instead of holding one each.
+        Cancelling the task kills the child processes and removes the
+        incomplete archive.
         """
 
         self.__log.info('Starting backup.')
 
-        wp_op = WpInternalBackup(wp_site, self.__temp_path, what_if=self.__what_if)
+        archive_filename = self.__archive_filename(wp_site, archive_filename, compression)
+        metrics = WpMetrics('backup', wp_site.site_path)
 
-        if archive_filename is None or len(archive_filename) == 0:
-            archive_filename = "wpbackup2-{}-{}.tar.gz".format(wp_site.db_name, datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+        with self.__measure(metrics, metrics_file):
+            wp_op = WpInternalBackup(wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter, metrics=metrics)
 
-        wp_op.backup(archive_filename=archive_filename, backup_mode=backup_mode)
+            await wp_op.backup_async(WpAsyncRunner(), archive_filename=archive_filename, backup_mode=backup_mode, compression=compression, compression_level=compression_level, base_archive=base_archive, hash_files=hash_files, seekable=seekable,
+                                     ignore_rules=WpIgnoreRules.for_site(wp_site.site_path, excludes, includes, default_excludes),
+                                     dump_workers=dump_workers, core_cache=self.__core_cache, hash_algorithm=hash_algorithm)
 
         self.__log.info('Backup complete.')
 
+        return metrics
+
+    #########################################################################
+    def __backup(self, wp_site, archive_filename, backup_mode, compression, compression_level, base_archive, hash_files, seekable, excludes, includes, default_excludes, dump_workers, metrics_file, profile=False, hash_algorithm=HASH_ALGORITHM):
+        self.__log.info('Starting backup.')
+
+        archive_filename = self.__archive_filename(wp_site, archive_filename, compression)
+        metrics = WpMetrics('backup', wp_site.site_path, profiler=WpProfiler() if profile else None)
+
+        with self.__measure(metrics, metrics_file, self.__profile_directory(profile, archive_filename)):
+            wp_op = WpInternalBackup(wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter, metrics=metrics)
+
+            wp_op.backup(archive_filename=archive_filename, backup_mode=backup_mode, compression=compression, compression_level=compression_level, base_archive=base_archive, hash_files=hash_files, seekable=seekable,
+                         ignore_rules=WpIgnoreRules.for_site(wp_site.site_path, excludes, includes, default_excludes),
+                         dump_workers=dump_workers, core_cache=self.__core_cache, hash_algorithm=hash_algorithm)
+
+        self.__log.info('Backup complete.')
+
+        return metrics
+
+    #########################################################################
+    @staticmethod
+    def __archive_filename(wp_site, archive_filename, compression):
+        """
+        ``archive_filename``, or a name made of the database name and the
+        time when none was given
+        """
+
+        if archive_filename is None or len(archive_filename) == 0:
+            return "wpbackup2-{}-{}{}".format(wp_site.db_name, datetime.datetime.now().strftime("%Y%m%d%H%M%S"), archive_extension(compression))
+
+        return archive_filename
+
+    #########################################################################
+    @staticmethod
+    def __profile_directory(profile, archive_filename):
+        """
+        Directory the profiles are written to: ``profile`` when it is a
+        path, next to the archive when it is True, None when not profiling
+        """
+
+        if not profile:
+            return None
+
+        if isinstance(profile, str):
+            return profile
+
+        return (archive_filename if archive_filename != '-' else 'wpbackup2-stdin') + PROFILE_DIRECTORY_SUFFIX
+
+    #########################################################################
+    @contextlib.contextmanager
+    def __measure(self, metrics, metrics_file=None, profile_directory=None):
+        """
+        Finish ``metrics`` when the ``with`` block ends, successfully or
+        not, log them and write them to ``metrics_file``. When profiling,
+        the profiles are written to ``profile_directory``.
+        """
+
+        try:
+            with metrics.profile(OTHER_PHASE):
+                yield metrics
+        except BaseException as error:
+            metrics.finish(error)
+            raise
+        else:
+            metrics.finish()
+        finally:
+            self.__log.info('%s metrics: %.1fs, %s',
+                            metrics.operation.capitalize(),
+                            metrics.duration,
+                            ', '.join('{} {:.1f}s'.format(phase, totals['seconds']) for phase, totals in sorted(metrics.phases.items())))
+
+            if metrics_file is not None and not self.__what_if:
+                metrics.write(metrics_file)
+
+            if metrics.profiler is not None and not self.__what_if:
+                metrics.profiler.write(profile_directory)
+
+    #########################################################################
+    def backup_many(self, sites, archive_directory, site_workers=4, io_workers=2, cpu_workers=0, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, seekable=False, excludes=None, includes=None, default_excludes=True, dump_workers=1, hash_files=True, hash_algorithm=HASH_ALGORITHM):
+        """
+        Backs up many sites concurrently (a fleet backup).
+
+        Every site gets its own archive in ``archive_directory``. Sites share
+        one pool of compression threads (``cpu_workers``), at most
+        ``io_workers`` of them read their files at the same time, and the
+        database dumps are limited by db_host_limits. A site that fails does
+        not stop the others.
+
+        Args:
+            sites (list):                   WpSite instances or WordPress directories;
+                                            or a directory whose subdirectories are
+                                            WordPress sites
+            archive_directory (str):        Directory the archives are written to
+            site_workers (int):             Number of sites backed up at once (0 = one
+                                            per CPU core)
+            io_workers (int):               Number of sites reading their files at once
+            cpu_workers (int):              Number of threads compressing, shared by all
+                                            sites (0 = one per CPU core)
+            backup_mode (WpBackupMode):     The backup mode to use
+            compression (WpCompression):    The compression codec to use
+            compression_level (int):        The codec specific compression level
+            seekable (bool):                Embed a member index in every archive
+            excludes (list):                gitignore-style patterns of paths to leave out
+            includes (list):                Patterns of excluded paths to back up anyway
+            default_excludes (bool):        Leave out well-known cache, upgrade and backup
+                                            plugin directories
+            dump_workers (int):             Number of tables of a site dumped concurrently
+            hash_files (bool):              Record a content hash for every file in
+                                            the manifest of every archive
+            hash_algorithm (str):           Algorithm of the content hashes
+        Returns:
+            list: A WpBackupResult per site, in the order of ``sites``.
+        """
+
+        if isinstance(sites, (str, os.PathLike)):
+            sites = WpSite.find_sites(sites)
+
+        sites = list(sites)
+        site_workers = resolve_workers(site_workers)
+        cpu_workers = resolve_workers(cpu_workers)
+
+        self.__log.info('Starting fleet backup of %d site(s): %d at once, %d reading files, %d compression thread(s).', len(sites), site_workers, io_workers, cpu_workers)
+
+        if not self.__what_if:
+            os.makedirs(archive_directory, exist_ok=True)
+
+        timestamp = datetime.datetime.now().strftime("%Y%m%d%H%M%S")
+        io_limiter = threading.BoundedSemaphore(max(io_workers, 1))
+
+        with ThreadPoolExecutor(max_workers=cpu_workers, thread_name_prefix='wpbackup2-compress') as compression_executor, \
+             ThreadPoolExecutor(max_workers=site_workers, thread_name_prefix='wpbackup2-site') as site_executor:
+
+            def backup_site(site):
+                started = time.monotonic()
+                site_path = site.site_path if isinstance(site, WpSite) else site
+                # The whole path names the archive, sites are often all
+                # called public_html or htdocs
+                archive_filename = os.path.join(archive_directory, "wpbackup2-{}-{}{}".format(str(os.path.abspath(str(site_path))).strip(os.path.sep).replace(os.path.sep, '-'), timestamp, archive_extension(compression)))
+
+                metrics = WpMetrics('backup', site_path)
+
+                try:
+                    wp_site = site if isinstance(site, WpSite) else WpSite.from_wp_path(site)
+
+                    wp_op = WpInternalBackup(wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter,
+                                             compression_executor=compression_executor, io_limiter=io_limiter, metrics=metrics)
+
+                    wp_op.backup(archive_filename=archive_filename, backup_mode=backup_mode, compression=compression, compression_level=compression_level, hash_files=hash_files, seekable=seekable,
+                                 ignore_rules=WpIgnoreRules.for_site(wp_site.site_path, excludes, includes, default_excludes),
+                                 dump_workers=dump_workers, core_cache=self.__core_cache, hash_algorithm=hash_algorithm)
+                except Exception as error: # pylint: disable=broad-except
+                    self.__log.exception('Backup of "%s" failed', site_path)
+                    metrics.finish(error)
+                    return WpBackupResult(site_path, archive_filename, time.monotonic() - started, error=error, metrics=metrics)
+
+                metrics.finish()
+                result = WpBackupResult(site_path, archive_filename, time.monotonic() - started,
+                                        os.path.getsize(archive_filename) if os.path.exists(archive_filename) else 0,
+                                        metrics=metrics)
+                self.__log.info('Backed up %s', result)
+
+                return result
+
+            results = list(site_executor.map(backup_site, sites))
+
+        failed = sum(1 for result in results if not result.succeeded)
+
+        self.__log.info('Fleet backup complete: %d succeeded, %d failed.', len(results) - failed, failed)
+
+        return results
+
+    #########################################################################
+    def backup_sharded(self, wp_site, backup_directory, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, hash_files=True, seekable=False, excludes=None, includes=None, default_excludes=True, dump_workers=1, shard_workers=4, split_uploads=False, previous_directory=None, metrics_file=None, profile=False, hash_algorithm=HASH_ALGORITHM):
+        """
+        Performs a sharded backup.
+
+        The WordPress core, wp-content/plugins, wp-content/themes,
+        wp-content/uploads and the database are each written to an archive
+        of their own in ``backup_directory``, ``shard_workers`` at a time,
+        next to a shards.json manifest listing them. The shards share one
+        pool of compression threads (compression_workers).
+
+        Args:
+            wp_site (WpSite):               WordPress Site Details.
+            backup_directory (str):         Directory the shards are written to (created
+                                            if needed; None for a timestamped one)
+            backup_mode (WpBackupMode):     The backup mode to use
+            compression (WpCompression):    The compression codec to use
+            compression_level (int):        The codec specific compression level
+            hash_files (bool):              Record a content hash for every file in
+                                            the manifest of every shard
+            seekable (bool):                Embed a member index in every shard
+            excludes (list):                gitignore-style patterns of paths to leave out
+            includes (list):                Patterns of excluded paths to back up anyway
+            default_excludes (bool):        Leave out well-known cache, upgrade and backup
+                                            plugin directories
+            dump_workers (int):             Number of tables dumped concurrently
+            shard_workers (int):            Number of shards written at once (0 = one
+                                            per CPU core)
+            split_uploads (bool):           Give every year directory of the uploads a
+                                            shard of its own
+            previous_directory (str):       Previous sharded backup whose unchanged file
+                                            shards are reused (hard linked) instead of
+                                            being written again
+            metrics_file (str):             Write the metrics of the backup to this file
+            profile (bool|str):             Profile every phase with cProfile and write
+                                            the profiles to this directory (True =
+                                            <backup directory>.profile)
+            hash_algorithm (str):           Algorithm of the content hashes
+        Returns:
+            WpMetrics: Time, bytes and files of every phase of the backup.
+        Raises:
+            WpConfigNotFoundError:  wp-config.php was not found.
+        """
+
+        self.__log.info('Starting sharded backup.')
+
+        if backup_directory is None or len(backup_directory) == 0:
+            backup_directory = "wpbackup2-{}-{}".format(wp_site.db_name, datetime.datetime.now().strftime("%Y%m%d%H%M%S"))
+
+        metrics = WpMetrics('backup', wp_site.site_path, profiler=WpProfiler() if profile else None)
+        compression_workers = resolve_workers(self.__compression_workers)
+
+        with self.__measure(metrics, metrics_file, self.__profile_directory(profile, str(backup_directory).rstrip(os.path.sep))), \
+             ThreadPoolExecutor(max_workers=compression_workers, thread_name_prefix='wpbackup2-compress') if compression_workers > 1 else contextlib.nullcontext() as compression_executor:
+            wp_op = WpShardedBackup(wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter, compression_executor=compression_executor, core_cache=self.__core_cache, metrics=metrics)
+
+            wp_op.backup(backup_directory, backup_mode=backup_mode, compression=compression, compression_level=compression_level, hash_files=hash_files, seekable=seekable,
+                         ignore_rules=WpIgnoreRules.for_site(wp_site.site_path, excludes, includes, default_excludes),
+                         dump_workers=dump_workers, shard_workers=shard_workers, split_uploads=split_uploads, previous_directory=previous_directory, hash_algorithm=hash_algorithm)
+
+        self.__log.info('Sharded backup complete.')
+
+        return metrics
+
+    #########################################################################
+    def restore_sharded(self, wp_site, backup_directory, restore_mode=WpRestoreMode.ALLCLEAN, includes=None, excludes=None, load_workers=1, extract_workers=1, shard_workers=4, metrics_file=None, profile=False):
+        """
+        Performs a restoration of a sharded backup (see backup_sharded).
+
+        The core shard is restored first, then the other shards
+        ``shard_workers`` at a time (0 = one per CPU core). The other
+        arguments are those of restore.
+
+        Returns:
+            WpMetrics: Time, bytes and files of every phase of the restore.
+        Raises:
+            WpBackupNotFoundError:  ``backup_directory`` is not a sharded backup.
+        """
+
+        if not isinstance(wp_site, WpSite):
+            raise TypeError("wp_site might be an instance of WpSite")
+
+        if backup_directory is None or not is_sharded(backup_directory):
+            raise WpBackupNotFoundError(backup_directory)
+
+        self.__log.info('Starting sharded restore.')
+
+        metrics = WpMetrics('restore', wp_site.site_path, profiler=WpProfiler() if profile else None)
+
+        with self.__measure(metrics, metrics_file, self.__profile_directory(profile, str(backup_directory).rstrip(os.path.sep))):
+            wp_op = WpShardedRestore(wp_site, self.__temp_path, what_if=self.__what_if, host_limiter=self.__host_limiter, core_cache=self.__core_cache, metrics=metrics)
+
+            manifest = wp_op.restore(backup_directory, restore_mode=restore_mode, path_filter=WpPathFilter(includes, excludes), load_workers=resolve_workers(load_workers), extract_workers=resolve_workers(extract_workers), shard_workers=shard_workers)
+
+            metrics.archive_bytes = sum(shard.size or 0 for shard in manifest.shards)
+
+        self.__log.info('Sharded restore complete.')
+
+        return metrics
+
     #########################################################################
-    def restore(self, wp_site, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN):
+    def restore(self, wp_site, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN, incremental_archives=None, includes=None, excludes=None, load_workers=1, extract_workers=1, metrics_file=None, profile=False):
         """
         Performs a restoration.
 
         Args:
             wp_site (WpSite):                   WordPress Site Details.
-            archive_filename (str):             Path and filename of tar gzip file to
-                                                create.
+            archive_filename (str):             Path and filename of the archive to
+                                                restore from (the compression is
+                                                detected automatically).
             restore_mode (WpRestoreMode):       The restore mode to use
+            incremental_archives (list):        Incremental backups to apply on top of
+                                                the archive, oldest first
+            includes (list):                    Globs of the paths (relative to the
+                                                WordPress directory) to restore
+                                                (None restores everything)
+            excludes (list):                    Globs of the paths not to restore
+            load_workers (int):                 Number of tables loaded concurrently from
+                                                a per-table database dump (0 = one per
+                                                CPU core); capped by db_host_limits
+            extract_workers (int):              Number of threads writing the restored
+                                                files (1 = written by the thread reading
+                                                the archive, 0 = one per CPU core); more
+                                                hide the latency of network filesystems
+            metrics_file (str):                 Write the metrics of the restore to this
+                                                file, also when it fails (a Prometheus
+                                                textfile when it ends in .prom, JSON
+                                                otherwise)
+            profile (bool|str):                 Profile every phase with cProfile and
+                                                write the profiles to this directory
+                                                (True = <archive>.profile next to the
+                                                archive)
 
+        Returns:
+            WpMetrics: Time, bytes and files of every phase of the restore.
         Raises:
             WpConfigNotFoundError:  wp-config.php was not found.
         """
 
+        if not isinstance(wp_site, WpSite):
+            raise TypeError("wp_site might be an instance of WpSite")
+
+        if archive_filename is None or len(archive_filename) == 0:
+            raise TypeError("archive name was not specified")
+
+        return self.__restore(wp_site, archive_filename, restore_mode, incremental_archives, includes, excludes, load_workers, extract_workers, metrics_file, profile)
+
+    #########################################################################
+    async def restore_async(self, wp_site, archive_filename, restore_mode=WpRestoreMode.ALLCLEAN, incremental_archives=None, includes=None, excludes=None, load_workers=1, extract_workers=1, metrics_file=None):
+        """
+        Performs a restoration without blocking the event loop.
+
+        Takes the same arguments as restore, but profile. Like
+        backup_async, mysql is fed by the loop and the archive is read (and
+        the files written) on the loop's default executor one short step at
+        a time. Cancelling the task kills the mysql processes (so no
+        partial dump is committed) and stops extracting files; files
+        already extracted are left in place.
+        """
+
         if not isinstance(wp_site, WpSite):
             raise TypeError("wp_site might be an instance of WpSite")
 
@@ -72,8 +492,197 @@ class WpBackup:
 
         self.__log.info('Starting restore.')
 
-        wp_op = WpInternalRestore(wp_site, self.__temp_path, what_if=self.__what_if)
+        metrics = WpMetrics('restore', wp_site.site_path)
+
+        with self.__measure(metrics, metrics_file):
+            metrics.archive_bytes = self.__archive_bytes(archive_filename, incremental_archives)
+
+            wp_op = WpInternalRestore(wp_site, self.__temp_path, what_if=self.__what_if, host_limiter=self.__host_limiter, metrics=metrics)
 
-        wp_op.restore(archive_filename=archive_filename, restore_mode=restore_mode)
+            await wp_op.restore_async(WpAsyncRunner(), archive_filename=archive_filename, restore_mode=restore_mode, incremental_archives=incremental_archives, path_filter=WpPathFilter(includes, excludes), load_workers=resolve_workers(load_workers), core_cache=self.__core_cache, extract_workers=resolve_workers(extract_workers))
 
         self.__log.info('Restore complete.')
+
+        return metrics
+
+    #########################################################################
+    def __restore(self, wp_site, archive_filename, restore_mode, incremental_archives, includes, excludes, load_workers, extract_workers, metrics_file, profile=False):
+        self.__log.info('Starting restore.')
+
+        metrics = WpMetrics('restore', wp_site.site_path, profiler=WpProfiler() if profile else None)
+
+        with self.__measure(metrics, metrics_file, self.__profile_directory(profile, archive_filename)):
+            metrics.archive_bytes = self.__archive_bytes(archive_filename, incremental_archives)
+
+            wp_op = WpInternalRestore(wp_site, self.__temp_path, what_if=self.__what_if, host_limiter=self.__host_limiter, metrics=metrics)
+
+            wp_op.restore(archive_filename=archive_filename, restore_mode=restore_mode, incremental_archives=incremental_archives, path_filter=WpPathFilter(includes, excludes), load_workers=resolve_workers(load_workers), core_cache=self.__core_cache, extract_workers=resolve_workers(extract_workers))
+
+        self.__log.info('Restore complete.')
+
+        return metrics
+
+    #########################################################################
+    @staticmethod
+    def __archive_bytes(archive_filename, incremental_archives):
+        """
+        Size of the archives of a restore (None when one is read from stdin)
+        """
+
+        archives = [archive_filename] + list(incremental_archives or [])
+        if all(os.path.isfile(archive) for archive in archives):
+            return sum(os.path.getsize(archive) for archive in archives)
+
+        return None
+
+    #########################################################################
+    def backup_to_repository(self, wp_site, repository_path, backup_mode=WpBackupMode.ALL, compression=WpCompression.GZIP, compression_level=None, excludes=None, includes=None, default_excludes=True):
+        """
+        Performs a backup into a deduplicating repository.
+
+        Args:
+            wp_site (WpSite):               WordPress Site Details.
+            repository_path (str):          Path of the repository (created if needed).
+            backup_mode (WpBackupMode):     The backup mode to use
+            compression (WpCompression):    The codec used for chunks of a new repository
+            compression_level (int):        The codec specific compression level
+            excludes (list):                gitignore-style patterns of paths to leave out
+            includes (list):                Patterns of excluded paths to back up anyway
+            default_excludes (bool):        Leave out well-known cache, upgrade and backup
+                                            plugin directories
+        Returns:
+            str: The id of the new snapshot.
+        Raises:
+            WpConfigNotFoundError:  wp-config.php was not found.
+        """
+
+        self.__log.info('Starting repository backup.')
+
+        repository = WpRepository(repository_path, compression=compression, compression_level=compression_level, workers=self.__compression_workers)
+
+        wp_op = WpInternalBackup(wp_site, self.__temp_path, what_if=self.__what_if, compression_workers=self.__compression_workers, host_limiter=self.__host_limiter)
+
+        snapshot_id = wp_op.backup_to_repository(repository, backup_mode=backup_mode,
+                                                 ignore_rules=WpIgnoreRules.for_site(wp_site.site_path, excludes, includes, default_excludes))
+
+        self.__log.info('Repository backup complete.')
+
+        return snapshot_id
+
+    #########################################################################
+    def restore_from_repository(self, wp_site, repository_path, snapshot_id=None, restore_mode=WpRestoreMode.ALLCLEAN, includes=None, excludes=None):
+        """
+        Performs a restoration from a deduplicating repository.
+
+        Args:
+            wp_site (WpSite):                   WordPress Site Details.
+            repository_path (str):              Path of the repository.
+            snapshot_id (str):                  Snapshot to restore (None for the newest)
+            restore_mode (WpRestoreMode):       The restore mode to use
+            includes (list):                    Globs of the paths to restore
+                                                (None restores everything)
+            excludes (list):                    Globs of the paths not to restore
+
+        Raises:
+            WpBackupNotFoundError:  the repository or snapshot was not found.
+        """
+
+        if not isinstance(wp_site, WpSite):
+            raise TypeError("wp_site might be an instance of WpSite")
+
+        if repository_path is None or len(repository_path) == 0 or not os.path.isdir(repository_path):
+            raise WpBackupNotFoundError(repository_path)
+
+        self.__log.info('Starting repository restore.')
+
+        repository = WpRepository(repository_path, workers=self.__compression_workers)
+
+        wp_op = WpInternalRestore(wp_site, self.__temp_path, what_if=self.__what_if, host_limiter=self.__host_limiter)
+
+        wp_op.restore_from_repository(repository, snapshot_id=snapshot_id, restore_mode=restore_mode, path_filter=WpPathFilter(includes, excludes))
+
+        self.__log.info('Repository restore complete.')
+
+    #########################################################################
+    def list_archive(self, archive_filename):
+        """
+        Lists the members of an archive.
+
+        Seekable archives are listed from their index; other archives are
+        read in full.
+
+        Args:
+            archive_filename (str):     Path and filename of the archive.
+        Returns:
+            list: (name, size) of every member, in archive order.
+        Raises:
+            WpBackupNotFoundError:  the archive was not found.
+        """
+
+        if archive_filename is None or not os.path.exists(archive_filename):
+            raise WpBackupNotFoundError(archive_filename)
+
+        return list_archive(archive_filename)
+
+    #########################################################################
+    def extract_from_archive(self, archive_filename, member_name, output_filename):
+        """
+        Extracts the content of a single member of an archive.
+
+        Seekable archives only decompress the frames holding that member.
+
+        Args:
+            archive_filename (str):     Path and filename of the archive.
+            member_name (str):          Name of the member (e.g. wp-root/wp-config.php).
+            output_filename (str):      File to write the content to.
+        Raises:
+            WpBackupNotFoundError:  the archive was not found.
+            KeyError:               the archive has no such member.
+        """
+
+        if archive_filename is None or not os.path.exists(archive_filename):
+            raise WpBackupNotFoundError(archive_filename)
+
+        self.__log.info('Extracting "%s" from "%s" to "%s"', member_name, archive_filename, output_filename)
+
+        if self.__what_if:
+            return
+
+        with open(output_filename, 'wb') as output:
+            copy_member(archive_filename, member_name, output)
+
+    #########################################################################
+    def verify(self, archive_filename, metrics_file=None, profile=False):
+        """
+        Verifies that an archive can be restored, without restoring it.
+
+        The archive is read once, in bounded chunks, and nothing is written
+        to disk: the compressed and tar streams must decode to their end,
+        the size (and content hash, for backups taken with hash_files) of
+        every file must match the manifest and every database dump must end
+        with the "-- Dump completed" line of mysqldump.
+
+        Args:
+            archive_filename (str):     Path and filename of the archive ('-' reads
+                                        it from stdin).
+            metrics_file (str):         Write the metrics of the verification to this
+                                        file (a Prometheus textfile when it ends in
+                                        .prom, JSON otherwise)
+            profile (bool|str):         Profile every phase with cProfile and write
+                                        the profiles to this directory (True =
+                                        <archive>.profile next to the archive)
+        Returns:
+            WpVerifyResult: The problems found and the throughput of the verification.
+        Raises:
+            WpBackupNotFoundError:  the archive was not found.
+        """
+
+        if archive_filename is None or (archive_filename != '-' and not os.path.isfile(archive_filename)):
+            raise WpBackupNotFoundError(archive_filename)
+
+        metrics = WpMetrics('verify', archive_filename, profiler=WpProfiler() if profile else None)
+
+        with self.__measure(metrics, metrics_file, self.__profile_directory(profile, archive_filename)):
+            result = WpArchiveVerifier(metrics=metrics).verify(archive_filename)
+
+        return result
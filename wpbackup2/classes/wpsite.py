@@ -86,6 +86,17 @@ class WpSite(WpConnection):
                    credentials=WpCredentials.from_username_and_password(username=wp_config.get('DB_USER'),
                                                                         password=wp_config.get('DB_PASSWORD')))
 
+    ###########################################################################
+    @classmethod
+    def find_sites(cls, directory):
+        """
+        Paths of the WordPress directories directly below ``directory``
+        (those holding a wp-config.php), sorted by name
+        """
+
+        return sorted(entry.path for entry in os.scandir(directory)
+                      if entry.is_dir() and os.path.isfile(os.path.join(entry.path, 'wp-config.php')))
+
     ###########################################################################
     @property
     def site_host(self):
@@ -1,7 +1,13 @@
 """ wpbackup2 exceptions """
 
 from wpbackup2.exceptions.backup_not_found import WpBackupNotFoundError # pylint: disable=line-too-long
+from wpbackup2.exceptions.backup_chain_invalid import WpBackupChainInvalidError # pylint: disable=line-too-long
 from wpbackup2.exceptions.config_not_found import WpConfigNotFoundError # pylint: disable=line-too-long
+from wpbackup2.exceptions.compression_not_available import WpCompressionNotAvailableError # pylint: disable=line-too-long
+from wpbackup2.exceptions.core_release_corrupt import WpCoreReleaseCorruptError # pylint: disable=line-too-long
+from wpbackup2.exceptions.core_release_not_found import WpCoreReleaseNotFoundError # pylint: disable=line-too-long
+from wpbackup2.exceptions.hash_not_available import WpHashNotAvailableError # pylint: disable=line-too-long
+from wpbackup2.exceptions.repository_corrupt import WpRepositoryCorruptError # pylint: disable=line-too-long
 
 from wpbackup2.exceptions.database_mysql_failed import WpDatabaseMysqlFailed # pylint: disable=line-too-long
 from wpbackup2.exceptions.database_backup_failed import WpDatabaseBackupFailed # pylint: disable=line-too-long
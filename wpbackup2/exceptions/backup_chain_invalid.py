@@ -0,0 +1,18 @@
+""" wpbackup2 file exception: WpBackupChainInvalidError """
+
+class WpBackupChainInvalidError(Exception):
+    """
+    Raised when an incremental backup does not follow on from the backup
+    restored before it.
+
+    Args:
+        filename (str): incremental backup file.
+        expected_parent (str): id of the backup restored before it.
+        actual_parent (str): id of the backup it was taken against.
+    """
+
+    def __init__(self, filename, expected_parent, actual_parent):
+        tmp = ('The incremental backup "{}" is based on backup "{}" but the '
+               'previous backup in the chain is "{}"')
+        msg = tmp.format(filename, actual_parent, expected_parent)
+        super().__init__(msg)
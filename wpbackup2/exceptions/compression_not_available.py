@@ -0,0 +1,16 @@
+""" wpbackup2 file exception: WpCompressionNotAvailableError """
+
+class WpCompressionNotAvailableError(Exception):
+    """
+    Raised when the package providing a compression codec is not installed.
+
+    Args:
+        compression (str): name of the requested compression codec.
+        package (str): python package that provides it.
+    """
+
+    def __init__(self, compression, package):
+        tmp = ('Compression "{}" requires the "{}" package. Install it with '
+               '"pip install {}" and try again.')
+        msg = tmp.format(compression, package, package)
+        super().__init__(msg)
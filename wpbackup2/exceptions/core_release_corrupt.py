@@ -0,0 +1,19 @@
+""" wpbackup2 file exception: WpCoreReleaseCorruptError """
+
+class WpCoreReleaseCorruptError(Exception):
+    """
+    Raised when a core file of the core release cache does not match the
+    file an archive references.
+
+    Args:
+        version (str): WordPress version of the release.
+        filename (str): file of the release that failed verification.
+    """
+
+    def __init__(self, version, filename):
+        tmp = ('The core file "{}" of WordPress {} in the core release cache does '
+               'not match the file the archive references (the release was '
+               'modified or damaged since the backup). Unpack an intact '
+               'wordpress-{}.tar.gz into the cache and try again.')
+        msg = tmp.format(filename, version, version)
+        super().__init__(msg)
@@ -0,0 +1,26 @@
+""" wpbackup2 file exception: WpCoreReleaseNotFoundError """
+
+import os
+
+class WpCoreReleaseNotFoundError(Exception):
+    """
+    Raised when an archive references WordPress core files of a release
+    that is not in the core release cache.
+
+    Args:
+        version (str): WordPress version the archive references.
+        directory (str): core release cache directory (None when not given).
+    """
+
+    def __init__(self, version, directory):
+        if directory is None:
+            tmp = ('The archive references the core files of WordPress {} instead '
+                   'of holding them. Restore it with a core release cache holding '
+                   'that release.')
+            msg = tmp.format(version)
+        else:
+            tmp = ('The archive references the core files of WordPress {} instead '
+                   'of holding them, but that release is not in the core release '
+                   'cache. Unpack wordpress-{}.tar.gz into "{}" and try again.')
+            msg = tmp.format(version, version, os.path.join(directory, version))
+        super().__init__(msg)
@@ -0,0 +1,17 @@
+""" wpbackup2 file exception: WpHashNotAvailableError """
+
+class WpHashNotAvailableError(Exception):
+    """
+    Raised when the package providing a content hash algorithm is not
+    installed.
+
+    Args:
+        algorithm (str): name of the requested hash algorithm.
+        package (str): python package that provides it.
+    """
+
+    def __init__(self, algorithm, package):
+        tmp = ('Hash algorithm "{}" requires the "{}" package. Install it with '
+               '"pip install {}" and try again.')
+        msg = tmp.format(algorithm, package, package)
+        super().__init__(msg)
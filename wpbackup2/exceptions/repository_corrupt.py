@@ -0,0 +1,15 @@
+""" wpbackup2 file exception: WpRepositoryCorruptError """
+
+class WpRepositoryCorruptError(Exception):
+    """
+    Raised when a chunk in a backup repository does not match its checksum.
+
+    Args:
+        filename (str): chunk file that failed verification.
+    """
+
+    def __init__(self, filename):
+        tmp = ('The repository chunk "{}" is corrupt (its content does not '
+               'match its checksum)')
+        msg = tmp.format(filename)
+        super().__init__(msg)